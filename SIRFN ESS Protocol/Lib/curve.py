@@ -0,0 +1,187 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Piecewise-linear curves for DER function verification (volt-var, freq-watt, ride-through curves).
+
+A Curve is built once from the curve points and evaluated with a binary search (numpy.searchsorted), so
+scalars, whole sweeps of test points and full captured traces are evaluated in a single call:
+
+    vv = curve.Curve.from_sunspec(volt, var, n_points)
+    var_pct = vv(gridV)                      # scalar
+    var_pct = vv(np.array(data['AC_V_1']))  # ndarray
+
+Curve points may be given in increasing or decreasing x order (e.g. the HVRT curves are listed from the
+highest voltage down). Values outside the curve are held at the end point value unless left/right are given.
+"""
+
+import numpy as np
+
+# extrapolation rule for left/right: continue the slope of the first/last curve segment
+LINEAR = 'linear'
+
+
+class CurveError(Exception):
+    pass
+
+
+def points(values, n_points=None, index_start=None):
+    """
+    Returns a list of the points in a SunSpec-indexed curve parameter. values may be a dict keyed by point index
+    (with optional 'index_start' and 'index_count' entries as returned by ts.param_value() for indexed
+    parameters) or a sequence indexed the same way.
+    """
+    if index_start is None:
+        index_start = 1
+        if isinstance(values, dict):
+            index_start = values.get('index_start', 1)
+    if n_points is None:
+        if isinstance(values, dict) and 'index_count' in values:
+            n_points = values['index_count']
+        else:
+            raise CurveError('Number of curve points not specified')
+    try:
+        return [float(values[i]) for i in range(index_start, index_start + int(n_points))]
+    except (KeyError, IndexError, TypeError, ValueError), e:
+        raise CurveError('Invalid curve points: %s' % str(e))
+
+
+def monotonic(values, increasing=True):
+    """
+    Returns True if values are monotonically non-decreasing (increasing=True) or non-increasing.
+    """
+    d = np.diff(np.asarray(values, dtype=float))
+    if increasing:
+        return bool(np.all(d >= 0))
+    return bool(np.all(d <= 0))
+
+
+class Curve(object):
+    """
+    Piecewise-linear curve y(x).
+
+    x, y - curve points in curve order. x must be monotonic, increasing or decreasing.
+    left - value for x below the smallest curve x: None holds the end point value, LINEAR extrapolates the end
+           segment, any other value is returned as is.
+    right - value for x above the largest curve x, as for left.
+    name - curve name used in error messages.
+    """
+
+    def __init__(self, x, y, left=None, right=None, name='curve'):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.name = name
+        if x.ndim != 1 or len(x) < 1:
+            raise CurveError('%s: no curve points' % name)
+        if len(x) != len(y):
+            raise CurveError('%s: x and y point counts differ (%d, %d)' % (name, len(x), len(y)))
+        if np.any(np.isnan(x)) or np.any(np.isnan(y)):
+            raise CurveError('%s: curve points are not numbers' % name)
+        # store in increasing x order
+        if x[0] > x[-1]:
+            x = x[::-1]
+            y = y[::-1]
+        if not monotonic(x):
+            raise CurveError('%s: points are not monotonic' % name)
+        self.x = np.ascontiguousarray(x)
+        self.y = np.ascontiguousarray(y)
+        self.left = left
+        self.right = right
+        # segment slopes, a vertical step (repeated x) takes the value after the step
+        dx = np.diff(self.x)
+        dy = np.diff(self.y)
+        self.slope = np.zeros(len(dx))
+        step = dx != 0
+        self.slope[step] = dy[step]/dx[step]
+
+    @classmethod
+    def from_sunspec(cls, x, y, n_points=None, index_start=None, **kwargs):
+        """
+        Builds a curve from SunSpec-indexed point parameters (see points()).
+        """
+        if n_points is None and isinstance(x, dict):
+            n_points = x.get('index_count')
+        return cls(points(x, n_points, index_start), points(y, n_points, index_start), **kwargs)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __call__(self, x):
+        """
+        Evaluates the curve at x. Returns a float for a scalar x, otherwise an ndarray of the shape of x.
+        """
+        scalar = np.ndim(x) == 0
+        xv = np.asarray(x, dtype=float)
+        if len(self.x) == 1:
+            y = np.empty(xv.shape)
+            y.fill(self.y[0])
+        else:
+            # index of the segment starting at or below x, clipped to the end segments
+            i = np.searchsorted(self.x, xv, side='right') - 1
+            i = np.clip(i, 0, len(self.slope) - 1)
+            y = self.y[i] + self.slope[i]*(xv - self.x[i])
+            # points exactly at the end of a vertical step take the value after the step
+            at_end = xv == self.x[-1]
+            if np.any(at_end):
+                y = np.where(at_end, self.y[-1], y)
+        y = self._extrapolate(xv, y, xv < self.x[0], self.left, self.y[0])
+        y = self._extrapolate(xv, y, xv > self.x[-1], self.right, self.y[-1])
+        if scalar:
+            return float(y)
+        return y
+
+    def _extrapolate(self, xv, y, outside, rule, end_value):
+        if rule == LINEAR and len(self.x) > 1:
+            # segment evaluation above already continues the end segments
+            return y
+        if not np.any(outside):
+            return y
+        if rule is None or rule == LINEAR:
+            rule = end_value
+        return np.where(outside, float(rule), y)
+
+    def __str__(self):
+        return '%s: %s' % (self.name, ', '.join(['(%g, %g)' % (x, y) for x, y in zip(self.x, self.y)]))
+
+
+def ride_through_curve(x, time, n_points=None, high=True, name='curve'):
+    """
+    Builds a ride-through (must disconnect or must remain connected) time curve from SunSpec-indexed points.
+    x is the voltage or frequency in %nominal, listed from the point furthest from nominal. Test points between
+    the curve and nominal have no time limit (0), points beyond the first curve point hold its time. Returns
+    None if the curve has no points.
+    """
+    if not n_points:
+        return None
+    if high:
+        return Curve.from_sunspec(x, time, n_points, left=0., name=name)
+    return Curve.from_sunspec(x, time, n_points, right=0., name=name)
+
+
+def response_time(test_pct, high_curve, low_curve, nominal=100.):
+    """
+    Evaluates a pair of ride-through curves at test_pct (%nominal): high_curve above nominal, low_curve at or
+    below. test_pct may be a scalar or an array of test points.
+    """
+    scalar = np.ndim(test_pct) == 0
+    test_pct = np.asarray(test_pct, dtype=float)
+    high = test_pct > nominal
+    t = np.zeros(test_pct.shape)
+    for c, mask in ((high_curve, high), (low_curve, ~high)):
+        if np.any(mask):
+            if c is None:
+                raise CurveError('No ride-through curve for test point')
+            t = np.where(mask, c(test_pct), t)
+    if scalar:
+        return float(t)
+    return t
+
+
+if __name__ == "__main__":
+
+    hvrt = Curve.from_sunspec({1: 120., 2: 110., 3: 110., 'index_start': 1, 'index_count': 3},
+                              {1: 0.16, 2: 0.16, 3: 13.}, left=0., name='HVRTD')
+    print hvrt
+    print hvrt(115.), hvrt(130.), hvrt(105.), hvrt(np.array([105., 110., 115., 125.]))
@@ -1,7 +1,6 @@
-import sys
 import os
-import glob
-import importlib
+import plugins
+import tasks
 
 das_modules = {}
 
@@ -10,13 +9,10 @@ def params(info, id=None, label='Data Acquisition System'):
     group_name = DAS_DEFAULT_ID
     if id is not None:
         group_name = group_name + '_' + str(id)
-    print 'group_name = %s' % group_name
     name = lambda name: group_name + '.' + name
     info.param_group(group_name, label='%s Parameters' % label, glob=True)
-    print 'name = %s' % name('mode')
     info.param(name('mode'), label='Mode', default='Manual', values=[])
-    for mode, m in das_modules.iteritems():
-        m.params(info, group_name=group_name)
+    das_modules.params(info, group_name=group_name)
 
 DAS_DEFAULT_ID = 'das'
 
@@ -28,7 +24,6 @@ def das_init(ts, id=None):
     group_name = DAS_DEFAULT_ID
     if id is not None:
         group_name = group_name + '_' + str(id)
-    print 'run group_name = %s' % group_name
     mode = ts.param_value(group_name + '.' + 'mode')
     sim_module = das_modules.get(mode)
     if sim_module is not None:
@@ -117,6 +112,14 @@ class DAS(object):
         """
         pass
 
+    def submit(self, func, *args, **kwargs):
+        """
+        Start an operation (method name or callable) on the data acquisition system's worker thread and return a
+        tasks.Future for its result. Operations submitted to the same data acquisition system run in order,
+        operations on different instruments run at the same time.
+        """
+        return tasks.submit(self, func, *args, **kwargs)
+
     def value_capture(self):
         pass
 
@@ -135,26 +138,10 @@ class DAS(object):
 
 def das_scan():
     global das_modules
-    # scan all files in current directory that match das_*.py
-    files = glob.glob(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'das_*.py'))
-    for f in files:
-        module_name = None
-        try:
-            module_name = os.path.splitext(os.path.basename(f))[0]
-            m = importlib.import_module(module_name)
-            if hasattr(m, 'das_info'):
-                info = m.das_info()
-                mode = info.get('mode')
-                # place module in module dict
-                if mode is not None:
-                    das_modules[mode] = m
-            else:
-                if module_name is not None and module_name in sys.modules:
-                    del sys.modules[module_name]
-        except Exception, e:
-            if module_name is not None and module_name in sys.modules:
-                del sys.modules[module_name]
-            raise DASError('Error scanning module %s: %s' % (module_name, str(e)))
+    # find the modes of all files in the current directory that match das_*.py, modules are imported when
+    # selected (see plugins.py)
+    das_modules = plugins.Registry('das', os.path.dirname(os.path.realpath(__file__)), error=DASError)
+    das_modules.scan()
 
 # scan for das modules on import
 das_scan()
@@ -1,7 +1,6 @@
-import sys
 import os
-import glob
-import importlib
+import plugins
+import tasks
 
 # Import all gridsim extensions in current directory.
 # A gridsim extension has a file name of gridsim_*.py and contains a function gridsim_params(info) that contains
@@ -16,8 +15,7 @@ def params(info):
     info.param('gridsim.mode', label='Mode', default='Manual', values=[])
     info.param('gridsim.auto_config', label='Configure grid simulator at beginning of test', default='Disabled',
                values=['Enabled', 'Disabled'])
-    for mode, m in gridsim_modules.iteritems():
-        m.params(info)
+    gridsim_modules.params(info)
 
 def gridsim_init(ts):
     """
@@ -83,6 +81,14 @@ class GridSim(object):
         """
         pass
 
+    def submit(self, func, *args, **kwargs):
+        """
+        Start an operation (method name or callable) on the grid simulator's worker thread and return a
+        tasks.Future for its result. Operations submitted to the same grid simulator run in order, operations on
+        different instruments run at the same time.
+        """
+        return tasks.submit(self, func, *args, **kwargs)
+
     def current_max(self, current=None):
         """
         Set the value for max current if provided. If none provided, obtains
@@ -131,6 +137,13 @@ class GridSim(object):
         """
         pass
 
+    def profile_wait(self, timeout=None):
+        """
+        Wait for the running profile to finish. Returns False if it is still running after timeout seconds.
+        Simulators that run the profile on the instrument return at once.
+        """
+        return True
+
     def profile_stop(self):
         """
         Stop the running profile.
@@ -184,26 +197,10 @@ class GridSim(object):
 
 def gridsim_scan():
     global gridsim_modules
-    # scan all files in current directory that match gridsim_*.py
-    files = glob.glob(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'gridsim_*.py'))
-    for f in files:
-        module_name = None
-        try:
-            module_name = os.path.splitext(os.path.basename(f))[0]
-            m = importlib.import_module(module_name)
-            if hasattr(m, 'gridsim_info'):
-                info = m.gridsim_info()
-                mode = info.get('mode')
-                # place module in module dict
-                if mode is not None:
-                    gridsim_modules[mode] = m
-            else:
-                if module_name is not None and module_name in sys.modules:
-                    del sys.modules[module_name]
-        except Exception, e:
-            if module_name is not None and module_name in sys.modules:
-                del sys.modules[module_name]
-            raise GridSimError('Error scanning module %s: %s' % (module_name, str(e)))
+    # find the modes of all files in the current directory that match gridsim_*.py, modules are imported when
+    # selected (see plugins.py)
+    gridsim_modules = plugins.Registry('gridsim', os.path.dirname(os.path.realpath(__file__)), error=GridSimError)
+    gridsim_modules.scan()
 
 # scan for gridsim modules on import
 gridsim_scan()
@@ -0,0 +1,149 @@
+import os
+import gridsim
+import grid_profiles
+import sim
+
+sim_info = {
+    'name': os.path.splitext(os.path.basename(__file__))[0],
+    'mode': 'Sim'
+}
+
+def gridsim_info():
+    return sim_info
+
+def params(info):
+    info.param_add_value('gridsim.mode', sim_info['mode'])
+    info.param_group(sim.PARAM_GROUP, label='Simulation Parameters',
+                     active='gridsim.mode',  active_value=['Sim'], glob=True)
+    sim.params(info)
+
+
+class GridSim(gridsim.GridSim):
+    """
+    Simulated grid (see sim.py). The simulated EUT is connected to it and served over Modbus TCP.
+
+    Valid parameters:
+      mode - 'Sim'
+      sim.clock - 'Virtual' (time passes only when the script sleeps) or 'Real'
+      sim.v_nom, sim.f_nom, sim.v_max, sim.i_max
+      sim.eut_* - simulated EUT rating and Modbus server address
+      sim.pv_* - simulated PV source
+    """
+    def __init__(self, ts, params=None):
+        gridsim.GridSim.__init__(self, ts, params)
+        self.world = sim.world(ts)
+        self.grid = self.world.grid
+        self.clock = self.world.clock
+        self.v_max_param = float(self.world.params['v_max'])
+        self.i_max_param = float(self.world.params['i_max'])
+        self.regen_state = gridsim.REGEN_OFF
+        self.profile = None
+
+    def config(self):
+        self.relay(gridsim.RELAY_CLOSED)
+        self.voltage(self.v_nom())
+        self.freq(self.f_nom())
+
+    def close(self):
+        """
+        Closes the simulation world (see sim.reset()).
+        """
+        sim.reset()
+
+    def current_max(self, current=None):
+        if current is not None:
+            self.i_max_param = float(current)
+        return self.i_max_param
+
+    def freq(self, freq=None):
+        if freq is not None:
+            self.grid.set(f=freq)
+        return self.grid.values()[1]
+
+    def profile_load(self, profile_name, v_step=100, f_step=100, t_step=None):
+        if profile_name is None:
+            raise gridsim.GridSimError('Profile not specified.')
+
+        if profile_name == 'Manual':  # Manual reserved for not running a profile.
+            self.ts.log_warning('Manual reserved for not running a profile')
+            return
+
+        try:
+            self.profile = grid_profiles.program(profile_name, self.grid.v_nom, self.grid.f_nom, v_step=v_step,
+                                                 f_step=f_step, t_step=t_step, v_max=self.v_max_param)
+        except grid_profiles.ProfileError, e:
+            raise gridsim.GridSimError(str(e))
+
+    def profile_start(self):
+        if not self.profile:
+            return
+        self.grid.start(self.profile)
+
+    def profile_wait(self, timeout=None):
+        """
+        Sleeps until the running profile has ended. Returns False if it is still running after timeout seconds.
+        """
+        end = self.grid.end_time()
+        if end is None:
+            return True
+        remaining = end - self.clock.time()
+        if timeout is not None and remaining > timeout:
+            self.clock.sleep(timeout)
+            return False
+        self.clock.sleep(remaining)
+        return True
+
+    def profile_stop(self):
+        self.grid.stop()
+
+    def regen(self, state=None):
+        if state is not None:
+            if state not in (gridsim.REGEN_ON, gridsim.REGEN_OFF):
+                raise gridsim.GridSimError('Unknown regen state: %s' % state)
+            self.regen_state = state
+        return self.regen_state
+
+    def relay(self, state=None):
+        if state is not None:
+            if state == gridsim.RELAY_OPEN:
+                self.grid.relay(False)
+            elif state == gridsim.RELAY_CLOSED:
+                self.grid.relay(True)
+            else:
+                raise gridsim.GridSimError('Invalid relay state. State = "%s"' % state)
+        if self.grid.relay_closed:
+            return gridsim.RELAY_CLOSED
+        return gridsim.RELAY_OPEN
+
+    def voltage(self, voltage=None):
+        if voltage is not None:
+            if type(voltage) is list or type(voltage) is tuple:
+                voltage = voltage[0]  # use the first value in the 3 phase list
+            if voltage > self.v_max_param:
+                raise gridsim.GridSimError('Voltage %0.1f V exceeds the maximum voltage %0.1f V' %
+                                           (voltage, self.v_max_param))
+            self.grid.set(v=voltage)
+        v = self.grid.values()[0]
+        return v, v, v
+
+    def voltage_max(self, voltage=None):
+        if voltage is not None:
+            if type(voltage) is list or type(voltage) is tuple:
+                voltage = max(voltage)
+            self.v_max_param = float(voltage)
+        return self.v_max_param, self.v_max_param, self.v_max_param
+
+    def i_max(self):
+        return self.i_max_param
+
+    def v_max(self):
+        return self.v_max_param
+
+    def v_nom(self):
+        return self.grid.v_nom
+
+    def f_nom(self):
+        return self.grid.f_nom
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,257 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Node fan-out: measure and evaluate several EUTs behind one grid simulator with a single grid event.
+
+Each node is one EUT on one Sandia DSM DAQ node (the dsm_points_<n> channel map in sandia_dsm). A Node gives the
+per-node view of the shared DAQ data and the node's own SunSpec Modbus client. The grid event (e.g., a
+Transient_Step profile) is run once with the waveform capture acquiring the channels of every node, and the
+capture is then evaluated for all nodes at once, each node in its own worker process where processes can be
+forked:
+
+    node_list = nodes.nodes_from_params(ts)
+    tasks.parallel(*[n.client for n in node_list])          # connect the EUTs
+    wfmtrigger_params['trigacqchannels'] = nodes.acq_channels(node_list, 'Ametek_Trigger')
+    ... run the profile, wait for the waveform ...
+    for node, (ride_through_time, error) in zip(node_list, nodes.ride_through(wfmname, node_list)):
+        ...
+
+The waveform is parsed once by the calling process (sandia_dsm.read_wfm writes the parsed sidecar) and the
+workers memory-map the parsed columns instead of each parsing the text file.
+"""
+
+import os
+
+import sandia_dsm
+
+# columns acquired per node, in acquisition order after the time column
+NODE_CHANNELS = ['AC_Voltage_%s', 'AC_Current_%s']
+
+
+class NodeError(Exception):
+    pass
+
+
+def parse_list(text, type=str):
+    """
+    Returns the values of a comma separated parameter as a list, an empty list for an empty parameter.
+    """
+    if text is None:
+        return []
+    if isinstance(text, (list, tuple)):
+        return [type(v) for v in text]
+    return [type(v.strip()) for v in str(text).split(',') if v.strip()]
+
+
+class Node(object):
+    """
+    One EUT and its DAQ node.
+
+    node_id - Sandia DSM node number (1-10).
+    ifc_type, ifc_name, baudrate, parity, ipaddr, ipport, slave_id - SunSpec Modbus client parameters of the EUT.
+    """
+
+    def __init__(self, node_id, ifc_type='TCP', ifc_name=None, baudrate=9600, parity='N', ipaddr=None,
+                 ipport=502, slave_id=1):
+        self.node_id = str(node_id)
+        if self.node_id not in sandia_dsm.dsm_points_map:
+            raise NodeError('Unknown DAQ node: %s' % node_id)
+        self.ifc_type = ifc_type
+        self.ifc_name = ifc_name
+        self.baudrate = baudrate
+        self.parity = parity
+        self.ipaddr = ipaddr
+        self.ipport = ipport
+        self.slave_id = slave_id
+        self.inv = None
+
+    def das(self, **kwargs):
+        """
+        Returns a sandia_dsm.Data view of the shared DAQ data with this node's channel map.
+        """
+        return sandia_dsm.Data(dsm_id=self.node_id, **kwargs)
+
+    def client(self):
+        """
+        Returns the node's SunSpec client device, connecting on first use.
+        """
+        if self.inv is None:
+            import sunspec.core.client as client
+            self.inv = client.SunSpecClientDevice(self.ifc_type, slave_id=self.slave_id, name=self.ifc_name,
+                                                  baudrate=self.baudrate, parity=self.parity, ipaddr=self.ipaddr,
+                                                  ipport=self.ipport)
+        return self.inv
+
+    def close(self):
+        """
+        Closes the node's SunSpec client device if it is connected.
+        """
+        if self.inv is not None:
+            inv = self.inv
+            self.inv = None
+            try:
+                inv.close()
+            except Exception:
+                # already closed by the cleanup of a failed connection
+                pass
+
+    def wfm_channels(self):
+        return [c % self.node_id for c in NODE_CHANNELS]
+
+    def __str__(self):
+        if self.ipaddr:
+            return 'Node %s (%s:%s, slave %s)' % (self.node_id, self.ipaddr, self.ipport, self.slave_id)
+        return 'Node %s (slave %s)' % (self.node_id, self.slave_id)
+
+
+def nodes_from_params(ts, group='nodes', comm='comm'):
+    """
+    Returns the Nodes configured by the script parameters <group>.ids, <group>.ipaddrs and <group>.slave_ids
+    (comma separated, one entry per node). Empty address or slave id lists use the <comm> parameters for every
+    node.
+    """
+    ids = parse_list(ts.param_value('%s.ids' % group))
+    if not ids:
+        raise NodeError('No nodes configured')
+    ipaddrs = parse_list(ts.param_value('%s.ipaddrs' % group))
+    slave_ids = parse_list(ts.param_value('%s.slave_ids' % group), int)
+    for name, values in (('ipaddrs', ipaddrs), ('slave_ids', slave_ids)):
+        if values and len(values) != len(ids):
+            raise NodeError('%d nodes but %d %s' % (len(ids), len(values), name))
+
+    ifc_type = ts.param_value('%s.ifc_type' % comm)
+    node_list = []
+    for i, node_id in enumerate(ids):
+        node_list.append(Node(node_id, ifc_type=ifc_type,
+                              ifc_name=ts.param_value('%s.ifc_name' % comm),
+                              baudrate=ts.param_value('%s.baudrate' % comm),
+                              parity=ts.param_value('%s.parity' % comm),
+                              ipaddr=ipaddrs[i] if ipaddrs else ts.param_value('%s.ipaddr' % comm),
+                              ipport=ts.param_value('%s.ipport' % comm),
+                              slave_id=slave_ids[i] if slave_ids else ts.param_value('%s.slave_id' % comm)))
+    return node_list
+
+
+def params(info, group='nodes'):
+    info.param_group(group, label='Multi-Node Fan-Out', glob=True)
+    info.param('%s.fanout' % group, label='Test all nodes with each grid event', default='Disabled',
+               values=['Disabled', 'Enabled'],
+               desc='Measure and evaluate the EUTs on several DAQ nodes behind the same grid simulator at once.')
+    info.param('%s.ids' % group, label='DAQ nodes', default='', active='%s.fanout' % group,
+               active_value=['Enabled'], desc='Comma separated DAQ node numbers, e.g., 2, 3, 6, 10')
+    info.param('%s.ipaddrs' % group, label='EUT IP addresses', default='', active='%s.fanout' % group,
+               active_value=['Enabled'], desc='Comma separated, one per node. Empty to use the EUT IP Address.')
+    info.param('%s.slave_ids' % group, label='EUT slave ids', default='', active='%s.fanout' % group,
+               active_value=['Enabled'], desc='Comma separated, one per node. Empty to use the EUT Slave Id.')
+    info.param('%s.processes' % group, label='Worker processes', default=0, active='%s.fanout' % group,
+               active_value=['Enabled'], desc='Processes evaluating the nodes, 0 for one per CPU where processes '
+                                              'can be forked (in the test process on Windows), 1 to evaluate in '
+                                              'the test process.')
+
+
+def acq_channels(node_list, trigger=None):
+    """
+    Returns the waveform acquisition channel list for the nodes (voltage and current of each node in node order,
+    then the trigger channel).
+    """
+    channels = []
+    for node in node_list:
+        channels.extend(node.wfm_channels())
+    if trigger:
+        channels.append(trigger)
+    return ', '.join(channels)
+
+
+def _columns(index, trigger):
+    # waveform columns of node index: time, voltage, current and the trigger (last column) if acquired
+    first = 1 + index*len(NODE_CHANNELS)
+    cols = [0, first, first + 1]
+    if trigger:
+        cols.append(-1)
+    return cols
+
+
+def _ride_through_worker(args):
+    wfmname, cols, use_voltage = args
+    try:
+        import wave
+        columns = sandia_dsm.read_wfm(wfmname, mmap_mode='r')
+        wfmtime, ac_voltage, ac_current = columns[cols[0]], columns[cols[1]], columns[cols[2]]
+        if use_voltage or len(cols) < 4:
+            return wave.calc_ride_through_duration(wfmtime, ac_current, ac_voltage=ac_voltage), None
+        return wave.calc_ride_through_duration(wfmtime, ac_current, grid_trig=columns[cols[3]]), None
+    except Exception, e:
+        return None, str(e) or e.__class__.__name__
+
+
+def map_nodes(func, args_list, processes=0):
+    """
+    Calls func(args) for each entry of args_list, in worker processes if processes is not 1. With processes 0 there
+    is one process per CPU where processes are forked and the calls are made in the calling process on Windows,
+    where the workers are spawned and import the main module again. Returns the results in order. func must be a
+    module level function so it can be sent to the workers.
+    """
+    if not processes and not hasattr(os, 'fork'):
+        processes = 1
+    if processes == 1 or len(args_list) < 2:
+        return [func(args) for args in args_list]
+    import multiprocessing
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes=min(processes, len(args_list)))
+    try:
+        return pool.map(func, args_list)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def ride_through(wfmname, node_list, trigger=True, use_voltage=False, processes=0):
+    """
+    Evaluates the ride-through duration of every node from one waveform capture acquired with acq_channels().
+    Returns a list of (ride_through_time, error) per node, ride_through_time is None if the node could not be
+    evaluated.
+    """
+    if not os.path.isfile(wfmname):
+        raise NodeError('Waveform file not found: %s' % wfmname)
+    # parse once here so the workers memory-map the parsed columns
+    columns = sandia_dsm.read_wfm(wfmname)
+    expected = 1 + len(node_list)*len(NODE_CHANNELS) + (1 if trigger else 0)
+    if len(columns) < expected:
+        raise NodeError('Waveform has %d channels, %d expected for %d nodes' %
+                        (len(columns), expected, len(node_list)))
+    args_list = [(wfmname, _columns(i, trigger), use_voltage) for i in range(len(node_list))]
+    return map_nodes(_ride_through_worker, args_list, processes=processes)
+
+
+if __name__ == "__main__":
+
+    import time
+    import tempfile
+    import numpy as np
+
+    # synthetic capture: 4 nodes, node i trips i*0.1 s after the trigger
+    fs = 24e3
+    t = np.arange(int(2*fs))/fs
+    trig = np.where(t >= 0.5, 5., 0.)
+    cols = [t]
+    node_list = [Node(n) for n in (2, 3, 6, 10)]
+    for i, node in enumerate(node_list):
+        v = 240.*np.sqrt(2)*np.sin(2*np.pi*60.*t)
+        a = np.where(t < 0.5 + (i + 1)*0.1, 20., 0.)*np.sin(2*np.pi*60.*t)
+        cols.extend([v, a])
+    cols.append(trig)
+    wfmname = os.path.join(tempfile.mkdtemp(), 'fanout.wfm')
+    with open(wfmname, 'w') as f:
+        f.write('\t'.join(['Time'] + acq_channels(node_list, 'Ametek_Trigger').split(', ')) + '\n')
+        np.savetxt(f, np.column_stack(cols), delimiter='\t', fmt='%.6g')
+
+    for processes in (1, 0):
+        start = time.time()
+        results = ride_through(wfmname, node_list, processes=processes)
+        print 'processes=%d: %0.2f s' % (processes, time.time() - start)
+        for node, r in zip(node_list, results):
+            print '  %s: %s' % (node, r)
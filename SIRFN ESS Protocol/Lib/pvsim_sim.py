@@ -0,0 +1,58 @@
+import os
+import pvsim
+import pv_profiles
+import sim
+
+sim_info = {
+    'name': os.path.splitext(os.path.basename(__file__))[0],
+    'mode': 'Sim'
+}
+
+def pvsim_info():
+    return sim_info
+
+def params(info):
+    info.param_add_value('pvsim.mode', sim_info['mode'])
+
+class PVSim(pvsim.PVSim):
+    """
+    Simulated PV source feeding the simulated EUT (see sim.py). The array rating and maximum power point voltage
+    are the gridsim.sim.pv_* parameters.
+    """
+
+    def __init__(self, ts):
+        pvsim.PVSim.__init__(self, ts)
+        self.pv = sim.world(ts).pv
+        self.profile = None
+
+    def close(self):
+        """
+        Closes the simulation world (see sim.reset()).
+        """
+        sim.reset()
+
+    def irradiance_set(self, irradiance=1000):
+        self.pv.set(irradiance=irradiance)
+
+    def power_on(self):
+        self.pv.set(on=True)
+
+    def power_off(self):
+        self.pv.set(on=False)
+
+    def profile_load(self, profile_name):
+        profile = pv_profiles.profiles.get(profile_name)
+        if profile is None:
+            raise pvsim.PVSimError('Profile Not Found: %s' % profile_name)
+        if profile_name.endswith('Norm'):
+            # available power in % of nameplate, 100% at 1000 W/m^2
+            profile = [(t, pct*10.) for t, pct in profile]
+        self.profile = profile
+
+    def profile_start(self):
+        if self.profile is None:
+            raise pvsim.PVSimError('No profile loaded')
+        self.pv.start(self.profile)
+
+if __name__ == "__main__":
+    pass
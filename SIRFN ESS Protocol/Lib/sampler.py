@@ -0,0 +1,186 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Deadline-based periodic sampling for test script measurement loops.
+
+The test scripts traditionally paced their loops with a fixed sleep tuned by hand for one computer
+(ts.sleep(0.93), ts.sleep(0.998), ...). The sleep does not account for the time spent reading the EUT and
+DAS so the real loop period drifts with communication latency. Sampler schedules each sample against an
+absolute deadline (t0 + n*period) on a monotonic clock so the loop rate is held regardless of the work done
+in the loop body, and records how well the schedule was kept.
+
+    s = sampler.Sampler(rate=1., sleep=ts.sleep)
+    for t in s.ticks(duration=test_duration):
+        pf = inverter.get_power_factor(inv, data)
+        ...
+    ts.log(str(s))
+"""
+
+import sys
+import time
+
+# monotonic clock: time.monotonic on python 3, QueryPerformanceCounter based time.clock on Windows,
+# otherwise fall back to the wall clock
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+elif sys.platform == 'win32':
+    monotonic = time.clock
+else:
+    monotonic = time.time
+
+
+class SamplerError(Exception):
+    pass
+
+
+class Sampler(object):
+    """
+    Periodic sampler with absolute deadlines.
+
+    rate - sample rate in Hz (rates above 1 Hz are supported, limited by the sleep resolution of the host).
+    sleep - sleep function, normally ts.sleep so the script remains abortable. Defaults to time.sleep.
+    clock - monotonic clock function in seconds.
+    skip - if True, samples whose deadline has already passed by more than a full period are dropped so the
+           sampler stays phase locked to t0. If False, late samples are taken immediately (catch up).
+    """
+
+    def __init__(self, rate=1., sleep=None, clock=None, skip=True):
+        rate = float(rate)
+        if rate <= 0:
+            raise SamplerError('Invalid sample rate: %s' % rate)
+        self.rate = rate
+        self.period = 1./rate
+        self.sleep = sleep
+        if self.sleep is None:
+            self.sleep = time.sleep
+        self.clock = clock
+        if self.clock is None:
+            self.clock = monotonic
+        self.skip = skip
+        self.t0 = None
+        self.index = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.count = 0
+        self.overruns = 0
+        self.dropped = 0
+        self.jitter_sum = 0.
+        self.jitter_max = 0.
+
+    def start(self, t0=None):
+        """
+        Starts (or restarts) the schedule at t0, default now. The first deadline is t0 + period.
+        """
+        if t0 is None:
+            t0 = self.clock()
+        self.t0 = t0
+        self.index = 0
+        self.reset_stats()
+        return t0
+
+    def elapsed(self):
+        """
+        Returns seconds since the start of the schedule.
+        """
+        if self.t0 is None:
+            return 0.
+        return self.clock() - self.t0
+
+    def deadline(self):
+        """
+        Returns the clock time of the next sample.
+        """
+        return self.t0 + (self.index + 1)*self.period
+
+    def wait(self):
+        """
+        Blocks until the next deadline and returns the time of the sample relative to the start of the schedule.
+        Drop-in replacement for a fixed loop sleep; the schedule is started on the first call if start() was not
+        called.
+        """
+        if self.t0 is None:
+            self.start()
+
+        now = self.clock()
+        deadline = self.deadline()
+        if now > deadline:
+            # loop body took longer than the remaining period
+            self.overruns += 1
+            if self.skip:
+                missed = int((now - deadline)/self.period)
+                if missed > 0:
+                    self.dropped += missed
+                    self.index += missed
+                    deadline = self.deadline()
+        # ts.sleep and time.sleep may wake early; sleep again for any remainder
+        while now < deadline:
+            self.sleep(deadline - now)
+            now = self.clock()
+
+        jitter = now - deadline
+        self.jitter_sum += jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+        self.count += 1
+        self.index += 1
+        return now - self.t0
+
+    def ticks(self, duration=None, count=None):
+        """
+        Generator yielding the sample time (seconds since start) at each deadline until duration seconds have
+        elapsed or count samples have been taken. With neither limit the generator runs until the caller breaks.
+        """
+        self.start()
+        n = 0
+        while count is None or n < count:
+            if duration is not None and self.deadline() - self.t0 > duration:
+                break
+            yield self.wait()
+            n += 1
+
+    def run(self, func, duration=None, count=None, *args, **kwargs):
+        """
+        Calls func(t, *args, **kwargs) at each sample time. Stops early if func returns False. Returns stats().
+        """
+        for t in self.ticks(duration=duration, count=count):
+            if func(t, *args, **kwargs) is False:
+                break
+        return self.stats()
+
+    def stats(self):
+        """
+        Returns a dict of scheduling statistics:
+            count - samples taken
+            overruns - samples where the loop body ran past the deadline
+            dropped - deadlines skipped to stay on schedule
+            jitter_mean, jitter_max - lateness of the wake up relative to the deadline (s)
+            rate - achieved sample rate (Hz)
+        """
+        jitter_mean = 0.
+        if self.count > 0:
+            jitter_mean = self.jitter_sum/self.count
+        rate = 0.
+        elapsed = self.elapsed()
+        if self.count > 0 and elapsed > 0:
+            rate = self.count/elapsed
+        return {'count': self.count, 'overruns': self.overruns, 'dropped': self.dropped,
+                'jitter_mean': jitter_mean, 'jitter_max': self.jitter_max, 'rate': rate}
+
+    def __str__(self):
+        s = self.stats()
+        return ('Sampler: %d samples at %0.3f Hz (target %0.3f Hz), %d overruns, %d dropped, '
+                'jitter mean %0.1f ms max %0.1f ms' %
+                (s['count'], s['rate'], self.rate, s['overruns'], s['dropped'],
+                 s['jitter_mean']*1000., s['jitter_max']*1000.))
+
+
+if __name__ == "__main__":
+
+    s = Sampler(rate=10.)
+    for t in s.ticks(duration=1.):
+        time.sleep(0.02)
+    print s
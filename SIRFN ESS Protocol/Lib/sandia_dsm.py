@@ -32,12 +32,21 @@ Written by Sandia National Laboratories, Loggerware, and SunSpec Alliance
 
 
 import os
+import time
 
 PATH = 'C:\\python_dsm\\'
 POINTS_FILE = 'C:\\python_dsm\\channels.txt'
 DATA_FILE = 'C:\\python_dsm\\data.txt'
 TRIGGER_FILE = 'C:\\python_dsm\\trigger.txt'
 WFM_TRIGGER_FILE = 'C:\\python_dsm\\waveform trigger.txt'
+WFM_EXT = '.wfm'
+# optional file written by the DSM beside a waveform once it is complete (<wfmname>.done)
+WFM_SENTINEL_EXT = '.done'
+
+
+class DSMError(Exception):
+    pass
+
 
 # Data channels for Node 1
 dsm_points_1 = {
@@ -222,6 +231,61 @@ dsm_points_map = {
     '10': dsm_points_10
 }
 
+WFM_CACHE_EXT = '.npy'
+
+
+def wfm_cache_name(wfmname):
+    return wfmname + WFM_CACHE_EXT
+
+
+def read_wfm(wfmname, cache=True, mmap_mode=None):
+    """
+    Returns the channels of a tab delimited waveform (.wfm) file as a 2D numpy array with one row per channel.
+
+    The text is parsed once into contiguous float columns and saved in a binary sidecar (<wfmname>.npy) beside
+    the waveform. Later reads of the same file load the binary sidecar instead of parsing the text again. The
+    sidecar is ignored if it is older than the waveform file.
+
+    By default the sidecar is read into a writable array and closed. mmap_mode='r' returns a read-only memory map
+    of the sidecar instead (e.g., for worker processes reading the same capture); the map keeps the sidecar open
+    until the array is released, which prevents moving it on Windows.
+    """
+    import numpy as np
+
+    cache_name = wfm_cache_name(wfmname)
+    if cache and os.path.isfile(cache_name) and os.path.getmtime(cache_name) >= os.path.getmtime(wfmname):
+        try:
+            return np.load(cache_name, mmap_mode=mmap_mode)
+        except Exception:
+            pass  # unusable sidecar, parse the waveform file again
+
+    with open(wfmname, 'r') as f:
+        f.readline()  # channel names
+        text = f.read()
+
+    n_cols = len(text.split('\n', 1)[0].split('\t'))
+    n_rows = text.count('\n') + (0 if text.endswith('\n') else 1)
+    # numpy parses the whole block in C; whitespace separators cover the tabs and line endings
+    data = np.fromstring(text, dtype=float, sep=' ')
+    if data.size != n_rows*n_cols:
+        # blank lines or empty cells, use the slower parser which understands them
+        data = np.genfromtxt(wfmname, delimiter='\t', skip_header=1, dtype=float)
+    columns = np.ascontiguousarray(data.reshape(-1, n_cols).T)
+
+    if cache:
+        try:
+            tmp_name = cache_name + '.tmp'
+            with open(tmp_name, 'wb') as f:
+                np.save(f, columns)
+            if os.path.exists(cache_name):
+                os.remove(cache_name)
+            os.rename(tmp_name, cache_name)
+        except Exception:
+            pass  # the sidecar is only an optimization, e.g., the waveform directory may be read-only
+
+    return columns
+
+
 class Data(object):
 
     def __getitem__(self, k):
@@ -257,6 +321,24 @@ class Data(object):
             if point_name is not None:
                 self[point_name] = None
 
+    def wait_update(self, timeout=5., interval=0.1, sleep=None):
+        """
+        Waits for the DSM to write a new data record. Returns the new DSM time or None if the time has not
+        changed within timeout seconds.
+        """
+        if sleep is None:
+            sleep = time.sleep
+        self.read()
+        last = getattr(self, 'time', None)
+        end = time.time() + timeout
+        while time.time() < end:
+            sleep(interval)
+            self.read()
+            t = getattr(self, 'time', None)
+            if t is not None and t != last:
+                return t
+        return None
+
     def read(self):
         try:
             f = open(self._data_file)
@@ -311,8 +393,126 @@ class Trigger(object):
             self.off_last_error = str(e)
 
 
+def _win32_notifications():
+    try:
+        import win32file
+        import win32event
+        import win32con
+    except ImportError:
+        return None
+    return win32file, win32event, win32con
+
+
+class WfmWatcher(object):
+    """
+    Watches the DSM directory for the waveform file of the trigger that was just armed.
+
+    arm() records the waveform files present when the trigger is written. wait() returns the first waveform file
+    created after that, once the DSM has finished writing it: the sentinel file (<wfmname>.done) exists or the file
+    size has not changed for stable_time seconds. Directory changes are waited for with file change notifications
+    where available (Windows with pywin32), otherwise the directory names are rescanned every poll_interval
+    seconds; in both cases only new files are examined, never the complete directory history.
+    """
+
+    def __init__(self, path=PATH, stable_time=0.5, poll_interval=0.1):
+        self.path = path
+        self.stable_time = stable_time
+        self.poll_interval = poll_interval
+        self.known = None
+        self.armed_time = None
+        self.filename = None
+        self._handle = None
+
+    def _names(self):
+        return [n for n in os.listdir(self.path) if n.lower().endswith(WFM_EXT)]
+
+    def arm(self):
+        """
+        Records the existing waveform files. Call immediately before writing the trigger.
+        """
+        self.close()
+        self.known = set(self._names())
+        self.armed_time = time.time()
+        self.filename = None
+        win32 = _win32_notifications()
+        if win32 is not None:
+            win32file, win32event, win32con = win32
+            try:
+                self._handle = win32file.FindFirstChangeNotification(
+                    self.path, False, win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_SIZE |
+                    win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+            except Exception:
+                self._handle = None
+
+    def close(self):
+        if self._handle is not None:
+            win32file, win32event, win32con = _win32_notifications()
+            try:
+                win32file.FindCloseChangeNotification(self._handle)
+            except Exception:
+                pass
+            self._handle = None
+
+    def _wait_change(self, sleep):
+        if self._handle is not None:
+            win32file, win32event, win32con = _win32_notifications()
+            # returns early when the directory changes
+            win32event.WaitForSingleObject(self._handle, int(self.poll_interval*1000))
+            win32file.FindNextChangeNotification(self._handle)
+        else:
+            sleep(self.poll_interval)
+
+    def new_files(self):
+        """
+        Returns the waveform files created since arm(), oldest first.
+        """
+        if self.known is None:
+            raise DSMError('Waveform watcher is not armed')
+        names = [n for n in self._names() if n not in self.known]
+        files = [os.path.join(self.path, n) for n in names]
+        return sorted(files, key=os.path.getctime)
+
+    def wait(self, timeout, sleep=None):
+        """
+        Waits up to timeout seconds for the waveform file of the armed trigger to be complete. Returns the file
+        name or None.
+        """
+        if sleep is None:
+            sleep = time.sleep
+        end = time.time() + timeout
+        size = None
+        size_time = None
+        try:
+            while True:
+                if self.filename is None:
+                    files = self.new_files()
+                    if files:
+                        self.filename = files[0]
+                if self.filename is not None:
+                    if os.path.isfile(self.filename + WFM_SENTINEL_EXT):
+                        return self.filename
+                    try:
+                        current = os.path.getsize(self.filename)
+                    except OSError:
+                        current = None
+                    now = time.time()
+                    if current != size:
+                        size = current
+                        size_time = now
+                    elif current and now - size_time >= self.stable_time:
+                        return self.filename
+                if time.time() >= end:
+                    return None
+                self._wait_change(sleep)
+        finally:
+            self.close()
+
+
 class WfmTrigger(object):
 
+    # once the DSM has triggered, the capture runs to its end and the waveform file is written
+    cancellable = False
+
     def __init__(self, ts, filename=WFM_TRIGGER_FILE):
 
         self.filename = filename
@@ -321,11 +521,13 @@ class WfmTrigger(object):
         self.off_error_count = 0
         self.off_last_error = ''
         self.ts = ts
+        self.watcher = WfmWatcher(path=os.path.dirname(filename) or PATH)
 
     def trigger(self, wfmtrigger_params=None):
 
         if wfmtrigger_params is not None:
             try:
+                self.watcher.arm()
                 # Formatting for the file:
                 # Sampling rate, e.g., 24.5e3
                 # Pretrigger (sec), e.g., 0
@@ -358,35 +560,45 @@ class WfmTrigger(object):
                 self.on_error_count += 1
                 self.on_last_error = str(e)
 
+    def cancel(self):
+        """
+        Drops the capture of the armed trigger if the trigger is cancellable. Returns True if it was dropped.
+        """
+        return False
+
+    def wait_for_file(self, timeout, sleep=None):
+        """
+        Returns the waveform file of the last trigger as soon as the DSM has finished writing it or None if it is
+        not complete within timeout seconds.
+        """
+        try:
+            return self.watcher.wait(timeout, sleep=sleep)
+        except Exception, e:
+            self.off_error_count += 1
+            self.off_last_error = str(e)
+
     def getfilename(self):
 
         try:
+            if self.watcher.filename is not None:
+                return self.watcher.filename
             import glob
             return max(glob.iglob('C:\python_dsm\*.[Ww][Ff][Mm]'), key=os.path.getctime)  #fix with os.path.sep
         except Exception, e:
             self.off_error_count += 1
             self.off_last_error = str(e)
 
-    def read_file(self, wfmname):
+    def read_file(self, wfmname, cache=True):
 
         try:
-            from collections import defaultdict
-            columns = defaultdict(list)  # each value in each column is appended to a list
-
-            import csv
-            with open(wfmname, 'r') as f:
-                reader = csv.reader(f, delimiter='\t')
-                reader.next()
-                for row in reader:
-                    for (j, v) in enumerate(row):
-                        columns[j].append(v)
+            columns = read_wfm(wfmname, cache=cache)
 
-            wfmtime = [float(i) for i in columns[0]]
-            ac_voltage = [float(i) for i in columns[1]]
-            ac_current = [float(i) for i in columns[2]]
+            wfmtime = columns[0]
+            ac_voltage = columns[1]
+            ac_current = columns[2]
 
             if len(columns) > 3:
-                daq_trig = [float(i) for i in columns[3]]
+                daq_trig = columns[3]
                 return wfmtime, ac_voltage, ac_current, daq_trig
             else:
                 return wfmtime, ac_voltage, ac_current
@@ -402,6 +614,9 @@ class WfmTrigger(object):
             #results_dir = os.path.dirname(__file__)[:-7] + 'Results' + os.path.sep
             if delete_original == 'Yes':
                 shutil.move(wfmname, results_dir)
+                # keep the parsed copy next to the waveform it was made from
+                if os.path.isfile(wfm_cache_name(wfmname)):
+                    shutil.move(wfm_cache_name(wfmname), results_dir)
             else:
                 shutil.copy(wfmname, results_dir)
         except Exception, e:
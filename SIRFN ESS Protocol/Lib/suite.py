@@ -0,0 +1,412 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Concurrent suite execution.
+
+A suite (.ste) is flattened into its test members (.tst), with the suite parameters applied to each member as
+the suite's globals. The instruments each member uses are read from its parameters: the grid simulator, PV
+simulator and data acquisition system (by mode and address) and the EUT communication endpoint. Members that
+share an instrument keep their suite order, members that don't share any run at the same time in separate
+worker processes, each holding named locks on its instruments while it runs. Members with no instruments
+(e.g., offline analysis) may use the results of the member before them, they run once the preceding member in
+the suite has completed.
+
+    python suite.py "UL 1741 SA - CA Rule 21/Suites/All.ste" --jobs 4
+    python suite.py "Sandia Inverter Test Protocol/Suites/VV12.ste" --dry-run
+
+The report lists the member start and end times, the critical path (the chain of dependent members that set
+the total run time) and the wall clock time saved against running the members in order.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+
+# instrument parameter groups: the mode parameter and the parameters that identify the physical instrument
+INSTRUMENTS = ['gridsim', 'pvsim', 'das', 'der']
+ADDRESS_PARAMS = ['ipaddr', 'ip_addr', 'ipport', 'ip_port', 'serial_port', 'ifc_name', 'channel', 'node']
+# modes without an instrument connection need the operator
+MANUAL_MODE = 'Manual'
+OPERATOR = 'operator'
+
+
+class SuiteError(Exception):
+    pass
+
+
+class Param(object):
+    """
+    Suite or test parameter, kept as read so it can be written back unchanged.
+    """
+
+    def __init__(self, element):
+        self.name = element.get('name')
+        self.type = element.get('type')
+        self.value = element.text or ''
+        self.attrib = dict(element.attrib)
+
+    def element(self):
+        e = ET.Element('param', self.attrib)
+        e.text = self.value
+        return e
+
+
+class Member(object):
+    """
+    Test member of a suite with the effective parameters.
+    """
+
+    def __init__(self, name, tst_file, script, script_file, params, index):
+        self.name = name
+        self.tst_file = tst_file
+        self.script = script
+        self.script_file = script_file
+        self.params = params
+        self.index = index
+        self.resources = resources(self.values())
+        self.depends = []  # indexes of the members that must complete first
+        self.reset()
+
+    def reset(self):
+        self.start = None
+        self.end = None
+        self.rc = None
+        self.output = ''
+
+    def values(self):
+        return dict([(name, p.value) for name, p in self.params.iteritems()])
+
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.
+        return self.end - self.start
+
+    def write_config(self, filename):
+        """
+        Writes the member's test configuration with the effective parameters.
+        """
+        root = ET.Element('scriptConfig', {'name': self.name, 'script': self.script})
+        params = ET.SubElement(root, 'params')
+        for name in sorted(self.params):
+            params.append(self.params[name].element())
+        ET.ElementTree(root).write(filename)
+
+    def __str__(self):
+        return self.name
+
+
+def resources(values):
+    """
+    Returns the set of named resources (instruments and EUT endpoint) used by a test with parameter values.
+    """
+    res = set()
+    for kind in INSTRUMENTS:
+        mode = values.get('%s.mode' % kind)
+        if mode is None or mode.startswith('Disabled'):
+            continue
+        if mode == MANUAL_MODE:
+            res.add(OPERATOR)
+            continue
+        prefix = '%s.' % kind
+        address = []
+        for name in sorted(values):
+            if name.startswith(prefix) and name.rsplit('.', 1)[-1] in ADDRESS_PARAMS:
+                address.append(values[name])
+        res.add('%s:%s' % (kind, ':'.join(address) or mode))
+
+    # EUT communication endpoint of the Sandia and UL 1741 SA scripts
+    ifc_type = values.get('comm.ifc_type')
+    if ifc_type is not None:
+        if ifc_type == 'TCP':
+            res.add('comm:%s:%s' % (values.get('comm.ipaddr'), values.get('comm.ipport')))
+        elif ifc_type == 'MAPPED':
+            res.add('comm:%s' % values.get('comm.map_name'))
+        else:
+            res.add('comm:%s' % values.get('comm.ifc_name'))
+    # Sandia DSM data files are shared by every test using them
+    if values.get('datatrig.dsm_method', '').startswith('Sandia') or values.get('das.mode') == 'Sandia DSM':
+        res.add('dsm')
+    return res
+
+
+def _read(filename):
+    try:
+        return ET.parse(filename).getroot()
+    except Exception, e:
+        raise SuiteError('Unable to read %s: %s' % (filename, str(e)))
+
+
+def _params(root):
+    params = {}
+    element = root.find('params')
+    if element is not None:
+        for p in element.findall('param'):
+            params[p.get('name')] = Param(p)
+    return params
+
+
+class Suite(object):
+    """
+    Flattened suite.
+
+    filename - suite (.ste) file. Members are found relative to the suite directory (suites) and the Tests and
+               Scripts directories beside it.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        suites_dir = os.path.dirname(self.filename)
+        # nested suite directories (e.g., Suites/Sandia) find the Tests and Scripts of the protocol directory
+        base = suites_dir
+        while base and os.path.basename(base) != 'Suites' and os.path.dirname(base) != base:
+            base = os.path.dirname(base)
+        if os.path.basename(base) != 'Suites':
+            base = suites_dir
+        self.suites_dir = suites_dir
+        self.tests_dir = os.path.join(os.path.dirname(base), 'Tests')
+        self.scripts_dir = os.path.join(os.path.dirname(base), 'Scripts')
+        self.members = []
+        self._load(self.filename, [], set())
+        self._graph()
+
+    def _load(self, filename, globals_stack, loading):
+        if filename in loading:
+            raise SuiteError('Suite %s includes itself' % filename)
+        loading.add(filename)
+        root = _read(filename)
+        suite_params = _params(root)
+        stack = globals_stack
+        if root.get('globals', 'False') == 'True':
+            stack = [suite_params] + globals_stack
+        members = root.find('members')
+        for m in (members.findall('member') if members is not None else []):
+            name = m.get('name')
+            if name.endswith('.ste'):
+                path = os.path.join(os.path.dirname(filename), name)
+                if not os.path.isfile(path):
+                    path = os.path.join(self.suites_dir, name)
+                self._load(path, stack, loading)
+            else:
+                path = os.path.join(self.tests_dir, name)
+                if not os.path.isfile(path):
+                    path = os.path.join(os.path.dirname(filename), name)
+                tst = _read(path)
+                params = _params(tst)
+                # inner suites first, the outermost suite's globals take precedence
+                for g in reversed(stack):
+                    params.update(g)
+                script = tst.get('script')
+                self.members.append(Member(tst.get('name') or os.path.splitext(os.path.basename(name))[0], path,
+                                           script, os.path.join(self.scripts_dir, '%s.py' % script), params,
+                                           len(self.members)))
+        loading.discard(filename)
+
+    def _graph(self):
+        # a member depends on the last earlier member holding each of its resources, a member without resources
+        # on the member preceding it
+        last = {}
+        for m in self.members:
+            deps = set()
+            if not m.resources and m.index > 0:
+                deps.add(m.index - 1)
+            for r in m.resources:
+                if r in last:
+                    deps.add(last[r])
+                last[r] = m.index
+            m.depends = sorted(deps)
+
+    def levels(self):
+        """
+        Returns the members grouped by dependency depth (members in a group can run at the same time).
+        """
+        depth = {}
+        for m in self.members:
+            depth[m.index] = max([depth[d] + 1 for d in m.depends] or [0])
+        groups = {}
+        for m in self.members:
+            groups.setdefault(depth[m.index], []).append(m)
+        return [groups[k] for k in sorted(groups)]
+
+    def critical_path(self):
+        """
+        Returns (duration, members) of the longest chain of dependent members by member run time.
+        """
+        best = {}
+        for m in self.members:
+            prev = None
+            for d in m.depends:
+                if prev is None or best[d][0] > best[prev][0]:
+                    prev = d
+            if prev is None:
+                best[m.index] = (m.duration(), [m])
+            else:
+                best[m.index] = (best[prev][0] + m.duration(), best[prev][1] + [m])
+        if not best:
+            return 0., []
+        return max(best.values(), key=lambda b: b[0])
+
+
+def run_script(member, python=None, workdir=None):
+    """
+    Runs a member's script in a worker process with the member's effective configuration. Returns (rc, output).
+    """
+    if not os.path.isfile(member.script_file):
+        return -1, 'Script not found: %s' % member.script_file
+    fd, config = tempfile.mkstemp(suffix='.tst', dir=workdir)
+    os.close(fd)
+    try:
+        member.write_config(config)
+        p = subprocess.Popen([python or sys.executable, member.script_file, config],
+                             cwd=os.path.dirname(member.script_file),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0]
+        return p.returncode, output
+    finally:
+        os.remove(config)
+
+
+class Runner(object):
+    """
+    Runs the members of a suite with up to jobs members at the same time.
+
+    run_func - function(member) returning (rc, output), defaults to run_script.
+    stop_on_fail - don't start new members after a member fails.
+    """
+
+    def __init__(self, suite, jobs=2, run_func=None, stop_on_fail=False, log=None):
+        self.suite = suite
+        self.jobs = max(1, int(jobs))
+        self.run_func = run_func or run_script
+        self.stop_on_fail = stop_on_fail
+        self.log = log or (lambda msg: sys.stdout.write('%s\n' % msg))
+        self.locks = {}
+        self.start = None
+        self.end = None
+        self._cond = threading.Condition()
+        self._finished = []
+
+    def lock(self, name):
+        """
+        Returns the named lock for a resource.
+        """
+        with self._cond:
+            if name not in self.locks:
+                self.locks[name] = threading.Lock()
+            return self.locks[name]
+
+    def _worker(self, member):
+        held = []
+        try:
+            # resources are locked in a fixed order so two members can never hold one each
+            for name in sorted(member.resources):
+                lock = self.lock(name)
+                lock.acquire()
+                held.append(lock)
+            member.start = time.time()
+            self.log('%8.1f  start  %s [%s]' % (member.start - self.start, member, ', '.join(sorted(member.resources))))
+            try:
+                member.rc, member.output = self.run_func(member)
+            except Exception, e:
+                member.rc, member.output = -1, str(e)
+            member.end = time.time()
+            self.log('%8.1f  %s %s (%0.1f s)' % (member.end - self.start, 'done  ' if member.rc == 0 else 'FAILED',
+                                                 member, member.duration()))
+        finally:
+            for lock in reversed(held):
+                lock.release()
+            with self._cond:
+                self._finished.append(member.index)
+                self._cond.notify_all()
+
+    def run(self):
+        """
+        Runs the suite, returns True if every member passed.
+        """
+        members = self.suite.members
+        for m in members:
+            m.reset()
+        self._finished = []
+        self.start = time.time()
+        pending = list(members)
+        running = {}
+        done = set()
+        failed = False
+        with self._cond:
+            while pending or running:
+                while self._finished:
+                    index = self._finished.pop()
+                    running.pop(index).join()
+                    done.add(index)
+                    if members[index].rc != 0:
+                        failed = True
+                if failed and self.stop_on_fail:
+                    pending = []
+                ready = [m for m in pending if all([d in done for d in m.depends])]
+                while ready and len(running) < self.jobs:
+                    m = ready.pop(0)
+                    pending.remove(m)
+                    t = threading.Thread(target=self._worker, args=(m,), name=m.name)
+                    t.daemon = True
+                    running[m.index] = t
+                    t.start()
+                if pending and not ready and not running:
+                    # remaining members depend on members that were not run
+                    break
+                if running and not self._finished:
+                    self._cond.wait(1.)
+        self.end = time.time()
+        return all([m.rc == 0 for m in members])
+
+    def report(self):
+        """
+        Returns the run report: member timings, critical path and time saved.
+        """
+        lines = ['Suite: %s' % self.suite.filename, '']
+        lines.append('%-40s %9s %9s %9s  %s' % ('Member', 'Start', 'End', 'Duration', 'Result'))
+        for m in self.suite.members:
+            if m.start is None:
+                lines.append('%-40s %9s %9s %9s  %s' % (m.name, '-', '-', '-', 'not run'))
+                continue
+            lines.append('%-40s %9.1f %9.1f %9.1f  %s' % (m.name, m.start - self.start, m.end - self.start,
+                                                         m.duration(), 'pass' if m.rc == 0 else 'FAIL (%s)' % m.rc))
+        total, path = self.suite.critical_path()
+        sequential = sum([m.duration() for m in self.suite.members])
+        wall = (self.end or time.time()) - self.start
+        lines.append('')
+        lines.append('Critical path (%0.1f s): %s' % (total, ' -> '.join([m.name for m in path])))
+        lines.append('Wall clock %0.1f s, members in order %0.1f s, saved %0.1f s (%0.0f%%)' %
+                     (wall, sequential, sequential - wall, 100.*(sequential - wall)/sequential if sequential else 0.))
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the members of a suite concurrently.')
+    parser.add_argument('suite', help='suite (.ste) file')
+    parser.add_argument('--jobs', type=int, default=2, help='members run at the same time')
+    parser.add_argument('--dry-run', action='store_true', help='show the resource groups without running')
+    parser.add_argument('--stop-on-fail', action='store_true')
+    args = parser.parse_args()
+
+    s = Suite(args.suite)
+    if args.dry_run:
+        for i, group in enumerate(s.levels()):
+            print 'Stage %d:' % (i + 1)
+            for m in group:
+                print '    %-40s %s' % (m.name, ', '.join(sorted(m.resources)) or '(no instruments)')
+        sys.exit(0)
+
+    r = Runner(s, jobs=args.jobs, stop_on_fail=args.stop_on_fail)
+    ok = r.run()
+    print
+    print r.report()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,307 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Concurrent instrument operations for test scripts.
+
+Instrument set up and set point changes that do not depend on each other (initializing the PV simulator while
+the grid simulator is configured, setting the PV power while the grid voltage is changed) can be overlapped
+instead of waiting for each round trip in turn. Each instrument gets its own worker thread, so operations
+submitted to the same instrument still run one at a time in the order submitted, while operations on different
+instruments run at the same time:
+
+    pv_on = tasks.submit(pv, 'power_on')
+    grid_v = tasks.submit(grid, 'voltage', voltage=v)
+    tasks.gather(pv_on, grid_v)
+
+    grid, pv, daq = tasks.parallel((gridsim.gridsim_init, ts), (pvsim.pvsim_init, ts), (das.das_init, ts),
+                                   cleanup=tasks.close)
+
+    inverter.submit(inv, inverter.set_power_factor, power_factor=0.95, enable=1)
+
+The synchronous instrument methods are unchanged, submit() calls them on the worker thread and returns a Future
+for the result. Exceptions raised by the operation are raised again by Future.result() in the calling thread.
+"""
+
+import sys
+import time
+import Queue
+import weakref
+import threading
+
+
+class TaskError(Exception):
+    pass
+
+
+class Future(object):
+    """
+    Result of an operation running on a worker thread.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.start_time = None
+        self.end_time = None
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self.end_time = time.time()
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for cb in callbacks:
+            cb(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the operation to complete. Returns True if it completed within timeout seconds.
+        """
+        # Event.wait() without a timeout can't be interrupted on python 2, wait in short steps
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not self._done.is_set():
+            remaining = 1.
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.time())
+                if remaining <= 0:
+                    break
+            self._done.wait(remaining)
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Returns the result of the operation, raising the operation's exception if it failed.
+        """
+        if not self.wait(timeout):
+            raise TaskError('Timeout waiting for %s' % (self.name or 'operation'))
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Returns the exception raised by the operation or None.
+        """
+        if not self.wait(timeout):
+            raise TaskError('Timeout waiting for %s' % (self.name or 'operation'))
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, func):
+        """
+        Calls func(future) when the operation completes (immediately if it already has).
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def elapsed(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+def _run(future, func, args, kwargs):
+    future.start_time = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except:
+        future.set_exception(sys.exc_info())
+    else:
+        future.set_result(result)
+
+
+def _name(func):
+    return getattr(func, '__name__', None) or str(func)
+
+
+class Worker(object):
+    """
+    Worker thread running submitted operations one at a time in submission order.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future(_name(func))
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._serve, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+            self.queue.put((future, func, args, kwargs))
+        return future
+
+    def _serve(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            _run(*item)
+
+    def close(self):
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread = None
+
+
+_workers = weakref.WeakKeyDictionary()
+_workers_by_id = {}
+_workers_lock = threading.Lock()
+
+
+def worker(obj):
+    """
+    Returns the worker thread for an instrument object, creating it on first use.
+    """
+    with _workers_lock:
+        try:
+            w = _workers.get(obj)
+            if w is None:
+                w = _workers[obj] = Worker(name='%s worker' % type(obj).__name__)
+        except TypeError:
+            # object can't be weakly referenced, key on its identity
+            w = _workers_by_id.get(id(obj))
+            if w is None:
+                w = _workers_by_id[id(obj)] = Worker(name='%s worker' % type(obj).__name__)
+    return w
+
+
+def submit(obj, func, *args, **kwargs):
+    """
+    Runs an operation on obj's worker thread and returns a Future. func may be the name of a method of obj or a
+    callable, which is called as func(*args, **kwargs) (pass obj in args for helper functions that take it).
+    """
+    if isinstance(func, basestring):
+        func = getattr(obj, func)
+    return worker(obj).submit(func, *args, **kwargs)
+
+
+def spawn(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) on a new thread and returns a Future.
+    """
+    future = Future(_name(func))
+    t = threading.Thread(target=_run, args=(future, func, args, kwargs), name=future.name)
+    t.daemon = True
+    t.start()
+    return future
+
+
+def gather(*futures, **kwargs):
+    """
+    Waits for all futures and returns their results in order. If any operation failed, the exception of the first
+    failed one (in argument order) is raised once all have completed.
+
+    timeout - maximum seconds to wait for all operations.
+    """
+    timeout = kwargs.get('timeout')
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for f in futures:
+        remaining = None
+        if deadline is not None:
+            remaining = max(0., deadline - time.time())
+        if not f.wait(remaining):
+            raise TaskError('Timeout waiting for %s' % (f.name or 'operation'))
+    return [f.result() for f in futures]
+
+
+def close(obj):
+    """
+    Closes an instrument object returned by an init function, if it has a close() method.
+    """
+    if obj is not None and hasattr(obj, 'close'):
+        obj.close()
+
+
+def parallel(*calls, **kwargs):
+    """
+    Runs independent calls at the same time and returns their results in order. Each call is a callable or a
+    tuple (func, arg, ...).
+
+    cleanup - called with the result of each call that succeeded if any call failed (e.g., tasks.close for
+              instrument init functions), so instruments that were started are released before the exception of
+              the first failed call is raised again. Errors raised by cleanup are ignored.
+    timeout - maximum seconds to wait for all calls.
+    """
+    cleanup = kwargs.pop('cleanup', None)
+    futures = []
+    for call in calls:
+        if callable(call):
+            call = (call,)
+        futures.append(spawn(call[0], *call[1:]))
+    try:
+        return gather(*futures, **kwargs)
+    except:
+        exc_info = sys.exc_info()
+        if cleanup is not None:
+            for f in futures:
+                # calls still running after a timeout are left alone
+                if f.done() and f.exception() is None:
+                    try:
+                        cleanup(f.result())
+                    except Exception:
+                        pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+
+if __name__ == "__main__":
+
+    class Instrument(object):
+        def __init__(self, name, latency):
+            self.name = name
+            self.latency = latency
+            self.log = []
+
+        def set(self, value):
+            time.sleep(self.latency)
+            self.log.append(value)
+            return value
+
+    grid = Instrument('grid', 0.2)
+    pv = Instrument('pv', 0.3)
+    start = time.time()
+    for i in range(3):
+        grid.set(i)
+        pv.set(i)
+    print 'sequential: %0.2f s' % (time.time() - start)
+
+    grid = Instrument('grid', 0.2)
+    pv = Instrument('pv', 0.3)
+    start = time.time()
+    futures = []
+    for i in range(3):
+        futures.append(submit(grid, 'set', i))
+        futures.append(submit(pv, 'set', i))
+    gather(*futures)
+    print 'concurrent: %0.2f s, order preserved: %s %s' % (time.time() - start, grid.log, pv.log)
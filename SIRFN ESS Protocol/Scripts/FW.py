@@ -60,7 +60,7 @@ def get_ac_freq_pct(inv, freq_ref = 60., data=None):
             inv.inverter.read()
             gridFraw = float(inv.inverter.Hz)
 
-        inv.settings.read()
+        inverter.read_model(inv, 'settings')
         Freq_nom = float(freq_ref)
 
         return (gridFraw/Freq_nom)*100.0
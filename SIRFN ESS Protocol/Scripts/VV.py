@@ -64,7 +64,7 @@ def get_ac_voltage_pct(inv, data=None):
             inv.inverter.read()
             gridVraw = float(inv.inverter.PhVphA)
 
-        inv.settings.read()
+        inverter.read_model(inv, 'settings')
         Vgrid_nom = float(inv.settings.VRef)
 
         return (gridVraw/Vgrid_nom)*100.0
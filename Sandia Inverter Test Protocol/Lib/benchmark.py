@@ -0,0 +1,520 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Benchmarks for the analysis and transport code in Lib. Run stand-alone:
+
+    python benchmark.py                  # import times, RMS against the legacy code and all hot path cases
+    python benchmark.py --case read_wfm  # selected hot path cases only
+    python benchmark.py --save           # store the hot path results as the baseline
+    python benchmark.py --compare        # compare with the baseline, exit status 1 on a regression
+
+Each hot path case runs in a fresh interpreter on synthetic captures (see capture()) and reports the best time of
+--repeat runs, the throughput in samples per second and the increase of the peak resident memory over the setup
+(exact on Linux, elsewhere only growth beyond the peak of the setup is seen).
+Baselines are machine specific, save one before a change and compare after it.
+"""
+
+import os
+import sys
+import math
+import time
+import json
+import atexit
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+import wave
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'benchmark_baseline.json')
+# throughput drop or memory growth, as a fraction of the baseline, reported as a regression
+TOLERANCE = 0.25
+# memory growth (MB) below which no regression is reported, the peak resident memory is page granular
+MEMORY_SLACK = 2.
+TRIGGER_HIGH = 5.
+
+
+def calculate_rms_legacy(data):
+    # per-sample reference implementation that wave.calculateRMS replaced
+    tmp = 0
+    size = len(data)
+    for i in range(size):
+        tmp += data[i]
+    mean = tmp / float(size)
+    tmp = 0
+    for i in range(size):
+        tmp2 = data[i] - mean
+        tmp += tmp2 * tmp2
+    tmp /= float(size)
+    return math.sqrt(tmp)
+
+
+def calculate_rms_of_signal_legacy(data, windowSize, samplingFrequency, overlap=0):
+    # per-window reference implementation that wave.calculateRmsOfSignal replaced
+    numFrames = len(data)
+    duration = numFrames / float(samplingFrequency)
+
+    readProgress = (windowSize - overlap) / 1000.0
+    outputSize = int(duration / readProgress)
+    dataX = np.zeros(outputSize)
+    dataY = np.zeros(outputSize)
+    t = 0
+    halfWindowSize = windowSize / 2000.0
+    for idx in range(outputSize):
+        left = int((t - halfWindowSize) * float(samplingFrequency))
+        right = left + int(windowSize * float(samplingFrequency) / 1000.0)
+        if right >= numFrames:
+            right = numFrames - 1
+        numFramesLocal = right - left
+        if numFramesLocal <= 0:
+            raise Exception("zero window size (t = " + str(t) + " sec.)")
+        dataTmp = np.zeros(numFramesLocal)
+        for i in range(numFramesLocal):
+            dataTmp[i] = data[i + left]
+        dataX[idx] = t
+        t += readProgress
+        dataY[idx] = calculate_rms_legacy(dataTmp)
+
+    return dataX[1:], dataY[1:]
+
+
+def sine_capture(duration=2., fs=24e3, f_grid=60., amplitude=240.*math.sqrt(2.), noise=1.):
+    """
+    Returns (time, signal) for a synthetic sinusoidal capture.
+    """
+    t = np.arange(int(duration*fs))/fs
+    sig = amplitude*np.sin(2.*math.pi*f_grid*t) + noise*np.random.randn(len(t))
+    return t, sig
+
+
+def capture(duration=5., fs=24e3, f_grid=60., v_rms=240., i_rms=12.5, t_event=None, v_pct=100., f_event=None,
+            trip_time=None, noise=0.002, seed=0):
+    """
+    Returns (time, ac voltage, ac current, grid trigger) of a synthetic waveform capture with the channels of a
+    DSM waveform file. At t_event the grid voltage steps to v_pct (%nominal) and the frequency to f_event (Hz) and
+    the grid simulator trigger goes high; trip_time seconds later the EUT stops producing current. noise is the
+    rms of the added white noise as a fraction of the rms values.
+    """
+    t = np.arange(int(round(duration*fs)))/float(fs)
+    freq = np.empty(len(t))
+    freq.fill(f_grid)
+    v_amp = np.empty(len(t))
+    v_amp.fill(v_rms*math.sqrt(2.))
+    i_amp = np.empty(len(t))
+    i_amp.fill(i_rms*math.sqrt(2.))
+    trig = np.zeros(len(t))
+    if t_event is not None:
+        event = t >= t_event
+        v_amp[event] *= v_pct/100.
+        if f_event is not None:
+            freq[event] = f_event
+        trig[event] = TRIGGER_HIGH
+        if trip_time is not None:
+            i_amp[t >= t_event + trip_time] = 0.
+    # phase continuous through frequency steps
+    phase = 2.*math.pi*np.cumsum(freq)/fs
+    rnd = np.random.RandomState(seed)
+    v = v_amp*np.sin(phase) + noise*v_rms*rnd.randn(len(t))
+    i = i_amp*np.sin(phase) + noise*i_rms*rnd.randn(len(t))
+    return t, v, i, trig
+
+
+def vrt_capture(duration=5., fs=24e3, f_grid=60., v_pct=60., trip_time=0.32, pretrig=0.167, **kwargs):
+    """
+    Voltage ride-through capture: sag (or swell) to v_pct after the pretrigger time, trip trip_time later.
+    """
+    return capture(duration, fs, f_grid, t_event=pretrig, v_pct=v_pct, trip_time=trip_time, **kwargs)
+
+
+def frt_capture(duration=5., fs=24e3, f_grid=60., f_pct=102., trip_time=1.5, pretrig=0.167, **kwargs):
+    """
+    Frequency ride-through capture: step to f_pct (%nominal) after the pretrigger time, trip trip_time later.
+    """
+    return capture(duration, fs, f_grid, t_event=pretrig, f_event=f_grid*f_pct/100., trip_time=trip_time, **kwargs)
+
+
+def write_capture(filename, columns, channels=('Time', 'AC_Voltage', 'AC_Current', 'Ametek_Trigger')):
+    """
+    Writes capture columns as a DSM waveform file.
+    """
+    with open(filename, 'w') as f:
+        f.write('\t'.join(channels[:len(columns)]) + '\n')
+        np.savetxt(f, np.column_stack(columns), fmt='%.6g', delimiter='\t')
+
+
+def timeit(func, *args, **kwargs):
+    """
+    Returns (seconds, result) for a single call of func.
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def bench_rms(duration=2., fs=24e3, f_grid=60.):
+    t, sig = sine_capture(duration=duration, fs=fs, f_grid=f_grid)
+    window_size = (1./f_grid)*1000.
+    overlap = int(window_size/3)
+
+    t_legacy, (x_legacy, y_legacy) = timeit(calculate_rms_of_signal_legacy, sig, window_size, fs, overlap)
+    t_new, (x_new, y_new) = timeit(wave.calculateRmsOfSignal, sig, window_size, fs, overlap)
+    max_err = np.max(np.abs(y_new - y_legacy)) if len(y_new) > 0 else 0.
+
+    print 'calculateRmsOfSignal: %d samples, %d windows' % (len(sig), len(y_new))
+    print '  legacy:     %8.4f s (%.0f samples/s)' % (t_legacy, len(sig)/t_legacy)
+    print '  vectorized: %8.4f s (%.0f samples/s)' % (t_new, len(sig)/max(t_new, 1e-9))
+    print '  speedup:    %8.1fx, max abs difference %g' % (t_legacy/max(t_new, 1e-9), max_err)
+
+    for cycles in [1., 0.5]:
+        t_cyc, (x, y) = timeit(wave.cycle_rms, t, sig, fs, f_grid=f_grid, cycles=cycles)
+        print 'cycle_rms (%.1f cycle): %d windows in %.4f s' % (cycles, len(y), t_cyc)
+
+
+def import_time(module, repeat=3):
+    """
+    Returns the best time (s) to import module in a fresh interpreter with Lib on the path.
+    """
+    lib = os.path.dirname(os.path.realpath(__file__))
+    code = ('import sys, time; sys.path.insert(0, %r); t = time.time(); import %s; '
+            'sys.stdout.write(repr(time.time() - t))' % (lib, module))
+    env = dict(os.environ)
+    env.setdefault('MPLBACKEND', 'Agg')
+    best = None
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+        t = float(out.strip().splitlines()[-1])
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def bench_import(modules=('numpy', 'wave', 'scipy.signal', 'matplotlib.pyplot')):
+    """
+    Script startup cost: import time of the analysis modules and of the optional packages they defer.
+    """
+    print 'import time (fresh interpreter, best of 3):'
+    for m in modules:
+        try:
+            print '  %-20s %8.1f ms' % (m, import_time(m)*1000.)
+        except subprocess.CalledProcessError:
+            print '  %-20s not available' % m
+
+
+def _proc_status():
+    # resident and peak resident memory (MB) from /proc on Linux
+    mem = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                mem[line.split(':')[0]] = float(line.split()[1])/1024.
+    return mem['VmRSS'], mem['VmHWM']
+
+
+def reset_peak_rss():
+    """
+    Restarts the peak resident memory at the present resident memory where the platform allows it (Linux).
+    Returns the present resident memory (MB), None if the peak cannot be restarted.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status()[0]
+    except (IOError, OSError, KeyError):
+        return None
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory (MB) of this process, None if it cannot be read on this platform.
+    """
+    try:
+        return _proc_status()[1]
+    except (IOError, OSError, KeyError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return rss/1048576.  # bytes
+        return rss/1024.  # kB
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize',
+                                                             'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                                                             'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage',
+                                                             'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize/1048576.
+    except Exception:
+        pass
+    return None
+
+
+class BenchScript(object):
+    """
+    Minimal script context for instantiating the lab equipment classes: parameter values from a dict, logging
+    discarded and confirmations accepted.
+    """
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def param_value(self, name):
+        return self.params.get(name)
+
+    def log(self, msg):
+        pass
+
+    log_warning = log_error = log_debug = log
+
+    def confirm(self, msg):
+        return True
+
+
+def _tempdir():
+    path = tempfile.mkdtemp(prefix='svp_bench_')
+    atexit.register(shutil.rmtree, path, True)
+    return path
+
+
+# Hot path cases. Each takes the capture settings and returns (samples, func): the number of samples processed by
+# one call of func and the call to time. The setup (generating and writing captures) is not timed.
+
+def case_rms(duration, fs, f_grid):
+    t, v, i, trig = vrt_capture(duration, fs, f_grid)
+    window_size = 1000./f_grid
+    return len(v), lambda: wave.calculateRmsOfSignal(v, window_size, fs, int(window_size/3))
+
+
+def case_trip(duration, fs, f_grid):
+    # calc_ride_through_duration assumes 24 kHz captures of a 60 Hz grid
+    t, v, i, trig = vrt_capture(duration, 24e3, 60.)
+    return len(i), lambda: wave.calc_ride_through_duration(t, i, grid_trig=trig)
+
+
+def case_freq(duration, fs, f_grid):
+    t, v, i, trig = frt_capture(duration, fs, f_grid)
+    return len(v), lambda: wave.freq_from_crossings(t, v, fs)
+
+
+def case_read_wfm(duration, fs, f_grid):
+    import sandia_dsm
+
+    name = os.path.join(_tempdir(), 'vrt.wfm')
+    columns = vrt_capture(duration, fs, f_grid)
+    write_capture(name, columns)
+    return len(columns[0]), lambda: sandia_dsm.read_wfm(name, cache=False)
+
+
+def case_read_file(duration, fs, f_grid):
+    import sandia_dsm
+
+    path = _tempdir()
+    name = os.path.join(path, 'vrt.wfm')
+    columns = vrt_capture(duration, fs, f_grid)
+    write_capture(name, columns)
+    trigger = sandia_dsm.WfmTrigger(BenchScript(), filename=os.path.join(path, 'waveform trigger.txt'))
+    trigger.read_file(name)  # first read writes the binary sidecar
+
+    def read():
+        wfmtime, ac_voltage, ac_current, daq_trig = trigger.read_file(name)
+        return float(ac_current.sum())
+    return len(columns[0]), read
+
+
+def case_response_time(duration, fs, f_grid):
+    import curve
+
+    # SunSpec default curves in the parameter layout of the VRT script, test points swept across both curves
+    h_volt, h_time = {1: 120., 2: 120., 3: 110., 4: 110.}, {1: 0., 2: 0.16, 3: 0.16, 4: 13.}
+    l_volt, l_time = {1: 50., 2: 50., 3: 88., 4: 88.}, {1: 0., 2: 0.16, 3: 0.16, 4: 2.}
+    test_pct = np.linspace(40., 130., 1000)
+
+    def predict():
+        # the curve.* calls of predict_vrt_response_time (VRT.py) and predict_frt_response_time (FRT.py)
+        return curve.response_time(test_pct, curve.ride_through_curve(h_volt, h_time, 4, high=True),
+                                   curve.ride_through_curve(l_volt, l_time, 4, high=False))
+    return len(test_pct), predict
+
+
+def case_ametek_profile(duration, fs, f_grid):
+    import scpi
+    import grid_profiles
+    import gridsim_ametek
+
+    fake = scpi.FakeInstrument(responses={'OUTP?': '1'})
+    atexit.register(fake.close)
+    ts = BenchScript({'gridsim.auto_config': 'Disabled', 'gridsim.ametek.v_nom': 240.,
+                      'gridsim.ametek.v_max': 300., 'gridsim.ametek.i_max': 100., 'gridsim.ametek.freq': f_grid,
+                      'gridsim.ametek.comm': 'TCP/IP', 'gridsim.ametek.ip_addr': '127.0.0.1',
+                      'gridsim.ametek.ip_port': fake.ipport})
+    grid = gridsim_ametek.GridSim(ts)
+    atexit.register(grid.close)
+    names = ('VV Profile', 'FW Profile')
+    segments = sum([len(grid_profiles.program(name, 240., f_grid, v_max=300.)) for name in names])
+
+    def load():
+        # alternate the profiles so the lists differ from those held by the instrument on every start
+        for name in names:
+            grid.profile_load(name)
+            grid.profile_start()
+    return segments, load
+
+
+def case_compile_profile(duration, fs, f_grid):
+    import grid_profiles
+
+    profiles = [grid_profiles.profiles[name] for name in sorted(grid_profiles.profiles)]
+    segments = sum([len(p) for p in profiles])
+    return segments, lambda: [grid_profiles.compile_profile(p, 240., f_grid, v_max=300.) for p in profiles]
+
+
+CASES = [
+    ('rms', case_rms),
+    ('trip', case_trip),
+    ('freq', case_freq),
+    ('read_wfm', case_read_wfm),
+    ('read_file', case_read_file),
+    ('response_time', case_response_time),
+    ('compile_profile', case_compile_profile),
+    ('ametek_profile', case_ametek_profile),
+]
+
+
+def run_case(name, duration=5., fs=24e3, f_grid=60., repeat=3):
+    """
+    Runs a hot path case in this interpreter. Returns a dict of the samples per call, the best time of repeat
+    calls (s), the throughput (samples/s) and the peak memory increase of the first call (MB).
+    """
+    samples, func = dict(CASES)[name](duration, fs, f_grid)
+    # without a restart the peak includes the setup and only growth beyond it is seen
+    rss = reset_peak_rss()
+    if rss is None:
+        rss = peak_rss()
+    best, result = timeit(func)
+    peak = peak_rss()
+    for i in range(repeat - 1):
+        best = min(best, timeit(func)[0])
+    return {'samples': samples, 'seconds': best, 'samples_s': samples/max(best, 1e-9),
+            'peak_mb': None if rss is None else max(peak - rss, 0.)}
+
+
+def run_case_process(name, duration=5., fs=24e3, f_grid=60., repeat=3):
+    """
+    Runs a hot path case in a fresh interpreter so the peak memory is that of the case alone.
+    """
+    cmd = [sys.executable, os.path.realpath(__file__), '--run', name, '--duration', str(duration), '--fs', str(fs),
+           '--f-grid', str(f_grid), '--repeat', str(repeat)]
+    env = dict(os.environ)
+    env.setdefault('MPLBACKEND', 'Agg')
+    out = subprocess.check_output(cmd, env=env)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def bench_cases(names=None, duration=5., fs=24e3, f_grid=60., repeat=3, baseline=None):
+    """
+    Runs the hot path cases and prints their results against the baseline. Returns (results, regressions).
+    """
+    if not names:
+        names = [name for name, case in CASES]
+    print 'hot paths (%g s captures at %g Hz, %g Hz grid, fresh interpreter, best of %d):' % (duration, fs, f_grid,
+                                                                                             repeat)
+    print '  %-16s %10s %10s %14s %9s  %s' % ('case', 'samples', 'best (s)', 'samples/s', 'peak MB', 'baseline')
+    results = {}
+    regressions = []
+    for name in names:
+        try:
+            r = run_case_process(name, duration, fs, f_grid, repeat)
+        except subprocess.CalledProcessError:
+            print '  %-16s failed' % name
+            continue
+        results[name] = r
+        note = ''
+        base = (baseline or {}).get('cases', {}).get(name)
+        if base:
+            note = '%+.0f%% samples/s' % ((r['samples_s']/base['samples_s'] - 1.)*100.)
+            if r['samples_s'] < base['samples_s']*(1. - TOLERANCE):
+                regressions.append('%s throughput' % name)
+                note += ' REGRESSION'
+            if r['peak_mb'] is not None and base.get('peak_mb') is not None and \
+                    r['peak_mb'] > base['peak_mb']*(1. + TOLERANCE) + MEMORY_SLACK:
+                regressions.append('%s memory' % name)
+                note += ', memory REGRESSION (baseline %0.1f MB)' % base['peak_mb']
+        peak = 'n/a' if r['peak_mb'] is None else '%0.1f' % r['peak_mb']
+        print '  %-16s %10d %10.4f %14.0f %9s  %s' % (name, r['samples'], r['seconds'], r['samples_s'], peak, note)
+    return results, regressions
+
+
+def load_baseline(filename=BASELINE_FILE):
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_baseline(results, settings, filename=BASELINE_FILE):
+    """
+    Stores the hot path results as the baseline, merged into an existing baseline taken with the same settings.
+    """
+    baseline = load_baseline(filename)
+    if baseline is None or baseline.get('settings') != settings:
+        baseline = {'settings': settings, 'cases': {}}
+    baseline['cases'].update(results)
+    baseline['python'] = sys.version.split()[0]
+    baseline['numpy'] = np.__version__
+    baseline['date'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(filename, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the analysis and transport code in Lib.')
+    parser.add_argument('--case', action='append', choices=[name for name, case in CASES],
+                        help='hot path case to run (repeat for several), all if not given')
+    parser.add_argument('--duration', type=float, default=5., help='capture length (s)')
+    parser.add_argument('--fs', type=float, default=24e3, help='capture sampling rate (Hz)')
+    parser.add_argument('--f-grid', type=float, default=60., help='grid frequency (Hz), 50 or 60')
+    parser.add_argument('--repeat', type=int, default=3, help='timed calls per case, the best is reported')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='exit status 1 on a regression against the baseline')
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # single case in this interpreter, json result
+    args = parser.parse_args()
+
+    if args.run:
+        sys.stdout.write(json.dumps(run_case(args.run, args.duration, args.fs, args.f_grid, args.repeat)) + '\n')
+        sys.exit(0)
+
+    if not args.case:
+        bench_import()
+        bench_rms(f_grid=args.f_grid)
+    settings = {'duration': args.duration, 'fs': args.fs, 'f_grid': args.f_grid}
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and baseline.get('settings') != settings:
+        print 'baseline %s was taken with other capture settings %s, not compared' % (args.baseline,
+                                                                                     baseline.get('settings'))
+        baseline = None
+    results, regressions = bench_cases(args.case, args.duration, args.fs, args.f_grid, args.repeat, baseline)
+    if args.save:
+        save_baseline(results, settings, args.baseline)
+        print 'baseline saved to %s' % args.baseline
+    if regressions:
+        print 'regressions: %s' % ', '.join(regressions)
+        if args.compare:
+            sys.exit(1)
@@ -0,0 +1,375 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Online ride-through, trip and run-on detection.
+
+The detector is fed measurements while the capture is still running, either RMS samples from the DAS (voltage,
+current and frequency at the DAS rate) or raw waveform chunks, which are reduced to one RMS value per cycle and a
+per-cycle frequency. Events are recorded, and reported to on_event, as soon as they are seen:
+
+    start - the grid event: voltage or frequency outside the nominal window, or the time given to start()
+    cessation - EUT current at or below the trip threshold
+    resume - EUT current above the resume threshold for resume_cycles samples after a cessation
+    trip - a cessation that has not resumed within trip_hold seconds
+    end - voltage and frequency back within the nominal window after the start
+
+The test script can stop waiting as soon as the outcome is decided:
+
+    d = detector.Detector(v_nom=240., v_window=20., trip_thresh=3., on_event=log_event)
+    while not timed_out:
+        d.update(t, v_rms, i_rms, freq)
+        ride_through_time = d.decide(t, c_time, d_time, time_msa, resolution=0.1)
+        if ride_through_time is not None:
+            break
+
+The ride-through time is the time from the start to the first cessation (0 if the EUT has not ceased to
+energize), the same quantity wave.calc_ride_through_duration computes from the complete waveform. For
+anti-islanding tests the run-on time is the same quantity with the start at the island formation.
+"""
+
+import numpy as np
+
+START = 'start'
+CESSATION = 'cessation'
+RESUME = 'resume'
+TRIP = 'trip'
+END = 'end'
+
+
+class DetectorError(Exception):
+    pass
+
+
+class Detector(object):
+    """
+    Event detector for ride-through and anti-islanding tests.
+
+    v_nom, v_window - nominal voltage (RMS) and the window around it; the event starts when the voltage leaves
+                      the window. None to start only with start() or frequency.
+    f_nom, f_window - nominal frequency and the window around it. None to ignore frequency.
+    trip_thresh - RMS current at or below which the EUT has ceased to energize.
+    resume_thresh - RMS current above which the EUT has resumed (default 2 x trip_thresh).
+    resume_cycles - samples above resume_thresh for a resume.
+    trip_hold - seconds without a resume after which a cessation is a trip.
+    on_event - function(name, t) called for every event as it is detected.
+    """
+
+    def __init__(self, v_nom=None, v_window=None, f_nom=60., f_window=None, trip_thresh=3., resume_thresh=None,
+                 resume_cycles=3, trip_hold=1., on_event=None):
+        self.v_nom = v_nom
+        self.v_window = v_window
+        self.f_nom = f_nom
+        self.f_window = f_window
+        self.trip_thresh = trip_thresh
+        self.resume_thresh = resume_thresh if resume_thresh is not None else 2.*trip_thresh
+        self.resume_cycles = resume_cycles
+        self.trip_hold = trip_hold
+        self.on_event = on_event
+        self.events = []
+        self.start_time = None
+        self.cessation_time = None  # first cessation after the start
+        self.ceased = None  # time of the current cessation, None while energized
+        self.above = 0  # consecutive samples above the resume threshold while ceased
+        self.ended = False
+        self.last_time = None
+        self.samples = 0
+        # waveform state
+        self._wfm = None
+        self._tracker = None
+
+    def _event(self, name, t):
+        self.events.append((name, t))
+        if self.on_event is not None:
+            self.on_event(name, t)
+
+    def event_time(self, name):
+        """
+        Returns the time of the first event name or None.
+        """
+        for n, t in self.events:
+            if n == name:
+                return t
+        return None
+
+    def start(self, t):
+        """
+        Sets the start of the grid event (e.g., the simulator trigger or the island formation).
+        """
+        if self.start_time is None:
+            self.start_time = t
+            self._event(START, t)
+
+    def _abnormal(self, v_rms, freq):
+        abnormal = np.zeros(len(v_rms), dtype=bool)
+        if self.v_nom is not None and self.v_window is not None:
+            abnormal |= np.abs(v_rms - self.v_nom) > self.v_window
+        if self.f_window is not None and freq is not None:
+            with np.errstate(invalid='ignore'):
+                abnormal |= np.abs(freq - self.f_nom) > self.f_window
+        return abnormal
+
+    def update(self, t, v_rms=None, i_rms=None, freq=None):
+        """
+        Processes measurements (scalars or arrays of equal length): time, RMS voltage, RMS current and frequency.
+        Voltage and frequency may be None when the start is set with start().
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        n = len(t)
+        if n == 0:
+            return
+        if i_rms is None:
+            raise DetectorError('No current measurement')
+        i_rms = np.atleast_1d(np.asarray(i_rms, dtype=float))
+        v_rms = np.atleast_1d(np.asarray(v_rms, dtype=float)) if v_rms is not None else np.zeros(n) + np.nan
+        freq = np.atleast_1d(np.asarray(freq, dtype=float)) if freq is not None else None
+        abnormal = self._abnormal(v_rms, freq)
+        self.samples += n
+        self.last_time = t[-1]
+
+        k = 0
+        while k < n:
+            if self.start_time is None:
+                idx = np.flatnonzero(abnormal[k:])
+                if len(idx) == 0:
+                    break
+                k += idx[0]
+                self.start(t[k])
+            if not self.ended and (self.v_window is not None or self.f_window is not None) and \
+                    self.start_time is not None:
+                # end of the grid event, voltage and frequency back within the window
+                idx = np.flatnonzero(~abnormal[k:])
+                end_idx = k + idx[0] if len(idx) else None
+            else:
+                end_idx = None
+            if self.ceased is None:
+                idx = np.flatnonzero(i_rms[k:] <= self.trip_thresh)
+                next_idx = k + idx[0] if len(idx) else None
+                if end_idx is not None and (next_idx is None or end_idx < next_idx):
+                    self.ended = True
+                    self._event(END, t[end_idx])
+                    k = end_idx
+                    continue
+                if next_idx is None:
+                    break
+                k = next_idx
+                self.ceased = t[k]
+                self.above = 0
+                if self.cessation_time is None:
+                    self.cessation_time = t[k]
+                self._event(CESSATION, t[k])
+                k += 1
+            else:
+                above = i_rms[k:] > self.resume_thresh
+                # first run of resume_cycles consecutive samples above the threshold, continuing the run from the
+                # previous update
+                counts = _run_lengths(above, self.above)
+                idx = np.flatnonzero(counts >= self.resume_cycles)
+                if len(idx) == 0:
+                    self.above = counts[-1] if len(counts) else self.above
+                    self._check_trip(t[-1])
+                    if end_idx is not None:
+                        self.ended = True
+                        self._event(END, t[end_idx])
+                    break
+                r = k + idx[0]
+                self._check_trip(t[r])
+                if end_idx is not None and end_idx < r:
+                    self.ended = True
+                    self._event(END, t[end_idx])
+                self.ceased = None
+                self.above = 0
+                self._event(RESUME, t[r])
+                k = r + 1
+
+    def _check_trip(self, t):
+        if self.ceased is not None and t - self.ceased >= self.trip_hold and self.event_time(TRIP) is None:
+            self._event(TRIP, self.ceased)
+
+    def update_waveform(self, t, voltage, current, fs):
+        """
+        Processes a chunk of raw waveform samples: the chunk is reduced to one RMS value per cycle of the nominal
+        frequency and a per-cycle frequency (with scipy) before update() is called.
+        """
+        t = np.asarray(t, dtype=float)
+        voltage = np.asarray(voltage, dtype=float)
+        current = np.asarray(current, dtype=float)
+        if self._wfm is None:
+            self._wfm = (np.zeros(0), np.zeros(0), np.zeros(0))
+            try:
+                import frequency
+                self._tracker = frequency.Tracker(fs, t0=t[0] if len(t) else 0., f_nom=self.f_nom)
+            except Exception:
+                self._tracker = None
+        f_times = f_values = None
+        if self._tracker is not None:
+            freqs, freq_times = self._tracker.update(voltage)
+            f_times, f_values = freq_times, freqs
+        t = np.concatenate((self._wfm[0], t))
+        voltage = np.concatenate((self._wfm[1], voltage))
+        current = np.concatenate((self._wfm[2], current))
+        cycle = int(round(fs/self.f_nom))
+        cycles = len(t)//cycle
+        used = cycles*cycle
+        self._wfm = (t[used:], voltage[used:], current[used:])
+        if cycles == 0:
+            return
+        v = voltage[:used].reshape(cycles, cycle)
+        i = current[:used].reshape(cycles, cycle)
+        v_rms = np.sqrt(np.mean((v - v.mean(axis=1)[:, None])**2, axis=1))
+        i_rms = np.sqrt(np.mean((i - i.mean(axis=1)[:, None])**2, axis=1))
+        cycle_t = t[:used].reshape(cycles, cycle)[:, -1]
+        freq = None
+        if f_values is not None:
+            freq = np.zeros(cycles) + np.nan
+            if len(f_values):
+                freq = np.interp(cycle_t, f_times, f_values, left=np.nan, right=f_values[-1])
+        self.update(cycle_t, v_rms, i_rms, freq)
+
+    def ride_through_time(self):
+        """
+        Returns the time from the start to the first cessation, 0 if there has been no cessation, None before the
+        start.
+        """
+        if self.start_time is None:
+            return None
+        if self.cessation_time is None:
+            return 0.
+        return self.cessation_time - self.start_time
+
+    def decide(self, now, c_time, d_time, time_msa=0., resolution=0.):
+        """
+        Returns the ride-through time once the pass/fail outcome against the ride-through window (c_time + time_msa
+        to d_time - time_msa after the start) can no longer change, otherwise None.
+
+        now - time of the latest measurement.
+        resolution - time resolution of the measurements; a cessation closer than this to a window edge is not
+                     decided online (the complete waveform is needed).
+
+        A cessation decides the outcome. Without a cessation, once now is past the window the outcome is a failure
+        whatever happens later, and 0 is returned.
+        """
+        if self.start_time is None:
+            return None
+        rt = self.ride_through_time()
+        if self.cessation_time is not None:
+            if abs(rt - time_msa - c_time) <= resolution or abs(rt + time_msa - d_time) <= resolution:
+                return None
+            return rt
+        if now - self.start_time > d_time - time_msa + resolution:
+            return 0.
+        return None
+
+    def run_on_time(self):
+        """
+        Returns the anti-islanding run-on time (start to cessation) or None if the EUT has not ceased.
+        """
+        if self.start_time is None or self.cessation_time is None:
+            return None
+        return self.cessation_time - self.start_time
+
+
+def _run_lengths(mask, carry=0):
+    """
+    Returns the length of the run of True values ending at each element of mask, the run at the first element
+    continuing carry earlier True values.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if len(mask) == 0:
+        return np.zeros(0, dtype=int)
+    idx = np.arange(1, len(mask) + 1)
+    # index just after the last False at or before each element
+    last_false = np.maximum.accumulate(np.where(mask, 0, idx))
+    counts = idx - last_false
+    # runs from the start of the array continue the carried run
+    counts[last_false == 0] += carry
+    return counts
+
+
+def watch(read, detector, timeout, sleep, rate=10., stop=None):
+    """
+    Polls measurements and feeds the detector until stop(detector, t) returns True or timeout seconds have passed.
+
+    read - function returning (t, v_rms, i_rms, freq) for the newest measurement(s), scalars or arrays.
+    sleep - sleep function, normally ts.sleep.
+    Returns True if stopped by stop, False on timeout.
+    """
+    import sampler
+    s = sampler.Sampler(rate=rate, sleep=sleep)
+    for elapsed in s.ticks(duration=timeout):
+        t, v_rms, i_rms, freq = read()
+        detector.update(t, v_rms, i_rms, freq)
+        if stop is not None and detector.last_time is not None and stop(detector, detector.last_time):
+            return True
+    return False
+
+
+class DASReader(object):
+    """
+    Read function for watch() returning the newest sample of a DAS data object with time, ac_voltage, ac_current
+    and ac_freq points (sandia_dsm.Data). resolution is the longest interval seen between new samples.
+    """
+
+    def __init__(self, das):
+        self.das = das
+        self.time = None
+        self.resolution = None
+
+    def __call__(self):
+        self.das.read()
+        t = getattr(self.das, 'time', None)
+        if t is None or t == self.time:
+            return [], None, None, None
+        if self.time is not None:
+            self.resolution = max(self.resolution or 0., t - self.time)
+        self.time = t
+        return t, self.das.ac_voltage, self.das.ac_current, getattr(self.das, 'ac_freq', None)
+
+
+def watch_ride_through(detector, das, window, c_time, d_time, time_msa, sleep, rate=10.):
+    """
+    Feeds the detector from a DAS data object for up to window seconds. Returns the ride-through time as soon as
+    the outcome is decided (see Detector.decide), None if it was not decided within the window. The resolution
+    used for the decision is the DAS sample interval (1 s until it is known).
+    """
+    read = DASReader(das)
+    result = {}
+
+    def decided(d, t):
+        result['time'] = d.decide(t, c_time, d_time, time_msa, resolution=read.resolution or 1.)
+        return result['time'] is not None
+
+    watch(read, detector, window, sleep, rate=rate, stop=decided)
+    return result.get('time')
+
+
+if __name__ == "__main__":
+
+    import math
+    import time
+
+    # EUT trips 0.35 s after a voltage sag at 0.5 s, then resumes 1.5 s later
+    fs = 24e3
+    t = np.arange(int(3*fs))/fs
+    v_amp = np.where((t >= 0.5) & (t < 1.0), 0.5, 1.)*240.*math.sqrt(2)
+    i_amp = np.where((t >= 0.85) & (t < 2.35), 0., 20.)
+    v = v_amp*np.sin(2*math.pi*60*t)
+    i = i_amp*np.sin(2*math.pi*60*t)
+
+    def log_event(name, t_event):
+        print '  %-10s %0.4f s' % (name, t_event)
+
+    d = Detector(v_nom=240., v_window=20., trip_thresh=3., on_event=log_event)
+    start = time.time()
+    for k in range(0, len(t), 1200):  # 50 ms chunks as they arrive from the DAQ
+        d.update_waveform(t[k:k + 1200], v[k:k + 1200], i[k:k + 1200], fs)
+        rt = d.decide(t[min(k + 1199, len(t) - 1)], c_time=0.16, d_time=2., time_msa=0.02, resolution=1/60.)
+        if rt is not None:
+            print 'decided at %0.3f s of the 3 s capture: ride-through time %0.3f s (%0.1f ms processing)' % \
+                  (t[min(k + 1199, len(t) - 1)], rt, (time.time() - start)*1000.)
+            break
+
+    import wave
+    print 'complete waveform: %0.3f s' % wave.calc_ride_through_duration(t, i, ac_voltage=v)
@@ -0,0 +1,256 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Grid frequency and rate of change of frequency (ROCOF) from sampled voltage waveforms.
+
+The frequency is estimated from the interval between the positive going zero crossings of the low pass filtered
+voltage, the crossings located by linear interpolation between samples. The Butterworth designs are cached per
+sample rate, and every step works on whole arrays.
+
+A complete capture is estimated with the zero phase filter:
+
+    avg_freq, freqs, freq_times = frequency.freq_from_crossings(wfmtime, ac_voltage, fs)
+    rocof, rocof_times = frequency.rocof(freqs, freq_times)
+
+Data arriving in chunks (a capture being read while it is acquired) is estimated with a Tracker, which keeps the
+filter state and the last crossing between chunks. The tracker's filter is causal, the crossing times are
+corrected by the filter delay at the nominal frequency:
+
+    tracker = frequency.Tracker(fs, t0=wfmtime[0])
+    for chunk in chunks:
+        freqs, freq_times = tracker.update(chunk)
+"""
+
+import math
+import numpy as np
+
+# low pass cutoff (Hz): the filter of the original estimator, wn = 2*pi*60/fs of the Nyquist frequency
+CUTOFF = math.pi*60.
+ORDER = 4
+F_NOM = 60.
+# cycles over which the ROCOF is measured
+ROCOF_CYCLES = 6
+
+_designs = {}
+_imported = {}
+
+
+class FrequencyError(Exception):
+    pass
+
+
+def _scipy_signal():
+    if 'signal' not in _imported:
+        try:
+            from scipy import signal
+        except ImportError:
+            signal = None
+        _imported['signal'] = signal
+    return _imported['signal']
+
+
+def design(fs, cutoff=CUTOFF, order=ORDER):
+    """
+    Returns the cached Butterworth low pass design for a sample rate as a dict:
+        wn - cutoff normalized to the Nyquist frequency
+        b, a - transfer function coefficients (None without scipy)
+        sos - second order sections (None without scipy)
+        zi - initial state of the sections for a unit step input (None without scipy)
+    """
+    key = (float(fs), float(cutoff), int(order))
+    d = _designs.get(key)
+    if d is None:
+        wn = 2.*cutoff/fs
+        if not 0 < wn < 1:
+            raise FrequencyError('Cutoff %0.1f Hz is not below the Nyquist frequency of %0.1f Hz' % (cutoff, fs/2.))
+        d = {'wn': wn, 'b': None, 'a': None, 'sos': None, 'zi': None}
+        signal = _scipy_signal()
+        if signal is not None:
+            d['b'], d['a'] = signal.butter(order, wn, analog=False)
+            d['sos'] = signal.butter(order, wn, analog=False, output='sos')
+            d['zi'] = signal.sosfilt_zi(d['sos'])
+        _designs[key] = d
+    return d
+
+
+def lowpass(sig, fs, cutoff=CUTOFF, order=ORDER):
+    """
+    Zero phase low pass filter of a complete signal.
+    """
+    d = design(fs, cutoff, order)
+    signal = _scipy_signal()
+    if signal is not None:
+        return signal.filtfilt(d['b'], d['a'], np.asarray(sig, dtype=float))
+    import wave
+    return wave.lowpass(sig, d['wn'], order=order)
+
+
+def crossings(sig_ff):
+    """
+    Returns the fractional sample positions of the positive going zero crossings of a filtered signal.
+    """
+    sig_ff = np.asarray(sig_ff, dtype=float)
+    idx = np.flatnonzero((sig_ff[1:] >= 0.) & (sig_ff[:-1] < 0.))
+    return idx - sig_ff[idx]/(sig_ff[idx + 1] - sig_ff[idx])
+
+
+def freq_from_crossings(wfmtime, sig, fs, cutoff=CUTOFF, order=ORDER):
+    """
+    Estimates the frequency of each cycle of a complete capture.
+
+    Returns (avg_freq, freqs, freq_times): the average frequency, the frequency of each cycle and the time of the
+    middle of each cycle.
+    """
+    cross = crossings(lowpass(sig, fs, cutoff, order))
+    if len(cross) < 2:
+        raise FrequencyError('Less than one cycle found in the waveform')
+    steps = np.diff(cross)
+    cross_times = wfmtime[0] + cross/fs
+    return fs/np.mean(steps), fs/steps, (cross_times[:-1] + cross_times[1:])/2.
+
+
+def rocof(freqs, freq_times, cycles=ROCOF_CYCLES):
+    """
+    Returns (rocof, rocof_times), the rate of change of frequency (Hz/s) over cycles cycles and the time of the
+    middle of each measurement.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    freq_times = np.asarray(freq_times, dtype=float)
+    if len(freqs) <= cycles:
+        return np.zeros(0), np.zeros(0)
+    df = freqs[cycles:] - freqs[:-cycles]
+    dt = freq_times[cycles:] - freq_times[:-cycles]
+    return df/dt, (freq_times[cycles:] + freq_times[:-cycles])/2.
+
+
+def plot(wfmtime, sig, freqs, freq_times, fs, filename=None, cutoff=CUTOFF, order=ORDER):
+    """
+    Plots the waveform, the filtered waveform and the frequency estimate to filename (shown if filename is None).
+    """
+    import matplotlib
+    if filename is not None:
+        matplotlib.use('Agg', warn=False)
+    import matplotlib.pyplot as plt
+    plt.figure()
+    plt.plot(wfmtime, sig, color='red', label='Original')
+    plt.plot(wfmtime, lowpass(sig, fs, cutoff, order), color='blue', label='Filtered data')
+    plt.plot(freq_times, freqs, 'g', label='Frequency')
+    plt.legend(loc=4)
+    plt.grid(which='both', axis='both')
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename)
+    plt.close()
+
+
+class Tracker(object):
+    """
+    Frequency estimate of a waveform processed in chunks.
+
+    fs - sample rate (Hz).
+    t0 - time of the first sample.
+    f_nom - nominal frequency, the frequency at which the filter delay is corrected.
+    """
+
+    def __init__(self, fs, t0=0., cutoff=CUTOFF, order=ORDER, f_nom=F_NOM):
+        signal = _scipy_signal()
+        if signal is None:
+            raise FrequencyError('Frequency tracking requires scipy')
+        self.fs = float(fs)
+        self.t0 = t0
+        self.design = design(fs, cutoff, order)
+        w, gd = signal.group_delay((self.design['b'], self.design['a']), w=[2.*math.pi*f_nom/self.fs])
+        self.delay = float(gd[0])  # samples
+        self.zi = None
+        self.samples = 0  # samples processed
+        self.last = None  # last filtered sample of the previous chunk
+        self.last_cross = None  # position of the last crossing (samples)
+        self.freqs = []
+        self.freq_times = []
+
+    def update(self, chunk):
+        """
+        Processes the next chunk of samples. Returns (freqs, freq_times) of the cycles completed in the chunk.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return np.zeros(0), np.zeros(0)
+        signal = _scipy_signal()
+        if self.zi is None:
+            # start in steady state with the first sample to avoid the filter start up transient
+            self.zi = self.design['zi']*chunk[0]
+        sig_ff, self.zi = signal.sosfilt(self.design['sos'], chunk, zi=self.zi)
+        # crossings between the previous chunk and this one are found with the previous last sample
+        if self.last is not None:
+            sig_ff = np.concatenate(([self.last], sig_ff))
+            offset = self.samples - 1
+        else:
+            offset = self.samples
+        cross = crossings(sig_ff) + offset
+        self.samples += len(chunk)
+        self.last = sig_ff[-1]
+        if self.last_cross is not None:
+            cross = np.concatenate(([self.last_cross], cross))
+        if len(cross) == 0:
+            return np.zeros(0), np.zeros(0)
+        self.last_cross = cross[-1]
+        if len(cross) < 2:
+            return np.zeros(0), np.zeros(0)
+        freqs = self.fs/np.diff(cross)
+        cross_times = self.t0 + (cross - self.delay)/self.fs
+        freq_times = (cross_times[:-1] + cross_times[1:])/2.
+        self.freqs.extend(freqs)
+        self.freq_times.extend(freq_times)
+        return freqs, freq_times
+
+    def frequency(self):
+        """
+        Returns the frequency of the last complete cycle or None.
+        """
+        if self.freqs:
+            return self.freqs[-1]
+        return None
+
+    def rocof(self, cycles=ROCOF_CYCLES):
+        """
+        Returns the rate of change of frequency over the last cycles cycles or None.
+        """
+        if len(self.freqs) <= cycles:
+            return None
+        return (self.freqs[-1] - self.freqs[-1 - cycles])/(self.freq_times[-1] - self.freq_times[-1 - cycles])
+
+
+if __name__ == "__main__":
+
+    import time
+
+    # 60 Hz with a 0.5 Hz/s ramp from 1 s, 24 kHz sampling
+    fs = 24e3
+    t = np.arange(int(4*fs))/fs
+    f = np.where(t < 1., 60., 60. + 0.5*(t - 1.))
+    phase = 2*math.pi*np.cumsum(f)/fs
+    v = 240.*math.sqrt(2)*np.sin(phase) + np.random.randn(len(t))
+
+    for i in range(2):
+        start = time.time()
+        avg_freq, freqs, freq_times = freq_from_crossings(t, v, fs)
+        print 'batch: %0.1f ms (%s design), avg %0.4f Hz' % ((time.time() - start)*1000.,
+                                                             'new' if i == 0 else 'cached', avg_freq)
+    r, r_times = rocof(freqs, freq_times)
+    print 'ROCOF after the ramp start: %0.3f Hz/s' % np.mean(r[r_times > 1.5])
+    expected = np.interp(freq_times, t, f)
+    print 'max frequency error %0.4f Hz' % np.max(np.abs(freqs - expected)[5:-5])
+
+    start = time.time()
+    tracker = Tracker(fs, t0=t[0])
+    for i in range(0, len(v), 2400):
+        tracker.update(v[i:i + 2400])
+    s_freqs = np.array(tracker.freqs)
+    s_times = np.array(tracker.freq_times)
+    print 'streaming: %0.1f ms in 0.1 s chunks, %d cycles, ROCOF %0.3f Hz/s' % ((time.time() - start)*1000.,
+                                                                              len(s_freqs), tracker.rocof())
+    print 'max frequency error %0.4f Hz' % np.max(np.abs(s_freqs - np.interp(s_times, t, f))[5:])
@@ -1,10 +1,22 @@
 import sys
 import os
+import re
+import threading
 import gridsim
 import grid_profiles
+import sampler
+import tasks
 from collections import namedtuple
 import script
 
+# three phase measurement record, values per phase (None if not measured)
+Measurement = namedtuple('Measurement', 'voltage current apparent_power')
+# set values read by GridSim.settings()
+Settings = namedtuple('Settings', 'idn voltage voltage_max current_max freq')
+
+MEASUREMENTS = {'VOLT': 'voltage', 'CURR': 'current', 'S': 'apparent_power'}
+_number = re.compile(r'\s*([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)')
+
 sps_info = {
     'name': os.path.splitext(os.path.basename(__file__))[0],
     'mode': 'SPS'
@@ -35,10 +47,106 @@ def params(info):
 
     info.param('gridsim.sps.visa_device', label='VISA Device String', active='gridsim.sps.comm',
                active_value=['VISA'], default='GPIB0::6::INSTR')
+    info.param('gridsim.sps.compound_queries', label='Compound Queries', default='Disabled',
+               values=['Disabled', 'Enabled', 'Auto'],
+               desc='Send several queries in one message (SyCore versions that answer them in one response). '
+                    'Auto tries it on the first multi-query read.')
     # info.param('gridsim.sps.visa_path', label='VISA Module Path', active='gridsim.sps.comm',
     #            active_value=['VISA'], default='C:\Python27\lib\site-packages', ptype=script.PTYPE_DIR)
 
 
+class ProfileRunner(object):
+    """
+    Plays a profile on its own thread against an absolute timeline.
+
+    Segment i is due at t0 + the sum of the preceding segment durations on the monotonic clock, so the timing
+    errors of the segments do not accumulate. The commands of a segment are sent early by their expected latency,
+    the number of commands of the segment times the measured time per command (a running average, first
+    measured on the queries of the start values), so that the ramp starts on time. Segments without a change
+    are waits and send nothing. stop() ends the profile at once, including during a wait.
+
+    late - start error of each segment sent (s, positive when late).
+    """
+
+    def __init__(self, gsim, profile, clock=None):
+        self.gsim = gsim
+        self.profile = profile
+        self.clock = clock or sampler.monotonic
+        self.cmd_time = gsim.execution_time  # time per command (s)
+        self.cmd_count = {}  # commands per segment kind
+        self.late = []
+        self.t0 = None
+        self.future = None
+        self._stop = threading.Event()
+
+    def duration(self):
+        return sum([entry.t for entry in self.profile])
+
+    def start(self):
+        self.future = tasks.spawn(self._run)
+
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def stop(self, timeout=5.):
+        self._stop.set()
+        if self.future is not None:
+            self.future.wait(timeout)
+
+    def wait(self, timeout=None):
+        """
+        Waits for the profile to finish. Returns False on timeout, raises the error that ended the profile.
+        """
+        if self.future is None:
+            return True
+        if not self.future.wait(timeout):
+            return False
+        self.future.result()
+        return True
+
+    def _sleep_until(self, t):
+        """
+        Sleeps until clock time t. Returns False if stopped.
+        """
+        remaining = t - self.clock()
+        if remaining > 0:
+            return not self._stop.wait(remaining)
+        return not self._stop.is_set()
+
+    def _run(self):
+        gsim = self.gsim
+        start = self.clock()
+        count = gsim.commands
+        prev_v = gsim.voltage()[0]
+        prev_f = gsim.freq()
+        self.cmd_time = (self.clock() - start)/max(1, gsim.commands - count)
+        due = None
+        for entry in self.profile:
+            change_v = not gsim._numeric_equal(prev_v, entry.v, gsim.eps)
+            change_f = not gsim._numeric_equal(prev_f, entry.f, gsim.eps)
+            if change_v or change_f:
+                kind = (change_v, change_f)
+                # a pulse is set up with 6 commands and started with one
+                latency = self.cmd_count.get(kind, 7*(change_v + change_f))*self.cmd_time
+                if due is None:
+                    self.t0 = due = self.clock() + latency
+                if not self._sleep_until(due - latency):
+                    return False
+                start = self.clock()
+                count = gsim.commands
+                gsim._profile_segment(entry, prev_v, prev_f, change_v, change_f)
+                end = self.clock()
+                self.late.append(end - due)
+                self.cmd_count[kind] = gsim.commands - count
+                self.cmd_time = 0.8*self.cmd_time + 0.2*(end - start)/max(1, self.cmd_count[kind])
+            elif due is None:
+                self.t0 = due = self.clock()
+            prev_v = entry.v
+            prev_f = entry.f
+            due += entry.t
+        return self._sleep_until(due)
+
+
 class GridSim(gridsim.GridSim):
     """
     Spitzenberger Spiess (SPS) grid simulation implementation.
@@ -56,6 +164,7 @@ class GridSim(gridsim.GridSim):
       gpib_board
       visa_device
       visa_path
+      compound_queries
     """
 
     def __init__(self, ts):
@@ -64,8 +173,14 @@ class GridSim(gridsim.GridSim):
 
         self.dt_min = 0.02  # minimal delta t for amplitude pulses to avoid to fast amplitude changes
         self.ProfileEntry = namedtuple('ProfileEntry', 't v f ph')
-        self.execution_time = 0.02
+        self.execution_time = 0.02  # initial estimate of the command latency, measured while a profile runs
         self.eps = 0.01
+        self.runner = None
+        self.commands = 0  # commands sent, for the command latency measurement
+        self.flush_timeout = 200  # ms, read timeout when discarding stale responses
+        self.flush_max = 32  # max stale responses discarded
+        # commands from the profile thread and the calling script are not interleaved
+        self.lock = threading.RLock()
 
         gridsim.GridSim.__init__(self, ts)
 
@@ -84,6 +199,9 @@ class GridSim(gridsim.GridSim):
 
         self.visa_device = ts.param_value('gridsim.sps.visa_device')
         self.visa_path = ts.param_value('gridsim.sps.visa_path')
+        # SyCore accepts several queries in one message: True, False or None until tried (Auto)
+        self.compound_queries = {'Enabled': True, 'Auto': None}.get(ts.param_value('gridsim.sps.compound_queries'),
+                                                                     False)
 
         self.open()  # open communications, not the relay
         self.profile_stop()
@@ -122,45 +240,48 @@ class GridSim(gridsim.GridSim):
         Perform any configuration for the simulation based on the previously
         provided parameters.
         """
-        self.ts.log('Grid simulator model: %s' % self.info().strip())
+        # read all settings in a single pass, write only those that differ
+        settings = self.settings()
+        self.ts.log('Grid simulator model: %s' % settings.idn.strip())
 
         # set the phase angles for the 3 phases
         self._config_phase_angles()
 
+        changed = False
+
         # set voltage range
         v_max = self.v_max_param
-        v1, v2, v3 = self.voltage_max()
-        if v1 != v_max or v2 != v_max or v3 != v_max:
+        if any([v != v_max for v in settings.voltage_max]):
             self.voltage_max(v_max)
-            v1, v2, v3 = self.voltage_max()
-        self.ts.log('Grid sim max voltage settings: %.2fV' % v1)
+            changed = True
 
         # set nominal voltage
         v_nom = self.v_nom_param
-        v1, v2, v3 = self.voltage()
-        if not (self._numeric_equal(v1, v_nom, self.eps) and self._numeric_equal(v2, v_nom, self.eps)
-                and self._numeric_equal(v3, v_nom, self.eps)):
+        if not all([self._numeric_equal(v, v_nom, self.eps) for v in settings.voltage]):
             # because of 229.995 equals 230 due to limited accuracy of SPS
             self.voltage(voltage=(v_nom, v_nom, v_nom))
-            v1, v2, v3 = self.voltage()
-        self.ts.log('Grid sim nominal voltage settings: %.2fV' % v1)
+            changed = True
 
         # set max current if it's not already at gridsim_Imax
         i_max = self.i_max_param
-        current = self.current_max()
-        if i_max != max(current) and i_max != min(current):
+        if i_max != max(settings.current_max) and i_max != min(settings.current_max):
             # TODO: discuss what to do, when max currents for single phases are not the same
             self.current_max(i_max)
-            current = self.current_max(i_max)
-        self.ts.log('Grid sim max current: %.2fA' % current[0])
+            changed = True
 
         # set nominal frequency
         f_nom = self.freq_param
-        f = self.freq()
-
-        if not self._numeric_equal(f, f_nom, self.eps):  # f != f_nom:
-            f = self.freq(f_nom)
-        self.ts.log('Grid sim nominal frequency settings: %.2fHz' % f)
+        if not self._numeric_equal(settings.freq, f_nom, self.eps):  # f != f_nom:
+            self.freq(f_nom)
+            changed = True
+
+        # verify the new settings with a second pass
+        if changed:
+            settings = self.settings()
+        self.ts.log('Grid sim max voltage settings: %.2fV' % settings.voltage_max[0])
+        self.ts.log('Grid sim nominal voltage settings: %.2fV' % settings.voltage[0])
+        self.ts.log('Grid sim max current: %.2fA' % settings.current_max[0])
+        self.ts.log('Grid sim nominal frequency settings: %.2fHz' % settings.freq)
 
         # TODO: discuss what else should be configured here...
         # trigger angle, AMP mode (AC, DC)
@@ -213,10 +334,15 @@ class GridSim(gridsim.GridSim):
             raise NotImplementedError('The driver for plain GPIB is not implemented yet.')
         elif self.comm == 'VISA':
             try:
-                if self.rm is not None:
-                    if self.conn is not None:
-                        self.conn.close()
-                    self.rm.close()
+                try:
+                    if self.runner is not None and self.conn is not None:
+                        # a profile still playing would send its commands to the closed connection
+                        self.profile_stop()
+                finally:
+                    if self.rm is not None:
+                        if self.conn is not None:
+                            self.conn.close()
+                        self.rm.close()
 
                 self.ts.sleep(1)
             except Exception, e:
@@ -235,8 +361,7 @@ class GridSim(gridsim.GridSim):
         if current is not None:
             raise gridsim.GridSimError('SPS cannot set the current. Use this function only to get current measurements')
         else:
-            # TODO: current measurements are not
-            return [self._measure_current(1), self._measure_current(2), self._measure_current(3)]
+            return list(self.measure(quantities=('CURR',)).current)
 
     def current_max(self, current=None):
         """
@@ -257,9 +382,7 @@ class GridSim(gridsim.GridSim):
             self._write('curr:limitation:level 3,%f' % i_max[2])
 
         else:
-            i_max = [float(self._query('curr:limitation:level 1?')),
-                     float(self._query('curr:limitation:level 2?')),
-                     float(self._query('curr:limitation:level 3?'))]
+            i_max = [float(v) for v in self._query_many(['curr:limitation:level %i?' % p for p in (1, 2, 3)])]
 
         return i_max
 
@@ -308,7 +431,7 @@ class GridSim(gridsim.GridSim):
         dt_min = self.dt_min
 
         # for simple transient steps in voltage or frequency, use v_step, f_step, and t_step
-        if profile_name is 'Transient_Step':
+        if profile_name == 'Transient_Step':
             if t_step is None:
                 raise gridsim.GridSimError('Transient profile did not have a duration.')
             else:
@@ -368,51 +491,56 @@ class GridSim(gridsim.GridSim):
 
     def profile_start(self):
         """
-        Start the loaded profile.
+        Start the loaded profile. The profile plays on a background thread, use profile_wait() to wait for the
+        end of the profile and profile_stop() to end it early.
         """
-        if self.profile is not None:
+        if self.profile:
+            self.profile_stop()
             self.ts.log('Starting profile: %s' % self.profile_name)
-            prev_v = self.voltage()[0]
-            prev_f = self.freq()
-
-            for entry in self.profile:
-                if not self._numeric_equal(prev_v, entry.v, self.eps):
-                    if not self._numeric_equal(prev_f, entry.f, self.eps):
-                        # change in voltage and frequency
-                        self.ts.log('\tChange voltage from %0.1fV to %0.1fV and frequency from %0.1fHz to %0.1fHz in %0.2fs'
-                              % (prev_v, entry.v, prev_f, entry.f, entry.t))
-                        self.amplitude_frequency_ramp(amplitude_end_value=entry.v, end_frequency=entry.f,
-                                                      ramp_time=entry.t, phases=entry.ph,
-                                                      amplitude_start_value=prev_v, start_frequency=prev_f)
-                    else:
-                        # change in voltage
-                        self.ts.log('\tChange voltage from %0.1fV to %0.1fV in %0.2fs' % (prev_v, entry.v, entry.t))
-                        self.amplitude_ramp(end_value=entry.v, ramp_time=entry.t, phases=entry.ph, start_value=prev_v)
-
-                elif not self._numeric_equal(prev_f, entry.f, self.eps):
-                    # change in frequency
-                    self.ts.log('\tChange frequency from %0.1fHz to %0.1fHz in %0.2fs' % (prev_f, entry.f, entry.t))
-                    self.frequency_ramp(end_frequency=entry.f, ramp_time=entry.t, start_frequency=prev_f)
-
-                else:
-                    # wait, because no change in voltage or frequency
-                    self.ts.log('\tWait %0.2fs' % entry.t)
-                    self.ts.sleep(entry.t)
-
-                prev_v = entry.v
-                prev_f = entry.f
-
-            self.ts.log('Finished profile')
+            self.runner = ProfileRunner(self, self.profile)
+            self.runner.start()
         else:
             raise gridsim.GridSimError('You have to load a profile before starting it')
 
+    def profile_wait(self, timeout=None):
+        """
+        Wait for the running profile to finish. Returns False if it is still running after timeout seconds.
+        """
+        if self.runner is None:
+            return True
+        if not self.runner.wait(timeout):
+            return False
+        if self.runner.late:
+            self.ts.log('Finished profile, segment start error max %0.1f ms' % (max(self.runner.late)*1000.))
+        self.runner = None
+        return True
+
+    def _profile_segment(self, entry, prev_v, prev_f, change_v, change_f):
+        """
+        Sends the ramp of a profile segment without waiting for it.
+        """
+        if change_v and change_f:
+            self.ts.log('\tChange voltage from %0.1fV to %0.1fV and frequency from %0.1fHz to %0.1fHz in %0.2fs'
+                        % (prev_v, entry.v, prev_f, entry.f, entry.t))
+            self.amplitude_frequency_ramp(amplitude_end_value=entry.v, end_frequency=entry.f,
+                                          ramp_time=entry.t, phases=entry.ph,
+                                          amplitude_start_value=prev_v, start_frequency=prev_f, wait=False)
+        elif change_v:
+            self.ts.log('\tChange voltage from %0.1fV to %0.1fV in %0.2fs' % (prev_v, entry.v, entry.t))
+            self.amplitude_ramp(end_value=entry.v, ramp_time=entry.t, phases=entry.ph, start_value=prev_v,
+                                wait=False)
+        else:
+            self.ts.log('\tChange frequency from %0.1fHz to %0.1fHz in %0.2fs' % (prev_f, entry.f, entry.t))
+            self.frequency_ramp(end_frequency=entry.f, ramp_time=entry.t, start_frequency=prev_f, wait=False)
+
     def profile_stop(self):
         """
-        Stop the running profile.
+        Stop the running profile and the current ramp.
         """
+        if self.runner is not None:
+            self.runner.stop()
+            self.runner = None
         self.stop_command()
-        # TODO: this will NOT stop the profile, but only the current ramp.
-        # Also, at the moment the profile_start function will be executed until the profile is done
 
     def regen(self, state=None):
         """
@@ -482,9 +610,7 @@ class GridSim(gridsim.GridSim):
                 self.amplitude_ramp(v[2], self.dt_min, 3)
         else:
             # as discussed, return here the set value and not the measured voltage
-            v = [self._get_voltage_set_value(1),
-                 self._get_voltage_set_value(2),
-                 self._get_voltage_set_value(3)]
+            v = [float(value) for value in self._query_many(['OSC:AMP %i?' % p for p in (1, 2, 3)])]
 
         return v
 
@@ -517,12 +643,108 @@ class GridSim(gridsim.GridSim):
         else:
             # return 270
 
-            # get range
-            act_range = int(self._query('amp:range?'))
-            # get range values
-            range_values = str(self._query('conf:amp:range?')).split(',')
+            # get range and range values
+            act_range, range_values = self._query_many(['amp:range?', 'conf:amp:range?'])
+            return self._range_voltage(act_range, range_values)
 
-            return self._create_3tuple(float(range_values[act_range - 1][:-1]))
+    def _range_voltage(self, act_range, range_values):
+        range_values = str(range_values).split(',')
+        return self._create_3tuple(float(range_values[int(act_range) - 1].strip()[:-1]))
+
+    def settings(self):
+        """
+        Reads the set values checked by config() in a single pass.
+        :return: Settings record (idn, voltage, voltage_max, current_max, freq), per phase values as lists
+        """
+        cmds = ['*IDN?', 'amp:range?', 'conf:amp:range?']
+        cmds.extend(['OSC:AMP %i?' % p for p in (1, 2, 3)])
+        cmds.extend(['curr:limitation:level %i?' % p for p in (1, 2, 3)])
+        cmds.append('OSC:FREQ?')
+        resp = self._query_many(cmds)
+        return Settings(idn=resp[0],
+                        voltage=[float(v) for v in resp[3:6]],
+                        voltage_max=self._range_voltage(resp[1], resp[2]),
+                        current_max=[float(v) for v in resp[6:9]],
+                        freq=float(resp[9]))
+
+    def measure(self, quantities=('VOLT', 'CURR', 'S'), phases=(1, 2, 3)):
+        """
+        Measures quantities on phases with as few queries as possible.
+        :param quantities: SPS measurement names: 'VOLT', 'CURR', 'S'
+        :param phases: phases to measure, from 1 to 3
+        :return: Measurement record (voltage, current, apparent_power), each a list of the values of the phases
+                 or None if not measured
+        """
+        for what in quantities:
+            if what not in MEASUREMENTS:
+                raise ValueError('A query for the measurement of ' + what + ' is not possible or not implemented yet')
+        phases = [int(float(p)) for p in phases]  # convert if string '1' or 1.0 instead of int 1
+        if [p for p in phases if p < 1 or p > 3]:
+            raise ValueError('Phase must be between 1 and 3')
+        cmds = []
+        for p in phases:
+            cmds.append('CONF:MEAS:PH %i' % p)
+            cmds.extend(['MEAS:%s?' % what for what in quantities])
+        with self.lock:
+            resp = self._query_many(cmds)
+        values = dict([(field, None) for field in Measurement._fields])
+        for i, what in enumerate(quantities):
+            # query returns the unit which is removed before converting to float
+            values[MEASUREMENTS[what]] = [self._number(v) for v in resp[i::len(quantities)]]
+        return Measurement(**values)
+
+    @staticmethod
+    def _number(value):
+        m = _number.match(value)
+        if m is None:
+            raise gridsim.GridSimError('Invalid measurement: %s' % value)
+        return float(m.group(1))
+
+    def _query_many(self, cmds):
+        """
+        Sends commands and queries in one message if the SyCore accepts compound messages, otherwise one by one.
+        :param cmds: SCPI commands, queries end with '?'
+        :return: the responses to the queries in order
+        """
+        n = len([c for c in cmds if c.endswith('?')])
+        if self.compound_queries is not False and len(cmds) > 1:
+            try:
+                resp = self._query(';:'.join(cmds)).strip().split(';')
+            except gridsim.GridSimError:
+                resp = None
+            if resp is not None and len(resp) == n:
+                self.compound_queries = True
+                return [r.strip() for r in resp]
+            if self.compound_queries is None:
+                # first try, the instrument does not answer compound queries. It may have answered them on separate
+                # lines, the responses not read would be taken as the answers to the following queries.
+                self.compound_queries = False
+                self._flush_input()
+            else:
+                raise gridsim.GridSimError('Unexpected response to %s: %s' % (cmds, resp))
+        resp = []
+        with self.lock:
+            for c in cmds:
+                if c.endswith('?'):
+                    resp.append(self._query(c).strip())
+                else:
+                    self._write(c)
+        return resp
+
+    def _flush_input(self):
+        """
+        Discards the responses waiting in the instrument output by reading until the read times out.
+        """
+        with self.lock:
+            timeout = self.conn.timeout
+            self.conn.timeout = self.flush_timeout
+            try:
+                for i in range(self.flush_max):
+                    self.conn.read()
+            except Exception:
+                pass
+            finally:
+                self.conn.timeout = timeout
 
     def i_max(self):
         return self.i_max_param
@@ -584,17 +806,19 @@ class GridSim(gridsim.GridSim):
         self._write('OSC:AFPULS:GO %i' % phases)
 
     def amplitude_frequency_ramp(self, amplitude_end_value, end_frequency, ramp_time, phases,
-                                 amplitude_start_value=None, start_frequency=None):
+                                 amplitude_start_value=None, start_frequency=None, wait=True):
 
-        self.amplitude_ramp(end_value=amplitude_end_value, ramp_time=ramp_time, phases=phases,
-                            start_value=amplitude_start_value, start_ramp=False)
-        self.frequency_ramp(end_frequency=end_frequency, ramp_time=ramp_time,
-                            start_frequency=start_frequency, start_ramp=False)
+        with self.lock:
+            self.amplitude_ramp(end_value=amplitude_end_value, ramp_time=ramp_time, phases=phases,
+                                start_value=amplitude_start_value, start_ramp=False)
+            self.frequency_ramp(end_frequency=end_frequency, ramp_time=ramp_time,
+                                start_frequency=start_frequency, start_ramp=False)
 
-        self.start_amplitude_frequency_pulse(phases)
-        self.ts.sleep(max(0, ramp_time - 4 * self.execution_time))
+            self.start_amplitude_frequency_pulse(phases)
+        if wait:
+            self.ts.sleep(max(0, ramp_time - 4 * self.execution_time))
 
-    def amplitude_ramp(self, end_value, ramp_time, phases, start_value=None, start_ramp=True):
+    def amplitude_ramp(self, end_value, ramp_time, phases, start_value=None, start_ramp=True, wait=True):
         """
 
         :param end_value:
@@ -602,6 +826,7 @@ class GridSim(gridsim.GridSim):
         :param phases:
         :param start_value:
         :param start_ramp:
+        :param wait: wait for the end of the ramp
         :return:
         """
 
@@ -616,6 +841,16 @@ class GridSim(gridsim.GridSim):
 
         phases = self._phases2int(phases)
 
+        self.lock.acquire()
+        try:
+            self._amplitude_ramp(end_value, ramp_time, phases, start_value, start_ramp)
+        finally:
+            self.lock.release()
+
+        if start_ramp and wait:
+            self.ts.sleep(max(0, ramp_time - 2 * self.execution_time))
+
+    def _amplitude_ramp(self, end_value, ramp_time, phases, start_value, start_ramp):
         if start_value is None:
             if phases in (1, 2, 3):
                 start_value = self._get_voltage_set_value(phases)
@@ -632,8 +867,6 @@ class GridSim(gridsim.GridSim):
 
         if start_ramp:  # only start if start_ramp == True; False is needed for the AFPULS
             self.start_amplitude_pulse(phases)
-            self.ts.sleep(max(0, ramp_time - 2 * self.execution_time))
-        # TODO: improve timing accuracy by finding out the execution time
 
     def setup_frequency_pulse(self, start_frequency, pulse_frequency, end_frequency,
                               rise_time, duration, fall_time):
@@ -666,14 +899,16 @@ class GridSim(gridsim.GridSim):
         """
         self._write('OSC:FPULS:GO')
 
-    def frequency_ramp(self, end_frequency, ramp_time, start_frequency=None, start_ramp=True):
-        if start_frequency is None:
-            start_frequency = self.freq()
+    def frequency_ramp(self, end_frequency, ramp_time, start_frequency=None, start_ramp=True, wait=True):
+        with self.lock:
+            if start_frequency is None:
+                start_frequency = self.freq()
 
-        self.setup_frequency_pulse(start_frequency, end_frequency, end_frequency, ramp_time, 0, 0)
+            self.setup_frequency_pulse(start_frequency, end_frequency, end_frequency, ramp_time, 0, 0)
 
-        if start_ramp:  # only start if start_ramp == True; False is needed for the AFPULS
-            self.start_frequency_pulse()
+            if start_ramp:  # only start if start_ramp == True; False is needed for the AFPULS
+                self.start_frequency_pulse()
+        if start_ramp and wait:
             self.ts.sleep(max(0, ramp_time - 2*self.execution_time))
 
     def _query(self, cmd_str):
@@ -687,7 +922,9 @@ class GridSim(gridsim.GridSim):
             if self.conn is None:
                 raise gridsim.GridSimError('GPIB connection not open')
 
-            return self.conn.query(cmd_str)
+            with self.lock:
+                self.commands += 1
+                return self.conn.query(cmd_str)
         except Exception, e:
             raise gridsim.GridSimError(str(e))
 
@@ -700,7 +937,9 @@ class GridSim(gridsim.GridSim):
             if self.conn is None:
                 raise gridsim.GridSimError('GPIB connection not open')
 
-            num_written_bytes = self.conn.write(cmd_str)
+            with self.lock:
+                self.commands += 1
+                num_written_bytes = self.conn.write(cmd_str)
             # TODO: check num_written_bytes to see if writing succeeded
 
             return num_written_bytes
@@ -742,19 +981,8 @@ class GridSim(gridsim.GridSim):
         :param what: which entity according to SPS manual. Currently supported: 'VOLT', 'CURR', 'S'
         :return: the measured value as float
         """
-
-        phase = int(float(phase))  # convert if string '1' or 1.0 instead of int 1
-        if phase < 1 or phase > 3:
-            raise ValueError('Phase must be between 1 and 3')
-        else:
-            suffix = {'VOLT': -2, 'CURR': -2, 'S': -3}
-            if what in suffix.keys():
-                self._write('CONF:MEAS:PH %i' % phase)
-                value = self._query('MEAS:' + what + '?')
-                # query returns the unit + '\n' which has to be removed before converting to float
-                return float(value[:suffix[what]])
-            else:
-                raise ValueError('A query for the measurement of ' + what + ' is not possible or not implemented yet')
+        m = self.measure(quantities=(what,), phases=(phase,))
+        return getattr(m, MEASUREMENTS[what])[0]
 
     def _measure_current(self, phase):
         """
@@ -0,0 +1,431 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Chunked columnar store for low-rate test data.
+
+Each run (one capture: a test, sweep and power level, for example) is appended to its own data file as typed
+columns. Rows are buffered and written in chunks, every column of a chunk is compressed separately, and the run
+index (a small JSON file beside the data file) records the run keys, the column types and the offset of every
+compressed block. Loading one sweep reads and decompresses only the blocks of the requested columns, nothing is
+parsed from text:
+
+    results = store.Store(ts.results_dir())
+    run = results.run(test='VV', sweep='high', power=100)
+    run.append({'TIME': t, 'AC_V_1': v, 'AC_Q_1': q})
+    ...
+    run.close()
+
+    data = results.query(columns=['AC_V_1', 'AC_Q_1'], test='VV', sweep='high')
+    results.add(ds, test='SA13', curve=1, power=100)
+    results.to_csv('VV_high.csv', test='VV', sweep='high')
+
+Runs are never modified once written, so a store can be written by several test processes at once. The query
+results are dicts of numpy arrays and can be passed to the evaluate functions directly.
+"""
+
+import os
+import glob
+import json
+import time
+import zlib
+import itertools
+import numpy as np
+
+INDEX_EXT = '.json'
+DATA_EXT = '.dat'
+CHUNK_ROWS = 1024
+
+_run_ids = itertools.count()
+
+
+class StoreError(Exception):
+    pass
+
+
+def column_type(value):
+    """
+    Returns the numpy dtype string for a column from its first value. Numeric columns are stored as float so a
+    column that starts with integer values keeps later fractional values, and missing values (None) are stored as
+    NaN. Declare the column type to store integers or booleans (see RunWriter).
+    """
+    if value is None or isinstance(value, (bool, int, long, float, np.bool_, np.integer, np.floating)):
+        return '<f8'
+    return 'str'
+
+
+def _array(values, dtype):
+    if dtype == 'str':
+        return np.array([str(v) for v in values])
+    if dtype == '<f8':
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    return np.asarray(values, dtype=dtype)
+
+
+def dataset_columns(dataset):
+    """
+    Returns (columns dict, column names in dataset order) for the dataset types supported by evaluate.columns().
+    """
+    if isinstance(dataset, dict):
+        return dataset, sorted(dataset)
+    import evaluate
+    data = evaluate.columns(dataset)
+    names = getattr(dataset, 'points', None)
+    if names is None and isinstance(dataset, np.ndarray):
+        names = dataset.dtype.names
+    return data, list(names or sorted(data))
+
+
+def write_csv(filename, data, names=None, delimiter=','):
+    """
+    Writes columns to a CSV file with a header row of column names, the format of the dataset to_csv() method.
+    """
+    names = names or sorted(data)
+    f = open(filename, 'w')
+    try:
+        f.write('%s\n' % delimiter.join(names))
+        for row in zip(*[data[name] for name in names]):
+            f.write('%s\n' % delimiter.join([str(v) for v in row]))
+    finally:
+        f.close()
+
+
+class RunWriter(object):
+    """
+    Appends rows to one run of a store. Created by Store.run().
+
+    columns - list of column names or (name, dtype) pairs. If not given, the columns are taken from the first row
+              appended. Columns without a dtype are typed from their first chunk, numeric values as float.
+    chunk_rows - rows buffered before a chunk is compressed and written.
+    """
+
+    def __init__(self, store, run_id, keys, columns=None, chunk_rows=CHUNK_ROWS):
+        self.store = store
+        self.run_id = run_id
+        self.keys = keys
+        self.chunk_rows = chunk_rows
+        self.index = {'id': run_id, 'keys': keys, 'created': time.time(), 'columns': [], 'chunks': [], 'rows': 0,
+                      'complete': False}
+        self.buffer = None
+        self.data_file = None
+        if columns is not None:
+            self._set_columns([(c, None) if isinstance(c, basestring) else tuple(c) for c in columns])
+
+    def _set_columns(self, columns):
+        self.index['columns'] = [[name, dtype] for name, dtype in columns]
+        self.buffer = dict([(name, []) for name, dtype in columns])
+
+    def names(self):
+        return [name for name, dtype in self.index['columns']]
+
+    def append(self, row):
+        """
+        Appends a row, a dict keyed by column name or a sequence in column order.
+        """
+        if self.buffer is None:
+            if not isinstance(row, dict):
+                raise StoreError('Columns of run %s are not defined' % self.run_id)
+            self._set_columns([(name, None) for name in sorted(row)])
+        names = self.names()
+        if not isinstance(row, dict):
+            if len(row) != len(names):
+                raise StoreError('Row has %d values, run %s has %d columns' % (len(row), self.run_id, len(names)))
+            row = dict(zip(names, row))
+        for name in names:
+            self.buffer[name].append(row.get(name))
+        if len(self.buffer[names[0]]) >= self.chunk_rows:
+            self.flush()
+
+    def append_columns(self, data):
+        """
+        Appends whole columns (dict of equal length arrays).
+        """
+        if self.buffer is None:
+            self._set_columns([(name, None) for name in sorted(data)])
+        names = self.names()
+        lengths = set([len(data[name]) for name in names])
+        if len(lengths) != 1:
+            raise StoreError('Columns appended to run %s have different lengths' % self.run_id)
+        n = lengths.pop()
+        for start in range(0, n, self.chunk_rows):
+            for name in names:
+                self.buffer[name].extend(data[name][start:start + self.chunk_rows])
+            self.flush()
+
+    def flush(self):
+        """
+        Compresses and writes the buffered rows as one chunk and updates the run index.
+        """
+        if self.buffer is None:
+            return
+        names = self.names()
+        rows = len(self.buffer[names[0]]) if names else 0
+        if rows == 0:
+            return
+        # all the columns are converted before anything is written, a value that does not fit its column type
+        # leaves the buffered rows and the run unchanged
+        types = {}
+        arrays = {}
+        for name, dtype in self.index['columns']:
+            if dtype is None:
+                dtype = column_type(next((v for v in self.buffer[name] if v is not None), None))
+            try:
+                arrays[name] = _array(self.buffer[name], dtype)
+            except (TypeError, ValueError), e:
+                raise StoreError('Column %s of run %s does not fit type %s: %s' % (name, self.run_id, dtype, e))
+            types[name] = dtype
+        if self.data_file is None:
+            self.data_file = open(self.store.data_file(self.run_id), 'ab')
+        blocks = {}
+        for col in self.index['columns']:
+            name = col[0]
+            col[1] = types[name]
+            a = arrays[name]
+            if col[1] == 'str':
+                # strings are stored fixed width, the width can change from chunk to chunk
+                blocks[name] = self._write(a.tostring(), a.dtype.str)
+            else:
+                blocks[name] = self._write(a.tostring())
+            self.buffer[name] = []
+        self.data_file.flush()
+        self.index['chunks'].append({'rows': rows, 'blocks': blocks})
+        self.index['rows'] += rows
+        self.store.write_index(self.index)
+
+    def _write(self, data, dtype=None):
+        offset = self.data_file.tell()
+        block = zlib.compress(data, 1)
+        self.data_file.write(block)
+        if dtype is None:
+            return [offset, len(block)]
+        return [offset, len(block), dtype]
+
+    def close(self):
+        """
+        Writes the remaining rows and marks the run complete.
+        """
+        self.flush()
+        if self.data_file is not None:
+            self.data_file.close()
+            self.data_file = None
+        self.index['complete'] = True
+        self.store.write_index(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class Store(object):
+    """
+    Store of runs in a directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._index_cache = {}  # index file: (mtime, size, index)
+
+    def data_file(self, run_id):
+        return os.path.join(self.path, run_id + DATA_EXT)
+
+    def index_file(self, run_id):
+        return os.path.join(self.path, run_id + INDEX_EXT)
+
+    def write_index(self, index):
+        filename = self.index_file(index['id'])
+        tmp = '%s.tmp' % filename
+        f = open(tmp, 'w')
+        try:
+            json.dump(index, f)
+        finally:
+            f.close()
+        if os.path.exists(filename) and os.name == 'nt':
+            os.remove(filename)
+        os.rename(tmp, filename)
+
+    def run(self, columns=None, chunk_rows=CHUNK_ROWS, **keys):
+        """
+        Starts a new run with the given keys (e.g., test='VV', sweep='high', power=100) and returns its RunWriter.
+        """
+        run_id = '%s_%d_%d' % (time.strftime('%Y%m%d%H%M%S'), os.getpid(), next(_run_ids))
+        return RunWriter(self, run_id, keys, columns=columns, chunk_rows=chunk_rows)
+
+    def add(self, dataset, chunk_rows=CHUNK_ROWS, **keys):
+        """
+        Stores a whole dataset (any dataset type supported by evaluate.columns()) as a run. Returns the run id.
+        """
+        data, names = dataset_columns(dataset)
+        run = self.run(columns=names, chunk_rows=chunk_rows, **keys)
+        run.append_columns(data)
+        run.close()
+        return run.run_id
+
+    def runs(self, **keys):
+        """
+        Returns the indexes of the runs matching keys, oldest first.
+        """
+        result = []
+        for filename in glob.glob(os.path.join(self.path, '*' + INDEX_EXT)):
+            try:
+                st = os.stat(filename)
+                cached = self._index_cache.get(filename)
+                if cached is None or cached[:2] != (st.st_mtime, st.st_size):
+                    f = open(filename, 'r')
+                    try:
+                        index = json.load(f)
+                    finally:
+                        f.close()
+                    self._index_cache[filename] = (st.st_mtime, st.st_size, index)
+                else:
+                    index = cached[2]
+            except (OSError, IOError, ValueError):
+                # index being replaced by a writer
+                continue
+            run_keys = index.get('keys', {})
+            if all([k in run_keys and run_keys[k] == v for k, v in keys.iteritems()]):
+                result.append(index)
+        return sorted(result, key=lambda i: (i.get('created'), i['id']))
+
+    def keys(self):
+        """
+        Returns the key values of the stored runs as a list of dicts.
+        """
+        return [index['keys'] for index in self.runs()]
+
+    def load(self, run, columns=None):
+        """
+        Returns a dict of the columns of a run (run id or index). Only the blocks of the requested columns are read.
+        """
+        if isinstance(run, basestring):
+            index = self.runs_by_id().get(run)
+            if index is None:
+                raise StoreError('Run not found: %s' % run)
+        else:
+            index = run
+        types = dict([(name, dtype) for name, dtype in index['columns']])
+        if columns is None:
+            columns = [name for name, dtype in index['columns']]
+        for name in columns:
+            if name not in types:
+                raise StoreError('Run %s has no %s column, available columns: %s' %
+                                 (index['id'], name, ', '.join(sorted(types))))
+        parts = dict([(name, []) for name in columns])
+        if index['chunks']:
+            f = open(self.data_file(index['id']), 'rb')
+            try:
+                for chunk in index['chunks']:
+                    for name in columns:
+                        block = chunk['blocks'][name]
+                        f.seek(block[0])
+                        dtype = block[2] if len(block) > 2 else types[name]
+                        parts[name].append(np.frombuffer(zlib.decompress(f.read(block[1])), dtype=dtype))
+            finally:
+                f.close()
+        data = {}
+        for name in columns:
+            dtype = types[name] if types[name] not in (None, 'str') else None
+            if parts[name]:
+                data[name] = np.concatenate(parts[name])
+            else:
+                data[name] = np.zeros(0, dtype=dtype or float)
+        return data
+
+    def runs_by_id(self):
+        return dict([(index['id'], index) for index in self.runs()])
+
+    def query(self, columns=None, **keys):
+        """
+        Returns the columns of the runs matching keys as a dict of arrays, the runs concatenated oldest first.
+        """
+        runs = self.runs(**keys)
+        if not runs:
+            raise StoreError('No runs match %s' % ', '.join(['%s=%s' % (k, v) for k, v in sorted(keys.items())]))
+        if len(runs) == 1:
+            return self.load(runs[0], columns)
+        loaded = [self.load(index, columns) for index in runs]
+        names = columns or [name for name, dtype in runs[0]['columns']]
+        return dict([(name, np.concatenate([d[name] for d in loaded])) for name in names])
+
+    def to_csv(self, filename, columns=None, delimiter=',', **keys):
+        """
+        Exports the runs matching keys to a CSV file.
+        """
+        data = self.query(columns=columns, **keys)
+        write_csv(filename, data, columns or [name for name, dtype in self.runs(**keys)[0]['columns']],
+                  delimiter=delimiter)
+
+
+def params(info, group='results'):
+    info.param_group(group, label='Results Storage', glob=True)
+    info.param('%s.csv' % group, label='Export captures as CSV files', default='Disabled',
+               values=['Disabled', 'Enabled'],
+               desc='Captures are saved to the results store, also write a CSV file for each capture.')
+
+
+class Results(object):
+    """
+    Results store in a test's result directory, configured by the params() parameters.
+
+    ts - test script.
+    """
+
+    def __init__(self, ts, group='results'):
+        self.ts = ts
+        self.store = Store(os.path.join(ts.result_dir(), 'store'))
+        self.csv = ts.param_value('%s.csv' % group) == 'Enabled'
+
+    def save(self, dataset, name, **keys):
+        """
+        Saves a captured dataset as a run with keys and the capture name, and as <name>.csv if CSV export is
+        enabled. Returns the run id.
+        """
+        run_id = self.store.add(dataset, name=name, **keys)
+        if self.csv:
+            data, names = dataset_columns(dataset)
+            write_csv(self.ts.result_file('%s.csv' % name), data, names)
+        return run_id
+
+
+if __name__ == "__main__":
+
+    import shutil
+    import tempfile
+
+    path = tempfile.mkdtemp()
+    try:
+        results = Store(path)
+        n = 100000
+        t = np.arange(n)*0.1
+        for sweep in ('high', 'low'):
+            for power in (100, 66, 20):
+                v = 240. + 10.*np.sin(t)
+                results.add({'TIME': t, 'AC_V_1': v, 'AC_Q_1': -v*power, 'MODE': ['VV']*n},
+                            test='VV', sweep=sweep, power=power)
+
+        csv_file = os.path.join(path, 'VV_high_100.csv')
+        start = time.time()
+        results.to_csv(csv_file, test='VV', sweep='high', power=100)
+        t_export = time.time() - start
+
+        start = time.time()
+        data = np.genfromtxt(csv_file, delimiter=',', skip_header=1, dtype=float)
+        t_csv = time.time() - start
+
+        results = Store(path)
+        start = time.time()
+        data = results.query(columns=['AC_V_1', 'AC_Q_1'], test='VV', sweep='high', power=100)
+        t_query = time.time() - start
+
+        store_size = sum([os.path.getsize(f) for f in glob.glob(os.path.join(path, '*' + DATA_EXT))])
+        print '%d rows per run, %d runs, %0.1f MB stored' % (n, len(results.runs()), store_size/1e6)
+        print 'query 2 columns of one run: %8.1f ms' % (t_query*1000.)
+        print 'parse CSV of one run:       %8.1f ms (export %0.1f ms)' % (t_csv*1000., t_export*1000.)
+        print 'rows: %d, max V %0.1f' % (len(data['AC_V_1']), np.max(data['AC_V_1']))
+    finally:
+        shutil.rmtree(path)
@@ -42,27 +42,33 @@ import os
 import math
 import time
 import traceback
+import numpy as np
 
 import sunspec.core.client as client
 import script
 import script_util
 
 import inverter
+import sampler
+import curve
+import frequency
 import terrasas
 import gridsim
 import sandia_dsm as dsm
 import pvsim
+import detector
 
 # returns: True if state == current connection state and power generation matches threshold expectation, False if not
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, das=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, das):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -93,6 +99,13 @@ def das_init():
         wfmtrigger = dsm.WfmTrigger(ts)
         wfmtrigger_params = script_util.group_params(ts, group='wfm')
 
+    # Simulated EUT measurements and waveforms (gridsim mode 'Sim')
+    if datamethod == 'Simulation':
+        import das_sim
+        das = das_sim.Data(ts)
+        wfmtrigger = das_sim.WfmTrigger(ts)
+        wfmtrigger_params = script_util.group_params(ts, group='wfm')
+
     return (das, wfmtrigger, wfmtrigger_params)
 
 
@@ -111,21 +124,23 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
     2. Using the freq calculation of the ac voltage to determine when the freq exits f_nominal +/- f_window
     """
 
+    import wave
+
     f_grid = 60.
     cycles_in_window = 1.
     window_size = cycles_in_window*(1./f_grid)*1000.  # in ms
 
     if ac_voltage is not None:  # use the ac voltage to calculate the frequency to determine when the FRT test starts
         fs = ts.param_value('wfm.trigsamplingrate')  # sampling rate of waveform
-        avg_freq, freqs, freq_times = freq_from_crossings(wfmtime, ac_voltage, fs)
+        try:
+            avg_freq, freqs, freq_times = frequency.freq_from_crossings(wfmtime, ac_voltage, fs)
+        except frequency.FrequencyError, e:
+            raise script.ScriptFail('Error in Waveform File. Unable to get freq time: %s' % str(e))
 
         f_nom = gsim.freq()
-        freq_idx = [idx for idx, i in enumerate(freqs) if (i <= (f_nom - f_window) or i >= (f_nom + f_window))]
+        freq_idx = np.flatnonzero((freqs <= (f_nom - f_window)) | (freqs >= (f_nom + f_window)))
         if len(freq_idx) != 0:
-            try:
-                frt_start = freq_times[min(freq_idx)]
-            except:
-                raise script.ScriptFail('Error in Waveform File. Unable to get freq time: %s' % str(e))
+            frt_start = freq_times[freq_idx[0]]
         else:
             raise script.ScriptFail('No frequency deviation in the waveform file.')
 
@@ -141,9 +156,9 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
             raise script.ScriptFail('No daq trigger in the waveform file.')
 
     ac_current_thresh = trip_thresh  # Amps
-    time_RMS, ac_current_RMS = calculateRmsOfSignal(ac_current, windowSize=window_size,
-                                                    samplingFrequency=24e3,
-                                                    overlap=int(window_size/3))
+    time_RMS, ac_current_RMS = wave.calculateRmsOfSignal(ac_current, windowSize=window_size,
+                                                         samplingFrequency=24e3,
+                                                         overlap=int(window_size/3))
 
     ac_current_idx = [idx for idx, i in enumerate(ac_current_RMS) if i <= ac_current_thresh]
     if len(ac_current_idx) != 0:
@@ -158,115 +173,44 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
         return trip_time
 
 
-def freq_from_crossings(wfmtime, sig, fs):
-    """Estimate frequency by counting zero crossings
+def ride_through_failed(ride_through_time, c_time, d_time, time_msa):
+    """
+    Logs the ride-through duration and returns True if it is outside the ride-through/must disconnect window.
+    """
+    if ride_through_time == 0:
+        ts.log('The EUT did not trip or momentarily cease to energize.')
+    else:
+        ts.log('The ride-through duration was %0.3f.' % ride_through_time)
+
+    if ride_through_time - time_msa < c_time:
+        ts.log_warning('The ride-through duration of %0.3f minus the manufacturers stated '
+                       'accuracy of %0.3f is less '
+                       'than the ride-through time of %0.3f.' % (ride_through_time, time_msa, c_time))
+        return True
+    elif ride_through_time + time_msa > d_time:
+        ts.log_warning('The ride-through duration of %0.3f plus the manufacturers stated '
+                       'accuracy of %0.3f is more '
+                       'than the must disconnect time of %0.3f.' % (ride_through_time, time_msa, c_time))
+        return True
+    return False
+
+
+def wait_for_wfm(wfmtrigger, timeout):
+    """
+    Returns the waveform file of the armed trigger once the DSM has finished writing it.
+    """
+    ts.log('Waiting up to %0.2f seconds for the waveform file.' % timeout)
+    wfmname = wfmtrigger.wait_for_file(timeout=timeout, sleep=ts.sleep)
+    if wfmname is None:
+        raise script.ScriptFail('No complete waveform file within %0.2f seconds. %s' %
+                                (timeout, wfmtrigger.off_last_error))
+    return wfmname
 
-    Doesn't work if there are multiple zero crossings per cycle.
 
-    """
-    from scipy import signal
-    #import matplotlib.pyplot as plt
-
-    # FILTER THE WAVEFORM WITH LOWPASS BUTTERWORTH FILTER
-    wn = (2*math.pi*60)/fs  #Wn is normalized from 0 to 1, where 1 is the Nyquist frequency, pi radians/sample
-    b, a = signal.butter(4, wn, analog=False)
-    sig_ff = signal.filtfilt(b, a, sig)
-
-    # Find the zero crossings of the filtered data
-    # Linear interpolation to find truer zero crossings
-    indices = find(logical_and(sig_ff[1:] >= 0., sig_ff[:-1] < 0.))
-    crossings = [i - sig_ff[i] / (sig_ff[i+1] - sig_ff[i]) for i in indices]  #interpolate
-    cross_times = wfmtime[0] + np.array(crossings)/fs
-
-    time_steps = diff(crossings)
-    avg_freq = fs / average(time_steps)
-    freqs = [fs/time_steps[i] for i in xrange(0, len(cross_times)-1)]  #interpolate
-    freq_times = [(cross_times[i]+cross_times[i+1])/2 for i in xrange(0, len(freqs)-1)]  #interpolate
-
-    plt.plot(wfmtime, sig, color='red', label='Original')
-    plt.plot(wfmtime, sig_ff, color='blue', label='Filtered data')
-    plt.plot(freq_times, freqs[:-1], 'g', label='Frequency')
-    plt.legend(loc=4)
-    plt.grid(which='both', axis='both')
-    plt.axis([0, freq_times[-1], 50, 61])
-    plt.show()
-
-    return avg_freq, freqs, freq_times
-
-
-def calculateRmsOfSignal(data, windowSize, samplingFrequency, overlap=0):
-    ######################################################################
-    #   calculate and return the time-varying RMS of a signal
-    #   @param data a list or a numpy array containing the signal that should be
-    #       analyzed
-    #   @param windowSize duration of the sliding analysis window in milli-seconds
-    #   @param samplingFrequency sampling frequency [Hz]
-    #   @param overlap overlap between individual windows, specified in milli-seconds
-    #   @return a tuple containing two numpy arrays for the temporal offset and the
-    #       RMS value at the respective temporal offset.
-    #   http://homepage.univie.ac.at/christian.herbst//python/dsp_util_8py_source.html
-
-    import numpy as np
-
-    if windowSize < 1:
-        raise Exception("window size must not below 1 ms")
-    if overlap >= windowSize:
-        raise Exception("overlap must not exceed window size")
-
-    numFrames = len(data)
-    duration = numFrames / float(samplingFrequency)
-
-    readProgress = (windowSize - overlap) / 1000.0
-    outputSize = int(duration / readProgress)
-    dataX = np.zeros(outputSize)
-    dataY = np.zeros(outputSize)
-    t = 0
-    halfWindowSize = windowSize / 2000.0
-
-    for idx in range(outputSize):
-        left = int((t - halfWindowSize) * float(samplingFrequency))
-        right = left + int(windowSize * float(samplingFrequency) / 1000.0)
-
-        if right >= numFrames:
-            right = numFrames - 1
-        numFramesLocal = right - left
-
-        if numFramesLocal <= 0:
-            raise Exception("zero window size (t = " + str(t) + " sec.)")
-
-        dataTmp = np.zeros(numFramesLocal)
-
-        for i in range(numFramesLocal):
-            dataTmp[i] = data[i + left]
-
-        dataX[idx] = t
-        t += readProgress
-        rms = calculateRMS(dataTmp)
-        dataY[idx] = rms
-
-    return dataX[1:], dataY[1:]  #throw away awful first data point
-
-
-def calculateRMS(data):
-    ######################################################################
-    #   calculates the RMS data of the given array
-    #   @param a list or a numpy array
-    #   @return a scalar containing either an RMS value
-    #   http://homepage.univie.ac.at/christian.herbst//python/dsp_util_8py_source.html
-
-    tmp = 0
-    size = len(data)
-    for i in range(size):
-        tmp += data[i]
-    mean = tmp / float(size)
-
-    tmp = 0
-    for i in range(size):
-        tmp2 = data[i] - mean
-        tmp += tmp2 * tmp2
-    tmp /= float(size)
-
-    return math.sqrt(tmp)
+def save_wfm(wfmtrigger, wfmname):
+    results_dir = os.path.dirname(__file__)[:-7] + 'Results' + os.path.sep
+    ts.log('Moving waveform "%s" to results folder: %s.' % (wfmname, results_dir))
+    wfmtrigger.move_file_to_results(wfmname=wfmname, results_dir=results_dir, delete_original='No')
 
 
 def predict_frt_response_time(test_freq_pct, ride_through, h_time=0, h_freq=0, h_n_points=0,
@@ -275,137 +219,26 @@ def predict_frt_response_time(test_freq_pct, ride_through, h_time=0, h_freq=0, h
                               lc_time=0, lc_freq=0, lc_n_points=0):
     """ Calculate the frequency response time for a given test condition and FRT curves
     Return must stay connected duration (c_time) and must disconnect time (d_time)
+    test_freq_pct may be a single test point or an array of test points.
     """
-    c_time = None
-    d_time = None
-    lots_of_output = False
-
     #Check to be sure the times are monotonically increasing.
-    for i in xrange(1, h_n_points-1):
-        if h_time[i] > h_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in HFRTD curve.')
-        break
-    for i in xrange(1, l_n_points-1):
-        if l_time[i] > l_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in LFRTD curve.')
-        break
-    for i in xrange(1, hc_n_points-1):
-        if hc_time[i] > hc_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in HFRTC curve.')
-        break
-    for i in xrange(1, lc_n_points-1):
-        if lc_time[i] > lc_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in LFRTC curve.')
-        break
-
-    if test_freq_pct > 100.:  # use HFRTD
-
-        if test_freq_pct < h_freq[h_n_points]: #test_freq_pct is below the last point - extrapolate
-            d_time = 0
-            if lots_of_output:
-                ts.log_debug('h_time = %s, h_time[n_points] = %s' % (h_time, h_time[h_n_points]))
-                ts.log_debug('F_test is lower than HFRTD[n_points]. Trip time is %0.3f' % d_time)
-        elif test_freq_pct > h_freq[1]: #test_freq_pct is above the 1st point - extrapolate
-            d_time = h_time[1]  # there is no trip time - EUT should run indefinitely
-            if lots_of_output:
-                ts.log_debug('F_test is higher than HFRTD[1]. Trip time is %0.3f' % d_time)
-        else:
-            # pointwise algorithm to find target vars
-            for i in xrange(1, h_n_points):
-                if lots_of_output:
-                    ts.log_debug('Grid frequency is %.3f' % (test_freq_pct))
-                    ts.log_debug('i = %d' % i)
-                    ts.log_debug('test_freq_pct >= freq[i+1] and test_freq_pct <= freq[i]')
-                    ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (test_freq_pct, h_freq[i+1], test_freq_pct, h_freq[i]))
-
-                if test_freq_pct >= h_freq[i+1] and test_freq_pct <= h_freq[i]: #curve interpolation
-                    #Time = Ti + (Ti+1 - Ti)*((test_freq_pct - Vi)/(Vi+1 - Vi))
-                    d_time = h_time[i] + (h_time[i+1] - h_time[i])*((test_freq_pct - h_freq[i])/(h_freq[i+1] - h_freq[i]))
-                    if lots_of_output:
-                        ts.log_debug('Interpolated. Trip time is %0.3f' % d_time)
-                    break
-
-    else:  # use LFRTD
-        if test_freq_pct < l_freq[1]: #test_freq_pct is below the 1st point - extrapolate
-            d_time = l_time[1]
-            if lots_of_output:
-                ts.log_debug('l_time = %s, l_time[1] = %s' % (l_time, l_time[1]))
-                ts.log_debug('F_test is lower than LFRTD[1]. Trip time is %0.3f' % d_time)
-        elif test_freq_pct > l_freq[l_n_points]: #test_freq_pct is above the last point - extrapolate
-            d_time = 0  # there is no trip time - EUT should run indefinitely
-            if lots_of_output:
-                ts.log_debug('F_test is higher than LFRTD[n_points]. Trip time is %0.3f' % d_time)
-        else:
-            # pointwise algorithm to find target vars
-            for i in xrange(1, l_n_points):
-                if lots_of_output:
-                    ts.log_debug('Grid frequency is %.3f' % (test_freq_pct))
-                    ts.log_debug('i = %d' % i)
-                    ts.log_debug('test_freq_pct >= freq[i] and test_freq_pct <= freq[i+1]')
-                    ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (test_freq_pct, l_freq[i], test_freq_pct, l_freq[i+1]))
-
-                if test_freq_pct >= l_freq[i] and test_freq_pct <= l_freq[i+1]: #curve interpolation
-                    #Time = Ti + (Ti+1 - Ti)*((test_freq_pct - Vi)/(Vi+1 - Vi))
-                    d_time = l_time[i] + (l_time[i+1] - l_time[i])*((test_freq_pct - l_freq[i])/(l_freq[i+1] - l_freq[i]))
-                    if lots_of_output:
-                        ts.log_debug('Interpolated. Trip time is %0.3f' % d_time)
-                    break
+    for name, t, n in (('HFRTD', h_time, h_n_points), ('LFRTD', l_time, l_n_points),
+                       ('HFRTC', hc_time, hc_n_points), ('LFRTC', lc_time, lc_n_points)):
+        if n > 1 and not curve.monotonic(curve.points(t, n)):
+            ts.log_error('Times are not monotonically increasing in %s curve.' % name)
+
+    d_time = curve.response_time(test_freq_pct,
+                                 curve.ride_through_curve(h_freq, h_time, h_n_points, high=True, name='HFRTD'),
+                                 curve.ride_through_curve(l_freq, l_time, l_n_points, high=False, name='LFRTD'))
 
     if ride_through == 'No':
-        c_time = 0
+        c_time = 0. * d_time
     else:
-        if test_freq_pct > 100.:  # use HFRTC
-            if test_freq_pct < hc_freq[hc_n_points]: #test_freq_pct is below the last point - extrapolate
-                c_time = 0
-                if lots_of_output:
-                    ts.log_debug('F_test is lower than HFRTC[n_points]. Ride-through time is %0.3f' % c_time)
-            elif test_freq_pct > hc_freq[1]: #test_freq_pct is above the 1st point - extrapolate
-                c_time = hc_time[1]  # there is no must remain connected time - EUT should run indefinitely
-                if lots_of_output:
-                    ts.log_debug('F_test is higher than HFRTC[1]. Ride-through time is %0.3f' % c_time)
-            else:
-                # pointwise algorithm to find target vars
-                for i in xrange(1, hc_n_points):
-                    if lots_of_output:
-                        ts.log_debug('Grid frequency is %.3f' % (test_freq_pct))
-                        ts.log_debug('i = %d' % i)
-                        ts.log_debug('test_freq_pct >= freq[i+1] and test_freq_pct <= freq[i]')
-                        ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' %
-                                     (test_freq_pct, hc_freq[i+1], test_freq_pct, hc_freq[i]))
-
-                    if test_freq_pct >= hc_freq[i+1] and test_freq_pct <= hc_freq[i]: #curve interpolation
-                        #Time = Ti + (Ti+1 - Ti)*((test_freq_pct - Vi)/(Vi+1 - Vi))
-                        c_time = hc_time[i] + (hc_time[i+1] - hc_time[i])*\
-                                              ((test_freq_pct - hc_freq[i])/(hc_freq[i+1] - hc_freq[i]))
-                        if lots_of_output:
-                            ts.log_debug('Interpolated. Ride-through time is %0.3f' % c_time)
-                        break
-        else:  # use LFRTD
-            if test_freq_pct < lc_freq[1]: #test_freq_pct is below the 1st point - extrapolate
-                c_time = lc_time[1]
-                if lots_of_output:
-                    ts.log_debug('F_test is lower than LFRTC[1]. Ride-through time is %0.3f' % c_time)
-            elif test_freq_pct > lc_freq[lc_n_points]: #test_freq_pct is above the last point - extrapolate
-                c_time = 0  # there is no must remain connected time - EUT should run indefinitely
-                if lots_of_output:
-                    ts.log_debug('F_test is higher than LFRTC[n_points]. Ride-through time is %0.3f' % c_time)
-            else:
-                # pointwise algorithm to find target vars
-                for i in xrange(1, lc_n_points):
-                    if lots_of_output:
-                        ts.log_debug('Grid frequency is %.3f' % (test_freq_pct))
-                        ts.log_debug('i = %d' % i)
-                        ts.log_debug('test_freq_pct >= freq[i] and test_freq_pct <= freq[i+1]')
-                        ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' %
-                                     (test_freq_pct, lc_freq[i], test_freq_pct, lc_freq[i+1]))
-
-                    if test_freq_pct >= lc_freq[i] and test_freq_pct <= lc_freq[i+1]: #curve interpolation
-                        #Time = Ti + (Ti+1 - Ti)*((test_freq_pct - Vi)/(Vi+1 - Vi))
-                        c_time = lc_time[i] + (lc_time[i+1] - lc_time[i])*\
-                                              ((test_freq_pct - lc_freq[i])/(lc_freq[i+1] - lc_freq[i]))
-                        if lots_of_output:
-                            ts.log_debug('Interpolated. Ride-through time is %0.3f' % c_time)
-                        break
+        c_time = curve.response_time(test_freq_pct,
+                                     curve.ride_through_curve(hc_freq, hc_time, hc_n_points, high=True,
+                                                              name='HFRTC'),
+                                     curve.ride_through_curve(lc_freq, lc_time, lc_n_points, high=False,
+                                                              name='LFRTC'))
 
     return c_time, d_time
 
@@ -466,9 +299,14 @@ def test_run():
         verification_delay = ts.param_value('invt.verification_delay')
         posttest_delay = ts.param_value('invt.posttest_delay')
         disable = ts.param_value('invt.disable')
+        online = ts.param_value('invt.online_detection') == 'Enabled'
 
         # initialize data acquisition system
         das, wfmtrigger, wfmtrigger_params = das_init()
+        if online and wfmtrigger is not None and not wfmtrigger.cancellable:
+            # the capture would still have to be waited out before the trigger is armed again
+            ts.log_warning('Online detection is not used with a waveform trigger that cannot be cancelled.')
+            online = False
 
         # initialize pv simulation
         pv = pvsim.pvsim_init(ts)
@@ -605,11 +443,11 @@ def test_run():
 
             ### Arm the data acquisition system for waveform capture
             if das is not None:
-                das_time = inverter.get_time(das=das)
-                while das_time == inverter.get_time(das=das):
-                    ts.log('Monitoring the data stream to ensure the das is prepared for a waveform capture. '
-                           'DAS time: %s' % inverter.get_time(das=das))
-                    ts.sleep(1)
+                ts.log('Monitoring the data stream to ensure the das is prepared for a waveform capture.')
+                das_time = das.wait_update(timeout=max(pretest_delay, 5.), sleep=ts.sleep)
+                if das_time is None:
+                    raise script.ScriptFail('The DAS data stream is not updating.')
+                ts.log('DAS time: %s' % das_time)
 
                 ts.log('Configuring the data capture for the following channels: %s' %
                        wfmtrigger_params.get('trigacqchannels'))
@@ -663,23 +501,43 @@ def test_run():
                     raise script.ScriptFail('Aborted frt!')
 
             ### Wait for DAS to capture transient event
-            start_time = time.time()
-            elapsed_time = 0.
-            while elapsed_time <= wfmtrigger_params['posttrig']:
-                ts.log('Waiting for waveform capture to complete. Total time remaining %0.3f seconds' %
-                       (wfmtrigger_params['posttrig']-elapsed_time))
-                ts.sleep(0.93)
-                elapsed_time = time.time() - start_time
+            online_time = None
+            if online and das is not None:
+                # evaluate the DAS measurements while the waveform is captured, stop when the outcome is decided
+                ts.log('Watching the DAS measurements for up to %0.3f seconds' % wfmtrigger_params['posttrig'])
+                f_nom = gsim.f_nom() if gsim else 60.
+                # the event starts when the frequency is half way to the test frequency
+                f_window = abs(frt_test_freq_pct - 100.)/100.*f_nom/2.
+                d = detector.Detector(f_nom=f_nom, f_window=f_window, trip_thresh=3.,
+                                      on_event=lambda name, t: ts.log('Detected %s at DAS time %0.3f' % (name, t)))
+                online_time = detector.watch_ride_through(d, das, wfmtrigger_params['posttrig'], c_time, d_time,
+                                                          time_msa, ts.sleep)
+            else:
+                start_time = time.time()
+                elapsed_time = 0.
+                loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
+                while elapsed_time <= wfmtrigger_params['posttrig']:
+                    ts.log('Waiting for waveform capture to complete. Total time remaining %0.3f seconds' %
+                           (wfmtrigger_params['posttrig']-elapsed_time))
+                    loop_timer.wait()
+                    elapsed_time = time.time() - start_time
 
             ### Screen waveform data and save in the results file
-            if das is not None:
+            if online_time is not None:
+                ts.log('Ride-through outcome decided from the DAS measurements, the waveform is not analyzed.')
+                if gsim is not None:
+                    gsim.profile_stop()  # end the event, the EUT response has been determined
+                    gsim.freq(gsim.f_nom())
+                if ride_through_failed(online_time, c_time, d_time, time_msa):
+                    failures += 1
+                    ts.log_warning('The number of failures is %i.' % failures)
+                if wfmtrigger is not None:
+                    wfmtrigger.cancel()  # the capture of this trigger is not needed
 
-                ts.log('Waiting post test delay of %0.2f seconds before processing the data file.' % posttest_delay)
-                ts.sleep(posttest_delay)
+            elif das is not None:
 
-                # get data from waveform saved on the hard drive
-                # (this function could use a little help to make it more robust...)
-                wfmname = wfmtrigger.getfilename()
+                # get data from the waveform of this trigger as soon as the DSM has finished saving it
+                wfmname = wait_for_wfm(wfmtrigger, posttest_delay)
                 ts.log('Analyzing waveform data in file "%s".' % wfmname)
 
                 if ts.param_value('wfm.trigchannel').count(',') == 3:
@@ -696,28 +554,12 @@ def test_run():
                     # ride_through_time == 0 means no trip/ceassation
                     ride_through_time = calc_ride_through_duration(wfmtime, ac_current, grid_trig=grid_trig)
 
-                if ride_through_time == 0:
-                    ts.log('The EUT did not trip or momentarily cease to energize.')
-                else:
-                    ts.log('The ride-through duration was %0.3f.' % ride_through_time)
-
-                if ride_through_time - time_msa < c_time:
-                    ts.log_warning('The ride-through duration of %0.3f minus the manufacturers stated '
-                                   'accuracy of %0.3f is less '
-                                   'than the ride-through time of %0.3f.' % (ride_through_time, time_msa, c_time))
-                    failures += 1
-                    ts.log_warning('The number of failures is %i.' % failures)
-                elif ride_through_time + time_msa > d_time:
-                    ts.log_warning('The ride-through duration of %0.3f plus the manufacturers stated '
-                                   'accuracy of %0.3f is more '
-                                   'than the must disconnect time of %0.3f.' % (ride_through_time, time_msa, c_time))
+                if ride_through_failed(ride_through_time, c_time, d_time, time_msa):
                     failures += 1
                     ts.log_warning('The number of failures is %i.' % failures)
 
                 # save file to results
-                results_dir = os.path.dirname(__file__)[:-7] + 'Results' + os.path.sep
-                ts.log('Moving waveform "%s" to results folder: %s.' % (wfmname, results_dir))
-                wfmtrigger.move_file_to_results(wfmname=wfmname, results_dir=results_dir, delete_original='No')
+                save_wfm(wfmtrigger, wfmname)
 
             else:
                 ts.log('Ride-through test complete. Please analyze the data to assign pass/fail result.')
@@ -737,7 +579,7 @@ def test_run():
     finally:
         if pv:
             pv.close()
-        if disable == 'yes' and inv is not None:
+        if disable == 'Yes' and inv is not None:
             '''
             inv.hfrtd.ModEna = 0
             inv.hfrtc.ModEna = 0
@@ -878,11 +720,17 @@ info.param('invt.frt_period', label='Duration beyond must trip curve for analysi
 info.param('invt.verification_delay', label='Verification Delay (seconds)', default=5,
            desc='Wait time allowance before assigning failure for the time parameters.')
 info.param('invt.posttest_delay', label='Post-Test Delay (seconds)', default=10,
-           desc='Delay after finishing the test.')
+           desc='Delay after finishing the test and the longest wait for the waveform file of a test point.')
 info.param('invt.failure_count', label='Setpoint Failure Count', default=60,
            desc='Number of consecutive failures (power excursions beyond target vars) which does not '
                 'produce a script fail. This accounts for EUT settling time.')
 info.param('invt.disable', label='Disable frt function at end of test?', default='No', values=['Yes', 'No'])
+info.param('invt.online_detection', label='Decide from DAS measurements during the capture', default='Disabled',
+           values=['Disabled', 'Enabled'],
+           desc='Evaluate the ride-through from the DAS RMS measurements while the waveform is captured and end the '
+                'test point as soon as the outcome is decided. Cessations close to the ride-through window edges '
+                'are still evaluated from the waveform. Not used with the Sandia DSM waveform trigger, whose '
+                'capture cannot be cancelled once triggered.')
 
 # Grid simulator
 gridsim.params(info)
@@ -896,11 +744,11 @@ pvsim.params(info)
 # DAS
 info.param_group('datatrig', label='Data Acquisition and Triggering', glob=True)
 info.param('datatrig.dsm_method', label='Data Acquisition Method', default='Disabled - Data from EUT',
-           values=['Disabled - Data from EUT', 'Sandia LabView DSM'],
+           values=['Disabled - Data from EUT', 'Sandia LabView DSM', 'Simulation'],
            desc='Each lab will have different data acquisition methods. Sandia passes the data from the DAQ '
                 'to python by writing the values locally or collecting them over the local TCP network.')
 info.param_group('wfm', label='Waveform Capture Parameters',
-           active='datatrig.dsm_method', active_value=['Sandia LabView DSM'],
+           active='datatrig.dsm_method', active_value=['Sandia LabView DSM', 'Simulation'],
            desc='Sandia technique for capturing waveforms using the DSM.', glob=True)
 info.param('wfm.trigsamplingrate', label='Waveform Sampling Rate (Hz)', default='24.0e3')
 info.param('wfm.pretrig', label='Pretrigger Time (sec)', default='166.667e-3')
@@ -41,6 +41,8 @@ import os
 import traceback
 import time
 import inverter
+import sampler
+import curve
 import pvsim
 
 import gridsim
@@ -53,12 +55,13 @@ import script
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, das=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, das):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -79,7 +82,7 @@ def get_ac_freq_pct(inv, freq_ref = 60., das=None):
             inv.inverter.read()
             gridFraw = float(inv.inverter.Hz)
 
-        inv.settings.read()
+        inverter.read_model(inv, 'settings')
         Freq_nom = float(freq_ref)
 
         return (gridFraw/Freq_nom)*100.0
@@ -88,16 +91,9 @@ def get_ac_freq_pct(inv, freq_ref = 60., das=None):
         raise script.ScriptFail('Unable to get ac freq from das or EUT: %s' % str(e))
 
 
-# returns: target power and pass/fail limits - excluding hysteresis or ramp rates.
-def power_pass_fail_band(inv, fw_mode='FW21 (FW parameters)', freq=None, W=None, n_points=3,
-                         power_range=5, WGra = 65., HzStr=0.2, freq_ref=60, das=None):
-    pow_targ = None
-    pow_upper = None
-    pow_lower = None
-
-    freq_now = inverter.get_freq(inv, das=das)
-    f_pct = (freq_now/freq_ref)*100.
-
+# returns: the freq-watt curve (%Hz, %Wmax) for the fw_mode settings - built once when the curve is written
+def freq_watt_curve(fw_mode='FW21 (FW parameters)', freq=None, W=None, n_points=3, WGra=65., HzStr=0.2,
+                    freq_ref=60):
     if fw_mode == 'FW21 (FW parameters)':
         # convert parameterized FW to pointwise parameters
 
@@ -116,50 +112,37 @@ def power_pass_fail_band(inv, fw_mode='FW21 (FW parameters)', freq=None, W=None,
             'index_start': 1,
             'index_count': 3
         }
+        n_points = 3
 
-    #Check to be sure the freq points are monotonically increasing.
-    for i in xrange(1, n_points-1):
-        if freq[i] > freq[i+1]:
-            ts.log_error('Voltages are not monotonically increasing in FW curve.')
-        break
+    # curve is held at the end points when Fgrid is outside the curve
+    return curve.Curve.from_sunspec(freq, W, n_points, name='freq-watt curve')
+
+# returns: target power and pass/fail limits - excluding hysteresis or ramp rates.
+# fw_curve is the curve from freq_watt_curve(), it is built from the other settings only if it is not given
+def power_pass_fail_band(inv, fw_mode='FW21 (FW parameters)', freq=None, W=None, n_points=3,
+                         power_range=5, WGra = 65., HzStr=0.2, freq_ref=60, das=None, freq_now=None,
+                         fw_curve=None):
+    pow_targ = None
+    pow_upper = None
+    pow_lower = None
+
+    if freq_now is None:
+        freq_now = inverter.get_freq(inv, das=das)
+    f_pct = (freq_now/freq_ref)*100.
+
+    if fw_curve is None:
+        fw_curve = freq_watt_curve(fw_mode=fw_mode, freq=freq, W=W, n_points=n_points, WGra=WGra, HzStr=HzStr,
+                                   freq_ref=freq_ref)
 
     lots_of_output = True  #Flag to turn on data dumps to help debugging
 
-    if f_pct <= freq[1]:  # Fgrid is below the 1st point - extrapolate
-        pow_targ = W[1]  # units of % nameplate watts
-        pow_upper = pow_targ + power_range  # units of % nameplate watts
-        pow_lower = pow_targ - power_range  # units of % nameplate watts
-        if lots_of_output:
-            ts.log_debug('Low, frequency is %0.3f and freq point 1 is %0.3f' % (f_pct, freq[1]))
-            ts.log_debug('pow_targ, pow_upper, pow_lower')
-            ts.log_debug('%.3f, %.3f, %.3f' % (pow_targ, pow_upper, pow_lower))
-    elif f_pct >= freq[n_points]: #Fgrid is above the last point - extrapolate
-        pow_targ = W[n_points]  # units of vars
-        pow_upper = pow_targ + power_range  # units of % nameplate watts
-        pow_lower = pow_targ - power_range  # units of % nameplate watts
-        if lots_of_output:
-            ts.log_debug('High, frequency is %0.3f and freq point n is %0.3f' % (f_pct, freq[n_points]))
-            ts.log_debug('pow_targ, pow_upper, pow_lower')
-            ts.log_debug('%.3f, %.3f, %.3f' % (pow_targ, pow_upper, pow_lower))
-    else:
-        # pointwise algorithm to find target power
-        for i in xrange(1, n_points):
-            if lots_of_output:
-                ts.log_debug('Grid freq is %.3f' % (f_pct))
-                ts.log_debug('i = %d' % i)
-                ts.log_debug('gridF >= freq[i] and gridF <= freq[i+1]')
-                ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (f_pct, freq[i], f_pct, freq[i+1]))
-
-            if f_pct >= freq[i] and f_pct <= freq[i+1]:  # curve interpolation
-                # pow_targ = Pi + (Pi+1 - Pi)*((f_pct - Fi)/(Fi+1 - Fi))
-                pow_targ = (W[i]+(W[i+1]-W[i])*((f_pct-freq[i])/(freq[i+1]-freq[i])))
-                pow_upper = pow_targ + power_range  # units of % nameplate watts
-                pow_lower = pow_targ - power_range  # units of % nameplate watts
-                if lots_of_output:
-                    ts.log_debug('Interpolated')
-                    ts.log_debug('pow_targ, pow_upper, pow_lower')
-                    ts.log_debug('%.3f, %.3f, %.3f' % (pow_targ, pow_upper, pow_lower))
-                break
+    pow_targ = fw_curve(f_pct)  # units of % nameplate watts
+    pow_upper = pow_targ + power_range  # units of % nameplate watts
+    pow_lower = pow_targ - power_range  # units of % nameplate watts
+    if lots_of_output:
+        ts.log_debug('Grid freq is %.3f, %s' % (f_pct, fw_curve))
+        ts.log_debug('pow_targ, pow_upper, pow_lower')
+        ts.log_debug('%.3f, %.3f, %.3f' % (pow_targ, pow_upper, pow_lower))
 
     return pow_targ, pow_upper, pow_lower
 
@@ -247,8 +230,9 @@ def test_run():
             ts.sleep(pretest_delay)
 
         # Request status and display power
-        freq_original = inverter.get_freq(inv, das=data)
-        power_original = inverter.get_power(inv, das=data)
+        snap = inverter.snapshot(inv, das=data)
+        freq_original = snap.freq
+        power_original = snap.power
         ts.log('Current grid frequency is %.3f Hz and EUT power is %.3f W' % (freq_original, power_original))
 
         ### todo: open the ride-through settings at this point to ensure the EUT doesn't trip during freq profile.
@@ -263,6 +247,8 @@ def test_run():
                                recovery_ramp_rate=recovery_ramp_rate,
                                time_window=time_window, WGra=WGra, HzStr=HzStr, HzStop=HzStop, HysEna=HysEna,
                                HzStopWGra=HzStopWGra, enable=1, trigger=trigger)
+        fw_curve = freq_watt_curve(fw_mode=fw_mode, freq=freq, W=W, n_points=n_points, WGra=WGra, HzStr=HzStr,
+                                   freq_ref=freq_ref)
 
         # Run the grid simulator profile immediately after setting the freq-watt functions and triggering
         if grid is not None:
@@ -272,7 +258,8 @@ def test_run():
         # power_pass_fail_band only determines the point on the curve. It does not account for hysteresis.
         pow_targ, pow_upper, pow_lower = power_pass_fail_band(inv, fw_mode=fw_mode, freq=freq, W=W, n_points=n_points,
                                                               power_range=power_range, WGra=WGra,
-                                                              HzStr=HzStr, freq_ref=freq_ref, das=das)
+                                                              HzStr=HzStr, freq_ref=freq_ref, das=data,
+                                                              fw_curve=fw_curve)
 
         ts.log('Target power: %.3f. Pass limits for screening: upper = %.3f  lower = %.3f' %
                (pow_targ, pow_upper, pow_lower))
@@ -308,15 +295,18 @@ def test_run():
             window_complete = True
         time_window_execution = time_window
 
+        loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
         while elapsed_time <= test_duration:
-            ts.sleep(0.93)
+            loop_timer.wait()
             elapsed_time = time.time()-start_time
 
-            power_pct = (inverter.get_power(inv, das=data) / max_W) * 100.
+            # power and frequency of the same sample
+            snap = inverter.snapshot(inv, das=data)
+            power_pct = (snap.power / max_W) * 100.
 
             #determine if function is in hysteresis
             if fw_mode == 'FW21 (FW parameters)' and HysEna == 'Yes':
-                freq_new = inverter.get_freq(inv, das=data)
+                freq_new = snap.freq
 
                 if freq_new < freq_original and freq_original > HzStr:
                     if not in_hysteresis:
@@ -338,7 +328,8 @@ def test_run():
                     pow_targ, pow_upper, pow_lower = power_pass_fail_band(inv, fw_mode=fw_mode, freq=freq, W=W,
                                                                           n_points=n_points, power_range=power_range,
                                                                           WGra=WGra, HzStr=HzStr,
-                                                                          freq_ref=freq_ref, das=data)
+                                                                          freq_ref=freq_ref, das=data,
+                                                                          freq_now=snap.freq, fw_curve=fw_curve)
                 else:  # in hysteresis band
                     pow_targ = hys_power
                     pow_upper = pow_targ + power_range  # units of % nameplate watts
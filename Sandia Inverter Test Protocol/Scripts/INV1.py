@@ -41,6 +41,7 @@ import os
 import traceback
 import time
 import inverter
+import sampler
 import pvsim
 import das
 
@@ -71,12 +72,13 @@ def verify_conn_state_change(inv, state, time_window=0, timeout_period=0, verifi
         time_period = verification_delay
         ts.log('Waiting for verification delay of up to %d seconds' % verification_delay)
 
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
     while result is None:
         if elapsed_time <= time_period:
             power = inverter.get_power(inv, data)
             ts.log('Elapsed time is %0.3f seconds, EUT power is %0.3f W' % (elapsed_time, power))
             if not inverter.verify_conn_state(inv, state, threshold, data):
-                ts.sleep(0.89)  # Attempt to make loop exactly 1 second
+                loop_timer.wait()
                 elapsed_time = time.time()-start_time
             else:
                 ts.log('State changed to %s after %0.3f seconds' % (inverter.conn_state_str(state), elapsed_time))
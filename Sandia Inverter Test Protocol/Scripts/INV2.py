@@ -48,17 +48,19 @@ import sunspec.core.client as client
 import script
 
 import inverter
+import sampler
 
 # returns: True if state == current connection state and power generation matches threshold expectation, False if not
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, data=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, data):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -167,6 +169,8 @@ def test_run():
         # Note: this is below the pv.profile_start command to allow the manual operator time to begin he profile.
         start_time = time.time()
         elapsed_time = 0
+        loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
+        loop_timer.start()
 
         # Sandia Test Protocol Step 5: EUT response to command.
         # Sandia Test Protocol Step 6: Verify command was executed. (Conduct test while profile is running.)
@@ -213,7 +217,7 @@ def test_run():
                     ramp_and_window_complete = True
                 else:
                     ts.log_warning('EUT has not completed the Time Window or Ramp Time by %0.3f seconds' % (time.time()-start_time))
-                    ts.sleep(0.998) # Attempt to sleep 1 second for each loop iteration
+                    loop_timer.wait()
                     elapsed_time = time.time()-start_time
             else:
                 ts.log_error('Operation did not occur within time window, current power output is %d W' % (power))
@@ -244,7 +248,7 @@ def test_run():
 
                     # Reversion has not occurred
                     else:
-                        ts.sleep(0.998) # Attempt to sleep 1 second for each loop iteration
+                        loop_timer.wait()
                         elapsed_time = time.time()-start_time
 
                     ts.log('EUT Power Limit Target = %.2f %%, EUT %% power = %.2f (Total Error = %.2f%%). '
@@ -277,7 +281,7 @@ def test_run():
 
                     # failure only occurs if the EUT power exceeds the curtailment power_limit
                     if power > power_limit:
-                        ts.sleep(0.998) # Attempt to sleep 1 second for each loop iteration
+                        loop_timer.wait()
                         failures += 1
                         ts.log_warning('Inverter exceeded power setpoint %d consecutive times.' % (failures))
                         if failures >= setpoint_failure_count:
@@ -286,7 +290,7 @@ def test_run():
                                          'power is %d W.' % (elapsed_time, power))
 
                     else: # power is below the power_limit
-                        ts.sleep(0.998) # Attempt to sleep 1 second for each loop iteration
+                        loop_timer.wait()
                         elapsed_time = time.time()-start_time
                         failures = 0
 
@@ -303,6 +307,8 @@ def test_run():
                 if curtailment_success is False:
                     raise script.ScriptFail()
 
+        ts.log_debug(str(loop_timer))
+
         if posttest_delay > 0:
             ts.log('Waiting for post-test delay of %d seconds' % posttest_delay)
             ts.sleep(posttest_delay)
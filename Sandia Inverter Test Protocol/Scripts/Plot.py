@@ -39,7 +39,6 @@ import traceback
 import inverter
 
 import sunspec.core.client as client
-import matplotlib.pyplot as plt
 import script
 
 
@@ -90,11 +89,6 @@ def test_run():
                               deptRef=2, enable=0)
         ts.log('VV Functions Disabled.')
 
-    '''
-    plt.plot([0, 1, 2, 3], [2, 3, 2, 1], color='red', label='Voltage')
-    plt.show()
-    '''
-
     return script.RESULT_PASS
 
 def run(test_script):
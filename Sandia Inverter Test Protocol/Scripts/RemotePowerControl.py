@@ -44,17 +44,19 @@ import sunspec.core.client as client
 import script
 
 import inverter
+import sampler
 
 # returns: True if state == current connection state and power generation matches threshold expectation, False if not
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, das=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, das):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -48,21 +48,27 @@ import script
 import script_util
 
 import inverter
+import sampler
+import curve
 import terrasas
 import gridsim
 import sandia_dsm as dsm
 import pvsim
+import nodes
+import tasks
+import detector
 
 # returns: True if state == current connection state and power generation matches threshold expectation, False if not
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, das=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, das):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -71,6 +77,37 @@ def verify_initial_conn_state(inv, state, time_period=0, threshold=50, das=None)
     return result
 
 
+def verify_operating(inv, gsim, time_period, das=None, label=''):
+    """
+    Makes sure the EUT is on and operating, returning the grid simulator to nominal voltage if it is not.
+    """
+    if inverter.get_conn_state(inv) and inverter.get_power_norm(inv) < 0.05:
+        ts.log_warning('%sEUT not operating! Checking grid simulator operations.' % label)
+
+        # if the inverter is off it's probably because the grid simulator is misconfigured.
+        if gsim:
+            gsim.profile_stop()  #abort the profile
+            ts.log('grid nominal voltage: %s' % gsim.v_nom())
+            gsim.voltage(gsim.v_nom())  # return simulator to nominal voltage
+
+        ts.log('%sWaiting up to %d seconds for EUT to begin power export.' % (label, time_period))
+        if verify_initial_conn_state(inv, state=inverter.CONN_CONNECT, time_period=time_period, das=das) is False:
+            ts.log_error('%sInverter unable to be set to connected state.' % label)
+            raise script.ScriptFail()
+
+
+def disable_rt(inv):
+    inv.hvrtd.ModEna = 0
+    inv.hvrtc.ModEna = 0
+    inv.lvrtd.ModEna = 0
+    inv.lvrtc.ModEna = 0
+
+    inv.hvrtd.write()
+    inv.hvrtc.write()
+    inv.lvrtd.write()
+    inv.lvrtc.write()
+
+
 def das_init():
     das = None
     wfmtrigger = None
@@ -94,6 +131,13 @@ def das_init():
         wfmtrigger = dsm.WfmTrigger(ts)
         wfmtrigger_params = script_util.group_params(ts, group='wfm')
 
+    # Simulated EUT measurements and waveforms (gridsim mode 'Sim')
+    if datamethod == 'Simulation':
+        import das_sim
+        das = das_sim.Data(ts)
+        wfmtrigger = das_sim.WfmTrigger(ts)
+        wfmtrigger_params = script_util.group_params(ts, group='wfm')
+
     return (das, wfmtrigger, wfmtrigger_params)
 
 
@@ -112,14 +156,16 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
     2. Using the RMS calculation of the ac voltage to determine when the voltage exits v_nominal +/- v_window
     """
 
+    import wave
+
     f_grid = 60.
     cycles_in_window = 1.
     window_size = cycles_in_window*(1./f_grid)*1000.  # in ms
 
     if ac_voltage is not None:  # use the ac voltage RMS values to determine when the vrt test starts
-        time_RMS, ac_voltage_RMS = calculateRmsOfSignal(ac_voltage, windowSize=window_size,
-                                                        samplingFrequency=24e3,
-                                                        overlap=int(window_size/3))
+        time_RMS, ac_voltage_RMS = wave.calculateRmsOfSignal(ac_voltage, windowSize=window_size,
+                                                             samplingFrequency=24e3,
+                                                             overlap=int(window_size/3))
         v_nom = gsim.v_nom()
         volt_idx = [idx for idx, i in enumerate(ac_voltage_RMS) if (i <= (v_nom - v_window) or i >= (v_nom + v_window))]
         if len(volt_idx) != 0:
@@ -142,9 +188,9 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
             raise script.ScriptFail('No daq trigger in the waveform file.')
 
     ac_current_thresh = trip_thresh  # Amps
-    time_RMS, ac_current_RMS = calculateRmsOfSignal(ac_current, windowSize=window_size,
-                                                    samplingFrequency=24e3,
-                                                    overlap=int(window_size/3))
+    time_RMS, ac_current_RMS = wave.calculateRmsOfSignal(ac_current, windowSize=window_size,
+                                                         samplingFrequency=24e3,
+                                                         overlap=int(window_size/3))
 
     ac_current_idx = [idx for idx, i in enumerate(ac_current_RMS) if i <= ac_current_thresh]
     if len(ac_current_idx) != 0:
@@ -159,216 +205,72 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
         return trip_time
 
 
-def calculateRmsOfSignal(data, windowSize, samplingFrequency, overlap=0):
-    ######################################################################
-    #   calculate and return the time-varying RMS of a signal
-    #   @param data a list or a numpy array containing the signal that should be
-    #       analyzed
-    #   @param windowSize duration of the sliding analysis window in milli-seconds
-    #   @param samplingFrequency sampling frequency [Hz]
-    #   @param overlap overlap between individual windows, specified in milli-seconds
-    #   @return a tuple containing two numpy arrays for the temporal offset and the
-    #       RMS value at the respective temporal offset.
-    #   http://homepage.univie.ac.at/christian.herbst//python/dsp_util_8py_source.html
-
-    import numpy as np
-
-    if windowSize < 1:
-        raise Exception("window size must not below 1 ms")
-    if overlap >= windowSize:
-        raise Exception("overlap must not exceed window size")
-
-    numFrames = len(data)
-    duration = numFrames / float(samplingFrequency)
-
-    readProgress = (windowSize - overlap) / 1000.0
-    outputSize = int(duration / readProgress)
-    dataX = np.zeros(outputSize)
-    dataY = np.zeros(outputSize)
-    t = 0
-    halfWindowSize = windowSize / 2000.0
-
-    for idx in range(outputSize):
-        left = int((t - halfWindowSize) * float(samplingFrequency))
-        right = left + int(windowSize * float(samplingFrequency) / 1000.0)
-
-        if right >= numFrames:
-            right = numFrames - 1
-        numFramesLocal = right - left
-
-        if numFramesLocal <= 0:
-            raise Exception("zero window size (t = " + str(t) + " sec.)")
-
-        dataTmp = np.zeros(numFramesLocal)
-
-        for i in range(numFramesLocal):
-            dataTmp[i] = data[i + left]
-
-        dataX[idx] = t
-        t += readProgress
-        rms = calculateRMS(dataTmp)
-        dataY[idx] = rms
-
-    return dataX[1:], dataY[1:]  #throw away awful first data point
-
-
-def calculateRMS(data):
-    ######################################################################
-    #   calculates the RMS data of the given array
-    #   @param a list or a numpy array
-    #   @return a scalar containing either an RMS value
-    #   http://homepage.univie.ac.at/christian.herbst//python/dsp_util_8py_source.html
-
-    tmp = 0
-    size = len(data)
-    for i in range(size):
-        tmp += data[i]
-    mean = tmp / float(size)
+def ride_through_failed(ride_through_time, c_time, d_time, time_msa, label=''):
+    """
+    Logs the ride-through duration and returns True if it is outside the ride-through/must disconnect window.
+    """
+    if ride_through_time == 0:
+        ts.log('%sThe EUT did not trip or momentarily cease to energize.' % label)
+    else:
+        ts.log('%sThe ride-through duration was %0.3f.' % (label, ride_through_time))
+
+    if ride_through_time - time_msa < c_time:
+        ts.log_warning('%sThe ride-through duration of %0.3f minus the manufacturers stated '
+                       'accuracy of %0.3f is less '
+                       'than the ride-through time of %0.3f.' % (label, ride_through_time, time_msa, c_time))
+        return True
+    elif ride_through_time + time_msa > d_time:
+        ts.log_warning('%sThe ride-through duration of %0.3f plus the manufacturers stated '
+                       'accuracy of %0.3f is more '
+                       'than the must disconnect time of %0.3f.' % (label, ride_through_time, time_msa, c_time))
+        return True
+    return False
+
+
+def wait_for_wfm(wfmtrigger, timeout):
+    """
+    Returns the waveform file of the armed trigger once the DSM has finished writing it.
+    """
+    ts.log('Waiting up to %0.2f seconds for the waveform file.' % timeout)
+    wfmname = wfmtrigger.wait_for_file(timeout=timeout, sleep=ts.sleep)
+    if wfmname is None:
+        raise script.ScriptFail('No complete waveform file within %0.2f seconds. %s' %
+                                (timeout, wfmtrigger.off_last_error))
+    return wfmname
 
-    tmp = 0
-    for i in range(size):
-        tmp2 = data[i] - mean
-        tmp += tmp2 * tmp2
-    tmp /= float(size)
 
-    return math.sqrt(tmp)
+def save_wfm(wfmtrigger, wfmname):
+    results_dir = os.path.dirname(__file__)[:-7] + 'Results' + os.path.sep
+    ts.log('Moving waveform "%s" to results folder: %s.' % (wfmname, results_dir))
+    wfmtrigger.move_file_to_results(wfmname=wfmname, results_dir=results_dir, delete_original='No')
 
 
 def predict_vrt_response_time(test_voltage, ride_through, h_time=0, h_volt=0, h_n_points=0,
                               l_time=0, l_volt=0, l_n_points=0,
                               hc_time=0, hc_volt=0, hc_n_points=0,
                               lc_time=0, lc_volt=0, lc_n_points=0):
-
-    c_time = None
-    d_time = None
-    lots_of_output = False
-
+    """ Calculate the voltage response time for a given test condition and VRT curves
+    Return must stay connected duration (c_time) and must disconnect time (d_time)
+    test_voltage may be a single test point or an array of test points.
+    """
     #Check to be sure the times are monotonically increasing.
-    for i in xrange(1, h_n_points-1):
-        if h_time[i] > h_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in HVRTD curve.')
-        break
-    for i in xrange(1, l_n_points-1):
-        if l_time[i] > l_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in LVRTD curve.')
-        break
-    for i in xrange(1, hc_n_points-1):
-        if hc_time[i] > hc_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in HVRTC curve.')
-        break
-    for i in xrange(1, lc_n_points-1):
-        if lc_time[i] > lc_time[i+1]:
-            ts.log_error('Times are not monotonically increasing in LVRTC curve.')
-        break
-
-    if test_voltage > 100:  # use HVRTD
-
-        if test_voltage < h_volt[h_n_points]: #test_voltage is below the last point - extrapolate
-            d_time = 0
-            if lots_of_output:
-                ts.log_debug('h_time = %s, h_time[n_points] = %s' % (h_time, h_time[h_n_points]))
-                ts.log_debug('V_test is lower than HVRTD[n_points]. Trip time is %0.3f' % d_time)
-        elif test_voltage > h_volt[1]: #test_voltage is above the 1st point - extrapolate
-            d_time = h_time[1]  # there is no trip time - EUT should run indefinitely
-            if lots_of_output:
-                ts.log_debug('V_test is higher than HVRTD[1]. Trip time is %0.3f' % d_time)
-        else:
-            # pointwise algorithm to find target vars
-            for i in xrange(1, h_n_points):
-                if lots_of_output:
-                    ts.log_debug('Grid voltage is %.3f' % (test_voltage))
-                    ts.log_debug('i = %d' % i)
-                    ts.log_debug('test_voltage >= volt[i+1] and test_voltage <= volt[i]')
-                    ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (test_voltage, h_volt[i+1], test_voltage, h_volt[i]))
-
-                if test_voltage >= h_volt[i+1] and test_voltage <= h_volt[i]: #curve interpolation
-                    #Time = Ti + (Ti+1 - Ti)*((test_voltage - Vi)/(Vi+1 - Vi))
-                    d_time = h_time[i] + (h_time[i+1] - h_time[i])*((test_voltage - h_volt[i])/(h_volt[i+1] - h_volt[i]))
-                    if lots_of_output:
-                        ts.log_debug('Interpolated. Trip time is %0.3f' % d_time)
-                    break
-
-    else:  # use LVRTD
-        if test_voltage < l_volt[1]: #test_voltage is below the 1st point - extrapolate
-            d_time = l_time[1]
-            if lots_of_output:
-                ts.log_debug('l_time = %s, l_time[1] = %s' % (l_time, l_time[1]))
-                ts.log_debug('V_test is lower than LVRTD[1]. Trip time is %0.3f' % d_time)
-        elif test_voltage > l_volt[l_n_points]: #test_voltage is above the last point - extrapolate
-            d_time = 0  # there is no trip time - EUT should run indefinitely
-            if lots_of_output:
-                ts.log_debug('V_test is higher than LVRTD[n_points]. Trip time is %0.3f' % d_time)
-        else:
-            # pointwise algorithm to find target vars
-            for i in xrange(1, l_n_points):
-                if lots_of_output:
-                    ts.log_debug('Grid voltage is %.3f' % (test_voltage))
-                    ts.log_debug('i = %d' % i)
-                    ts.log_debug('test_voltage >= volt[i] and test_voltage <= volt[i+1]')
-                    ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (test_voltage, l_volt[i], test_voltage, l_volt[i+1]))
-
-                if test_voltage >= l_volt[i] and test_voltage <= l_volt[i+1]: #curve interpolation
-                    #Time = Ti + (Ti+1 - Ti)*((test_voltage - Vi)/(Vi+1 - Vi))
-                    d_time = l_time[i] + (l_time[i+1] - l_time[i])*((test_voltage - l_volt[i])/(l_volt[i+1] - l_volt[i]))
-                    if lots_of_output:
-                        ts.log_debug('Interpolated. Trip time is %0.3f' % d_time)
-                    break
+    for name, t, n in (('HVRTD', h_time, h_n_points), ('LVRTD', l_time, l_n_points),
+                       ('HVRTC', hc_time, hc_n_points), ('LVRTC', lc_time, lc_n_points)):
+        if n > 1 and not curve.monotonic(curve.points(t, n)):
+            ts.log_error('Times are not monotonically increasing in %s curve.' % name)
+
+    d_time = curve.response_time(test_voltage,
+                                 curve.ride_through_curve(h_volt, h_time, h_n_points, high=True, name='HVRTD'),
+                                 curve.ride_through_curve(l_volt, l_time, l_n_points, high=False, name='LVRTD'))
 
     if ride_through == 'No':
-        c_time = 0
+        c_time = 0. * d_time
     else:
-        if test_voltage > 100:  # use HVRTC
-            if test_voltage < hc_volt[hc_n_points]: #test_voltage is below the last point - extrapolate
-                c_time = 0
-                if lots_of_output:
-                    ts.log_debug('V_test is lower than HVRTC[n_points]. Ride-through time is %0.3f' % c_time)
-            elif test_voltage > hc_volt[1]: #test_voltage is above the 1st point - extrapolate
-                c_time = hc_time[1]  # there is no must remain connected time - EUT should run indefinitely
-                if lots_of_output:
-                    ts.log_debug('V_test is higher than HVRTC[1]. Ride-through time is %0.3f' % c_time)
-            else:
-                # pointwise algorithm to find target vars
-                for i in xrange(1, hc_n_points):
-                    if lots_of_output:
-                        ts.log_debug('Grid voltage is %.3f' % (test_voltage))
-                        ts.log_debug('i = %d' % i)
-                        ts.log_debug('test_voltage >= volt[i+1] and test_voltage <= volt[i]')
-                        ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' %
-                                     (test_voltage, hc_volt[i+1], test_voltage, hc_volt[i]))
-
-                    if test_voltage >= hc_volt[i+1] and test_voltage <= hc_volt[i]: #curve interpolation
-                        #Time = Ti + (Ti+1 - Ti)*((test_voltage - Vi)/(Vi+1 - Vi))
-                        c_time = hc_time[i] + (hc_time[i+1] - hc_time[i])*\
-                                              ((test_voltage - hc_volt[i])/(hc_volt[i+1] - hc_volt[i]))
-                        if lots_of_output:
-                            ts.log_debug('Interpolated. Ride-through time is %0.3f' % c_time)
-                        break
-        else:  # use LVRTD
-            if test_voltage < lc_volt[1]: #test_voltage is below the 1st point - extrapolate
-                c_time = lc_time[1]
-                if lots_of_output:
-                    ts.log_debug('V_test is lower than LVRTC[1]. Ride-through time is %0.3f' % c_time)
-            elif test_voltage > lc_volt[lc_n_points]: #test_voltage is above the last point - extrapolate
-                c_time = 0  # there is no must remain connected time - EUT should run indefinitely
-                if lots_of_output:
-                    ts.log_debug('V_test is higher than LVRTC[n_points]. Ride-through time is %0.3f' % c_time)
-            else:
-                # pointwise algorithm to find target vars
-                for i in xrange(1, lc_n_points):
-                    if lots_of_output:
-                        ts.log_debug('Grid voltage is %.3f' % (test_voltage))
-                        ts.log_debug('i = %d' % i)
-                        ts.log_debug('test_voltage >= volt[i] and test_voltage <= volt[i+1]')
-                        ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' %
-                                     (test_voltage, lc_volt[i], test_voltage, lc_volt[i+1]))
-
-                    if test_voltage >= lc_volt[i] and test_voltage <= lc_volt[i+1]: #curve interpolation
-                        #Time = Ti + (Ti+1 - Ti)*((test_voltage - Vi)/(Vi+1 - Vi))
-                        c_time = lc_time[i] + (lc_time[i+1] - lc_time[i])*\
-                                              ((test_voltage - lc_volt[i])/(lc_volt[i+1] - lc_volt[i]))
-                        if lots_of_output:
-                            ts.log_debug('Interpolated. Ride-through time is %0.3f' % c_time)
-                        break
+        c_time = curve.response_time(test_voltage,
+                                     curve.ride_through_curve(hc_volt, hc_time, hc_n_points, high=True,
+                                                              name='HVRTC'),
+                                     curve.ride_through_curve(lc_volt, lc_time, lc_n_points, high=False,
+                                                              name='LVRTC'))
 
     return c_time, d_time
 
@@ -383,6 +285,7 @@ def test_run():
     inv = None
     filename = None
     disable = None
+    node_list = []
 
     try:
         ifc_type = ts.param_value('comm.ifc_type')
@@ -429,9 +332,15 @@ def test_run():
         verification_delay = ts.param_value('invt.verification_delay')
         posttest_delay = ts.param_value('invt.posttest_delay')
         disable = ts.param_value('invt.disable')
+        fanout = ts.param_value('nodes.fanout') == 'Enabled'
+        online = ts.param_value('invt.online_detection') == 'Enabled'
 
         # initialize data acquisition system
         das, wfmtrigger, wfmtrigger_params = das_init()
+        if online and wfmtrigger is not None and not wfmtrigger.cancellable:
+            # the capture would still have to be waited out before the trigger is armed again
+            ts.log_warning('Online detection is not used with a waveform trigger that cannot be cancelled.')
+            online = False
 
         # initialize pv simulation
         pv = pvsim.pvsim_init(ts)
@@ -445,6 +354,19 @@ def test_run():
         inv = client.SunSpecClientDevice(ifc_type, slave_id=slave_id, name=ifc_name, baudrate=baudrate, parity=parity,
                                          ipaddr=ipaddr, ipport=ipport)
 
+        # with fan-out, each grid event is measured and evaluated on every node, the node EUTs are checked and
+        # cleaned up like the main EUT
+        node_failures = {}
+        if fanout:
+            node_list = nodes.nodes_from_params(ts)
+            ts.log('Scanning node EUTs: %s' % ', '.join([str(n) for n in node_list]))
+            tasks.parallel(*[n.client for n in node_list],
+                           cleanup=tasks.close)  # clients connected before a failed connection are closed
+            node_failures = dict([(n.node_id, 0) for n in node_list])
+            if wfmtrigger_params is not None:
+                wfmtrigger_params['trigacqchannels'] = nodes.acq_channels(node_list,
+                                                                          wfmtrigger_params.get('trigchannel'))
+
         ### Find test points ###
         # determine the test points for the HVRT tests (ends near nominal)
         h_v_test_points = [h_volt[h_volt['index_start']]+test_point_offset]
@@ -550,29 +472,19 @@ def test_run():
                 ts.log_debug('max_time: %s, max(max_time): %s' % (max_time, max(max_time)))
                 d_time = max_time + verification_delay
 
-            ### Make sure the EUT is on and operating
-            if inverter.get_conn_state(inv) and inverter.get_power_norm(inv) < 0.05:
-                ts.log_warning('EUT not operating! Checking grid simulator operations.')
-
-                # if the inverter is off it's probably because the grid simulator is misconfigured.
-                if gsim:
-                    gsim.profile_stop()  #abort the profile
-                    ts.log('grid nominal voltage: %s' % gsim.v_nom())
-                    gsim.voltage(gsim.v_nom())  # return simulator to nominal voltage
-
-                ts.log('Waiting up to %d seconds for EUT to begin power export.' % (verification_delay+pretest_delay))
-                if verify_initial_conn_state(inv, state=inverter.CONN_CONNECT,
-                                             time_period=verification_delay+pretest_delay, das=das) is False:
-                        ts.log_error('Inverter unable to be set to connected state.')
-                        raise script.ScriptFail()
+            ### Make sure the EUTs are on and operating
+            verify_operating(inv, gsim, verification_delay+pretest_delay, das=das)
+            for node in node_list:
+                # the DAS measures the main EUT, the node EUTs are checked over Modbus
+                verify_operating(node.inv, gsim, verification_delay+pretest_delay, label='%s: ' % node)
 
             ### Arm the data acquisition system for waveform capture
             if das is not None:
-                das_time = inverter.get_time(das=das)
-                while das_time == inverter.get_time(das=das):
-                    ts.log('Monitoring the data stream to ensure the das is prepared for a waveform capture. '
-                           'DAS time: %s' % inverter.get_time(das=das))
-                    ts.sleep(1)
+                ts.log('Monitoring the data stream to ensure the das is prepared for a waveform capture.')
+                das_time = das.wait_update(timeout=max(pretest_delay, 5.), sleep=ts.sleep)
+                if das_time is None:
+                    raise script.ScriptFail('The DAS data stream is not updating.')
+                ts.log('DAS time: %s' % das_time)
 
                 ts.log('Configuring the data capture for the following channels: %s' %
                        wfmtrigger_params.get('trigacqchannels'))
@@ -626,67 +538,84 @@ def test_run():
                     raise script.ScriptFail('Aborted VRT!')
 
             ### Wait for DAS to capture transient event
-            start_time = time.time()
-            elapsed_time = 0.
-            while elapsed_time <= wfmtrigger_params['posttrig']:
-                ts.log('Waiting for waveform capture to complete. Total time remaining %0.3f seconds' %
-                       (wfmtrigger_params['posttrig']-elapsed_time))
-                ts.sleep(0.93)
-                elapsed_time = time.time() - start_time
+            online_time = None
+            if online and das is not None and not node_list:
+                # evaluate the DAS measurements while the waveform is captured, stop when the outcome is decided
+                ts.log('Watching the DAS measurements for up to %0.3f seconds' % wfmtrigger_params['posttrig'])
+                d = detector.Detector(v_nom=gsim.v_nom() if gsim else 240., v_window=20., trip_thresh=3.,
+                                      on_event=lambda name, t: ts.log('Detected %s at DAS time %0.3f' % (name, t)))
+                online_time = detector.watch_ride_through(d, das, wfmtrigger_params['posttrig'], c_time, d_time,
+                                                          time_msa, ts.sleep)
+            else:
+                start_time = time.time()
+                elapsed_time = 0.
+                loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
+                while elapsed_time <= wfmtrigger_params['posttrig']:
+                    ts.log('Waiting for waveform capture to complete. Total time remaining %0.3f seconds' %
+                           (wfmtrigger_params['posttrig']-elapsed_time))
+                    loop_timer.wait()
+                    elapsed_time = time.time() - start_time
 
             ### Screen waveform data and save in the results file
-            if das is not None:
+            if online_time is not None:
+                ts.log('Ride-through outcome decided from the DAS measurements, the waveform is not analyzed.')
+                if gsim is not None:
+                    gsim.profile_stop()  # end the event, the EUT response has been determined
+                    gsim.voltage(gsim.v_nom())
+                if ride_through_failed(online_time, c_time, d_time, time_msa):
+                    failures += 1
+                    ts.log_warning('The number of failures is %i.' % failures)
+                if wfmtrigger is not None:
+                    wfmtrigger.cancel()  # the capture of this trigger is not needed
 
-                ts.log('Waiting post test delay of %0.2f seconds before processing the data file.' % posttest_delay)
-                ts.sleep(posttest_delay)
+            elif das is not None:
 
-                # get data from waveform saved on the hard drive
-                # (this function could use a little help to make it more robust...)
-                wfmname = wfmtrigger.getfilename()
+                # get data from the waveform of this trigger as soon as the DSM has finished saving it
+                wfmname = wait_for_wfm(wfmtrigger, posttest_delay)
                 ts.log('Analyzing waveform data in file "%s".' % wfmname)
 
-                if ts.param_value('wfm.trigchannel').count(',') == 3:
-                    wfmtime, ac_voltage, ac_current = wfmtrigger.read_file(wfmname)
+                if node_list:
+                    # the same grid event evaluated on every node, each node in its own worker process
+                    node_results = nodes.ride_through(wfmname, node_list, processes=ts.param_value('nodes.processes'))
+                    for node, (node_time, error) in zip(node_list, node_results):
+                        if node_time is None:
+                            ts.log_warning('%s: unable to evaluate the waveform: %s' % (node, error))
+                            node_failures[node.node_id] += 1
+                        elif ride_through_failed(node_time, c_time, d_time, time_msa, label='%s: ' % node):
+                            node_failures[node.node_id] += 1
+                    ts.log('Node failures: %s' % ', '.join(['%s: %d' % (n.node_id, node_failures[n.node_id])
+                                                            for n in node_list]))
 
-                    # calculate the time the EUT rode through the voltage event
-                    # ride_through_time == 0 means no trip/ceassation
-                    ride_through_time = calc_ride_through_duration(wfmtime, ac_current, ac_voltage=ac_voltage)
+                else:
+                    if ts.param_value('wfm.trigchannel').count(',') == 3:
+                        wfmtime, ac_voltage, ac_current = wfmtrigger.read_file(wfmname)
 
-                else:  # if there are more than 3 channels being collected, assume the first 4 the following:
-                    wfmtime, ac_voltage, ac_current, grid_trig = wfmtrigger.read_file(wfmname)
+                        # calculate the time the EUT rode through the voltage event
+                        # ride_through_time == 0 means no trip/ceassation
+                        ride_through_time = calc_ride_through_duration(wfmtime, ac_current, ac_voltage=ac_voltage)
 
-                    # calculate the time the EUT rode through the voltage event
-                    # ride_through_time == 0 means no trip/ceassation
-                    ride_through_time = calc_ride_through_duration(wfmtime, ac_current, grid_trig=grid_trig)
+                    else:  # if there are more than 3 channels being collected, assume the first 4 the following:
+                        wfmtime, ac_voltage, ac_current, grid_trig = wfmtrigger.read_file(wfmname)
 
-                if ride_through_time == 0:
-                    ts.log('The EUT did not trip or momentarily cease to energize.')
-                else:
-                    ts.log('The ride-through duration was %0.3f.' % ride_through_time)
+                        # calculate the time the EUT rode through the voltage event
+                        # ride_through_time == 0 means no trip/ceassation
+                        ride_through_time = calc_ride_through_duration(wfmtime, ac_current, grid_trig=grid_trig)
 
-                if ride_through_time - time_msa < c_time:
-                    ts.log_warning('The ride-through duration of %0.3f minus the manufacturers stated '
-                                   'accuracy of %0.3f is less '
-                                   'than the ride-through time of %0.3f.' % (ride_through_time, time_msa, c_time))
-                    failures += 1
-                    ts.log_warning('The number of failures is %i.' % failures)
-                elif ride_through_time + time_msa > d_time:
-                    ts.log_warning('The ride-through duration of %0.3f plus the manufacturers stated '
-                                   'accuracy of %0.3f is more '
-                                   'than the must disconnect time of %0.3f.' % (ride_through_time, time_msa, c_time))
-                    failures += 1
-                    ts.log_warning('The number of failures is %i.' % failures)
+                    if ride_through_failed(ride_through_time, c_time, d_time, time_msa):
+                        failures += 1
+                        ts.log_warning('The number of failures is %i.' % failures)
 
                 # save file to results
-                results_dir = os.path.dirname(__file__)[:-7] + 'Results' + os.path.sep
-                ts.log('Moving waveform "%s" to results folder: %s.' % (wfmname, results_dir))
-                wfmtrigger.move_file_to_results(wfmname=wfmname, results_dir=results_dir, delete_original='No')
+                save_wfm(wfmtrigger, wfmname)
 
             else:
                 ts.log('Ride-through test complete. Please analyze the data to assign pass/fail result.')
 
             if failures >= failure_count:
                 raise script.ScriptFail()
+            if node_failures and max(node_failures.values()) >= failure_count:
+                raise script.ScriptFail('Failure count reached on nodes %s' %
+                                        ', '.join([k for k, v in node_failures.iteritems() if v >= failure_count]))
 
         ts.log('Waiting the post-test duration %i.' % posttest_delay)
         ts.sleep(posttest_delay)
@@ -700,16 +629,16 @@ def test_run():
     finally:
         if pv:
             pv.close()
-        if disable == 'yes' and inv is not None:
-            inv.hvrtd.ModEna = 0
-            inv.hvrtc.ModEna = 0
-            inv.lvrtd.ModEna = 0
-            inv.lvrtc.ModEna = 0
-
-            inv.hvrtd.write()
-            inv.hvrtc.write()
-            inv.lvrtd.write()
-            inv.lvrtc.write()
+        if disable == 'Yes' and inv is not None:
+            disable_rt(inv)
+            for node in node_list:
+                if node.inv is not None:
+                    try:
+                        disable_rt(node.inv)
+                    except Exception, e:
+                        ts.log_error('%s: unable to disable the ride-through settings: %s' % (node, e))
+        for node in node_list:
+            node.close()
 
         if gsim:
             gsim.profile_stop()  #abort the profile
@@ -839,11 +768,17 @@ info.param('invt.VRT_period', label='Duration beyond must trip curve for analysi
 info.param('invt.verification_delay', label='Verification Delay (seconds)', default=5,
            desc='Wait time allowance before assigning failure for the time parameters.')
 info.param('invt.posttest_delay', label='Post-Test Delay (seconds)', default=10,
-           desc='Delay after finishing the test.')
+           desc='Delay after finishing the test and the longest wait for the waveform file of a test point.')
 info.param('invt.failure_count', label='Setpoint Failure Count', default=60,
            desc='Number of consecutive failures (power excursions beyond target vars) which does not '
                 'produce a script fail. This accounts for EUT settling time.')
 info.param('invt.disable', label='Disable VRT function at end of test?', default='No', values=['Yes', 'No'])
+info.param('invt.online_detection', label='Decide from DAS measurements during the capture', default='Disabled',
+           values=['Disabled', 'Enabled'],
+           desc='Evaluate the ride-through from the DAS RMS measurements while the waveform is captured and end the '
+                'test point as soon as the outcome is decided. Cessations close to the ride-through window edges '
+                'are still evaluated from the waveform. Not used with the Sandia DSM waveform trigger, whose '
+                'capture cannot be cancelled once triggered.')
 
 # Grid simulator
 gridsim.params(info)
@@ -851,17 +786,20 @@ gridsim.params(info)
 # PV simulator
 pvsim.params(info)
 
+# Multi-node fan-out
+nodes.params(info)
+
 # todo: must add ability to control multiple channels at the same time
 # todo: also nice to control the two racks at the same time for multiple inverter tests
 
 # DAS
 info.param_group('datatrig', label='Data Acquisition and Triggering', glob=True)
 info.param('datatrig.dsm_method', label='Data Acquisition Method', default='Disabled - Data from EUT',
-           values=['Disabled - Data from EUT', 'Sandia LabView DSM'],
+           values=['Disabled - Data from EUT', 'Sandia LabView DSM', 'Simulation'],
            desc='Each lab will have different data acquisition methods. Sandia passes the data from the DAQ '
                 'to python by writing the values locally or collecting them over the local TCP network.')
 info.param_group('wfm', label='Waveform Capture Parameters',
-           active='datatrig.dsm_method', active_value=['Sandia LabView DSM'],
+           active='datatrig.dsm_method', active_value=['Sandia LabView DSM', 'Simulation'],
            desc='Sandia technique for capturing waveforms using the DSM.', glob=True)
 info.param('wfm.trigsamplingrate', label='Waveform Sampling Rate (Hz)', default='24.0e3')
 info.param('wfm.pretrig', label='Pretrigger Time (sec)', default='166.667e-3')
@@ -58,6 +58,7 @@ def test_run():
         gsim.profile_load(ts.param_value('profile.profile_name'))
 
         gsim.profile_start()
+        gsim.profile_wait()
 
         result = script.RESULT_PASS
 
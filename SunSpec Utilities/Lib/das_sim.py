@@ -0,0 +1,205 @@
+import os
+import math
+import tempfile
+import das
+import sandia_dsm
+import sim
+import sim_eut
+
+sim_info = {
+    'name': os.path.splitext(os.path.basename(__file__))[0],
+    'mode': 'Sim'
+}
+
+def das_info():
+    return sim_info
+
+def params(info, group_name=None):
+    gname = lambda name: group_name + '.' + name
+    info.param_add_value(gname('mode'), sim_info['mode'])
+
+WFM_CHANNELS = ['Time', 'AC_Voltage', 'AC_Current', 'Ametek_Trigger']
+TRIGGER_HIGH = 5.
+# interval at which the waveform trigger looks for the grid simulator trigger (s)
+TRIGGER_POLL = 0.1
+
+
+class Data(das.Data):
+    """
+    Measurements of the simulated EUT with the point names of the Sandia DSM data (sandia_dsm.Data).
+    """
+
+    def __init__(self, ts):
+        das.Data.__init__(self, ts)
+        self.world = sim.world(ts)
+        self.read_error_count = 0
+        self.read_last_error = ''
+        for name in ('time', 'dc_voltage', 'dc_current', 'ac_voltage', 'ac_current', 'dc_watts', 'ac_va',
+                     'ac_watts', 'ac_vars', 'ac_freq', 'ac_pf', 'trigger', 'ametek_trigger'):
+            self[name] = None
+
+    def read(self):
+        w = self.world
+        eut = w.eut
+        eut.update()
+        self.time = eut.t
+        self.ac_voltage = eut.v
+        self.ac_current = eut.current()
+        self.ac_watts = eut.w
+        self.ac_vars = eut.var
+        self.ac_va = eut.va()
+        self.ac_freq = eut.f
+        self.ac_pf = eut.pf()
+        self.dc_watts = eut.w/sim_eut.EFFICIENCY if eut.w > 0 else 0.
+        self.dc_voltage = w.pv.v_mpp if w.pv.on else 0.
+        self.dc_current = self.dc_watts/self.dc_voltage if self.dc_voltage else 0.
+        self.trigger = 0.
+        self.ametek_trigger = TRIGGER_HIGH if w.grid.running(eut.t) else 0.
+
+    def wait_update(self, timeout=5., interval=0.1, sleep=None):
+        """
+        Returns the time of a new sample (sandia_dsm.Data.wait_update).
+        """
+        if sleep is None:
+            sleep = self.world.clock.sleep
+        self.read()
+        last = self.time
+        sleep(interval)
+        self.read()
+        if self.time != last:
+            return self.time
+        return None
+
+
+def waveform(history, t0, t1, fs, run=None):
+    """
+    Returns the columns (time, ac voltage, ac current, grid simulator trigger) of a waveform sampled at fs from t0
+    to t1, synthesized from the EUT history [(t, v rms, f, i rms, w, var), ...]. run is the (start, end) of the
+    grid simulator profile, the trigger is high while it runs.
+    """
+    import numpy as np
+
+    h = np.array([s for s in history if t0 - 1. <= s[0] <= t1 + 1.], dtype=float)
+    if len(h) == 0:
+        raise das.DASError('No simulation history between %0.3f and %0.3f' % (t0, t1))
+    t = t0 + np.arange(int(round((t1 - t0)*fs)))/float(fs)
+    v = np.interp(t, h[:, 0], h[:, 1])
+    f = np.interp(t, h[:, 0], h[:, 2])
+    i = np.interp(t, h[:, 0], h[:, 3])
+    phi = np.interp(t, h[:, 0], np.arctan2(h[:, 5], h[:, 4]))
+    phase = 2.*math.pi*np.cumsum(f)/fs
+    trig = np.zeros(len(t))
+    if run is not None:
+        trig[(t >= run[0]) & (t < run[1])] = TRIGGER_HIGH
+    return t - t0, math.sqrt(2.)*v*np.sin(phase), math.sqrt(2.)*i*np.sin(phase - phi), trig
+
+
+class WfmTrigger(sandia_dsm.WfmTrigger):
+    """
+    Waveform capture of the simulated EUT with the interface of the Sandia DSM waveform trigger. The capture is
+    triggered by the next grid simulator profile started after trigger() and the waveform file is written when
+    the post-trigger time has elapsed.
+    """
+
+    # the waveform is made when it is waited for, a capture is dropped by disarming the trigger
+    cancellable = True
+
+    def __init__(self, ts, path=None):
+        if path is None:
+            path = tempfile.mkdtemp(prefix='svp_sim_')
+        sandia_dsm.WfmTrigger.__init__(self, ts, filename=os.path.join(path, 'waveform trigger.txt'))
+        self.path = path
+        self.world = sim.world(ts)
+        self.params = None
+        self.armed = None
+        self.filename_last = None
+        self.count = 0
+
+    def trigger(self, wfmtrigger_params=None):
+        if wfmtrigger_params is not None:
+            self.params = wfmtrigger_params
+            self.armed = self.world.clock.time()
+            self.filename_last = None
+
+    def cancel(self):
+        self.armed = None
+        return True
+
+    def _run(self):
+        run = self.world.grid.last_run
+        if run is not None and run[0] >= self.armed:
+            return run
+        return None
+
+    def wait_for_file(self, timeout, sleep=None):
+        try:
+            if self.armed is None:
+                raise das.DASError('Waveform trigger not armed')
+            clock = self.world.clock
+            if sleep is None:
+                sleep = clock.sleep
+            end = clock.time() + timeout
+            run = self._run()
+            while run is None and clock.time() < end:
+                sleep(TRIGGER_POLL)
+                run = self._run()
+            if run is None:
+                raise das.DASError('No grid simulator trigger within %0.3f seconds' % timeout)
+            capture_end = run[0] + float(self.params.get('posttrig'))
+            if capture_end > end:
+                raise das.DASError('Capture ends after the timeout of %0.3f seconds' % timeout)
+            if clock.time() < capture_end:
+                sleep(capture_end - clock.time())
+            self.world.eut.update()
+            fs = float(self.params.get('trigsamplingrate'))
+            columns = waveform(self.world.eut.history, run[0] - float(self.params.get('pretrig')), capture_end,
+                               fs, run)
+            self.count += 1
+            name = os.path.join(self.path, 'sim_%03d.wfm' % self.count)
+            write_wfm(name, columns)
+            self.armed = None
+            self.filename_last = name
+            return name
+        except Exception, e:
+            self.off_error_count += 1
+            self.off_last_error = str(e)
+
+    def getfilename(self):
+        return self.filename_last
+
+
+def write_wfm(filename, columns, channels=WFM_CHANNELS):
+    """
+    Writes waveform columns in the DSM waveform file format: a tab delimited channel name line and one row per
+    sample.
+    """
+    import numpy as np
+
+    with open(filename, 'w') as f:
+        f.write('\t'.join(channels[:len(columns)]) + '\n')
+        np.savetxt(f, np.column_stack(columns), fmt='%.6g', delimiter='\t')
+
+
+class DAS(das.DAS):
+    """
+    Data acquisition of the simulated EUT (see sim.py).
+    """
+
+    def __init__(self, ts, group_name):
+        das.DAS.__init__(self, ts, group_name)
+        self.world = sim.world(ts)
+
+    def data_init(self):
+        return Data(self.ts)
+
+    def close(self):
+        """
+        Closes the simulation world (see sim.reset()).
+        """
+        sim.reset()
+
+    def wfm_trigger_init(self):
+        return WfmTrigger(self.ts)
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,262 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Post-hoc pass/fail evaluation of captured datasets.
+
+The target value, the upper and lower limits and the pass/fail result are computed for every row of a capture
+in one set of array operations, so the evaluation does not have to run inside the timed test loop and can be
+re-run from the saved CSV files without hardware:
+
+    ds = daq.data_capture_dataset()
+    vv = curve.Curve(v_points, q_points)
+    result = evaluate.curve_band(ds, x='AC_V_1', y='AC_Q_1', curve=vv, y_tolerance=var_msa,
+                                 settling_time=t_settling)
+    ts.log(str(result))
+
+Datasets may be a das dataset object (points and data attributes), a dict of columns, a numpy structured array
+or the name of a CSV file written by the dataset to_csv() method.
+"""
+
+import os
+import numpy as np
+
+TIME = 'TIME'
+
+
+class EvaluateError(Exception):
+    pass
+
+
+def columns(dataset):
+    """
+    Returns a dict of numpy float arrays keyed by channel name for the supported dataset types.
+    """
+    if isinstance(dataset, basestring):
+        return read_csv(dataset)
+    if isinstance(dataset, dict):
+        return dict([(k, np.asarray(v, dtype=float)) for k, v in dataset.iteritems()])
+    if isinstance(dataset, np.ndarray) and dataset.dtype.names:
+        return dict([(k, np.asarray(dataset[k], dtype=float)) for k in dataset.dtype.names])
+    points = getattr(dataset, 'points', None)
+    data = getattr(dataset, 'data', None)
+    if points is not None and data is not None:
+        return dict([(points[i], np.asarray(data[i], dtype=float)) for i in range(len(points))])
+    raise EvaluateError('Unsupported dataset type: %s' % type(dataset))
+
+
+def read_csv(filename):
+    """
+    Reads a dataset CSV file (header row of channel names) into a dict of numpy arrays.
+    """
+    if not os.path.exists(filename):
+        raise EvaluateError('Dataset file not found: %s' % filename)
+    f = open(filename, 'r')
+    try:
+        header = f.readline().strip()
+    finally:
+        f.close()
+    names = [n.strip() for n in header.split(',')]
+    data = np.genfromtxt(filename, delimiter=',', skip_header=1, dtype=float)
+    data = np.atleast_2d(data)
+    if data.size == 0:
+        return dict([(n, np.zeros(0)) for n in names])
+    return dict([(names[i], data[:, i]) for i in range(len(names))])
+
+
+def column(data, name):
+    try:
+        return data[name]
+    except KeyError:
+        raise EvaluateError('Dataset has no %s channel, available channels: %s' % (name, ', '.join(sorted(data))))
+
+
+def settled(time, x, settling_time, step):
+    """
+    Returns a mask that is False for samples within settling_time seconds of a step change in x larger than step,
+    True otherwise. Samples before the first step are evaluated; a step made before the capture started is not
+    seen, exclude the start of the capture separately if it may still be settling (see power_factor_band).
+    """
+    time = np.asarray(time, dtype=float)
+    x = np.asarray(x, dtype=float)
+    mask = np.ones(len(time), dtype=bool)
+    if len(time) < 2 or not settling_time:
+        return mask
+    step_idx = np.nonzero(np.abs(np.diff(x)) > step)[0] + 1
+    if len(step_idx) == 0:
+        return mask
+    step_time = time[step_idx]
+    # time of the most recent step at or before each sample
+    last = np.searchsorted(step_time, time, side='right') - 1
+    after = last >= 0
+    mask[after] = (time[after] - step_time[last[after]]) >= settling_time
+    return mask
+
+
+def pf_offset(pf):
+    """
+    Maps power factor to a value that is continuous through unity: 1 - pf for positive pf, -(1 + pf) for negative
+    pf. A tolerance in power factor units applies unchanged to the offset values.
+    """
+    pf = np.asarray(pf, dtype=float)
+    return np.where(pf >= 0, 1. - pf, -(1. + pf))
+
+
+class Result(object):
+    """
+    Row by row evaluation of a captured dataset.
+
+    measured, target, upper, lower - arrays of the evaluated channel and its limits
+    evaluated - mask of the rows that were evaluated (e.g. excluding settling periods)
+    passed - mask of the evaluated rows within limits (rows not evaluated are reported as passed)
+    """
+
+    def __init__(self, name, measured, target, upper, lower, evaluated=None, time=None):
+        self.name = name
+        self.measured = np.asarray(measured, dtype=float)
+        self.target = np.asarray(target, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.lower = np.asarray(lower, dtype=float)
+        if evaluated is None:
+            evaluated = np.ones(len(self.measured), dtype=bool)
+        self.evaluated = np.asarray(evaluated, dtype=bool) & ~np.isnan(self.measured)
+        self.time = time
+        within = (self.measured >= self.lower) & (self.measured <= self.upper)
+        self.passed = within | ~self.evaluated
+
+    @property
+    def failed(self):
+        return ~self.passed
+
+    def result(self):
+        """
+        Returns True if all evaluated rows are within limits. A dataset with no evaluated rows does not pass.
+        """
+        return bool(np.any(self.evaluated) and np.all(self.passed))
+
+    def summary(self):
+        """
+        Returns a dict summarizing the evaluation.
+        """
+        evaluated = int(np.count_nonzero(self.evaluated))
+        failed = int(np.count_nonzero(self.failed))
+        error = np.abs(self.measured - self.target)[self.evaluated]
+        s = {'name': self.name, 'rows': len(self.measured), 'evaluated': evaluated, 'failed': failed,
+             'pass_pct': 100.*(evaluated - failed)/evaluated if evaluated else 0.,
+             'max_error': float(np.max(error)) if len(error) else 0.,
+             'mean_error': float(np.mean(error)) if len(error) else 0.,
+             'first_fail_time': None, 'result': self.result()}
+        if failed and self.time is not None:
+            s['first_fail_time'] = float(self.time[np.argmax(self.failed)])
+        return s
+
+    def to_csv(self, filename):
+        """
+        Writes the row by row evaluation to filename.
+        """
+        cols = [self.measured, self.target, self.upper, self.lower, self.evaluated, self.passed]
+        header = '%s,%s_TARGET,%s_UPPER,%s_LOWER,EVALUATED,PASS' % ((self.name,) * 4)
+        if self.time is not None:
+            cols.insert(0, self.time)
+            header = '%s,%s' % (TIME, header)
+        np.savetxt(filename, np.column_stack(cols), delimiter=',', header=header, comments='', fmt='%.6g')
+
+    def __str__(self):
+        s = self.summary()
+        text = ('%s: %s, %d of %d rows evaluated, %d outside limits (%0.1f%% pass), max error %0.3f' %
+                (s['name'], 'Pass' if s['result'] else 'Fail', s['evaluated'], s['rows'], s['failed'],
+                 s['pass_pct'], s['max_error']))
+        if s['first_fail_time'] is not None:
+            text += ', first failure at %0.3f s' % s['first_fail_time']
+        return text
+
+
+def band(dataset, y, target, tolerance=None, upper=None, lower=None, evaluated=None, time=TIME):
+    """
+    Evaluates channel y against a target (scalar or per-row array) with a symmetric tolerance or explicit
+    upper/lower limits.
+    """
+    data = columns(dataset)
+    measured = column(data, y)
+    target = np.zeros(measured.shape) + np.asarray(target, dtype=float)
+    if upper is None:
+        if tolerance is None:
+            raise EvaluateError('No tolerance or upper limit for %s' % y)
+        upper = target + tolerance
+    if lower is None:
+        if tolerance is None:
+            raise EvaluateError('No tolerance or lower limit for %s' % y)
+        lower = target - tolerance
+    t = data.get(time)
+    return Result(y, measured, target, np.broadcast_to(upper, measured.shape),
+                  np.broadcast_to(lower, measured.shape), evaluated=evaluated, time=t)
+
+
+def curve_band(dataset, x, y, curve, y_tolerance=0., x_tolerance=0., settling_time=None, step=None, time=TIME):
+    """
+    Evaluates channel y against curve(x). The limits are the curve envelope over x +/- x_tolerance widened by
+    y_tolerance. If settling_time is given, rows within settling_time of a step change in x greater than step are
+    not evaluated.
+    """
+    data = columns(dataset)
+    xv = column(data, x)
+    target = curve(xv)
+    if x_tolerance:
+        lo = curve(xv - x_tolerance)
+        hi = curve(xv + x_tolerance)
+        upper = np.maximum(np.maximum(lo, hi), target)
+        lower = np.minimum(np.minimum(lo, hi), target)
+        # the curve is linear between its points, so the envelope extremes are at the window ends or at the curve
+        # points inside the window
+        for cx, cy in zip(curve.x, curve.y):
+            inside = (xv - x_tolerance <= cx) & (cx <= xv + x_tolerance)
+            upper = np.where(inside, np.maximum(upper, cy), upper)
+            lower = np.where(inside, np.minimum(lower, cy), lower)
+        upper = upper + y_tolerance
+        lower = lower - y_tolerance
+    else:
+        upper = target + y_tolerance
+        lower = target - y_tolerance
+    evaluated = None
+    t = data.get(time)
+    if settling_time and t is not None:
+        if step is None:
+            step = 0.
+        evaluated = settled(t, xv, settling_time, step)
+    return Result(y, column(data, y), target, upper, lower, evaluated=evaluated, time=t)
+
+
+def power_factor_band(dataset, pf, target, tolerance, settling_time=None, time=TIME):
+    """
+    Evaluates a power factor channel against a fixed target power factor. Power factors are compared as
+    pf_offset() values so that the tolerance band may cross unity. If settling_time is given, rows within
+    settling_time of the start of the capture are not evaluated.
+    """
+    data = columns(dataset)
+    measured = pf_offset(column(data, pf))
+    target = float(pf_offset(target))
+    evaluated = None
+    t = data.get(time)
+    if settling_time and t is not None and len(t):
+        evaluated = (t - t[0]) >= settling_time
+    return Result(pf, measured, np.broadcast_to(target, measured.shape),
+                  np.broadcast_to(target + tolerance, measured.shape),
+                  np.broadcast_to(target - tolerance, measured.shape), evaluated=evaluated, time=t)
+
+
+if __name__ == "__main__":
+
+    import sys
+    import curve
+
+    # re-run a volt-var evaluation from a saved capture:
+    #   python evaluate.py capture.csv V1,V2,V3,V4 Q1,Q2,Q3,Q4 var_tolerance [settling_time]
+    if len(sys.argv) < 5:
+        print 'usage: evaluate.py <capture.csv> <v points> <q points> <var tolerance> [settling time]'
+        sys.exit(1)
+    vv = curve.Curve([float(v) for v in sys.argv[2].split(',')], [float(q) for q in sys.argv[3].split(',')])
+    settling = float(sys.argv[5]) if len(sys.argv) > 5 else None
+    print curve_band(sys.argv[1], x='AC_V_1', y='AC_Q_1', curve=vv, y_tolerance=float(sys.argv[4]),
+                     settling_time=settling)
@@ -61,6 +61,134 @@ profiles = {
     'VRT Test Profile': vrt_50v_2s
 }
 
-if __name__ == "__main__":
+TRANSIENT_STEP = 'Transient_Step'
+
+# compiled programs by (profile, v_nom, f_nom, v_max)
+_programs = {}
+
 
+class ProfileError(Exception):
     pass
+
+
+class Program(object):
+    """
+    Profile compiled for a grid simulator list, one entry per segment of positive duration. Zero duration
+    segments are steps, the following segment starts at the new value.
+
+        dwell - segment durations (s)
+        volt, freq - voltage (V) and frequency (Hz) at the end of each segment
+        volt_slew, freq_slew - slew rates (V/s, Hz/s) to reach them, None for an immediate change
+    """
+
+    def __init__(self, key, dwell, volt, volt_slew, freq, freq_slew):
+        self.key = key
+        self.dwell = tuple(dwell)
+        self.volt = tuple(volt)
+        self.volt_slew = tuple(volt_slew)
+        self.freq = tuple(freq)
+        self.freq_slew = tuple(freq_slew)
+        self._formatted = {}
+
+    def __len__(self):
+        return len(self.dwell)
+
+    def __eq__(self, other):
+        return isinstance(other, Program) and self.lists() == other.lists()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def duration(self):
+        return sum(self.dwell)
+
+    def lists(self, fmt='%0.3f', immediate='MAX'):
+        """
+        Returns the comma separated lists (dwell, volt, volt_slew, freq, freq_slew) formatted with fmt, slew
+        rates of immediate changes as immediate. The lists are formatted once per format.
+        """
+        key = (fmt, immediate)
+        lists = self._formatted.get(key)
+        if lists is None:
+            def fmt_list(values):
+                return ','.join([fmt % v if v is not None else immediate for v in values])
+            lists = (fmt_list(self.dwell), fmt_list(self.volt), fmt_list(self.volt_slew), fmt_list(self.freq),
+                     fmt_list(self.freq_slew))
+            self._formatted[key] = lists
+        return lists
+
+
+def transient_step(v_step=100, f_step=100, t_step=None):
+    """
+    Returns the profile of a step to v_step and f_step (% nominal) for t_step seconds and back to nominal.
+    """
+    if t_step is None:
+        raise ProfileError('Transient profile did not have a duration.')
+    return [(0, v_step, f_step), (t_step, v_step, f_step), (t_step, 100, 100)]
+
+
+def compile_profile(profile, v_nom, f_nom, v_max=None, key=None):
+    """
+    Compiles a profile [(time offset (s), % nominal voltage, % nominal frequency), ...] into a Program.
+    """
+    if len(profile) < 2:
+        raise ProfileError('Profile must have at least two entries')
+    v_nom = float(v_nom)
+    f_nom = float(f_nom)
+    dwell = []
+    volt = []
+    volt_slew = []
+    freq = []
+    freq_slew = []
+    for i in range(1, len(profile)):
+        t0, v0, f0 = [float(x) for x in profile[i - 1][:3]]
+        t1, v1, f1 = [float(x) for x in profile[i][:3]]
+        t_delta = t1 - t0
+        if t_delta < 0:
+            raise ProfileError('Profile time goes backwards at entry %d: %s' % (i, profile[i]))
+        if min(v1, f1) < 0:
+            raise ProfileError('Negative voltage or frequency at entry %d: %s' % (i, profile[i]))
+        if t_delta == 0:
+            continue
+        dwell.append(t_delta)
+        volt.append(v1/100.*v_nom)
+        volt_slew.append((abs(v1 - v0)/t_delta)/100.*v_nom if v1 != v0 else None)
+        freq.append(f1/100.*f_nom)
+        freq_slew.append((abs(f1 - f0)/t_delta)/100.*f_nom if f1 != f0 else None)
+    if not dwell:
+        raise ProfileError('Profile has no segment with a duration')
+    if v_max is not None and max(volt) > float(v_max):
+        raise ProfileError('Profile voltage %0.1f V exceeds the maximum voltage %0.1f V' % (max(volt), v_max))
+    return Program(key, dwell, volt, volt_slew, freq, freq_slew)
+
+
+def program(profile_name, v_nom, f_nom, v_step=100, f_step=100, t_step=None, v_max=None):
+    """
+    Returns the cached Program of a profile in profiles or of a transient step (profile_name 'Transient_Step').
+    """
+    if profile_name == TRANSIENT_STEP:
+        name = (TRANSIENT_STEP, v_step, f_step, t_step)
+    else:
+        name = profile_name
+    key = (name, v_nom, f_nom, v_max)
+    p = _programs.get(key)
+    if p is None:
+        if profile_name == TRANSIENT_STEP:
+            profile = transient_step(v_step, f_step, t_step)
+        else:
+            profile = profiles.get(profile_name)
+            if profile is None:
+                raise ProfileError('Profile Not Found: %s' % profile_name)
+        p = compile_profile(profile, v_nom, f_nom, v_max=v_max, key=key)
+        _programs[key] = p
+    return p
+
+
+if __name__ == "__main__":
+
+    for name in sorted(profiles):
+        p = program(name, 240., 60.)
+        print '%s: %d segments, %0.1f s' % (name, len(p), p.duration())
+    p = program(TRANSIENT_STEP, 240., 60., v_step=50, t_step=2)
+    print 'Transient_Step:', p.lists()
+    print 'cached:', p is program(TRANSIENT_STEP, 240., 60., v_step=50, t_step=2)
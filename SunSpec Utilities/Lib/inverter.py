@@ -8,6 +8,7 @@
 
 
 import time
+import tasks
 
 # connection state control enumeration as specified in SunSpec model 123
 CONN_DISCONNECT = 0
@@ -72,6 +73,7 @@ def get_active_control_status(inv, control):
 # writes the INV1 parameters and executes the command with an optional trigger
 def set_conn_state(inv, state, time_window=0, timeout_period=0, trigger=None):
     try:
+        invalidate(inv, 'controls')
         inv.controls.read()
         inv.controls.Conn_WinTms = time_window
         inv.controls.Conn_RvrtTms = timeout_period
@@ -116,8 +118,7 @@ def get_time(das=None):
 def get_power_norm(inv, das=None):
     try:
         power = get_power(inv, das=das)
-        inv.nameplate.read()
-        return float(power) / float(inv.nameplate.WRtg)
+        return float(power) / float(read_model(inv, 'nameplate').WRtg)
     except Exception, e:
         raise InverterError('Unable to get power from das or EUT: %s' % str(e))
 
@@ -141,8 +142,7 @@ def get_current(inv, das=None):
 def get_current_norm(inv, das=None):
     try:
         current = get_current(inv, das=das)
-        inv.nameplate.read()
-        return float(current) / float(inv.nameplate.ARtg)
+        return float(current) / float(read_model(inv, 'nameplate').ARtg)
     except Exception, e:
         raise InverterError('Unable to get current from das or EUT: %s' % str(e))
 
@@ -164,8 +164,7 @@ def get_ac_voltage(inv, das=None):
 def get_ac_voltage_norm(inv, das=None):
     try:
         voltage = get_ac_voltage(inv, das=das)
-        inv.settings.read()
-        Vgrid_nom = float(inv.settings.VRef)
+        Vgrid_nom = float(read_model(inv, 'settings').VRef)
         return voltage/Vgrid_nom
     except Exception, e:
         raise script.ScriptFail('Unable to normalize ac voltage with inv.settings.VRef, %s' % str(e))
@@ -194,8 +193,7 @@ def get_freq(inv, das=None):
 def get_freq_norm(inv, das=None):
     try:
         freq = get_freq(inv, das=das)
-        inv.settings.read()
-        return freq / float(inv.settings.ECPNomHz)  # need to verify
+        return freq / float(read_model(inv, 'settings').ECPNomHz)  # need to verify
     except Exception, e:
         raise InverterError('Unable to get power from das or EUT: %s' % str(e))
 
@@ -216,6 +214,153 @@ def get_power_factor(inv, das=None):
     except Exception, e:
         raise InverterError('Unable to get power factor from das or EUT: %s' % str(e))
 
+# Model cache policies for read_model()
+CACHE_OFF = None            # read the model from the EUT every time
+CACHE_FOREVER = 'forever'   # read once, keep until invalidate() is called
+CACHE_ON_WRITE = 'write'    # read once, keep until one of the inverter.set_* functions writes the model
+# a number is a time-to-live in seconds
+
+# default cache policy for each SunSpec model, models that are not listed are not cached
+# (scripts that write a model directly instead of through inverter.set_* should call invalidate() afterwards)
+MODEL_CACHE_POLICY = {
+    'nameplate': CACHE_FOREVER,
+    'settings': CACHE_FOREVER,
+    'controls': CACHE_ON_WRITE,
+    'volt_var': CACHE_ON_WRITE,
+    'freq_watt_param': CACHE_ON_WRITE,
+    'freq_watt_crv': CACHE_ON_WRITE,
+    'hvrtd': CACHE_ON_WRITE,
+    'lvrtd': CACHE_ON_WRITE,
+    'hvrtc': CACHE_ON_WRITE,
+    'lvrtc': CACHE_ON_WRITE,
+    'hfrtd': CACHE_ON_WRITE,
+    'lfrtd': CACHE_ON_WRITE,
+    'hfrtc': CACHE_ON_WRITE,
+    'lfrtc': CACHE_ON_WRITE,
+}
+
+def _model_cache(inv):
+    # time of the last read of each cached model, kept with the device
+    return inv.__dict__.setdefault('_model_cache', {})
+
+# sets the cache policy of a model for one device (overrides MODEL_CACHE_POLICY)
+def set_cache_policy(inv, model_name, policy):
+    inv.__dict__.setdefault('_model_cache_policy', {})[model_name] = policy
+    invalidate(inv, model_name)
+
+def get_cache_policy(inv, model_name):
+    policies = inv.__dict__.get('_model_cache_policy', {})
+    if model_name in policies:
+        return policies[model_name]
+    return MODEL_CACHE_POLICY.get(model_name, CACHE_OFF)
+
+# returns: the SunSpec model, read from the EUT unless the cached values are still valid under the model's policy
+def read_model(inv, model_name):
+    try:
+        model = getattr(inv, model_name)
+        policy = get_cache_policy(inv, model_name)
+        cache = _model_cache(inv)
+        read_time = cache.get(model_name)
+        now = time.time()
+        if policy is CACHE_OFF or read_time is None or \
+                (policy not in (CACHE_FOREVER, CACHE_ON_WRITE) and now - read_time > float(policy)):
+            model.read()
+            cache[model_name] = now
+        return model
+    except Exception, e:
+        raise InverterError('Unable to read %s model: %s' % (model_name, str(e)))
+
+# forget cached models so they are read again on next use (all models if model_name is None)
+def invalidate(inv, model_name=None):
+    cache = _model_cache(inv)
+    if model_name is None:
+        cache.clear()
+    else:
+        cache.pop(model_name, None)
+
+# starts an inverter helper, func(inv, *args, **kwargs), on the device's worker thread and returns a tasks.Future;
+# helpers submitted for the same device run in order, while other instruments carry on concurrently
+def submit(inv, func, *args, **kwargs):
+    return tasks.submit(inv, func, inv, *args, **kwargs)
+
+class Snapshot(object):
+    """
+    Measurements of the EUT taken from a single read of the das or the SunSpec inverter model.
+
+    Attributes that cannot be determined (e.g., a point missing from the das) are None.
+    """
+
+    def __getitem__(self, k):
+        return self.__dict__[k]
+
+    def __init__(self):
+        self.time = None
+        self.power = None
+        self.power_norm = None
+        self.var = None
+        self.pf = None
+        self.current = None
+        self.current_norm = None
+        self.voltage = None
+        self.voltage_norm = None
+        self.voltage_pct = None
+        self.freq = None
+        self.freq_norm = None
+
+    def __str__(self):
+        return ', '.join(['%s = %s' % (k, v) for k, v in sorted(self.__dict__.iteritems())])
+
+def _float(value):
+    if value is None:
+        return None
+    return float(value)
+
+# returns: Snapshot with power, vars, power factor, current, voltage and frequency (and their normalized values)
+#          taken from one das read, or one inverter model read when there is no das
+def snapshot(inv, das=None):
+    snap = Snapshot()
+    try:
+        if das:
+            das.read()
+            snap.time = getattr(das, 'time', None)
+            snap.power = _float(getattr(das, 'ac_watts', None))
+            snap.var = _float(getattr(das, 'ac_vars', None))
+            snap.pf = _float(getattr(das, 'ac_pf', None))
+            snap.current = _float(getattr(das, 'ac_current', None))
+            snap.voltage = _float(getattr(das, 'ac_voltage', None))
+            snap.freq = _float(getattr(das, 'ac_freq', None))
+        else:
+            inv.inverter.read()
+            snap.time = time.time()
+            snap.power = _float(inv.inverter.W)
+            snap.var = _float(inv.inverter.VAr)
+            pf = inv.inverter.PF
+            if pf is not None and pf > 1.0:
+                pf = pf/100.0
+            snap.pf = _float(pf)
+            snap.current = _float(inv.inverter.A)
+            snap.voltage = _float(inv.inverter.PhVphA)
+            snap.freq = _float(inv.inverter.Hz)
+    except Exception, e:
+        raise InverterError('Unable to get snapshot from das or EUT: %s' % str(e))
+
+    # normalized values are only available if the EUT has the nameplate and settings models
+    if hasattr(inv, 'nameplate'):
+        nameplate = read_model(inv, 'nameplate')
+        if snap.power is not None and nameplate.WRtg:
+            snap.power_norm = snap.power/float(nameplate.WRtg)
+        if snap.current is not None and nameplate.ARtg:
+            snap.current_norm = snap.current/float(nameplate.ARtg)
+    if hasattr(inv, 'settings'):
+        settings = read_model(inv, 'settings')
+        if snap.voltage is not None and settings.VRef:
+            snap.voltage_norm = snap.voltage/float(settings.VRef)
+            snap.voltage_pct = snap.voltage_norm*100.0
+        if snap.freq is not None and settings.ECPNomHz:
+            snap.freq_norm = snap.freq/float(settings.ECPNomHz)
+
+    return snap
+
 # returns: True if state == current connection state, False if not
 def in_conn_state(inv, state):
     try:
@@ -255,6 +400,7 @@ def verify_conn_state(inv, state, threshold=50, das=None):
 
 def set_power_limit(inv, time_window=0, timeout_period=0, ramp_time=0, power_limit_pct=100, enable=0, trigger=None):
     try:
+        invalidate(inv, 'controls')
         inv.controls.read()
         inv.controls.WMaxLimPct_WinTms = time_window
         inv.controls.WMaxLimPct_RvrtTms = timeout_period
@@ -271,6 +417,7 @@ def set_power_limit(inv, time_window=0, timeout_period=0, ramp_time=0, power_lim
 
 def set_power_factor(inv, time_window=0, timeout_period=0, ramp_time=0, power_factor=1, enable=0, trigger=None):
     try:
+        invalidate(inv, 'controls')
         inv.controls.read()
         inv.controls.OutPFSet_WinTms = time_window
         inv.controls.OutPFSet_RvrtTms = timeout_period
@@ -292,6 +439,7 @@ def set_vrt_trip_high(inv, h_time=None, h_volt=None, h_n_points=0, h_curve_num=0
     # SunSpec defines the HVRT/LVRT settings in different sunspec models
     try:
         if h_curve_num > 0:
+            invalidate(inv, 'hvrtd')
             inv.hvrtd.read()
             inv.hvrtd.RmpTms = ramp_time
             inv.hvrtd.RvrtTms = timeout_period
@@ -326,6 +474,7 @@ def set_vrt_trip_low(inv, l_time=None, l_volt=None, l_n_points=0, l_curve_num=0,
                      enable=0, trigger=None):
     try:
         if l_curve_num > 0:
+            invalidate(inv, 'lvrtd')
             inv.lvrtd.read()
             inv.lvrtd.RmpTms = ramp_time
             inv.lvrtd.RvrtTms = timeout_period
@@ -362,6 +511,7 @@ def set_vrt_stay_connected_high(inv, h_time=None, h_volt=None, h_n_points=0, h_c
     # SunSpec defines the HVRT/LVRT must remain connected settings in different sunspec models
     try:
         if h_curve_num > 0:
+            invalidate(inv, 'hvrtc')
             inv.hvrtc.read()
             inv.hvrtc.RmpTms = ramp_time
             inv.hvrtc.RvrtTms = timeout_period
@@ -397,6 +547,7 @@ def set_vrt_stay_connected_low(inv, l_time=None, l_volt=None, l_n_points=0, l_cu
 
     try:
         if l_curve_num > 0:
+            invalidate(inv, 'lvrtc')
             inv.lvrtc.read()
             inv.lvrtc.RmpTms = ramp_time
             inv.lvrtc.RvrtTms = timeout_period
@@ -432,6 +583,7 @@ def set_frt_trip_high(inv, h_time=None, h_freq=None, h_n_points=0, h_curve_num=0
     # SunSpec defines the HFRT/LFRT settings in different sunspec models
     try:
         if h_curve_num > 0:
+            invalidate(inv, 'hfrtd')
             inv.hfrtd.read()
             inv.hfrtd.RmpTms = ramp_time
             inv.hfrtd.RvrtTms = timeout_period
@@ -466,6 +618,7 @@ def set_frt_trip_low(inv, l_time=None, l_freq=None, l_n_points=0, l_curve_num=0,
                      enable=0, trigger=None):
     try:
         if l_curve_num > 0:
+            invalidate(inv, 'lfrtd')
             inv.lfrtd.read()
             inv.lfrtd.RmpTms = ramp_time
             inv.lfrtd.RvrtTms = timeout_period
@@ -502,6 +655,7 @@ def set_frt_stay_connected_high(inv, h_time=None, h_freq=None, h_n_points=0, h_c
     # SunSpec defines the HFRT/LFRT must remain connected settings in different sunspec models
     try:
         if h_curve_num > 0:
+            invalidate(inv, 'hfrtc')
             inv.hfrtc.read()
             inv.hfrtc.RmpTms = ramp_time
             inv.hfrtc.RvrtTms = timeout_period
@@ -537,6 +691,7 @@ def set_frt_stay_connected_low(inv, l_time=None, l_freq=None, l_n_points=0, l_cu
 
     try:
         if l_curve_num > 0:
+            invalidate(inv, 'lfrtc')
             inv.lfrtc.read()
             inv.lfrtc.RmpTms = ramp_time
             inv.lfrtc.RvrtTms = timeout_period
@@ -570,6 +725,7 @@ def set_volt_var(inv, volt=None, var=None, n_points=0, time_window=0, timeout_pe
                  deptRef=2, enable=0, trigger=None):
     try:
         if curve_num > 0:
+            invalidate(inv, 'volt_var')
             inv.volt_var.read()
             #inv.volt_var.curve[curve_num].RmpTms = ramp_time
             #inv.volt_var.curve[curve_num].RmpIncTmm = ramp_rate
@@ -607,6 +763,7 @@ def set_freq_watt(inv, fw_mode='FW21 (FW parameters)', freq=None, W=None, n_poin
 
     if fw_mode == 'FW21 (FW parameters)':
         try:
+            invalidate(inv, 'freq_watt_param')
             inv.freq_watt_param.read()
             inv.freq_watt_param.WGra = WGra
             inv.freq_watt_param.HzStr = HzStr
@@ -633,6 +790,7 @@ def set_freq_watt(inv, fw_mode='FW21 (FW parameters)', freq=None, W=None, n_poin
     else:  #FW22
         try:
             if curve_num > 0:
+                invalidate(inv, 'freq_watt_crv')
                 inv.freq_watt_crv.read()
                 inv.freq_watt_crv.curve[curve_num].RmpTms = ramp_time
                 #inv.freq_watt_crv.curve[curve_num].RmpIncTmm = ramp_rate
@@ -0,0 +1,316 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Lazy registry for the das_*, gridsim_* and pvsim_* extension modules.
+
+The extension modules are not imported when das, gridsim or pvsim is imported. The mode of each module is read
+from its source (the 'mode' entry of the module level dict returned by its <prefix>_info() function) and a
+module is imported only when it is selected by <prefix>_init(ts) or when its params() are needed. The calls a
+module's params(info) makes are recorded in a manifest file in the Lib directory and replayed on later runs, so
+building the script parameters does not import the modules either. The manifest is rebuilt whenever any .py file
+in the directory changes.
+
+Run stand-alone for a report of where startup time goes:
+
+    python plugins.py
+"""
+
+import os
+import sys
+import ast
+import glob
+import json
+import time
+import importlib
+
+MANIFEST_FILE = '.plugin_manifest.json'
+
+
+def signature(path):
+    """
+    Returns a dict of name: [mtime, size] for the python files in path.
+    """
+    sig = {}
+    for f in glob.glob(os.path.join(path, '*.py')):
+        try:
+            st = os.stat(f)
+            sig[os.path.basename(f)] = [int(st.st_mtime), st.st_size]
+        except OSError:
+            pass
+    return sig
+
+
+def source_mode(filename, info_func):
+    """
+    Returns the mode of an extension module from its source without importing it, or None if the mode can not be
+    determined statically. Recognizes the form used by the extension modules:
+
+        xxx_info = {'name': ..., 'mode': 'Mode'}
+
+        def <info_func>():
+            return xxx_info
+    """
+    try:
+        f = open(filename, 'r')
+        try:
+            tree = ast.parse(f.read(), filename)
+        finally:
+            f.close()
+    except Exception:
+        return None
+
+    dicts = {}
+    info_name = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict):
+            for key, value in zip(node.value.keys, node.value.values):
+                if isinstance(key, ast.Str) and key.s == 'mode' and isinstance(value, ast.Str):
+                    for target in node.targets:
+                        if isinstance(target, ast.Name):
+                            dicts[target.id] = value.s
+        elif isinstance(node, ast.FunctionDef) and node.name == info_func:
+            for stmt in node.body:
+                if isinstance(stmt, ast.Return) and isinstance(stmt.value, ast.Name):
+                    info_name = stmt.value.id
+    if info_name is None:
+        return None
+    return dicts.get(info_name)
+
+
+class ParamRecorder(object):
+    """
+    Proxy for the script info object that records the calls made on it.
+    """
+
+    def __init__(self, info):
+        self._info = info
+        self._calls = []
+        self._cacheable = True
+
+    def __getattr__(self, name):
+        attr = getattr(self._info, name)
+        if not callable(attr):
+            # parameters depend on the info state, can't be replayed
+            self._cacheable = False
+            return attr
+
+        def record(*args, **kwargs):
+            self._calls.append([name, list(args), kwargs])
+            return attr(*args, **kwargs)
+        return record
+
+    def calls(self):
+        """
+        Returns the recorded calls if they can be stored in the manifest, otherwise None.
+        """
+        if not self._cacheable:
+            return None
+        try:
+            # round trip to be sure the calls replay exactly as recorded
+            calls = json.loads(json.dumps(self._calls))
+        except (TypeError, ValueError):
+            return None
+        if calls != self._calls:
+            return None
+        return calls
+
+
+class Registry(object):
+    """
+    Registry of the extension modules <prefix>_*.py in a directory.
+
+    prefix - module prefix ('das', 'gridsim', 'pvsim').
+    path - directory containing the modules.
+    error - exception class raised for module errors.
+    """
+
+    def __init__(self, prefix, path, error=Exception):
+        self.prefix = prefix
+        self.path = path
+        self.error = error
+        self.info_func = '%s_info' % prefix
+        self.modes = {}  # mode: module name
+        self.order = []  # modes in scan order
+        self.loaded = {}  # mode: module
+        self.import_times = {}  # module name: import time (s)
+        self.scan_time = 0.
+        self.manifest = None
+        self.manifest_changed = False
+
+    def _manifest_file(self):
+        return os.path.join(self.path, MANIFEST_FILE)
+
+    def _load_manifest(self, sig):
+        manifest = None
+        try:
+            f = open(self._manifest_file(), 'r')
+            try:
+                manifest = json.load(f)
+            finally:
+                f.close()
+        except Exception:
+            pass
+        if not isinstance(manifest, dict) or manifest.get('signature') != sig:
+            manifest = {'signature': sig}
+        return manifest
+
+    def _save_manifest(self):
+        if not self.manifest_changed:
+            return
+        # merge with entries saved by the other registries since this one was loaded
+        current = self._load_manifest(self.manifest['signature'])
+        current[self.prefix] = self.manifest.get(self.prefix, {})
+        tmp = '%s.%d.tmp' % (self._manifest_file(), os.getpid())
+        try:
+            f = open(tmp, 'w')
+            try:
+                json.dump(current, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+            if os.path.exists(self._manifest_file()) and sys.platform == 'win32':
+                os.remove(self._manifest_file())
+            os.rename(tmp, self._manifest_file())
+            self.manifest_changed = False
+        except Exception:
+            # the manifest is only a cache, a read only Lib directory just means no caching
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def scan(self):
+        """
+        Discover the modes of the extension modules without importing them.
+        """
+        start = time.time()
+        self.modes = {}
+        self.order = []
+        sig = signature(self.path)
+        self.manifest = self._load_manifest(sig)
+        entries = self.manifest.setdefault(self.prefix, {})
+        files = sorted(glob.glob(os.path.join(self.path, '%s_*.py' % self.prefix)))
+        for f in files:
+            module_name = os.path.splitext(os.path.basename(f))[0]
+            entry = entries.get(module_name)
+            if entry is None:
+                entry = {'mode': source_mode(f, self.info_func), 'params': {}}
+                if entry['mode'] is None:
+                    # mode can't be read from the source, import the module to find it
+                    m = self._import(module_name)
+                    if m is None:
+                        continue
+                    entry['mode'] = m.__dict__[self.info_func]().get('mode')
+                entries[module_name] = entry
+                self.manifest_changed = True
+            mode = entry.get('mode')
+            if mode is not None:
+                self.modes[mode] = module_name
+                self.order.append(mode)
+        self._save_manifest()
+        self.scan_time = time.time() - start
+
+    def _import(self, module_name):
+        """
+        Import an extension module. Returns None if the module is not an extension module.
+        """
+        start = time.time()
+        try:
+            m = importlib.import_module(module_name)
+        except Exception, e:
+            if module_name in sys.modules:
+                del sys.modules[module_name]
+            raise self.error('Error scanning module %s: %s' % (module_name, str(e)))
+        self.import_times[module_name] = time.time() - start
+        if not hasattr(m, self.info_func):
+            if module_name in sys.modules:
+                del sys.modules[module_name]
+            return None
+        return m
+
+    def get(self, mode, default=None):
+        """
+        Returns the extension module for mode, importing it if needed.
+        """
+        m = self.loaded.get(mode)
+        if m is None:
+            module_name = self.modes.get(mode)
+            if module_name is None:
+                return default
+            m = self._import(module_name)
+            if m is None:
+                return default
+            self.loaded[mode] = m
+        return m
+
+    def iteritems(self):
+        for mode in self.order:
+            yield mode, self.get(mode)
+
+    def __contains__(self, mode):
+        return mode in self.modes
+
+    def __len__(self):
+        return len(self.modes)
+
+    def params(self, info, **kwargs):
+        """
+        Add the parameters of all extension modules to info. Recorded parameters are replayed from the manifest,
+        modules without a recording are imported and their params() recorded.
+        """
+        key = json.dumps(kwargs, sort_keys=True)
+        entries = self.manifest.setdefault(self.prefix, {})
+        for mode in self.order:
+            module_name = self.modes[mode]
+            entry = entries.setdefault(module_name, {'mode': mode, 'params': {}})
+            calls = entry.setdefault('params', {}).get(key)
+            if calls is not None:
+                for name, args, kw in calls:
+                    getattr(info, name)(*args, **dict([(str(k), v) for k, v in kw.iteritems()]))
+            else:
+                recorder = ParamRecorder(info)
+                self.get(mode).params(recorder, **kwargs)
+                calls = recorder.calls()
+                if calls is not None:
+                    entry['params'][key] = calls
+                    self.manifest_changed = True
+        self._save_manifest()
+
+    def report(self):
+        """
+        Returns a text report of the scan and module import times.
+        """
+        lines = ['%s: %d modes found in %0.1f ms (%s)' %
+                 (self.prefix, len(self.modes), self.scan_time*1000., ', '.join(self.order))]
+        for module_name in sorted(self.import_times, key=self.import_times.get, reverse=True):
+            lines.append('    import %-24s %8.1f ms' % (module_name, self.import_times[module_name]*1000.))
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    class Info(object):
+        # stand-in for the script info object, counts the parameters added
+        def __init__(self):
+            self.count = 0
+
+        def __getattr__(self, name):
+            def call(*args, **kwargs):
+                self.count += 1
+            return call
+
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    for name in ['das', 'gridsim', 'pvsim']:
+        start = time.time()
+        m = importlib.import_module(name)
+        t_import = time.time() - start
+        registry = getattr(m, '%s_modules' % name)
+        start = time.time()
+        info = Info()
+        m.params(info)
+        t_params = time.time() - start
+        print 'import %-8s %8.1f ms, params() %8.1f ms (%d calls)' % (name, t_import*1000., t_params*1000.,
+                                                                     info.count)
+        print registry.report()
@@ -6,18 +6,16 @@
 """
 
 
-import sys
 import os
-import glob
-import importlib
+import plugins
+import tasks
 
 pvsim_modules = {}
 
 def params(info):
     info.param_group('pvsim', label='PV Simulator Parameters', glob=True)
     info.param('pvsim.mode', label='PV Simulation Mode', default='Manual', values=[])
-    for mode, m in pvsim_modules.iteritems():
-        m.params(info)
+    pvsim_modules.params(info)
 
 def pvsim_init(ts):
     """
@@ -47,6 +45,14 @@ class PVSim(object):
     def close(self):
         pass
 
+    def submit(self, func, *args, **kwargs):
+        """
+        Start an operation (method name or callable) on the PV simulator's worker thread and return a
+        tasks.Future for its result. Operations submitted to the same PV simulator run in order, operations on
+        different instruments run at the same time.
+        """
+        return tasks.submit(self, func, *args, **kwargs)
+
     def irradiance_set(self, irradiance=1000):
         pass
 
@@ -63,26 +69,10 @@ class PVSim(object):
 
 def pvsim_scan():
     global pvsim_modules
-    # scan all files in current directory that match gridsim_*.py
-    files = glob.glob(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pvsim_*.py'))
-    for f in files:
-        module_name = None
-        try:
-            module_name = os.path.splitext(os.path.basename(f))[0]
-            m = importlib.import_module(module_name)
-            if hasattr(m, 'pvsim_info'):
-                info = m.pvsim_info()
-                mode = info.get('mode')
-                # place module in module dict
-                if mode is not None:
-                    pvsim_modules[mode] = m
-            else:
-                if module_name is not None and module_name in sys.modules:
-                    del sys.modules[module_name]
-        except Exception, e:
-            if module_name is not None and module_name in sys.modules:
-                del sys.modules[module_name]
-            raise PVSimError('Error scanning module %s: %s' % (module_name, str(e)))
+    # find the modes of all files in the current directory that match pvsim_*.py, modules are imported when
+    # selected (see plugins.py)
+    pvsim_modules = plugins.Registry('pvsim', os.path.dirname(os.path.realpath(__file__)), error=PVSimError)
+    pvsim_modules.scan()
 
 # scan for gridsim modules on import
 pvsim_scan()
@@ -0,0 +1,1009 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Simulated EUT: a grid-tied PV inverter model served as a SunSpec Modbus TCP device.
+
+The EUT implements the functions exercised by the test scripts through the SunSpec models they write:
+
+    controls (123) - connect/disconnect, maximum power limit, fixed power factor, fixed var (with revert timers)
+    settings (121) - WMax, VRef, VAMax, VArMax and the power ramp rate WGra (%WMax/s)
+    volt_var (126) - volt-var curves (VAr in %VArMax, %WMax or %VArAval of %VRef)
+    freq_watt_param (127) - parameterized frequency-watt with optional hysteresis
+    freq_watt_crv (134) - frequency-watt curves (W in %available power of Hz)
+    lvrtd, hvrtd, lfrtd, hfrtd (129, 130, 135, 136) - must disconnect ride-through curves
+    lvrtc, hvrtc, lfrtc, hfrtc (137 - 140) - must remain connected ride-through curves
+
+It reports its state in common (1), inverter (101/103), nameplate (120) and status (122).
+
+The ride-through curves are the piecewise-linear time curves of curve.ride_through_curve: while the voltage
+(frequency) is beyond a must disconnect curve the EUT accumulates dt/d_time and trips when the sum reaches
+TRIP_FRACTION of the way from the must remain connected time to the must disconnect time. Without enabled curves
+the DEFAULT_* curves are used. After a trip the EUT reconnects once the grid has been normal for the reconnect
+delay.
+
+The model is advanced to the clock time whenever it is observed or its inputs change (update()), in steps of
+STEP seconds while anything is changing and in a single step to the next event otherwise.
+"""
+
+import math
+import struct
+import socket
+import threading
+import collections
+import SocketServer
+
+BASE_ADDR = 40000
+SUNS_ID = (0x5375, 0x6e53)
+END_ID = 0xffff
+
+STEP = 0.01             # integration step while the EUT state is changing (s)
+TAU_W = 0.05            # active power response time constant (s)
+TAU_VAR = 0.5           # reactive power response time constant without a curve ramp time (s)
+EFFICIENCY = 0.97
+TRIP_FRACTION = 0.5     # trip between the must remain connected (0) and must disconnect (1) times
+HISTORY_LEN = 200000    # samples of the EUT response kept for the DAS
+
+# (%nominal, trip time (s)) listed from the point furthest from nominal
+DEFAULT_LVRTD = [(50., 0.16), (88., 2.)]
+DEFAULT_HVRTD = [(120., 0.16), (110., 1.)]
+DEFAULT_LFRTD = [(95., 0.16), (98.3, 300.)]
+DEFAULT_HFRTD = [(103.3, 0.16), (100.8, 300.)]
+
+# normal operating window for connection (%nominal)
+CONNECT_V = (88., 110.)
+CONNECT_F = (98.3, 100.8)
+
+CONN_DISCONNECT = 0
+CONN_CONNECT = 1
+
+PVCONN_CONNECTED = (1 << 0)
+PVCONN_AVAILABLE = (1 << 1)
+PVCONN_OPERATING = (1 << 2)
+
+STACTCTL_FIXED_W = (1 << 0)
+STACTCTL_FIXED_VAR = (1 << 1)
+STACTCTL_FIXED_PF = (1 << 2)
+STACTCTL_VOLT_VAR = (1 << 3)
+STACTCTL_FREQ_WATT_PARAM = (1 << 4)
+STACTCTL_FREQ_WATT_CURVE = (1 << 5)
+STACTCTL_LVRT = (1 << 7)
+STACTCTL_HVRT = (1 << 8)
+STACTCTL_LFRT = (1 << 13)
+STACTCTL_HFRT = (1 << 14)
+
+# inverter operating states (St)
+ST_OFF = 1
+ST_SLEEPING = 2
+ST_MPPT = 4
+ST_THROTTLED = 5
+ST_FAULT = 7
+
+VOLTVAR_WMAX = 1
+VOLTVAR_VARMAX = 2
+VOLTVAR_VARAVAL = 3
+
+# register count of each point type, strings are 'string<n>'
+TYPE_SIZE = {
+    'uint16': 1, 'int16': 1, 'sunssf': 1, 'enum16': 1, 'bitfield16': 1, 'pad': 1,
+    'uint32': 2, 'int32': 2, 'acc32': 2, 'bitfield32': 2, 'acc64': 4
+}
+
+
+class EUTError(Exception):
+    pass
+
+
+def _type_size(ptype):
+    if ptype.startswith('string'):
+        return int(ptype[6:])
+    return TYPE_SIZE[ptype]
+
+
+def _curve_pairs(x_name, x_sf, y_name, y_sf, y_type='uint16', n=20):
+    points = []
+    for i in range(1, n + 1):
+        points.append(('%s%d' % (x_name, i), 'uint16', x_sf))
+        points.append(('%s%d' % (y_name, i), y_type, y_sf))
+    return points
+
+
+def _ride_through(x_name, x_sf):
+    # must disconnect and must remain connected curve models share a layout
+    fixed = [('ActCrv', 'uint16', None), ('ModEna', 'bitfield16', None), ('WinTms', 'uint16', None),
+             ('RvrtTms', 'uint16', None), ('RmpTms', 'uint16', None), ('NCrv', 'uint16', None),
+             ('NPt', 'uint16', None), ('Tms_SF', 'sunssf', None), (x_sf, 'sunssf', None), ('Pad', 'pad', None)]
+    curve = ([('ActPt', 'uint16', None)] + _curve_pairs('Tms', 'Tms_SF', x_name, x_sf) +
+             [('CrvNam', 'string8', None), ('ReadOnly', 'enum16', None)])
+    return fixed, curve
+
+
+_INVERTER = (
+    [('A', 'uint16', 'A_SF'), ('AphA', 'uint16', 'A_SF'), ('AphB', 'uint16', 'A_SF'), ('AphC', 'uint16', 'A_SF'),
+     ('A_SF', 'sunssf', None), ('PPVphAB', 'uint16', 'V_SF'), ('PPVphBC', 'uint16', 'V_SF'),
+     ('PPVphCA', 'uint16', 'V_SF'), ('PhVphA', 'uint16', 'V_SF'), ('PhVphB', 'uint16', 'V_SF'),
+     ('PhVphC', 'uint16', 'V_SF'), ('V_SF', 'sunssf', None), ('W', 'int16', 'W_SF'), ('W_SF', 'sunssf', None),
+     ('Hz', 'uint16', 'Hz_SF'), ('Hz_SF', 'sunssf', None), ('VA', 'int16', 'VA_SF'), ('VA_SF', 'sunssf', None),
+     ('VAr', 'int16', 'VAr_SF'), ('VAr_SF', 'sunssf', None), ('PF', 'int16', 'PF_SF'), ('PF_SF', 'sunssf', None),
+     ('WH', 'acc32', 'WH_SF'), ('WH_SF', 'sunssf', None), ('DCA', 'uint16', 'DCA_SF'), ('DCA_SF', 'sunssf', None),
+     ('DCV', 'uint16', 'DCV_SF'), ('DCV_SF', 'sunssf', None), ('DCW', 'int16', 'DCW_SF'),
+     ('DCW_SF', 'sunssf', None), ('TmpCab', 'int16', 'Tmp_SF'), ('TmpSnk', 'int16', 'Tmp_SF'),
+     ('TmpTrns', 'int16', 'Tmp_SF'), ('TmpOt', 'int16', 'Tmp_SF'), ('Tmp_SF', 'sunssf', None),
+     ('St', 'enum16', None), ('StVnd', 'enum16', None), ('Evt1', 'bitfield32', None), ('Evt2', 'bitfield32', None),
+     ('EvtVnd1', 'bitfield32', None), ('EvtVnd2', 'bitfield32', None), ('EvtVnd3', 'bitfield32', None),
+     ('EvtVnd4', 'bitfield32', None)], None)
+
+# model id: (name, fixed block points, repeating block points), points are (name, type, scale factor point)
+MODELS = {
+    1: ('common', [('Mn', 'string16', None), ('Md', 'string16', None), ('Opt', 'string8', None),
+                   ('Vr', 'string8', None), ('SN', 'string16', None), ('DA', 'uint16', None),
+                   ('Pad', 'pad', None)], None),
+    101: ('inverter',) + _INVERTER,
+    103: ('inverter',) + _INVERTER,
+    120: ('nameplate', [('DERTyp', 'enum16', None), ('WRtg', 'uint16', 'WRtg_SF'), ('WRtg_SF', 'sunssf', None),
+                        ('VARtg', 'uint16', 'VARtg_SF'), ('VARtg_SF', 'sunssf', None),
+                        ('VArRtgQ1', 'int16', 'VArRtg_SF'), ('VArRtgQ2', 'int16', 'VArRtg_SF'),
+                        ('VArRtgQ3', 'int16', 'VArRtg_SF'), ('VArRtgQ4', 'int16', 'VArRtg_SF'),
+                        ('VArRtg_SF', 'sunssf', None), ('ARtg', 'uint16', 'ARtg_SF'), ('ARtg_SF', 'sunssf', None),
+                        ('PFRtgQ1', 'int16', 'PFRtg_SF'), ('PFRtgQ2', 'int16', 'PFRtg_SF'),
+                        ('PFRtgQ3', 'int16', 'PFRtg_SF'), ('PFRtgQ4', 'int16', 'PFRtg_SF'),
+                        ('PFRtg_SF', 'sunssf', None), ('WHRtg', 'uint16', 'WHRtg_SF'), ('WHRtg_SF', 'sunssf', None),
+                        ('AhrRtg', 'uint16', 'AhrRtg_SF'), ('AhrRtg_SF', 'sunssf', None),
+                        ('MaxChaRte', 'uint16', 'MaxChaRte_SF'), ('MaxChaRte_SF', 'sunssf', None),
+                        ('MaxDisChaRte', 'uint16', 'MaxDisChaRte_SF'), ('MaxDisChaRte_SF', 'sunssf', None),
+                        ('Pad', 'pad', None)], None),
+    121: ('settings', [('WMax', 'uint16', 'WMax_SF'), ('VRef', 'uint16', 'VRef_SF'),
+                       ('VRefOfs', 'int16', 'VRefOfs_SF'), ('VMax', 'uint16', 'VMinMax_SF'),
+                       ('VMin', 'uint16', 'VMinMax_SF'), ('VAMax', 'uint16', 'VAMax_SF'),
+                       ('VArMaxQ1', 'int16', 'VArMax_SF'), ('VArMaxQ2', 'int16', 'VArMax_SF'),
+                       ('VArMaxQ3', 'int16', 'VArMax_SF'), ('VArMaxQ4', 'int16', 'VArMax_SF'),
+                       ('WGra', 'uint16', 'WGra_SF'), ('PFMinQ1', 'int16', 'PFMin_SF'),
+                       ('PFMinQ2', 'int16', 'PFMin_SF'), ('PFMinQ3', 'int16', 'PFMin_SF'),
+                       ('PFMinQ4', 'int16', 'PFMin_SF'), ('VArAct', 'enum16', None), ('ClcTotVA', 'enum16', None),
+                       ('MaxRmpRte', 'uint16', 'MaxRmpRte_SF'), ('ECPNomHz', 'uint16', 'ECPNomHz_SF'),
+                       ('ConnPh', 'enum16', None), ('WMax_SF', 'sunssf', None), ('VRef_SF', 'sunssf', None),
+                       ('VRefOfs_SF', 'sunssf', None), ('VMinMax_SF', 'sunssf', None), ('VAMax_SF', 'sunssf', None),
+                       ('VArMax_SF', 'sunssf', None), ('WGra_SF', 'sunssf', None), ('PFMin_SF', 'sunssf', None),
+                       ('MaxRmpRte_SF', 'sunssf', None), ('ECPNomHz_SF', 'sunssf', None)], None),
+    122: ('status', [('PVConn', 'bitfield16', None), ('StorConn', 'bitfield16', None),
+                     ('ECPConn', 'bitfield16', None), ('ActWh', 'acc64', None), ('ActVAh', 'acc64', None),
+                     ('ActVArhQ1', 'acc64', None), ('ActVArhQ2', 'acc64', None), ('ActVArhQ3', 'acc64', None),
+                     ('ActVArhQ4', 'acc64', None), ('VArAval', 'int16', 'VArAval_SF'),
+                     ('VArAval_SF', 'sunssf', None), ('WAval', 'uint16', 'WAval_SF'), ('WAval_SF', 'sunssf', None),
+                     ('StSetLimMsk', 'bitfield32', None), ('StActCtl', 'bitfield32', None),
+                     ('TmSrc', 'string4', None), ('Tms', 'uint32', None), ('RtSt', 'bitfield16', None),
+                     ('Ris', 'uint16', 'Ris_SF'), ('Ris_SF', 'sunssf', None)], None),
+    123: ('controls', [('Conn_WinTms', 'uint16', None), ('Conn_RvrtTms', 'uint16', None), ('Conn', 'enum16', None),
+                       ('WMaxLimPct', 'uint16', 'WMaxLimPct_SF'), ('WMaxLimPct_WinTms', 'uint16', None),
+                       ('WMaxLimPct_RvrtTms', 'uint16', None), ('WMaxLimPct_RmpTms', 'uint16', None),
+                       ('WMaxLim_Ena', 'enum16', None), ('OutPFSet', 'int16', 'OutPFSet_SF'),
+                       ('OutPFSet_WinTms', 'uint16', None), ('OutPFSet_RvrtTms', 'uint16', None),
+                       ('OutPFSet_RmpTms', 'uint16', None), ('OutPFSet_Ena', 'enum16', None),
+                       ('VArWMaxPct', 'int16', 'VArPct_SF'), ('VArMaxPct', 'int16', 'VArPct_SF'),
+                       ('VArAvalPct', 'int16', 'VArPct_SF'), ('VArPct_WinTms', 'uint16', None),
+                       ('VArPct_RvrtTms', 'uint16', None), ('VArPct_RmpTms', 'uint16', None),
+                       ('VArPct_Mod', 'enum16', None), ('VArPct_Ena', 'enum16', None),
+                       ('WMaxLimPct_SF', 'sunssf', None), ('OutPFSet_SF', 'sunssf', None),
+                       ('VArPct_SF', 'sunssf', None)], None),
+    126: ('volt_var', [('ActCrv', 'uint16', None), ('ModEna', 'bitfield16', None), ('WinTms', 'uint16', None),
+                       ('RvrtTms', 'uint16', None), ('RmpTms', 'uint16', None), ('NCrv', 'uint16', None),
+                       ('NPt', 'uint16', None), ('V_SF', 'sunssf', None), ('DeptRef_SF', 'sunssf', None),
+                       ('RmpIncDec_SF', 'sunssf', None)],
+          [('ActPt', 'uint16', None), ('DeptRef', 'enum16', None)] +
+          _curve_pairs('V', 'V_SF', 'VAr', 'DeptRef_SF', y_type='int16') +
+          [('CrvNam', 'string8', None), ('RmpTms', 'uint16', None), ('RmpDecTmm', 'uint16', 'RmpIncDec_SF'),
+           ('RmpIncTmm', 'uint16', 'RmpIncDec_SF'), ('ReadOnly', 'enum16', None)]),
+    127: ('freq_watt_param', [('WGra', 'uint16', 'WGra_SF'), ('HzStr', 'int16', 'HzStrStop_SF'),
+                              ('HzStop', 'int16', 'HzStrStop_SF'), ('HysEna', 'bitfield16', None),
+                              ('ModEna', 'bitfield16', None), ('HzStopWGra', 'uint16', 'RmpIncDec_SF'),
+                              ('WGra_SF', 'sunssf', None), ('HzStrStop_SF', 'sunssf', None),
+                              ('RmpIncDec_SF', 'sunssf', None), ('Pad', 'pad', None)], None),
+    134: ('freq_watt_crv', [('ActCrv', 'uint16', None), ('ModEna', 'bitfield16', None), ('WinTms', 'uint16', None),
+                            ('RvrtTms', 'uint16', None), ('RmpTms', 'uint16', None), ('NCrv', 'uint16', None),
+                            ('NPt', 'uint16', None), ('Hz_SF', 'sunssf', None), ('W_SF', 'sunssf', None),
+                            ('RmpIncDec_SF', 'sunssf', None)],
+          [('ActPt', 'uint16', None)] + _curve_pairs('Hz', 'Hz_SF', 'W', 'W_SF', y_type='int16') +
+          [('CrvNam', 'string8', None), ('RmpPT1Tms', 'uint16', None), ('RmpDecTmm', 'uint16', 'RmpIncDec_SF'),
+           ('RmpIncTmm', 'uint16', 'RmpIncDec_SF'), ('RmpRsUp', 'uint16', 'RmpIncDec_SF'),
+           ('SnptW', 'bitfield16', None), ('WRef', 'uint16', 'W_SF'), ('WRefStrHz', 'uint16', 'Hz_SF'),
+           ('WRefStopHz', 'uint16', 'Hz_SF'), ('ReadOnly', 'enum16', None)]),
+    129: ('lvrtd',) + _ride_through('V', 'V_SF'),
+    130: ('hvrtd',) + _ride_through('V', 'V_SF'),
+    135: ('lfrtd',) + _ride_through('F', 'Hz_SF'),
+    136: ('hfrtd',) + _ride_through('F', 'Hz_SF'),
+    137: ('lvrtc',) + _ride_through('V', 'V_SF'),
+    138: ('hvrtc',) + _ride_through('V', 'V_SF'),
+    139: ('lfrtc',) + _ride_through('F', 'Hz_SF'),
+    140: ('hfrtc',) + _ride_through('F', 'Hz_SF'),
+}
+
+# models of the simulated EUT in map order, the repeating models with their number of curves
+EUT_MODELS = [(1, 0), (120, 0), (121, 0), (122, 0), (123, 0), (126, 4), (127, 0), (134, 4),
+              (129, 1), (130, 1), (135, 1), (136, 1), (137, 1), (138, 1), (139, 1), (140, 1)]
+
+RIDE_THROUGH = {
+    # function: (must disconnect model, must remain connected model, high, default curve, status bit)
+    'lvrt': ('lvrtd', 'lvrtc', False, DEFAULT_LVRTD, STACTCTL_LVRT),
+    'hvrt': ('hvrtd', 'hvrtc', True, DEFAULT_HVRTD, STACTCTL_HVRT),
+    'lfrt': ('lfrtd', 'lfrtc', False, DEFAULT_LFRTD, STACTCTL_LFRT),
+    'hfrt': ('hfrtd', 'hfrtc', True, DEFAULT_HFRTD, STACTCTL_HFRT),
+}
+
+
+def _not_implemented(ptype):
+    if ptype in ('int16', 'sunssf', 'pad'):
+        return 0x8000
+    if ptype == 'int32':
+        return 0x80000000
+    if ptype.startswith('acc'):
+        return 0
+    return (1 << (16*TYPE_SIZE[ptype])) - 1
+
+
+def _encode(ptype, size, raw):
+    """
+    Returns the registers of a point from its raw (unscaled) value, None is not implemented.
+    """
+    if ptype.startswith('string'):
+        s = (raw or '')[:size*2].ljust(size*2, '\0')
+        return list(struct.unpack('>%dH' % size, s))
+    if raw is None:
+        raw = _not_implemented(ptype)
+    raw = int(raw) & ((1 << (16*size)) - 1)
+    return [(raw >> (16*(size - 1 - i))) & 0xffff for i in range(size)]
+
+
+def _decode(ptype, regs):
+    if ptype.startswith('string'):
+        return struct.pack('>%dH' % len(regs), *regs).rstrip('\0')
+    raw = 0
+    for r in regs:
+        raw = (raw << 16) | r
+    if raw == _not_implemented(ptype) and not ptype.startswith('acc'):
+        return None
+    if ptype in ('int16', 'sunssf', 'int32'):
+        bits = 16*len(regs)
+        if raw & (1 << (bits - 1)):
+            raw -= 1 << bits
+    return raw
+
+
+class SunSpecMap(object):
+    """
+    SunSpec register map: 'SunS', the models (id, length, points) and the end model, starting at base.
+
+    Points are addressed as (model name, curve, point), curve 0 is the fixed block and 1... the repeating blocks.
+    get() and set() apply the scale factors, read() and write() access the registers. version is incremented by
+    every register write.
+    """
+
+    def __init__(self, models, base=BASE_ADDR):
+        self.base = base
+        self.regs = list(SUNS_ID)
+        self.points = {}
+        self.model_ranges = []
+        self.version = 0
+        for model_id, n_curves in models:
+            name, fixed, repeat = MODELS[model_id]
+            blocks = [fixed] + [repeat]*n_curves
+            length = sum([_type_size(p[1]) for block in blocks for p in block])
+            self.regs.extend([model_id, length])
+            start = len(self.regs)
+            for curve, block in enumerate(blocks):
+                for pname, ptype, sf in block:
+                    size = _type_size(ptype)
+                    self.points[(name, curve, pname)] = (len(self.regs), ptype, size, sf)
+                    self.regs.extend(_encode(ptype, size, None))
+            self.model_ranges.append((start, len(self.regs), name))
+        self.regs.extend([END_ID, 0])
+
+    def _point(self, model, point, curve):
+        p = self.points.get((model, curve, point))
+        if p is None:
+            raise EUTError('No point %s in %s curve %d' % (point, model, curve))
+        return p
+
+    def _sf(self, model, sf):
+        if sf is None:
+            return 0
+        offset, ptype, size, _ = self.points[(model, 0, sf)]
+        value = _decode(ptype, self.regs[offset:offset + size])
+        return value or 0
+
+    def get(self, model, point, curve=0):
+        """
+        Returns the scaled value of a point, None if it is not implemented.
+        """
+        offset, ptype, size, sf = self._point(model, point, curve)
+        value = _decode(ptype, self.regs[offset:offset + size])
+        if value is None or sf is None:
+            return value
+        return value*10.**self._sf(model, sf)
+
+    def set(self, model, point, value, curve=0):
+        offset, ptype, size, sf = self._point(model, point, curve)
+        if value is not None and not ptype.startswith('string'):
+            value = int(round(value/10.**self._sf(model, sf)))
+        self.regs[offset:offset + size] = _encode(ptype, size, value)
+
+    def read(self, addr, count):
+        start = addr - self.base
+        if start < 0 or count < 1 or start + count > len(self.regs):
+            raise EUTError('Illegal address %d, count %d' % (addr, count))
+        return self.regs[start:start + count]
+
+    def write(self, addr, values):
+        start = addr - self.base
+        if start < 0 or start + len(values) > len(self.regs):
+            raise EUTError('Illegal address %d, count %d' % (addr, len(values)))
+        self.regs[start:start + len(values)] = [v & 0xffff for v in values]
+        self.version += 1
+        return [name for (s, e, name) in self.model_ranges if s < start + len(values) and start < e]
+
+
+def _interp(points, x):
+    # points [(x, y), ...] in increasing x, end values held
+    if x <= points[0][0]:
+        return points[0][1]
+    if x >= points[-1][0]:
+        return points[-1][1]
+    for i in range(1, len(points)):
+        x1, y1 = points[i]
+        if x <= x1:
+            x0, y0 = points[i - 1]
+            if x1 == x0:
+                return y1
+            return y0 + (y1 - y0)*(x - x0)/(x1 - x0)
+    return points[-1][1]
+
+
+class RideThroughCurve(object):
+    """
+    Ride-through time curve (see curve.ride_through_curve), points [(%nominal, time), ...] from the point
+    furthest from nominal. time(pct) is 0 between the curve and nominal.
+    """
+
+    def __init__(self, points, high):
+        self.high = high
+        self.points = sorted(points)
+        self.limit = self.points[0][0] if high else self.points[-1][0]
+
+    def time(self, pct):
+        if self.high and pct < self.limit:
+            return 0.
+        if not self.high and pct > self.limit:
+            return 0.
+        return _interp(self.points, pct)
+
+
+class EUT(object):
+    """
+    Simulated PV inverter.
+
+    clock - sim clock, grid - sim.Grid, pv - sim.PV.
+    w_max - power rating (W), phases - 1 or 3 (inverter model 101 or 103), reconnect - reconnect delay after a
+    trip (s).
+    """
+
+    def __init__(self, clock, grid, pv, w_max=3000., phases=1, reconnect=5., history_len=HISTORY_LEN):
+        self.clock = clock
+        self.grid = grid
+        self.pv = pv
+        self.w_max = float(w_max)
+        self.phases = int(phases)
+        self.reconnect = float(reconnect)
+        self.lock = threading.RLock()
+        models = list(EUT_MODELS)
+        models.insert(1, (103 if self.phases == 3 else 101, 0))
+        self.map = SunSpecMap(models)
+        self._init_map()
+        self._version = None
+        self._cfg = None
+        self.t = clock.time()
+        self.connected = False
+        self.tripped = None         # function that tripped the EUT, None if not tripped
+        self.normal_since = self.t  # time the grid entered the normal window
+        self.trip_acc = dict([(k, 0.) for k in RIDE_THROUGH])
+        self.w = 0.
+        self.var = 0.
+        self.wh = 0.
+        self.fw_active = False
+        self.fw_p_m = 0.
+        self.fw_recover = None
+        self.revert = {}
+        self.status = 0
+        self.st = ST_OFF
+        self.v = 0.
+        self.f = 0.
+        self.p_dc = 0.
+        self.settled = False
+        self.history = collections.deque(maxlen=history_len)
+        self.steps = 0
+        with self.lock:
+            self._step(self.t, 0.)
+            self._record(self.t)
+            self._publish()
+
+    def _init_map(self):
+        m = self.map
+        v_nom = self.grid.v_nom
+        var_max = 0.44*self.w_max
+        # power points are int16, scaled so 120% of the rating fits
+        w_sf = 0
+        while 1.2*self.w_max/10.**w_sf > 32767:
+            w_sf += 1
+        for p, v in (('Mn', 'SunSpec'), ('Md', 'SVP Simulated EUT'), ('Opt', 'sim'), ('Vr', '1.0'),
+                     ('SN', 'SIM0001'), ('DA', 1)):
+            m.set('common', p, v)
+        for p, v in (('DERTyp', 4), ('WRtg_SF', w_sf), ('WRtg', self.w_max), ('VARtg_SF', w_sf),
+                     ('VARtg', self.w_max), ('VArRtg_SF', w_sf), ('VArRtgQ1', var_max), ('VArRtgQ4', -var_max),
+                     ('ARtg_SF', -1),
+                     ('ARtg', 1.2*self.w_max/(v_nom*self.phases)), ('PFRtg_SF', -2), ('PFRtgQ1', 0.85),
+                     ('PFRtgQ4', -0.85)):
+            m.set('nameplate', p, v)
+        for p, v in (('WMax_SF', w_sf), ('VRef_SF', -1), ('VRefOfs_SF', -1), ('VMinMax_SF', -1), ('VAMax_SF', w_sf),
+                     ('VArMax_SF', w_sf), ('WGra_SF', 0), ('PFMin_SF', -2), ('MaxRmpRte_SF', 0), ('ECPNomHz_SF', -2),
+                     ('WMax', self.w_max), ('VRef', v_nom), ('VRefOfs', 0), ('VMax', 1.1*v_nom), ('VMin', 0.88*v_nom),
+                     ('VAMax', self.w_max), ('VArMaxQ1', var_max), ('VArMaxQ4', -var_max), ('WGra', 100),
+                     ('PFMinQ1', 0.85), ('PFMinQ4', -0.85), ('MaxRmpRte', 100), ('ECPNomHz', self.grid.f_nom),
+                     ('ConnPh', self.phases)):
+            m.set('settings', p, v)
+        for p, v in (('VArAval_SF', w_sf), ('WAval_SF', w_sf), ('Ris_SF', 0), ('TmSrc', 'SIM')):
+            m.set('status', p, v)
+        for p, v in (('WMaxLimPct_SF', 0), ('OutPFSet_SF', -3), ('VArPct_SF', 0), ('Conn', CONN_CONNECT),
+                     ('WMaxLimPct', 100), ('WMaxLim_Ena', 0), ('OutPFSet', 1.), ('OutPFSet_Ena', 0),
+                     ('VArWMaxPct', 0), ('VArMaxPct', 0), ('VArAvalPct', 0), ('VArPct_Mod', VOLTVAR_VARMAX),
+                     ('VArPct_Ena', 0), ('Conn_WinTms', 0), ('Conn_RvrtTms', 0), ('WMaxLimPct_RvrtTms', 0),
+                     ('OutPFSet_RvrtTms', 0), ('VArPct_RvrtTms', 0)):
+            m.set('controls', p, v)
+        for p, v in (('V_SF', -1), ('DeptRef_SF', -1), ('RmpIncDec_SF', 0), ('ActCrv', 0), ('ModEna', 0),
+                     ('WinTms', 0), ('RvrtTms', 0), ('RmpTms', 0), ('NCrv', 4), ('NPt', 20)):
+            m.set('volt_var', p, v)
+        for curve in range(1, 5):
+            for p, v in (('ActPt', 4), ('DeptRef', VOLTVAR_VARMAX), ('V1', 92.), ('VAr1', 30.), ('V2', 98.),
+                         ('VAr2', 0.), ('V3', 102.), ('VAr3', 0.), ('V4', 108.), ('VAr4', -30.), ('RmpTms', 0),
+                         ('ReadOnly', 0)):
+                m.set('volt_var', p, v, curve)
+        for p, v in (('WGra_SF', 0), ('HzStrStop_SF', -2), ('RmpIncDec_SF', 0), ('WGra', 40), ('HzStr', 0.2),
+                     ('HzStop', 0.05), ('HysEna', 0), ('ModEna', 0), ('HzStopWGra', 10000)):
+            m.set('freq_watt_param', p, v)
+        for p, v in (('Hz_SF', -2), ('W_SF', 0), ('RmpIncDec_SF', 0), ('ActCrv', 0), ('ModEna', 0), ('WinTms', 0),
+                     ('RvrtTms', 0), ('RmpTms', 0), ('NCrv', 4), ('NPt', 20)):
+            m.set('freq_watt_crv', p, v)
+        f_nom = self.grid.f_nom
+        for curve in range(1, 5):
+            for p, v in (('ActPt', 2), ('Hz1', f_nom + 0.2), ('W1', 100.), ('Hz2', f_nom + 2.), ('W2', 0.),
+                         ('ReadOnly', 0)):
+                m.set('freq_watt_crv', p, v, curve)
+        for func, (d_model, c_model, high, default, bit) in RIDE_THROUGH.items():
+            x_name, x_sf = ('V', 'V_SF') if func.endswith('vrt') else ('F', 'Hz_SF')
+            for model in (d_model, c_model):
+                for p, v in (('Tms_SF', -2), (x_sf, -2), ('ActCrv', 0), ('ModEna', 0), ('WinTms', 0), ('RvrtTms', 0),
+                             ('RmpTms', 0), ('NCrv', 1), ('NPt', 20)):
+                    m.set(model, p, v)
+                m.set(model, 'ActPt', 0, 1)
+                m.set(model, 'ReadOnly', 0, 1)
+
+    def _curve(self, model, x_name, y_name, curve):
+        m = self.map
+        n = m.get(model, 'ActPt', curve) or 0
+        points = []
+        for i in range(1, min(int(n), 20) + 1):
+            x = m.get(model, '%s%d' % (x_name, i), curve)
+            y = m.get(model, '%s%d' % (y_name, i), curve)
+            if x is None or y is None:
+                break
+            points.append((x, y))
+        return points
+
+    def _enabled_curve(self, model):
+        # active curve number of an enabled curve model or 0
+        m = self.map
+        if not (m.get(model, 'ModEna') or 0) & 1:
+            return 0
+        curve = int(m.get(model, 'ActCrv') or 0)
+        if (model, curve, 'ActPt') not in m.points:
+            return 0
+        return curve
+
+    def _config(self):
+        """
+        Returns the EUT settings decoded from the register map, decoded again only after a register write.
+        """
+        m = self.map
+        if self._cfg is not None and self._version == m.version:
+            return self._cfg
+        c = {}
+        c['w_max'] = m.get('settings', 'WMax') or self.w_max
+        c['v_ref'] = m.get('settings', 'VRef') or self.grid.v_nom
+        c['f_nom'] = m.get('settings', 'ECPNomHz') or self.grid.f_nom
+        c['va_max'] = m.get('settings', 'VAMax') or c['w_max']
+        c['var_max'] = abs(m.get('settings', 'VArMaxQ1') or 0.44*c['w_max'])
+        c['w_gra'] = m.get('settings', 'WGra') or 0.
+        c['conn'] = m.get('controls', 'Conn')
+        c['w_lim'] = None
+        if m.get('controls', 'WMaxLim_Ena') == 1:
+            c['w_lim'] = (m.get('controls', 'WMaxLimPct') or 0.)/100.*c['w_max']
+        c['pf'] = None
+        if m.get('controls', 'OutPFSet_Ena') == 1:
+            c['pf'] = m.get('controls', 'OutPFSet')
+        c['var_pct'] = None
+        if m.get('controls', 'VArPct_Ena') == 1:
+            mod = m.get('controls', 'VArPct_Mod')
+            if mod == VOLTVAR_WMAX:
+                c['var_pct'] = (m.get('controls', 'VArWMaxPct') or 0.)/100.*c['w_max']
+            elif mod == VOLTVAR_VARAVAL:
+                c['var_pct'] = (m.get('controls', 'VArAvalPct') or 0.)/100.*c['var_max']
+            else:
+                c['var_pct'] = (m.get('controls', 'VArMaxPct') or 0.)/100.*c['var_max']
+        c['revert'] = {}
+        for name, point in (('conn', 'Conn_RvrtTms'), ('w_lim', 'WMaxLimPct_RvrtTms'), ('pf', 'OutPFSet_RvrtTms'),
+                            ('var_pct', 'VArPct_RvrtTms')):
+            c['revert'][name] = m.get('controls', point) or 0
+
+        c['vv'] = None
+        curve = self._enabled_curve('volt_var')
+        if curve:
+            points = self._curve('volt_var', 'V', 'VAr', curve)
+            if points:
+                dept_ref = m.get('volt_var', 'DeptRef', curve)
+                ref = c['w_max'] if dept_ref == VOLTVAR_WMAX else c['var_max']
+                ramp = m.get('volt_var', 'RmpTms', curve) or m.get('volt_var', 'RmpTms') or 0.
+                c['vv'] = (sorted(points), ref, ramp/3. if ramp else TAU_VAR)
+
+        c['fw_param'] = None
+        if (m.get('freq_watt_param', 'ModEna') or 0) & 1:
+            c['fw_param'] = (m.get('freq_watt_param', 'WGra') or 0., m.get('freq_watt_param', 'HzStr') or 0.,
+                             m.get('freq_watt_param', 'HzStop') or 0.,
+                             (m.get('freq_watt_param', 'HysEna') or 0) & 1,
+                             m.get('freq_watt_param', 'HzStopWGra') or 0.)
+        c['fw_crv'] = None
+        curve = self._enabled_curve('freq_watt_crv')
+        if curve:
+            points = self._curve('freq_watt_crv', 'Hz', 'W', curve)
+            if points:
+                c['fw_crv'] = sorted(points)
+
+        c['rt'] = {}
+        c['st_act'] = 0
+        for func, (d_model, c_model, high, default, bit) in RIDE_THROUGH.items():
+            x_name = 'V' if func.endswith('vrt') else 'F'
+            d_points = default
+            curve = self._enabled_curve(d_model)
+            if curve:
+                d_points = [(x, t) for t, x in self._curve(d_model, 'Tms', x_name, curve)] or default
+                c['st_act'] |= bit
+            c_curve = None
+            curve = self._enabled_curve(c_model)
+            if curve:
+                points = [(x, t) for t, x in self._curve(c_model, 'Tms', x_name, curve)]
+                if points:
+                    c_curve = RideThroughCurve(points, high)
+            c['rt'][func] = (RideThroughCurve(d_points, high), c_curve)
+        if c['w_lim'] is not None:
+            c['st_act'] |= STACTCTL_FIXED_W
+        if c['var_pct'] is not None:
+            c['st_act'] |= STACTCTL_FIXED_VAR
+        if c['pf'] is not None:
+            c['st_act'] |= STACTCTL_FIXED_PF
+        if c['vv'] is not None:
+            c['st_act'] |= STACTCTL_VOLT_VAR
+        if c['fw_param'] is not None:
+            c['st_act'] |= STACTCTL_FREQ_WATT_PARAM
+        if c['fw_crv'] is not None:
+            c['st_act'] |= STACTCTL_FREQ_WATT_CURVE
+        self._cfg = c
+        self._version = m.version
+        return c
+
+    def written(self, models):
+        """
+        Called after a register write with the names of the models written: starts the control revert timers.
+        """
+        if 'controls' in models:
+            c = self._config()
+            for name, rvrt in c['revert'].items():
+                if rvrt and c.get(name) is not None:
+                    self.revert[name] = self.t + rvrt
+                else:
+                    self.revert.pop(name, None)
+
+    def _do_revert(self, t):
+        m = self.map
+        for name, deadline in self.revert.items():
+            if t >= deadline:
+                if name == 'conn':
+                    m.set('controls', 'Conn', CONN_CONNECT)
+                elif name == 'w_lim':
+                    m.set('controls', 'WMaxLim_Ena', 0)
+                elif name == 'pf':
+                    m.set('controls', 'OutPFSet_Ena', 0)
+                elif name == 'var_pct':
+                    m.set('controls', 'VArPct_Ena', 0)
+                del self.revert[name]
+                m.version += 1
+
+    def _trip_time(self, func, d_curve, c_curve, pct):
+        d_time = d_curve.time(pct)
+        if not d_time:
+            return 0.
+        c_time = c_curve.time(pct) if c_curve is not None else 0.
+        c_time = min(c_time, d_time)
+        return c_time + TRIP_FRACTION*(d_time - c_time)
+
+    def _p_target(self, c, p_avail, f):
+        p = p_avail
+        if c['w_lim'] is not None:
+            p = min(p, c['w_lim'])
+        fw = c['fw_param']
+        if fw is not None:
+            w_gra, hz_str, hz_stop, hys, hz_stop_w_gra = fw
+            f_dev = f - c['f_nom']
+            if f_dev > hz_str:
+                if not self.fw_active:
+                    self.fw_active = True
+                    self.fw_p_m = self.w
+                self.fw_recover = None
+            elif self.fw_active and (not hys or f_dev < hz_stop):
+                self.fw_active = False
+            if self.fw_active:
+                p = min(p, max(0., self.fw_p_m*(1. - w_gra/100.*(f_dev - hz_str))))
+        else:
+            self.fw_active = False
+        if c['fw_crv'] is not None:
+            p = min(p, p_avail*_interp(c['fw_crv'], f)/100.)
+        return max(p, 0.)
+
+    def _step(self, t, dt):
+        c = self._config()
+        v, f = self.grid.values(t)
+        self.v, self.f = v, f
+        self.p_dc = self.pv.power(t)
+        v_pct = v/c['v_ref']*100.
+        f_pct = f/c['f_nom']*100.
+        normal = (self.grid.relay_closed and CONNECT_V[0] <= v_pct <= CONNECT_V[1] and
+                  CONNECT_F[0] <= f_pct <= CONNECT_F[1])
+        if not normal:
+            self.normal_since = None
+        elif self.normal_since is None:
+            self.normal_since = t
+
+        # ride-through: accumulate time beyond the must disconnect curves
+        if self.connected:
+            for func, (d_curve, c_curve) in c['rt'].items():
+                pct = v_pct if func.endswith('vrt') else f_pct
+                trip_time = self._trip_time(func, d_curve, c_curve, pct)
+                if trip_time > 0:
+                    self.trip_acc[func] += dt/trip_time
+                    if self.trip_acc[func] >= 1. - 1e-9:
+                        self.connected = False
+                        self.tripped = func
+                else:
+                    self.trip_acc[func] = 0.
+            if not self.grid.relay_closed or c['conn'] != CONN_CONNECT:
+                self.connected = False
+
+        if not self.connected:
+            for func in self.trip_acc:
+                self.trip_acc[func] = 0.
+            delay = self.reconnect if self.tripped else 0.
+            if (c['conn'] == CONN_CONNECT and normal and self.p_dc > 0 and
+                    t - self.normal_since >= delay - 1e-9):
+                self.connected = True
+                self.tripped = None
+
+        if self.connected:
+            p_avail = min(self.p_dc*EFFICIENCY, c['w_max'])
+            w_target = self._p_target(c, p_avail, f)
+            if c['pf'] is not None and c['pf']:
+                pf = c['pf']
+                var_target = math.copysign(w_target*math.tan(math.acos(min(abs(pf), 1.))), pf)
+                if abs(var_target) > c['var_max']:
+                    # power is curtailed to hold the power factor
+                    w_target *= c['var_max']/abs(var_target)
+                    var_target = math.copysign(c['var_max'], var_target)
+                tau_var = TAU_W
+            elif c['var_pct'] is not None:
+                var_target = c['var_pct']
+                tau_var = TAU_W
+            elif c['vv'] is not None:
+                points, ref, tau_var = c['vv']
+                var_target = _interp(points, v_pct)/100.*ref
+            else:
+                var_target = 0.
+                tau_var = TAU_W
+            var_target = max(-c['var_max'], min(c['var_max'], var_target))
+            # VA limit: var priority for the reactive power functions, fixed power factor is held
+            va_max = c['va_max']
+            va = math.sqrt(w_target*w_target + var_target*var_target)
+            if va > va_max:
+                if c['pf'] is not None:
+                    w_target *= va_max/va
+                    var_target *= va_max/va
+                elif c['var_pct'] is not None or c['vv'] is not None:
+                    var_target = math.copysign(min(abs(var_target), va_max), var_target)
+                    w_target = math.sqrt(max(va_max*va_max - var_target*var_target, 0.))
+                else:
+                    var_target = math.copysign(math.sqrt(max(va_max*va_max - w_target*w_target, 0.)), var_target)
+            # first order response, power increases limited by the ramp rate
+            w_new = self.w + (w_target - self.w)*(1. - math.exp(-dt/TAU_W))
+            if c['w_gra'] > 0 and w_new > self.w:
+                w_new = min(w_new, self.w + c['w_gra']/100.*c['w_max']*dt)
+            self.w = w_new
+            self.var += (var_target - self.var)*(1. - math.exp(-dt/tau_var))
+            self.settled = (abs(w_target - self.w) < 1e-4*c['w_max'] and
+                            abs(var_target - self.var) < 1e-4*c['w_max'])
+        else:
+            self.w = 0.
+            self.var = 0.
+            self.settled = True
+        self.wh += self.w*dt/3600.
+        self.steps += 1
+
+    def _horizon(self, t, t_end):
+        # latest time the state can be advanced to in one step
+        v, f = self.grid.values(t)
+        if not self.settled or (v, f) != (self.v, self.f) or self.pv.power(t) != self.p_dc:
+            return min(t_end, t + STEP)
+        h = t_end
+        for change in (self.grid.next_change(t), self.pv.next_change(t)):
+            if change is not None:
+                if change <= t:
+                    return min(t_end, t + STEP)
+                h = min(h, change)
+        for deadline in self.revert.values():
+            h = min(h, max(deadline, t))
+        if self.connected:
+            c = self._config()
+            v_pct = v/c['v_ref']*100.
+            f_pct = f/c['f_nom']*100.
+            for func, (d_curve, c_curve) in c['rt'].items():
+                trip_time = self._trip_time(func, d_curve, c_curve, v_pct if func.endswith('vrt') else f_pct)
+                if trip_time > 0:
+                    h = min(h, t + (1. - self.trip_acc[func])*trip_time)
+        elif self.tripped and self.normal_since is not None:
+            h = min(h, max(self.normal_since + self.reconnect, t + STEP))
+        return max(h, min(t_end, t + 1e-6))
+
+    def update(self, t=None):
+        """
+        Advances the EUT to time t (default now) and publishes its state in the register map.
+        """
+        with self.lock:
+            if t is None:
+                t = self.clock.time()
+            while self.t < t - 1e-9:
+                self._do_revert(self.t)
+                t_next = self._horizon(self.t, t)
+                if t_next - self.t > STEP:
+                    # the state is held to the end of a long step, the history shows the step at its end
+                    self._record(t_next - 1e-6)
+                self._step(t_next, t_next - self.t)
+                self.t = t_next
+                self._record(t_next)
+            self._publish()
+
+    def _record(self, t):
+        self.history.append((t, self.v, self.f, self.current(), self.w, self.var))
+
+    def va(self):
+        return math.sqrt(self.w*self.w + self.var*self.var)
+
+    def current(self):
+        if self.v <= 0:
+            return 0.
+        return self.va()/(self.v*self.phases)
+
+    def pf(self):
+        va = self.va()
+        if va <= 0:
+            return 1.
+        return math.copysign(self.w/va, self.var if self.var else 1.)
+
+    def _publish(self):
+        m = self.map
+        c = self._config()
+        i = self.current()
+        w_sf = m.get('nameplate', 'WRtg_SF')
+        inv = (('A_SF', -2), ('V_SF', -1), ('W_SF', w_sf), ('Hz_SF', -3), ('VA_SF', w_sf), ('VAr_SF', w_sf),
+               ('PF_SF', -3), ('WH_SF', 0), ('DCA_SF', -2), ('DCV_SF', -1), ('DCW_SF', w_sf), ('Tmp_SF', -1),
+               ('A', i*self.phases), ('AphA', i), ('PhVphA', self.v), ('W', self.w), ('Hz', self.f),
+               ('VA', self.va()), ('VAr', self.var), ('PF', self.pf()), ('WH', self.wh), ('TmpCab', 35.),
+               ('Evt1', 0))
+        for p, v in inv:
+            m.set('inverter', p, v)
+        if self.phases == 3:
+            for p in ('AphB', 'AphC'):
+                m.set('inverter', p, i)
+            for p in ('PhVphB', 'PhVphC'):
+                m.set('inverter', p, self.v)
+        p_dc = self.w/EFFICIENCY if self.w > 0 else 0.
+        m.set('inverter', 'DCW', p_dc)
+        m.set('inverter', 'DCV', self.pv.v_mpp if self.pv.on else 0.)
+        m.set('inverter', 'DCA', p_dc/self.pv.v_mpp if self.pv.on and self.pv.v_mpp else 0.)
+
+        p_avail = min(self.pv.power(self.t)*EFFICIENCY, c['w_max'])
+        if self.tripped:
+            self.st = ST_FAULT
+        elif not self.connected:
+            self.st = ST_SLEEPING if p_avail <= 0 else ST_OFF
+        elif self.w < p_avail - 0.01*c['w_max']:
+            self.st = ST_THROTTLED
+        else:
+            self.st = ST_MPPT
+        m.set('inverter', 'St', self.st)
+        self.status = (PVCONN_CONNECTED | PVCONN_OPERATING) if self.connected else 0
+        if p_avail > 0:
+            self.status |= PVCONN_AVAILABLE
+        m.set('status', 'PVConn', self.status)
+        m.set('status', 'StActCtl', c['st_act'])
+        m.set('status', 'WAval', p_avail)
+        m.set('status', 'VArAval', max(c['var_max'] - abs(self.var), 0.))
+        m.set('status', 'ActWh', self.wh)
+        m.set('status', 'Tms', int(self.t) & 0xffffffff)
+
+    def __str__(self):
+        self.update()
+        return ('EUT %s at %0.3f: %0.1f V, %0.3f Hz, %0.1f W, %0.1f var%s (%d steps)' %
+                ('connected' if self.connected else 'disconnected', self.t, self.v, self.f, self.w, self.var,
+                 ', tripped by %s' % self.tripped if self.tripped else '', self.steps))
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+
+    def _recv(self, n):
+        data = ''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self):
+        eut = self.server.eut
+        while True:
+            header = self._recv(7)
+            if header is None:
+                return
+            tid, pid, length, unit = struct.unpack('>HHHB', header)
+            pdu = self._recv(length - 1)
+            if not pdu:
+                return
+            resp = self.server.process(eut, pdu)
+            self.request.sendall(struct.pack('>HHHB', tid, pid, len(resp) + 1, unit) + resp)
+
+
+class _TCPServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def process(self, eut, pdu):
+        """
+        Returns the response PDU of a request PDU: read holding/input registers (3, 4), write single register (6)
+        and write multiple registers (16).
+        """
+        fc = ord(pdu[0])
+        try:
+            with eut.lock:
+                if fc in (3, 4):
+                    addr, count = struct.unpack('>HH', pdu[1:5])
+                    if count < 1 or count > 125:
+                        return struct.pack('>BB', fc | 0x80, 3)
+                    eut.update()
+                    regs = eut.map.read(addr, count)
+                    return struct.pack('>BB%dH' % count, fc, 2*count, *regs)
+                if fc == 6:
+                    addr, value = struct.unpack('>HH', pdu[1:5])
+                    eut.update()
+                    eut.written(eut.map.write(addr, [value]))
+                    return pdu[:5]
+                if fc == 16:
+                    addr, count, nbytes = struct.unpack('>HHB', pdu[1:6])
+                    values = list(struct.unpack('>%dH' % count, pdu[6:6 + 2*count]))
+                    eut.update()
+                    eut.written(eut.map.write(addr, values))
+                    return struct.pack('>BHH', fc, addr, count)
+        except EUTError:
+            return struct.pack('>BB', fc | 0x80, 2)
+        except Exception:
+            return struct.pack('>BB', fc | 0x80, 4)
+        return struct.pack('>BB', fc | 0x80, 1)
+
+
+class Server(object):
+    """
+    Modbus TCP server of the simulated EUT. Any unit id is answered. Use port 0 to pick a free port.
+    """
+
+    def __init__(self, eut, ipaddr='127.0.0.1', ipport=5020):
+        self.eut = eut
+        self.server = _TCPServer((ipaddr, ipport), _Handler)
+        self.server.eut = eut
+        self.ipaddr, self.ipport = self.server.server_address
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Client(object):
+    """
+    Minimal Modbus TCP client for checking the EUT server without pysunspec.
+    """
+
+    def __init__(self, ipaddr='127.0.0.1', ipport=5020, unit=1, timeout=5.):
+        self.sock = socket.create_connection((ipaddr, ipport), timeout)
+        self.unit = unit
+        self.tid = 0
+
+    def _request(self, pdu):
+        self.tid = (self.tid + 1) & 0xffff
+        self.sock.sendall(struct.pack('>HHHB', self.tid, 0, len(pdu) + 1, self.unit) + pdu)
+        header = ''
+        while len(header) < 7:
+            header += self.sock.recv(7 - len(header))
+        length = struct.unpack('>HHHB', header)[2]
+        resp = ''
+        while len(resp) < length - 1:
+            resp += self.sock.recv(length - 1 - len(resp))
+        if ord(resp[0]) & 0x80:
+            raise EUTError('Modbus exception %d' % ord(resp[1]))
+        return resp
+
+    def read(self, addr, count):
+        resp = self._request(struct.pack('>BHH', 3, addr, count))
+        return list(struct.unpack('>%dH' % count, resp[2:2 + 2*count]))
+
+    def write(self, addr, values):
+        self._request(struct.pack('>BHHB%dH' % len(values), 16, addr, len(values), 2*len(values), *values))
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+
+    import time
+    import sim
+
+    w = sim.world(params={'eut_ipport': 0})
+    eut = w.eut
+    server = Server(eut, ipport=0)
+    server.start()
+    c = Client(ipport=server.ipport)
+    print 'SunS:', c.read(BASE_ADDR, 2) == list(SUNS_ID)
+    # walk the models as a SunSpec client would
+    addr = BASE_ADDR + 2
+    while True:
+        model_id, length = c.read(addr, 2)
+        if model_id == END_ID:
+            break
+        print 'model %d (%s) at %d, length %d' % (model_id, MODELS[model_id][0], addr, length)
+        addr += 2 + length
+
+    time.sleep(10.)
+    print eut
+    # 50% power limit written over Modbus
+    offset = eut.map.points[('controls', 0, 'WMaxLimPct')][0]
+    c.write(BASE_ADDR + offset, [50, 0, 0, 0, 1])
+    time.sleep(5.)
+    print 'W from Modbus: %s' % c.read(BASE_ADDR + eut.map.points[('inverter', 0, 'W')][0], 1)
+    # 60% voltage for 10 s, the default LVRT curve trips in 0.5*(0.16 + (60 - 50)/(88 - 50)*(2 - 0.16)) s
+    w.grid.set(v=0.6*w.grid.v_nom)
+    time.sleep(10.)
+    print eut
+    w.grid.set(v=w.grid.v_nom)
+    time.sleep(10.)
+    print eut
+    c.close()
+    server.stop()
+    sim.reset()
@@ -1,13 +1,65 @@
 from __future__ import division
-from numpy import logical_and, average, diff
-from matplotlib.mlab import find
 import numpy as np
-from scipy import signal
-import matplotlib.pyplot as plt
 import math
 
 __author__ = 'detldaq'
 
+# matplotlib and scipy take several hundred milliseconds to import and pyplot needs a display backend, so they are
+# imported only by the functions that plot or design filters. The RMS functions need numpy only.
+_imported = {}
+
+
+def _pyplot():
+    """
+    Returns matplotlib.pyplot, importing it on first use.
+    """
+    plt = _imported.get('pyplot')
+    if plt is None:
+        import matplotlib.pyplot as plt
+        _imported['pyplot'] = plt
+    return plt
+
+
+def _scipy_signal():
+    """
+    Returns scipy.signal, or None if scipy is not installed.
+    """
+    if 'signal' not in _imported:
+        try:
+            from scipy import signal
+        except ImportError:
+            signal = None
+        _imported['signal'] = signal
+    return _imported['signal']
+
+
+def lowpass(data, wn, order=4):
+    """
+    Zero-phase Butterworth low pass filter of data. wn is the cutoff normalized to the Nyquist frequency as for
+    scipy.signal.butter.
+
+    Uses scipy.signal.filtfilt when scipy is installed. Otherwise the filtfilt magnitude response of the same
+    digital filter, 1/(1 + (tan(w/2)/tan(wn*pi/2))^(2*order)), is applied in the frequency domain to the data
+    extended by odd reflection at both ends.
+    """
+    data = np.asarray(data, dtype=float)
+    signal = _scipy_signal()
+    if signal is not None:
+        b, a = signal.butter(order, wn, analog=False)
+        return signal.filtfilt(b, a, data)
+
+    n = len(data)
+    if n < 2:
+        return data.copy()
+    # reflect a few filter time constants at each end to limit the edge transients, as filtfilt does
+    pad = min(n - 1, max(3*(order + 1), int(4./wn)))
+    ext = np.concatenate((2*data[0] - data[pad:0:-1], data, 2*data[-1] - data[-2:-pad - 2:-1]))
+    w = np.pi*np.fft.rfftfreq(len(ext))*2.
+    ratio = np.tan(w/2.)/math.tan(wn*np.pi/2.)
+    with np.errstate(over='ignore'):
+        h = 1./(1. + ratio**(2*order))
+    return np.fft.irfft(np.fft.rfft(ext)*h, len(ext))[pad:pad + n]
+
 def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=None, v_window=20., trip_thresh=3.):
     """ Returns the time between the voltage change and when the EUT tripped
 
@@ -23,9 +75,6 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
     2. Using the RMS calculation of the ac voltage to determine when the voltage exits v_nominal +/- v_window
     """
 
-    import wave
-    import matplotlib.pyplot as plt
-
     f_grid = 60.
     cycles_in_window = 1.
     window_size = cycles_in_window*(1./f_grid)*1000.  # in ms
@@ -81,6 +130,7 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
             raise script.ScriptFail('Error in Waveform File. Unable to get trip time from wfmtime: %s' % str(e))
 
         '''
+        plt = _pyplot()
         plt.plot(wfmtime, ac_current, color='blue', label='ac_current')
         plt.plot(time_RMS, ac_current_RMS, color='black', label='ac_current_RMS')
         plt.plot(wfmtime, grid_trig, color='g', label='grid_trig')
@@ -99,63 +149,19 @@ def calc_ride_through_duration(wfmtime, ac_current, ac_voltage=None, grid_trig=N
         return trip_time
 
 
-def freq_from_crossings(wfmtime, sig, fs):
+def freq_from_crossings(wfmtime, sig, fs, plot=False):
     """Estimate frequency by counting zero crossings
 
-    Doesn't work if there are multiple zero crossings per cycle.
+    Doesn't work if there are multiple zero crossings per cycle. See frequency.py for the per cycle frequency
+    times, ROCOF and incremental estimation.
 
+    Set plot=True to plot the filtered signal and the frequency estimate (imports matplotlib).
     """
-    from scipy import signal
-    import matplotlib.pyplot as plt
-
-    # FILTER THE WAVEFORM WITH LOWPASS BUTTERWORTH FILTER
-    # todo: revisit the wn calculation to be sure it works for multiple sampling rates
-    wn = (2*math.pi*60)/fs  #Wn is normalized from 0 to 1, where 1 is the Nyquist frequency, pi radians/sample
-    b, a = signal.butter(4, wn, analog=False)
-    sig_ff = signal.filtfilt(b, a, sig)
-
-    #check the frequency response
-    '''
-    w, h = signal.freqs(b, a)
-    plt.plot(w, 20 * np.log10(abs(h)))
-    plt.xscale('log')
-    plt.title('Butterworth filter frequency response')
-    plt.xlabel('Frequency [radians / second]')
-    plt.ylabel('Amplitude [dB]')
-    plt.margins(0, 0.1)
-    plt.grid(which='both', axis='both')
-    plt.show()
-    '''
-
-    # Find the zero crossings of the filtered data
-    # Linear interpolation to find truer zero crossings
+    import frequency
+    avg_freq, freqs, freq_times = frequency.freq_from_crossings(wfmtime, sig, fs)
 
-    indices = find(logical_and(sig_ff[1:] >= 0., sig_ff[:-1] < 0.))
-    crossings = [i - sig_ff[i] / (sig_ff[i+1] - sig_ff[i]) for i in indices]  #interpolate
-    cross_times = wfmtime[0] + np.array(crossings)/fs
-
-    '''
-    plt.plot(wfmtime, sig, color='red', label='Original')
-    plt.plot(wfmtime, sig_ff, color='blue', label='filtered data')
-    plt.plot(cross_times, np.zeros(len(cross_times)), 'ro', label='Zero Crossings')
-    plt.legend()
-    plt.grid(which='both', axis='both')
-    plt.axis([0, 5/60, min(sig)/2, max(sig)/2])
-    plt.show()
-    '''
-
-    time_steps = diff(crossings)
-    avg_freq = fs / average(time_steps)
-    freqs = [fs/time_steps[i] for i in xrange(0, len(cross_times)-1)]  #interpolate
-    freq_times = [(cross_times[i]+cross_times[i+1])/2 for i in xrange(0, len(freqs)-1)]  #interpolate
-
-    plt.plot(wfmtime, sig, color='red', label='Original')
-    plt.plot(wfmtime, sig_ff, color='blue', label='Filtered data')
-    plt.plot(freq_times, freqs[:-1], 'g', label='Frequency')
-    plt.legend(loc=4)
-    plt.grid(which='both', axis='both')
-    plt.axis([0, freq_times[-1], 50, 61])
-    plt.show()
+    if plot:
+        frequency.plot(wfmtime, sig, freqs, freq_times, fs)
 
     return avg_freq, freqs
 
@@ -166,18 +172,40 @@ def calculateRMS(data):
     #   @param a list or a numpy array
     #   @return a scalar containing either an RMS value
     #   http://homepage.univie.ac.at/christian.herbst//python/dsp_util_8py_source.html
-    tmp = 0
-    size = len(data)
-    for i in range(size):
-        tmp += data[i]
-    mean = tmp / float(size)
-    #print "mean: ", mean
-    tmp = 0
-    for i in range(size):
-        tmp2 = data[i] - mean
-        tmp += tmp2 * tmp2
-    tmp /= float(size)
-    return math.sqrt(tmp)
+    data = np.asarray(data, dtype=float)
+    return math.sqrt(np.mean((data - np.mean(data))**2))
+
+
+def sliding_rms(data, left, right, remove_mean=True):
+    """
+    Returns the RMS of data[left[k]:right[k]] for every window k in a single pass.
+
+    The windows are evaluated from cumulative sums of the signal and of its square, so the cost is one pass over
+    the data regardless of how many windows there are or how much they overlap.
+
+    data is a list or numpy array containing the signal
+    left, right are integer arrays of window start (inclusive) and end (exclusive) sample indices
+    remove_mean subtracts the mean of each window before the RMS is taken (same as calculateRMS)
+    """
+    data = np.asarray(data, dtype=float)
+    left = np.asarray(left, dtype=int)
+    right = np.asarray(right, dtype=int)
+    n = (right - left).astype(float)
+    if np.any(n <= 0):
+        raise ValueError('zero window size')
+
+    # removing the global mean does not change the result but keeps the cumulative sums well conditioned
+    offset = np.mean(data) if len(data) > 0 else 0.
+    x = data - offset
+    c1 = np.concatenate(([0.], np.cumsum(x)))
+    c2 = np.concatenate(([0.], np.cumsum(x*x)))
+    s1 = c1[right] - c1[left]
+    s2 = c2[right] - c2[left]
+    if remove_mean:
+        ms = s2/n - (s1/n)**2
+    else:
+        ms = s2/n + 2.*offset*(s1/n) + offset*offset
+    return np.sqrt(np.maximum(ms, 0.))
 
 
 def calculateRmsOfSignal(data, windowSize, samplingFrequency, overlap=0):
@@ -202,29 +230,60 @@ def calculateRmsOfSignal(data, windowSize, samplingFrequency, overlap=0):
 
     readProgress = (windowSize - overlap) / 1000.0
     outputSize = int(duration / readProgress)
-    dataX = np.zeros(outputSize)
-    dataY = np.zeros(outputSize)
-    t = 0
+    if outputSize < 2:
+        return np.zeros(0), np.zeros(0)
     halfWindowSize = windowSize / 2000.0
-    for idx in range(outputSize):
-        left = int((t - halfWindowSize) * float(samplingFrequency))
-        right = left + int(windowSize * float(samplingFrequency) / 1000.0)
-        if right >= numFrames:
-            right = numFrames - 1
-        numFramesLocal = right - left
-        #print idx, t, left, right, readProgress
-        if numFramesLocal <= 0:
-            raise Exception("zero window size (t = " + str(t) + " sec.)")
-        dataTmp = np.zeros(numFramesLocal)
-        for i in range(numFramesLocal):
-            dataTmp[i] = data[i + left]
-        dataX[idx] = t
-        t += readProgress
-        rms = calculateRMS(dataTmp)
-        dataY[idx] = rms
+
+    # window centers are accumulated the same way as the original loop (t += readProgress) so the window edges
+    # land on the same samples
+    dataX = np.concatenate(([0.], np.cumsum(np.repeat(readProgress, outputSize - 1))))
+    left = np.trunc((dataX - halfWindowSize) * float(samplingFrequency)).astype(int)
+    right = left + int(windowSize * float(samplingFrequency) / 1000.0)
+    right = np.minimum(right, numFrames - 1)
+    if np.any(right - left <= 0):
+        raise Exception("zero window size (t = " + str(dataX[np.argmax(right - left <= 0)]) + " sec.)")
+    # the first window starts before the data, it is thrown away below
+    left = np.maximum(left, 0)
+
+    dataY = sliding_rms(data, left, right)
 
     return dataX[1:], dataY[1:]  #throw away awful first data point
 
+
+def cycle_rms(wfmtime, data, fs, f_grid=60., cycles=1., step_cycles=None, remove_mean=False):
+    """
+    Returns the time-varying RMS of a signal over whole or half grid cycles.
+
+    wfmtime is the time vector from the waveform (or None to start at t = 0)
+    data is the signal corresponding to wfmtime times
+    fs is the sampling rate in Hz
+    f_grid is the nominal grid frequency in Hz
+    cycles is the window length in grid cycles, e.g., 1. for per-cycle RMS or 0.5 for half-cycle RMS
+    step_cycles is the distance between windows in grid cycles (default: cycles, i.e., no overlap)
+    remove_mean subtracts the mean of each window (DC offset removal), only valid for whole cycle windows; a part
+    cycle window of a sine has a non-zero mean, e.g., half-cycle windows of a 240 V sine would read about 104 V
+
+    Returns a tuple (time, rms) where time is the time at the end of each window.
+    """
+    if remove_mean and cycles != int(cycles):
+        raise ValueError('Window mean can only be removed for whole cycle windows (cycles = %g)' % cycles)
+    if step_cycles is None:
+        step_cycles = cycles
+    window = int(round(cycles*fs/f_grid))
+    step = int(round(step_cycles*fs/f_grid))
+    if window < 1 or step < 1:
+        raise ValueError('RMS window must contain at least one sample')
+
+    left = np.arange(0, len(data) - window + 1, step)
+    right = left + window
+    rms = sliding_rms(data, left, right, remove_mean=remove_mean)
+
+    if wfmtime is None:
+        t = right/float(fs)
+    else:
+        t = np.asarray(wfmtime, dtype=float)[right - 1]
+    return t, rms
+
 if __name__ == "__main__":
 
     import sandia_dsm as dsm
@@ -240,6 +299,7 @@ if __name__ == "__main__":
 
     ride_through_time = calc_ride_through_duration(wfmtime, ac_current, grid_trig=grid_trig)
     '''
+    plt = _pyplot()
     plt.plot(wfmtime, ac_voltage, color='blue', label='ac_voltage data')
     plt.plot(wfmtime, ac_current, color='red', label='ac_current')
     plt.plot(wfmtime, grid_trig, 'g', label='grid_trig')
@@ -261,8 +321,7 @@ if __name__ == "__main__":
                                                     overlap=windowSize/3)
 
     wn = (2.*math.pi*60.)/fs  #Wn is normalized from 0 to 1, where 1 is the Nyquist frequency, pi radians/sample
-    b, a = signal.butter(4, wn, analog=False)
-    sig_ff = signal.filtfilt(b, a, ac_voltage)
+    sig_ff = lowpass(ac_voltage, wn, order=4)
     time_filt_RMS, ac_voltage_filt_RMS = calculateRmsOfSignal(sig_ff, windowSize=windowSize,
                                                               samplingFrequency=fs, overlap=windowSize/3)
 
@@ -36,15 +36,16 @@ Questions can be directed to Jay Johnson (jjohns2@sandia.gov)
 import sys
 import os
 import traceback
-import time
 import script
+import store
+import capture
 import sunspec.core.client as client
 
 
 def test_run():
 
     result = script.RESULT_FAIL
-    f = None
+    run = None
 
     try:
         # EUT communication parameters
@@ -63,6 +64,7 @@ def test_run():
         interval = ts.param_value('data.interval')
         parameters = ts.param_value('data.parameters')
         filename = ts.param_value('data.filename')
+        csv_export = ts.param_value('data.csv') == 'Enabled'
 
         # Sandia Test Protocol: Communication is established between the Utility Management System Simulator and EUT
         ts.log('Scanning EUT')
@@ -74,47 +76,32 @@ def test_run():
 
         # PARSE PARAMETERS
         ts.log('Configuring the data capture for the following channels: %s' % parameters)
-
-        formattedchans = parameters.replace(", ", "\t")
-        formattedchans = formattedchans.replace(",", "\t")
-        formattedchans = 'Time\tTotal_Time\t%s' % formattedchans  # add python time and absolute time to channels
-        ts.log('Channel string: %s' % formattedchans)
-        channels = formattedchans.split()
+        try:
+            # channels are resolved to their SunSpec models once, each model is read once per sample
+            c = capture.Capture(inv, parameters, interval=interval, sleep=ts.sleep, log_error=ts.log_error)
+        except capture.CaptureError, e:
+            raise script.ScriptFail('Error: %s' % e)
+        channels = c.columns()
+        ts.log('Channels: %s (models read: %s)' % (', '.join(channels), ', '.join(c.models)))
 
         results_dir = os.path.dirname(__file__)[:-7] + 'Results' + os.path.sep
-        csv_filename = '%s%s.tsv' % (results_dir, filename)
-        ts.log('Saving to file: %s' % csv_filename)
-        f = open(csv_filename, 'w')
+        results = store.Store(os.path.join(results_dir, 'store'))
+        ts.log('Saving to store: %s (run %s)' % (results.path, filename))
+        run = results.run(columns=channels, test='CaptureEUTData', name=filename)
 
-        try:
-            f.write("%s\n" % formattedchans)
-        except Exception, e:
-            ts.log_error('Unable to save channel list to file: %s' % csv_filename)
-
-        starttime = time.time()
-        while duration >= (time.time()-starttime):
-            try:
-                inv.inverter.read()
-                totaltime = time.time()-starttime
-                ts.log('Collecting data at time: %s' % totaltime)
-                data_string = '%s\t%s\t' % (time.time(), totaltime)
-                for name in channels[2:]:
-                    # ts.log('Getting %s data.' % name)
-                    dpoint = 'inv.inverter.%s' % name  # Assume all channels are in SunSpec Model 'inverter'
-                    # ts.log('Result: %s' % eval(dpoint))
-                    data_string += str(eval(dpoint))
-                    data_string += '\t'
-                try:
-                    f.write("%s\n" % data_string)
-                except Exception, e:
-                    ts.log_error('Unable to save channel list to file: %s. %s' % (csv_filename, e))
-            except Exception, e:
-                ts.log_error('Inverter could not be read. %s' % e)
-
-            time.sleep(interval - ((time.time() - starttime) % interval))
-
-        if f is not None:
-            f.close()
+        # buffered rows are written to the store every flush_interval (10 s)
+        c.sink = run
+        c.run(duration=duration)
+        ts.log(str(c))
+
+        run.close()
+        run_id = run.run_id
+        run = None
+
+        if csv_export:
+            csv_filename = '%s%s.tsv' % (results_dir, filename)
+            ts.log('Exporting to file: %s' % csv_filename)
+            store.write_csv(csv_filename, results.load(run_id), channels, delimiter='\t')
 
         result = script.RESULT_PASS
 
@@ -123,8 +110,8 @@ def test_run():
         if reason:
             ts.log_error(reason)
     finally:
-        if f is not None:
-            f.close()
+        if run is not None:
+            run.close()
 
     return result
 
@@ -177,11 +164,15 @@ info.param('comm.slave_id', label='Slave Id', default=1)
 
 info.param_group('data', label='EUT Data Parameters')
 info.param('data.duration', label='Capture Duration (seconds)', default=30)
-info.param('data.interval', label='Capture Interval (seconds)', default=1)
+info.param('data.interval', label='Capture Interval (seconds)', default=1.0,
+           desc='Sub-second intervals are supported, the achieved rate is logged at the end of the capture.')
 info.param('data.parameters', label='EUT parameters to capture (SunSpec names).', default='Hz, W, PF, DCA, DCV',
-           desc='Use the SunSpec parameter names to create the channels to capture.')
+           desc='Use the SunSpec parameter names to create the channels to capture. Points of models other than '
+                'the inverter model can be named model.point, e.g., settings.WMax.')
 info.param('data.filename', label='Data file name', default='FrequencyData',
            desc='The results will be saved in the results folder of the SVP directory.')
+info.param('data.csv', label='Export tab separated file', default='Disabled', values=['Disabled', 'Enabled'],
+           desc='The data is saved to the results store, also write <Data file name>.tsv.')
 
 info.logo('sunspec.gif')
 
@@ -52,6 +52,7 @@ def test_run():
 
     if ts.param_value('profile.run_profile') == 'Yes':
         grid.profile_start()
+        grid.profile_wait()
 
     return result
 
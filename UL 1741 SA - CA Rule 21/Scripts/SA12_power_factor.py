@@ -9,18 +9,85 @@ import das
 import der
 import script
 import openpyxl
+# curve, evaluate, tasks, store and detector are in the UL 1741 SA Lib of this repository. The standard external Lib
+# these scripts run with does not have them, that Lib is added after it on the path so the external Lib's own
+# modules are still used first.
+LIB_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                        'UL 1741 SA', 'Lib'))
+if os.path.isdir(LIB_DIR) and LIB_DIR not in sys.path:
+    sys.path.append(LIB_DIR)
+# Without them (the script used outside this repository) the instruments are set up one at a time, captures are
+# written as CSV files and the captures are not evaluated.
+try:
+    import curve
+    import evaluate
+except ImportError:
+    curve = evaluate = None
+try:
+    import tasks
+except ImportError:
+    tasks = None
+try:
+    import store
+except ImportError:
+    store = None
+
+
+class CsvResults(object):
+    """
+    Writes each capture as <name>.csv in the result directory, used when the store module is not available.
+    """
+
+    def __init__(self, ts):
+        self.ts = ts
+
+    def save(self, dataset, name, **keys):
+        dataset.to_csv(self.ts.result_file('%s.csv' % name))
+
+
+def results_init():
+    if store is not None:
+        return store.Results(ts)
+    return CsvResults(ts)
+
+
+def instruments_init(pv_init):
+    """
+    Returns (grid, pv, daq), set up at the same time if the tasks module is available.
+    """
+    if tasks is not None:
+        return tasks.parallel((gridsim.gridsim_init, ts), pv_init, (das.das_init, ts),
+                              cleanup=tasks.close)  # instruments started before a failed init are closed
+    grid = gridsim.gridsim_init(ts)
+    try:
+        pv = pv_init()
+        try:
+            daq = das.das_init(ts)
+        except Exception:
+            pv.close()
+            raise
+    except Exception:
+        grid.close()
+        raise
+    return grid, pv, daq
+
 
 def test_run():
 
     result = script.RESULT_FAIL
     daq = None
 
+    if evaluate is None:
+        ts.log_warning('The evaluate module is not available (%s), the captures are saved without a pass/fail '
+                       'evaluation.' % LIB_DIR)
+
     try:
 
         p_rated = ts.param_value('ratings.p_rated')
         pf_min_ind = ts.param_value('ratings.pf_min_ind')
         pf_min_cap = ts.param_value('ratings.pf_min_cap')
         pf_settling_time = ts.param_value('ratings.pf_settling_time')
+        pf_msa = ts.param_value('ratings.pf_msa')
         pf_target = ts.param_value('ratings.pf_target')
 
         p_low = p_rated * .2
@@ -34,16 +101,16 @@ def test_run():
         '''
         2) Set all AC source parameters to the normal operating conditions for the EUT. 
         '''
-        # grid simulator is initialized with test parameters and enabled
-        grid = gridsim.gridsim_init(ts)
-
         # pv simulator is initialized with test parameters and enabled
-        pv = pvsim.pvsim_init(ts)
-        pv.power_set(p_low)
-        pv.power_on()
+        def pv_init():
+            pv = pvsim.pvsim_init(ts)
+            pv.power_set(p_low)
+            pv.power_on()
+            return pv
 
-        # initialize data acquisition
-        daq = das.das_init(ts)
+        # grid simulator is initialized with test parameters and enabled, at the same time as the pv simulator and
+        # data acquisition
+        grid, pv, daq = instruments_init(pv_init)
 
         '''
         3) Turn on the EUT. It is permitted to set all L/HVRT limits and abnormal voltage trip parameters to the
@@ -54,6 +121,9 @@ def test_run():
         eut = der.der_init(ts)
         eut.config()
 
+        # captures are saved to the results store keyed by power factor, power level and pass
+        results = results_init()
+
         '''
         4) Select 'Fixed Power Factor' operational mode.
         '''
@@ -70,7 +140,12 @@ def test_run():
                 '''
                 5) Set the input source to produce Prated for the EUT.
                 '''
-                pv.power_set(p_rated * power_level)
+                # the power level is set while the EUT power factor is set, it must be reached before the capture
+                if tasks is not None:
+                    pv_set = tasks.submit(pv, 'power_set', p_rated * power_level)
+                else:
+                    pv.power_set(p_rated * power_level)
+                    pv_set = None
                 ts.log('*** Setting power level to %s W (rated power * %s)' % ((p_rated * power_level), power_level))
 
                 for count in range(1, 4):
@@ -81,12 +156,18 @@ def test_run():
                     '''
                     #ts.log('Fixed PF settings: %s' % eut.fixed_pf())
                     eut.fixed_pf(params={'Ena': True, 'PF': 1.0})
+                    if pv_set is not None:
+                        pv_set.result()
                     ts.log('Starting data capture for pf = %s' % (1.0))
                     daq.data_capture(True)
                     ts.sleep(pf_settling_time * 3)
                     daq.data_capture(False)
                     ds = daq.data_capture_dataset()
-                    ds.to_csv(ts.result_file('PF_1_%s_%s.csv') % (str(power_level), str(count)))
+                    results.save(ds, 'PF_1_%s_%s' % (str(power_level), str(count)), pf=1.0, power=power_level,
+                                 count=count)
+                    if evaluate is not None:
+                        ts.log('%s' % evaluate.power_factor_band(ds, 'AC_PF_1', 1.0, pf_msa,
+                                                                  settling_time=pf_settling_time))
                     ts.log('Saving data capture')
 
                     '''
@@ -99,7 +180,11 @@ def test_run():
                     ts.sleep(pf_settling_time * 3)
                     daq.data_capture(False)
                     ds = daq.data_capture_dataset()
-                    ds.to_csv(ts.result_file('PF_%s_%s_%s.csv') % (str(pf), str(power_level), str(count)))
+                    results.save(ds, 'PF_%s_%s_%s' % (str(pf), str(power_level), str(count)), pf=pf, power=power_level,
+                                 count=count)
+                    if evaluate is not None:
+                        ts.log('%s' % evaluate.power_factor_band(ds, 'AC_PF_1', pf, pf_msa,
+                                                                  settling_time=pf_settling_time))
 
                     '''
                     8) Repeat steps (6) - (8) for two additional times for a total of three repetitions.
@@ -160,6 +245,7 @@ info.param('ratings.p_rated', label='P_rated', default=3000)
 info.param('ratings.pf_min_ind', label='PF_min_ind', default=.850)
 info.param('ratings.pf_min_cap', label='PF_min_cap', default=-.850)
 info.param('ratings.pf_settling_time', label='PF Settling Time', default=1)
+info.param('ratings.pf_msa', label='PF manufacturers stated accuracy', default=0.01)
 info.param('ratings.pf_target', label='PF Target', default='All', values=['All', 'PF_min_ind', 'PF_mid_ind',
                                                                           'PF_min_cap', 'PF_mid_cap'])
 
@@ -175,6 +261,8 @@ info.param('profile.irr_start', label='Initial Irradiance (W/m^2)', default=1000
            desc='Irradiance at the beginning of the profile.')
 
 das.params(info)
+if store is not None:
+    store.params(info)
 
 # info.logo('sunspec.gif')
 
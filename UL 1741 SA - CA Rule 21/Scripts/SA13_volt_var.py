@@ -9,6 +9,28 @@ import pvsim
 import das
 import der
 import script
+# curve, evaluate, tasks, store and detector are in the UL 1741 SA Lib of this repository. The standard external Lib
+# these scripts run with does not have them, that Lib is added after it on the path so the external Lib's own
+# modules are still used first.
+LIB_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                        'UL 1741 SA', 'Lib'))
+if os.path.isdir(LIB_DIR) and LIB_DIR not in sys.path:
+    sys.path.append(LIB_DIR)
+# Without them (the script used outside this repository) the instruments are set up one at a time, captures are
+# written as CSV files and the captures are not evaluated.
+try:
+    import curve
+    import evaluate
+except ImportError:
+    curve = evaluate = None
+try:
+    import tasks
+except ImportError:
+    tasks = None
+try:
+    import store
+except ImportError:
+    store = None
 
 '''
     Open questions:
@@ -46,6 +68,44 @@ def voltage_sample_points(v, segment_count=3):
     points.extend(segment_points(v[4], v[5], segment_count)[1:-1])
     return points
 
+class CsvResults(object):
+    """
+    Writes each capture as <name>.csv in the result directory, used when the store module is not available.
+    """
+
+    def __init__(self, ts):
+        self.ts = ts
+
+    def save(self, dataset, name, **keys):
+        dataset.to_csv(self.ts.result_file('%s.csv' % name))
+
+
+def results_init():
+    if store is not None:
+        return store.Results(ts)
+    return CsvResults(ts)
+
+
+def instruments_init(pv_init):
+    """
+    Returns (grid, pv, daq), set up at the same time if the tasks module is available.
+    """
+    if tasks is not None:
+        return tasks.parallel((gridsim.gridsim_init, ts), pv_init, (das.das_init, ts),
+                              cleanup=tasks.close)  # instruments started before a failed init are closed
+    grid = gridsim.gridsim_init(ts)
+    try:
+        pv = pv_init()
+        try:
+            daq = das.das_init(ts)
+        except Exception:
+            pv.close()
+            raise
+    except Exception:
+        grid.close()
+        raise
+    return grid, pv, daq
+
 def test_run():
 
     result = script.RESULT_FAIL
@@ -53,6 +113,10 @@ def test_run():
     pv = None
     grid = None
 
+    if evaluate is None:
+        ts.log_warning('The evaluate module is not available (%s), the captures are saved without a pass/fail '
+                       'evaluation.' % LIB_DIR)
+
     try:
         # read test parameters
         tests_param = ts.param_value('general.tests')
@@ -64,7 +128,7 @@ def test_run():
         v_nom = ts.param_value('ratings.v_nom')
         v_min = ts.param_value('ratings.v_min')
         v_max = ts.param_value('ratings.v_max')
-        #v_msa = ts.param_value('ratings.v_msa')
+        v_msa = ts.param_value('ratings.v_msa')
         var_msa = ts.param_value('ratings.var_msa')
         var_ramp_max = ts.param_value('ratings.var_ramp_max')
         q_max_cap = ts.param_value('ratings.q_max_cap')
@@ -183,16 +247,16 @@ def test_run():
         2) Set all AC source parameters to the nominal operating conditions for the EUT. Frequency is set at nominal
         and held at nominal throughout this test. Set the EUT power to Pmax.
         '''
-        # grid simulator is initialized with test parameters and enabled
-        grid = gridsim.gridsim_init(ts)
-
         # pv simulator is initialized with test parameters and enabled
-        pv = pvsim.pvsim_init(ts)
-        pv.power_set(p_max)
-        pv.power_on()
+        def pv_init():
+            pv = pvsim.pvsim_init(ts)
+            pv.power_set(p_max)
+            pv.power_on()
+            return pv
 
-        # initialize data acquisition
-        daq = das.das_init(ts)
+        # grid simulator is initialized with test parameters and enabled, at the same time as the pv simulator and
+        # data acquisition
+        grid, pv, daq = instruments_init(pv_init)
 
         '''
         3) Turn on the EUT. Set all L/HVRT parameters to the widest range of adjustability possible with the
@@ -202,6 +266,9 @@ def test_run():
         eut = der.der_init(ts)
         eut.config()
 
+        # captures are saved to the results store keyed by test, power level and sweep
+        results = results_init()
+
         for priority in power_priorities:
             '''
             4) If the EUT has the ability to set 'Active Power Priority' or 'Reactive Power Priority', select Priority
@@ -220,6 +287,13 @@ def test_run():
                 voltage_points = voltage_sample_points(v, segment_point_count)
                 ts.log('Voltage test points = %s' % (voltage_points))
 
+                # expected response for the post-capture evaluation, captures are not evaluated for a settling
+                # time after each voltage step
+                vv_curve = None
+                if evaluate is not None:
+                    vv_curve = curve.Curve(v[1:5], q[1:5], name='Q(V)')
+                v_step = min([abs(voltage_points[k+1] - voltage_points[k]) for k in range(len(voltage_points)-1)])
+
                 # set dependent reference type
                 if priority == 'Active':
                     dept_ref = 'VAR_AVAL_PCT'
@@ -286,8 +360,12 @@ def test_run():
                         # stop capture and save
                         daq.data_capture(False)
                         ds = daq.data_capture_dataset()
-                        ds.to_csv(ts.result_file('%s.csv') % (test_str))
+                        results.save(ds, test_str, test=test, direction='high', power=power, sweep=i)
                         ts.log('Saving data capture')
+                        if vv_curve is not None:
+                            ts.log('        %s' % evaluate.curve_band(ds, x='AC_V_1', y='AC_Q_1', curve=vv_curve,
+                                                                     y_tolerance=var_msa, x_tolerance=v_msa,
+                                                                     settling_time=t_settling, step=v_step/2.))
 
                         # test voltage low to high
                         # start capture
@@ -305,8 +383,12 @@ def test_run():
                         # stop capture and save
                         daq.data_capture(False)
                         ds = daq.data_capture_dataset()
-                        ds.to_csv(ts.result_file('%s.csv') % (test_str))
+                        results.save(ds, test_str, test=test, direction='low', power=power, sweep=i)
                         ts.log('Saving data capture')
+                        if vv_curve is not None:
+                            ts.log('        %s' % evaluate.curve_band(ds, x='AC_V_1', y='AC_Q_1', curve=vv_curve,
+                                                                     y_tolerance=var_msa, x_tolerance=v_msa,
+                                                                     settling_time=t_settling, step=v_step/2.))
 
                         '''
                         9) Repeat test Steps (6) - (8) at power levels of 20 and 66%; as described by the following:
@@ -400,6 +482,8 @@ der.params(info)
 gridsim.params(info)
 pvsim.params(info)
 das.params(info)
+if store is not None:
+    store.params(info)
 
 info.logo('sunspec.gif')
 
@@ -39,6 +39,17 @@ import traceback
 import gridsim
 import pvsim
 import das
+# detector, needed by the run-on evaluation (ai.evaluate), is in the UL 1741 SA Lib of this repository. The
+# standard external Lib these scripts run with does not have it, that Lib is added after it on the path so the
+# external Lib's own modules are still used first.
+LIB_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                        'UL 1741 SA', 'Lib'))
+if os.path.isdir(LIB_DIR) and LIB_DIR not in sys.path:
+    sys.path.append(LIB_DIR)
+try:
+    import detector
+except ImportError:
+    detector = None
 
 import sunspec.core.client as client
 
@@ -49,6 +60,8 @@ def test_run():
 
     result = script.RESULT_FAIL
     daq = None
+    grid = None
+    island = False
 
     try:
         # initialize data acquisition system
@@ -66,18 +79,58 @@ def test_run():
 
         ts.log('Running capture 2')
         daq.data_capture_start()
-        ts.sleep(8)
+
+        if ts.param_value('ai.evaluate') != 'Enabled':
+            ts.sleep(8)
+            daq.data_capture_stop()
+            ds = daq.data_capture_dataset()
+            ds.to_csv(ts.result_file('capture_2.csv'))
+            return script.RESULT_COMPLETE
+
+        if detector is None:
+            raise script.ScriptFail('Run-on evaluation requires the detector module in the Lib directory')
+        trip_thresh = ts.param_value('ai.trip_thresh')
+        run_on_max = ts.param_value('ai.run_on_max')
+        current_chan = ts.param_value('ai.current_chan')
+        window = run_on_max + ts.param_value('ai.margin')
+
+        # form the island and watch the EUT current until it ceases to energize or the run-on limit has passed
+        d = detector.Detector(trip_thresh=trip_thresh,
+                              on_event=lambda name, t: ts.log('Detected %s at %0.3f s' % (name, t - t_island)))
+
+        def read():
+            data = daq.data_read()
+            return data.get('TIME'), None, data.get(current_chan), None
+
+        t_island = daq.data_read().get('TIME')
+        island = True
+        grid.relay(gridsim.RELAY_OPEN)
+        d.start(t_island)
+        detector.watch(read, d, window, ts.sleep, stop=lambda d, t: d.event_time(detector.CESSATION) is not None)
         daq.data_capture_stop()
+
+        run_on = d.run_on_time()
+        if run_on is None:
+            ts.log_warning('The EUT did not cease to energize within %0.3f seconds of the island formation.' % window)
+            result = script.RESULT_FAIL
+        elif run_on > run_on_max:
+            ts.log_warning('The run-on time of %0.3f exceeds the limit of %0.3f seconds.' % (run_on, run_on_max))
+            result = script.RESULT_FAIL
+        else:
+            ts.log('The run-on time was %0.3f seconds.' % run_on)
+            result = script.RESULT_PASS
+
         ds = daq.data_capture_dataset()
         ds.to_csv(ts.result_file('capture_2.csv'))
 
-        result = script.RESULT_COMPLETE
-
     except script.ScriptFail, e:
         reason = str(e)
         if reason:
             ts.log_error(reason)
     finally:
+        if island:
+            # reconnect the EUT to the grid simulator
+            grid.relay(gridsim.RELAY_CLOSED)
         if daq is not None:
             daq.close()
 
@@ -120,6 +173,24 @@ info.param('profile.profile_name', label='Profile Name', default='None',
 info.param('profile.irr_start', label='Initial Irradiance (W/m^2)', default=1000.0,
            desc='Irradiance at the beginning of the profile.')
 
+info.param_group('ai', label='Anti-Islanding')
+info.param('ai.evaluate', label='Form the Island and Evaluate the Run-On Time', default='Disabled',
+           values=['Disabled', 'Enabled'],
+           desc='Open the grid simulator relay and report PASS/FAIL from the run-on time. When disabled, the '
+                'capture is recorded for 8 seconds and the result is COMPLETE.')
+info.param('ai.current_chan', label='EUT Current Channel', default='AC_IRMS_1',
+           active='ai.evaluate', active_value=['Enabled'],
+           desc='DAS channel with the EUT RMS current.')
+info.param('ai.trip_thresh', label='Cessation Current Threshold (A)', default=3.0,
+           active='ai.evaluate', active_value=['Enabled'],
+           desc='EUT current at or below which the EUT has ceased to energize the island.')
+info.param('ai.run_on_max', label='Maximum Run-On Time (s)', default=2.0,
+           active='ai.evaluate', active_value=['Enabled'],
+           desc='Time after the island formation within which the EUT must cease to energize.')
+info.param('ai.margin', label='Additional Capture Time (s)', default=1.0,
+           active='ai.evaluate', active_value=['Enabled'],
+           desc='Time the EUT current is watched after the run-on limit before the test fails.')
+
 das.params(info)
 
 # info.logo('sunspec.gif')
@@ -0,0 +1,243 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Periodic capture of SunSpec points from an EUT.
+
+Channel names are resolved once, when the capture is created, into the SunSpec models that must be read and a
+single compiled accessor for the row: a channel is either 'model.point' (e.g., 'settings.WMax') or a point name
+alone, which is found in the device models (the inverter model first). At each sample every model used by the
+channels is read once and the row is taken from the models with the accessor. Samples are scheduled with
+sampler.Sampler, so sub-second intervals are kept against absolute deadlines and the achieved rate and dropped
+samples are counted. Rows are kept in memory and handed to the sink (a store.RunWriter, for example) in batches:
+
+    inv = client.SunSpecClientDevice(...)
+    c = capture.Capture(inv, ['Hz', 'W', 'PF', 'settings.WMax'], interval=0.2, sink=run, sleep=ts.sleep)
+    c.run(duration=30)
+    ts.log(str(c))
+"""
+
+import time
+import operator
+
+import sampler
+
+TIME = 'Time'
+TOTAL_TIME = 'Total_Time'
+# models searched first for point names without a model
+PREFERRED_MODELS = ['inverter']
+
+
+class CaptureError(Exception):
+    pass
+
+
+def parse_channels(text):
+    """
+    Returns the channel names of a comma (or white space) separated channel list.
+    """
+    return text.replace(',', ' ').split()
+
+
+def device_models(device):
+    """
+    Returns the model names of a SunSpec client device in search order.
+    """
+    models = list(getattr(device, 'models', None) or [])
+    preferred = [m for m in PREFERRED_MODELS if m in models]
+    return preferred + [m for m in models if m not in preferred]
+
+
+def _has_point(model, point):
+    try:
+        value = getattr(model, point)
+    except AttributeError:
+        return False
+    except Exception:
+        # point exists, its value could not be computed before the first read
+        return True
+    return not callable(value)
+
+
+def resolve(device, name):
+    """
+    Returns (model name, point name) of a channel name.
+    """
+    if '.' in name:
+        model_name, point = name.split('.', 1)
+        model = getattr(device, model_name, None)
+        if model is None:
+            raise CaptureError('Device has no %s model, available models: %s' %
+                               (model_name, ', '.join(device_models(device))))
+        if not _has_point(model, point):
+            raise CaptureError('Model %s has no %s point' % (model_name, point))
+        return model_name, point
+    for model_name in device_models(device):
+        if _has_point(getattr(device, model_name), name):
+            return model_name, name
+    raise CaptureError('Point %s not found in models: %s' % (name, ', '.join(device_models(device))))
+
+
+class Capture(object):
+    """
+    Periodic capture of SunSpec points.
+
+    device - SunSpec client device (sunspec.core.client.SunSpecClientDevice).
+    channels - channel names or a comma separated channel list.
+    interval - sample interval (s), sub-second intervals are supported.
+    sink - object with append(row) and flush() methods receiving the rows ([Time, Total_Time, channel values...])
+           or None to keep the rows in memory (rows attribute).
+    flush_interval - seconds between flushes of the buffered rows to the sink.
+    sleep - sleep function, normally ts.sleep so the script remains abortable.
+    log_error - function called with the message when a sample can not be read.
+    """
+
+    def __init__(self, device, channels, interval=1., sink=None, flush_interval=10., sleep=None, log_error=None):
+        if isinstance(channels, basestring):
+            channels = parse_channels(channels)
+        if not channels:
+            raise CaptureError('No channels to capture')
+        self.device = device
+        self.channels = list(channels)
+        self.interval = float(interval)
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.sleep = sleep
+        self.log_error = log_error
+        self.sampler = sampler.Sampler(rate=1./self.interval, sleep=sleep)
+        self.points = [resolve(device, name) for name in self.channels]
+        self.models = []
+        for model_name, point in self.points:
+            if model_name not in self.models:
+                self.models.append(model_name)
+        self._model_objs = [getattr(device, m) for m in self.models]
+        # compiled accessor returning the channel values from the device in channel order
+        getter = operator.attrgetter(*['%s.%s' % p for p in self.points])
+        if len(self.points) == 1:
+            self._row = lambda dev: (getter(dev),)
+        else:
+            self._row = getter
+        self.rows = []
+        self.errors = 0
+        self.flushes = 0
+        self.read_time = 0.
+
+    def columns(self):
+        """
+        Returns the column names of the captured rows.
+        """
+        return [TIME, TOTAL_TIME] + self.channels
+
+    def sample(self, t):
+        """
+        Reads the models once and buffers one row for sample time t (s since the start of the capture).
+        """
+        start = time.time()
+        try:
+            for m in self._model_objs:
+                m.read()
+            values = self._row(self.device)
+        except Exception, e:
+            self.errors += 1
+            if self.log_error is not None:
+                self.log_error('EUT could not be read at %0.3f s: %s' % (t, e))
+            return None
+        now = time.time()
+        self.read_time += now - start
+        row = [now, t]
+        row.extend(values)
+        self.rows.append(row)
+        return row
+
+    def flush(self):
+        """
+        Hands the buffered rows to the sink.
+        """
+        if self.sink is None or not self.rows:
+            return
+        for row in self.rows:
+            self.sink.append(row)
+        self.sink.flush()
+        self.rows = []
+        self.flushes += 1
+
+    def run(self, duration=None, count=None):
+        """
+        Captures until duration seconds have elapsed or count samples have been taken. Returns stats().
+        """
+        last_flush = 0.
+        try:
+            for t in self.sampler.ticks(duration=duration, count=count):
+                self.sample(t)
+                if self.flush_interval is not None and t - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = t
+        finally:
+            self.flush()
+        return self.stats()
+
+    def stats(self):
+        """
+        Returns the sampler statistics (count, overruns, dropped, jitter, achieved rate) with the capture counters:
+            samples - rows captured
+            errors - samples that could not be read
+            read_mean - mean time to read the models for a sample (s)
+        """
+        s = self.sampler.stats()
+        s['samples'] = s['count'] - self.errors
+        s['errors'] = self.errors
+        s['read_mean'] = self.read_time/s['samples'] if s['samples'] else 0.
+        s['target_rate'] = self.sampler.rate
+        return s
+
+    def __str__(self):
+        s = self.stats()
+        return ('Capture: %d samples of %d channels (%s models) at %0.3f Hz (target %0.3f Hz), %d dropped, '
+                '%d read errors, read time mean %0.1f ms' %
+                (s['samples'], len(self.channels), ', '.join(self.models), s['rate'], s['target_rate'],
+                 s['dropped'], s['errors'], s['read_mean']*1000.))
+
+
+if __name__ == "__main__":
+
+    import random
+
+    class Model(object):
+        # stand-in for a SunSpec client model with a read latency
+        def __init__(self, points, latency):
+            self.points = points
+            self.latency = latency
+            for p in points:
+                setattr(self, p, None)
+
+        def read(self):
+            time.sleep(self.latency)
+            for p in self.points:
+                setattr(self, p, random.random())
+
+    class Device(object):
+        def __init__(self):
+            self.models = ['common', 'inverter', 'settings']
+            self.common = Model(['Mn', 'Md'], 0.005)
+            self.inverter = Model(['Hz', 'W', 'PF', 'DCA', 'DCV'], 0.02)
+            self.settings = Model(['WMax', 'VRef'], 0.01)
+
+    dev = Device()
+    channels = 'Hz, W, PF, DCA, DCV, settings.WMax'
+
+    # reference: eval() of every channel and a model read per channel
+    start = time.time()
+    for i in range(20):
+        row = []
+        for name in parse_channels(channels):
+            model, point = name.split('.') if '.' in name else ('inverter', name)
+            getattr(dev, model).read()
+            row.append(eval('dev.%s.%s' % (model, point)))
+    print 'per channel reads: %0.1f ms per sample' % ((time.time() - start)/20*1000.)
+
+    for interval in (1., 0.1, 0.02):
+        c = Capture(dev, channels, interval=interval)
+        c.run(duration=min(2., 20*interval))
+        print '%5.2f s interval: %s' % (interval, c)
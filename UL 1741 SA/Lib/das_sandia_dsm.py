@@ -1,4 +1,8 @@
 import os
+import time
+import socket
+import threading
+import collections
 import das
 
 sandia_info = {
@@ -22,14 +26,27 @@ def params(info, group_name=None):
                     'to python by writing the values locally or collecting them over the local TCP network.')
     info.param(pname('das_comp'), label='Data Acquisition Computer', default='10 Node',
                values=['10 Node', 'DAS 3', 'DAS 5', 'DAS 8'],
-               active=pname('dsm_method'), active_value=['Sandia LabView DSM'],
+               active=pname('dsm_method'), active_value=['Sandia LabView DSM', 'TCP Stream for Sandia LabView DSM'],
                desc='Selection of the data acquisition system (if there are multiple options).')
     info.param(pname('node'), label='Node at Sandia - Used to ID DAQ channel', default=10, active=pname('das_comp'),
                active_value=['10 Node'],
                desc='Selection of the EUT which will be used for the test (Sandia specific).')
+    info.param(pname('ipaddr'), label='DSM Stream IP Address', default='127.0.0.1',
+               active=pname('dsm_method'), active_value=['TCP Stream for Sandia LabView DSM'])
+    info.param(pname('ipport'), label='DSM Stream IP Port', default=STREAM_PORT,
+               active=pname('dsm_method'), active_value=['TCP Stream for Sandia LabView DSM'])
+    info.param(pname('buffer_len'), label='DSM Stream Buffer Length (samples)', default=STREAM_BUFFER_LEN,
+               active=pname('dsm_method'), active_value=['TCP Stream for Sandia LabView DSM'],
+               desc='Number of the most recent samples kept in memory from the stream.')
 
 GROUP_NAME = 'sandia'
 
+DSM_METHOD_FILE = 'Sandia LabView DSM'
+DSM_METHOD_STREAM = 'TCP Stream for Sandia LabView DSM'
+
+STREAM_PORT = 4950
+STREAM_BUFFER_LEN = 1000
+
 PATH = 'C:\\python_dsm\\'
 POINTS_FILE = 'C:\\python_dsm\\channels.txt'
 DATA_FILE = 'C:\\python_dsm\\data.txt'
@@ -275,6 +292,215 @@ class Data(das.Data):
         pass
 
 
+class StreamData(Data):
+    """
+    DSM data received over TCP instead of through the data file.
+
+    The DSM stream is line oriented. The first line holds the channel names in the channels file format and each
+    following line holds one sample in the data file format. A background thread receives the samples and keeps
+    the most recent ones in a ring buffer. read() copies the newest sample into the data attributes without any
+    file or network access.
+    """
+
+    def __init__(self, ts, dsm_id=None, ipaddr='127.0.0.1', ipport=STREAM_PORT, buffer_len=STREAM_BUFFER_LEN,
+                 timeout=5, points=None):
+        das.Data.__init__(self, ts)
+        self._points = points
+        self._points_map = dsm_points_map.get(str(dsm_id), dsm_points_10)
+        self.read_error_count = 0
+        self.read_last_error = ''
+        self.ipaddr = ipaddr
+        self.ipport = int(ipport)
+        self.timeout = timeout
+        self.buffer = collections.deque(maxlen=int(buffer_len))
+        self.sample_count = 0
+        self._lock = threading.Lock()
+        self._points_ready = threading.Event()
+        self._running = True
+        self._conn = None
+
+        if self._points is not None:
+            self._set_points(self._points)
+
+        self._thread = threading.Thread(target=self._receive)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _set_points(self, points):
+        self._points = points
+        for p in self._points:
+            point_name = self._points_map.get(p)
+            if point_name is not None and point_name not in self.__dict__:
+                self[point_name] = None
+        self._points_ready.set()
+
+    def _line(self, line):
+        fields = self.extract_points(line.strip())
+        if not fields:
+            return
+        try:
+            sample = [float(v) for v in fields]
+        except ValueError:
+            # channel name line, sent by the DSM at the start of every connection
+            with self._lock:
+                self._set_points(fields)
+            return
+        with self._lock:
+            if self._points is None:
+                # samples received before the channel name line cannot be assigned to points
+                return
+            self.buffer.append(sample)
+            self.sample_count += 1
+
+    def _receive(self):
+        while self._running:
+            pending = ''
+            try:
+                self._conn = socket.create_connection((self.ipaddr, self.ipport), self.timeout)
+                self._conn.settimeout(self.timeout)
+                while self._running:
+                    data = self._conn.recv(4096)
+                    if not data:
+                        raise das.DASError('DSM stream closed by %s:%s' % (self.ipaddr, self.ipport))
+                    lines = (pending + data).split('\n')
+                    pending = lines.pop()
+                    for line in lines:
+                        self._line(line)
+            except Exception, e:
+                if self._running:
+                    self.read_error_count += 1
+                    self.read_last_error = str(e)
+                    time.sleep(1)
+            finally:
+                if self._conn is not None:
+                    try:
+                        self._conn.close()
+                    except Exception:
+                        pass
+                    self._conn = None
+
+    def wait(self, timeout=None):
+        """
+        Waits until the first sample has been received. Returns True if a sample is available.
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        while self.sample_count == 0:
+            if end is not None and time.time() >= end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def samples(self, count=None):
+        """
+        Returns the most recent samples (oldest first) as dicts of normalized point names.
+        """
+        with self._lock:
+            buf = list(self.buffer)
+            points = self._points
+        if points is None:
+            return []
+        if count is not None:
+            buf = buf[-count:]
+        result = []
+        for sample in buf:
+            values = {}
+            for i in range(min(len(points), len(sample))):
+                point_name = self._points_map.get(points[i])
+                if point_name is not None:
+                    values[point_name] = sample[i]
+            result.append(values)
+        return result
+
+    def read(self):
+        with self._lock:
+            if len(self.buffer) == 0 or self._points is None:
+                return
+            sample = self.buffer[-1]
+            points = self._points
+        if len(sample) == len(points):
+            for i in range(len(points)):
+                point_name = self._points_map.get(points[i])
+                if point_name is not None:
+                    self[point_name] = sample[i]
+
+    def close(self):
+        self._running = False
+        conn = self._conn
+        if conn is not None:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+        self._thread.join(self.timeout)
+
+
+class StreamServer(object):
+    """
+    Loopback stand-in for the DSM TCP stream, used to exercise StreamData without the LabView DSM.
+
+    points is the list of DSM channel names, sample is a function returning the list of values for one sample.
+    Samples are sent to every connected client at the given rate (Hz). Use port 0 to pick a free port.
+    """
+
+    def __init__(self, points, sample, ipaddr='127.0.0.1', ipport=0, rate=10.):
+        self.points = points
+        self.sample = sample
+        self.rate = float(rate)
+        self.clients = []
+        self._running = False
+        self._lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((ipaddr, ipport))
+        self.sock.listen(5)
+        self.ipaddr, self.ipport = self.sock.getsockname()
+
+    def start(self):
+        self._running = True
+        for target in (self._accept, self._send):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        self._running = False
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        with self._lock:
+            for c in self.clients:
+                c.close()
+            self.clients = []
+
+    def _accept(self):
+        while self._running:
+            try:
+                conn, addr = self.sock.accept()
+                conn.sendall('[%s]\n' % ','.join(self.points))
+                with self._lock:
+                    self.clients.append(conn)
+            except Exception:
+                pass
+
+    def _send(self):
+        period = 1./self.rate
+        next_time = time.time()
+        while self._running:
+            line = '[%s]\n' % ','.join([str(v) for v in self.sample()])
+            with self._lock:
+                for c in list(self.clients):
+                    try:
+                        c.sendall(line)
+                    except Exception:
+                        c.close()
+                        self.clients.remove(c)
+            next_time += period
+            time.sleep(max(0, next_time - time.time()))
+
+
 class Trigger(das.Trigger):
 
     def __init__(self, ts, filename=TRIGGER_FILE):
@@ -310,12 +536,22 @@ class DAS(das.DAS):
 
     def __init__(self, ts, group_name):
         das.DAS.__init__(self, ts, group_name)
-        self.ts.log('dsm_method = %s' % self.param_value('dsm_method'))
+        self.dsm_method = self.param_value('dsm_method')
+        self.ts.log('dsm_method = %s' % self.dsm_method)
+        self._data = []
 
     def param_value(self, name):
         return self.ts.param_value(self.group_name + '.' + GROUP_NAME + '.' + name)
 
     def data_init(self):
+        if self.dsm_method == DSM_METHOD_STREAM:
+            node = None
+            if self.param_value('das_comp') == '10 Node':
+                node = self.param_value('node')
+            data = StreamData(self.ts, dsm_id=node, ipaddr=self.param_value('ipaddr'),
+                              ipport=self.param_value('ipport'), buffer_len=self.param_value('buffer_len'))
+            self._data.append(data)
+            return data
         return Data(self.ts)
 
     def config(self):
@@ -336,7 +572,9 @@ class DAS(das.DAS):
         Close any open communications resources associated with the grid
         simulator.
         """
-        pass
+        for data in self._data:
+            data.close()
+        self._data = []
 
     def value_capture(self):
         pass
@@ -351,5 +589,18 @@ class DAS(das.DAS):
         pass
 
 if __name__ == "__main__":
-    pass
 
+    # loopback check of the DSM stream
+    import random
+    points = ['time', 'ac_voltage_10', 'ac_current_10', 'ac10_watts']
+    server = StreamServer(points, lambda: [time.time(), 240. + random.random(), 10., 2400.], rate=50.)
+    server.start()
+    d = StreamData(None, dsm_id=10, ipport=server.ipport)
+    if d.wait(timeout=5):
+        time.sleep(0.5)
+        d.read()
+        print 'samples buffered = %d, ac_voltage = %s, ac_watts = %s' % (len(d.buffer), d.ac_voltage, d.ac_watts)
+    else:
+        print 'no samples received: %s' % d.read_last_error
+    d.close()
+    server.stop()
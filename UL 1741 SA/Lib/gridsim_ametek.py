@@ -1,9 +1,8 @@
 
 import os
 import time
-import serial
-import socket
 import gridsim
+import scpi
 import grid_profiles
 
 ametek_info = {
@@ -30,6 +29,23 @@ def params(info):
     info.param('gridsim.ametek.ip_port', label='IP Port',
                active='gridsim.ametek.comm',  active_value=['TCP/IP'], default=5025)
 
+# list mode configuration sent with the lists on every profile start, and the trigger sent once they are accepted
+PROFILE_SETUP = [
+    'trig:tran:sour imm\n',
+    'list:step auto\n',
+    'abort\n',
+    'abort;:inst:coup none;:list:coun 1;:freq:mode list;:freq:slew:mode list\n',
+    ':inst:nsel 1;:volt:mode list;:volt:slew:mode list;:func:mode list\n',
+    ':inst:nsel 2;:volt:mode list;:volt:slew:mode list;:func:mode list\n',
+    ':inst:nsel 3;:volt:mode list;:volt:slew:mode list;:func:mode list\n',
+    'inst:coup all\n'
+]
+PROFILE_TRIGGER = [
+    '*esr?\n',
+    'trig:sync:sour imm\n',
+    ':init\n'
+]
+
 class GridSim(gridsim.GridSim):
     """
     Ametek grid simulation implementation.
@@ -51,7 +67,13 @@ class GridSim(gridsim.GridSim):
     """
     def __init__(self, ts):
         self.buffer_size = 1024
+        self.batch_size = 1024  # max bytes per write when sending command batches
+        self.error_queue_max = 32  # max entries read when draining the error queue
         self.conn = None
+        # list commands held by the instrument by list key. This assumes the instrument keeps its list data through
+        # abort (profile_stop) and the list mode setup of PROFILE_SETUP. The cache is cleared by every method that
+        # changes the output or its mode, and checked against the instrument before it is relied on (lists_held).
+        self.loaded_lists = {}
 
         gridsim.GridSim.__init__(self, ts)
 
@@ -69,17 +91,9 @@ class GridSim(gridsim.GridSim):
         self.timeout = 5
         self.write_timeout = 2
         self.cmd_str = ''
-        self._cmd = None
-        self._query = None
         self.profile_name = ts.param_value('profile.profile_name')
 
-        if self.comm == 'Serial':
-            self.open()  # open communications
-            self._cmd = self.cmd_serial
-            self._query = self.query_serial
-        elif self.comm == 'TCP/IP':
-            self._cmd = self.cmd_tcp
-            self._query = self.query_tcp
+        self.open()  # open communications
 
         self.profile_stop()
 
@@ -95,82 +109,36 @@ class GridSim(gridsim.GridSim):
                 self.ts.log('Turning on grid simulator.')
                 self.relay(state=gridsim.RELAY_CLOSED)
 
-    def cmd_serial(self, cmd_str):
-        self.cmd_str = cmd_str
+    def _cmd(self, cmd_str):
         try:
             if self.conn is None:
                 raise gridsim.GridSimError('Communications port not open')
 
-            self.conn.flushInput()
+            # print 'cmd> %s' % (cmd_str)
             self.conn.write(cmd_str)
-        except Exception, e:
-             raise gridsim.GridSimError(str(e))
-
-    def query_serial(self, cmd_str):
-        resp = ''
-        more_data = True
-
-        self.cmd_serial(cmd_str)
-
-        while more_data:
-            try:
-                count = self.conn.inWaiting()
-                if count < 1:
-                    count = 1
-                data = self.conn.read(count)
-                if len(data) > 0:
-                    for d in data:
-                        resp += d
-                        if d == '\n':
-                            more_data = False
-                            break
-                else:
-                    raise gridsim.GridSimError('Timeout waiting for response')
-            except gridsim.GridSimError:
-                raise
-            except Exception, e:
-                raise gridsim.GridSimError('Timeout waiting for response - More data problem')
-
-        return resp
+        except scpi.SCPIError, e:
+            raise gridsim.GridSimError(str(e))
 
-    def cmd_tcp(self, cmd_str):
+    def _query(self, cmd_str):
         try:
             if self.conn is None:
-                self.ts.log('ipaddr = %s  ipport = %s' % (self.ipaddr, self.ipport))
-                self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.conn.settimeout(self.timeout)
-                self.conn.connect((self.ipaddr, self.ipport))
+                raise gridsim.GridSimError('Communications port not open')
 
-            # print 'cmd> %s' % (cmd_str)
-            self.conn.send(cmd_str)
-        except Exception, e:
+            return self.conn.query(cmd_str)
+        except scpi.SCPIError, e:
             raise gridsim.GridSimError(str(e))
 
-    def query_tcp(self, cmd_str):
-        resp = ''
-        more_data = True
-
-        self._cmd(cmd_str)
-
-        while more_data:
-            try:
-                data = self.conn.recv(self.buffer_size)
-                if len(data) > 0:
-                    for d in data:
-                        resp += d
-                        if d == '\n': #\r
-                            more_data = False
-                            break
-            except Exception, e:
-                raise gridsim.GridSimError('Timeout waiting for response')
-
-        return resp
+    def _resp(self):
+        try:
+            return self.conn.read_line()
+        except scpi.SCPIError, e:
+            raise gridsim.GridSimError(str(e))
 
     def cmd(self, cmd_str):
         self.cmd_str = cmd_str
         try:
-            self._cmd(cmd_str)
-            resp = self._query('SYSTem:ERRor?\n') #\r
+            # send the command and the error query in a single write
+            resp = self._query(cmd_str + 'SYSTem:ERRor?\n') #\r
 
             if len(resp) > 0:
                 if resp[0] != '0':
@@ -178,6 +146,68 @@ class GridSim(gridsim.GridSim):
         except Exception, e:
             raise gridsim.GridSimError(str(e))
 
+    def cmd_batch(self, cmd_list):
+        """
+        Send a list of commands using as few writes as possible and check the error queue once at the end
+        instead of after every command. Responses to queries in the list are returned in order.
+        """
+        writes = []
+        batch = []
+        batch_len = 0
+        for cmd_str in cmd_list:
+            if batch and batch_len + len(cmd_str) > self.batch_size:
+                writes.append(batch)
+                batch = []
+                batch_len = 0
+            batch.append(cmd_str)
+            batch_len += len(cmd_str)
+        if batch:
+            writes.append(batch)
+
+        responses = []
+        try:
+            for batch in writes:
+                self.cmd_str = ''.join(batch)
+                self._cmd(self.cmd_str)
+                # read query responses as they are produced so they are not lost on the next write
+                for cmd_str in batch:
+                    if '?' in cmd_str:
+                        responses.append(self._resp().strip())
+            errors = self.errors()
+        except Exception, e:
+            raise gridsim.GridSimError(str(e))
+
+        if errors:
+            raise gridsim.GridSimError('; '.join([self.error_cmd(err, cmd_list) for err in errors]))
+        return responses
+
+    def errors(self):
+        """
+        Drain the instrument error queue. Returns the list of errors (empty if no errors).
+        """
+        errors = []
+        for i in range(self.error_queue_max):
+            resp = self._query('SYSTem:ERRor?\n').strip()
+            if len(resp) == 0 or resp[0] == '0':
+                break
+            errors.append(resp)
+        return errors
+
+    def error_cmd(self, err, cmd_list):
+        """
+        Return the error string with the command that caused it. The command is found by the header quoted in
+        the error message if present, otherwise the error is reported against the whole command list.
+        """
+        detail = ''
+        fields = err.split('"')
+        if len(fields) > 1:
+            detail = fields[1].split(';')[-1].strip().lower()
+        if detail:
+            for cmd_str in cmd_list:
+                if detail in cmd_str.lower():
+                    return '%s (command: %s)' % (err, cmd_str.strip())
+        return '%s (in batch: %s)' % (err, ' | '.join([c.strip() for c in cmd_list]))
+
     def query(self, cmd_str):
         try:
             resp = self._query(cmd_str).strip()
@@ -191,6 +221,7 @@ class GridSim(gridsim.GridSim):
 
     def config_phase_angles(self):
         # set the phase angles for the 3 phases
+        self.loaded_lists = {}
         self.cmd('inst:coup none;:inst:nsel 1;:phas 0.0\n')
         self.cmd('inst:coup none;:inst:nsel 1;:phas 0.0\n')
         self.cmd('inst:coup none;:inst:nsel 2;:phas 120.0\n')
@@ -245,11 +276,21 @@ class GridSim(gridsim.GridSim):
         """
         Open the communications resources associated with the grid simulator.
         """
+        self.loaded_lists = {}
         try:
-            self.conn = serial.Serial(port=self.serial_port, baudrate=self.baudrate, bytesize=8, stopbits=1, xonxoff=0,
-                                      timeout=self.timeout, writeTimeout=self.write_timeout)
-            time.sleep(2)
-        except Exception, e:
+            if self.comm == 'Serial':
+                self.conn = scpi.SerialTransport(self.serial_port, baudrate=self.baudrate,
+                                                 write_timeout=self.write_timeout, terminator='\n',
+                                                 timeout=self.timeout, buffer_size=self.buffer_size,
+                                                 flush_on_write=True)
+                self.conn.open()
+                time.sleep(2)
+            elif self.comm == 'TCP/IP':
+                # connection is made on the first command
+                self.ts.log('ipaddr = %s  ipport = %s' % (self.ipaddr, self.ipport))
+                self.conn = scpi.SocketTransport(self.ipaddr, self.ipport, terminator='\n', timeout=self.timeout,
+                                                 buffer_size=self.buffer_size)
+        except scpi.SCPIError, e:
             raise gridsim.GridSimError(str(e))
 
     def close(self):
@@ -266,6 +307,7 @@ class GridSim(gridsim.GridSim):
         the value for current.
         """
         if current is not None:
+            self.loaded_lists = {}
             self.cmd('inst:coup all;:curr %0.2f\n' % current)
         curr_str = self.query('inst:nsel 1;:curr?\n')
         return float(curr_str[:-1])
@@ -276,6 +318,7 @@ class GridSim(gridsim.GridSim):
         the value for max current.
         """
         if current is not None:
+            self.loaded_lists = {}
             self.cmd('inst:coup all;:curr %0.2f\n' % current)
         curr_str = self.query('inst:nsel 1;:curr? max\n')
         return float(curr_str[:-1])
@@ -286,6 +329,7 @@ class GridSim(gridsim.GridSim):
         the value for frequency.
         """
         if freq is not None:
+            self.loaded_lists = {}
             self.cmd('freq %0.2f\n' % freq)
         freq = self.query('freq?\n')
         return freq
@@ -298,100 +342,62 @@ class GridSim(gridsim.GridSim):
             self.ts.log_warning('Manual reserved for not running a profile')
             return
 
-        v_nom = self.v_nom_param
-        freq_nom = self.freq_param
-
         # for simple transient steps in voltage or frequency, use v_step, f_step, and t_step
-        if profile_name is 'Transient_Step':
-            if t_step is None:
-                raise gridsim.GridSimError('Transient profile did not have a duration.')
-            else:
-                # (time offset in seconds, % nominal voltage, % nominal frequency)
-                profile = [(0, v_step, f_step),(t_step, v_step, f_step),(t_step, 100, 100)]
+        # the compiled program is cached, loading the same profile again costs nothing
+        try:
+            self.profile = grid_profiles.program(profile_name, self.v_nom_param, self.freq_param, v_step=v_step,
+                                                 f_step=f_step, t_step=t_step, v_max=self.v_max_param)
+        except grid_profiles.ProfileError, e:
+            raise gridsim.GridSimError(str(e))
 
-        else:
-            # get the profile from grid_profiles
-            profile = grid_profiles.profiles.get(profile_name)
-            if profile is None:
-                raise gridsim.GridSimError('Profile Not Found: %s' % profile_name)
-
-        dwell_list = ''
-        v_list = ''
-        v_slew_list = ''
-        freq_list = ''
-        freq_slew_list = ''
-        func_list = ''
-        rep_list = ''
-        for i in range(1, len(profile)):
-            v = float(profile[i - 1][1])
-            freq = float(profile[i - 1][2])
-            t_delta = float(profile[i][0]) - float(profile[i - 1][0])
-            v_delta = abs(float(profile[i][1]) - v)
-            freq_delta = abs(float(profile[i][2]) - freq)
-            v_slew = 'MAX'
-            freq_slew = 'MAX'
-            if t_delta > 0:
-                if i > 1:
-                    dwell_list += ','
-                    v_list += ','
-                    v_slew_list += ','
-                    freq_list += ','
-                    freq_slew_list += ','
-                    func_list += ','
-                    rep_list += ','
-                if v_delta > 0:
-                    v_slew = '%0.3f' % (((v_delta/t_delta)/100.) * float(v_nom))
-                    v = float(profile[i][1])  # look at next voltage
-                if freq_delta > 0:
-                    freq_slew = '%0.3f' % (((freq_delta/t_delta)/100.) * float(freq_nom))
-                    freq = float(profile[i][2])  # look at next frequency
-                dwell_list += '%0.3f' % t_delta
-                v_list += '%0.3f' % ((v/100.) * float(v_nom))
-                v_slew_list += v_slew
-                freq_list += '%0.3f' % ((freq/100.) * float(freq_nom))
-                freq_slew_list += freq_slew
-                func_list += 'SINE'
-                rep_list += '0'
-
-        cmd_list = []
-        cmd_list.append('trig:tran:sour imm\n')
-        cmd_list.append('list:step auto\n')
-        cmd_list.append('abort\n')
-        cmd_list.append('abort;:inst:coup none;:list:coun 1;:freq:mode list;:freq:slew:mode list\n')
-        cmd_list.append(':inst:nsel 1;:volt:mode list;:volt:slew:mode list;:func:mode list\n')
-        cmd_list.append(':inst:nsel 2;:volt:mode list;:volt:slew:mode list;:func:mode list\n')
-        cmd_list.append(':inst:nsel 3;:volt:mode list;:volt:slew:mode list;:func:mode list\n')
-        cmd_list.append('inst:coup all\n')
-        cmd_list.append(':list:dwel %s\n' % dwell_list)
-        cmd_list.append(':list:freq %s\n' % freq_list)
-        cmd_list.append(':list:freq:slew %s\n' % freq_slew_list)
-        cmd_list.append(':inst:nsel 1;:list:volt %s\n' % v_list)
-        cmd_list.append(':list:volt:slew %s\n' % v_slew_list)
-        cmd_list.append(':list:func %s\n' % func_list)
-        cmd_list.append(':inst:nsel 2;:list:volt %s\n' % v_list)
-        cmd_list.append(':list:volt:slew %s\n' % v_slew_list)
-        cmd_list.append(':list:func %s\n' % func_list)
-        cmd_list.append(':inst:nsel 3;:list:volt %s\n' % v_list)
-        cmd_list.append(':list:volt:slew %s\n' % v_slew_list)
-        cmd_list.append(':list:func %s\n' % func_list)
-        cmd_list.append(':list:rep %s\n' % rep_list)
-        cmd_list.append('*esr?\n')
-        cmd_list.append('trig:sync:sour imm\n')
-        cmd_list.append(':init\n')
-
-        self.profile = cmd_list
+    def profile_lists(self, program):
+        """
+        Returns the list commands of a program as (key, command) pairs. The per phase commands select the phase,
+        so each can be sent on its own.
+        """
+        dwell, volt, volt_slew, freq, freq_slew = program.lists()
+        func = ','.join(['SINE']*len(program))
+        rep = ','.join(['0']*len(program))
+        cmds = [('dwel', ':list:dwel %s\n' % dwell),
+                ('freq', ':list:freq %s\n' % freq),
+                ('freq:slew', ':list:freq:slew %s\n' % freq_slew)]
+        for phase in range(1, 4):
+            cmds.append(('volt %d' % phase, ':inst:nsel %d;:list:volt %s\n' % (phase, volt)))
+            cmds.append(('volt:slew %d' % phase, ':inst:nsel %d;:list:volt:slew %s\n' % (phase, volt_slew)))
+            cmds.append(('func %d' % phase, ':inst:nsel %d;:list:func %s\n' % (phase, func)))
+        cmds.append(('rep', ':list:rep %s\n' % rep))
+        return cmds
+
+    def lists_held(self, program):
+        """
+        Check that the instrument still holds lists of the program length before the cached lists are relied on.
+        Only the point count of the phase 1 voltage list is compared, the instrument may format the values differently.
+        """
+        resp = self.query(':inst:nsel 1;:list:volt?\n')
+        return len([v for v in resp.split(',') if v.strip()]) == len(program)
 
     def profile_start(self):
         """
-        Start the loaded profile.
+        Start the loaded profile. Only the lists that differ from those already held by the instrument are sent.
+        The trigger is only sent once the setup and the lists have been accepted without error.
         """
-        if self.profile is not None:
-            for entry in self.profile:
-                self.cmd(entry)
+        if not self.profile:
+            return
+        lists = self.profile_lists(self.profile)
+        if self.loaded_lists and not self.lists_held(self.profile):
+            self.loaded_lists = {}
+        cmd_list = list(PROFILE_SETUP)
+        cmd_list.extend([cmd_str for key, cmd_str in lists if self.loaded_lists.get(key) != cmd_str])
+        # the instrument lists are unknown if the batch fails part way
+        self.loaded_lists = {}
+        # cmd_batch drains the error queue and raises on any error, so a rejected list never gets triggered
+        self.cmd_batch(cmd_list)
+        self.loaded_lists = dict(lists)
+        self.cmd_batch(PROFILE_TRIGGER)
 
     def profile_stop(self):
         """
-        Stop the running profile.
+        Stop the running profile. The lists are kept by the instrument and may be reused by the next profile_start.
         """
         self.cmd('abort\n')
 
@@ -400,6 +406,8 @@ class GridSim(gridsim.GridSim):
         Set the state of the regen mode if provided. Valid states are: REGEN_ON,
         REGEN_OFF. If none is provided, obtains the state of the regen mode.
         """
+        if state is not None:
+            self.loaded_lists = {}
         if state == gridsim.REGEN_ON:
             self.cmd('REGenerate:STATe ON\n')
             self.query('*esr?\n')
@@ -425,6 +433,7 @@ class GridSim(gridsim.GridSim):
         RELAY_CLOSED. If none is provided, obtains the state of the relay.
         """
         if state is not None:
+            self.loaded_lists = {}
             if state == gridsim.RELAY_OPEN:
                 self.cmd('abort;:outp off\n')
             elif state == gridsim.RELAY_CLOSED:
@@ -450,6 +459,7 @@ class GridSim(gridsim.GridSim):
         """
         if voltage is not None:
             # set output voltage on all phases
+            self.loaded_lists = {}
             # self.ts.log_debug('voltage: %s, type: %s' % (voltage, type(voltage)))
             if type(voltage) is not list and type(voltage) is not tuple:
                 self.cmd('inst:coup all;:volt:ac %0.1f\n' % voltage)
@@ -467,6 +477,7 @@ class GridSim(gridsim.GridSim):
         """
         if voltage is not None:
             voltage = max(voltage)  # voltage is a triplet but Ametek only takes one value
+            self.loaded_lists = {}
             if voltage == 150 or voltage == 300 or voltage == 600:
                 self.cmd('volt:rang %0.0f\n' % voltage)
             else:
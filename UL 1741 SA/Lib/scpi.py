@@ -0,0 +1,351 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Buffered SCPI line transports for socket and serial instruments.
+
+Received bytes are kept in a buffer between calls, so bytes that arrive after a response terminator (e.g. the
+response to a pipelined query) are returned by the next read instead of being lost. Responses are split on the
+terminator with a string search on the received block rather than character by character.
+
+    conn = scpi.SocketTransport('192.168.1.10', 5025, terminator='\\n', timeout=5)
+    idn = conn.query('*IDN?\\n')
+    conn.stats()  # query count and latency
+
+Run stand-alone to exercise the transports against a local fake instrument:
+
+    python scpi.py
+"""
+
+import time
+import socket
+import threading
+
+
+class SCPIError(Exception):
+    pass
+
+
+class Transport(object):
+    """
+    Base buffered line transport. Subclasses implement _open(), _write(data), _recv(timeout) and _close().
+
+    terminator - response line terminator.
+    timeout - seconds to wait for a complete response line.
+    flush_on_write - discard any unread input before each write (for instruments that may send unsolicited
+                     output).
+    """
+
+    def __init__(self, terminator='\n', timeout=5, buffer_size=1024, flush_on_write=False):
+        self.terminator = terminator
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.flush_on_write = flush_on_write
+        self.buf = ''
+        self.is_open = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.writes = 0
+        self.bytes_written = 0
+        self.lines_read = 0
+        self.bytes_read = 0
+        self.queries = 0
+        self.latency_last = 0.
+        self.latency_total = 0.
+        self.latency_max = 0.
+
+    def open(self):
+        if not self.is_open:
+            self._open()
+            self.is_open = True
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.buf = ''
+            self._close()
+
+    def flush_input(self):
+        """
+        Discard buffered and pending input.
+        """
+        self.buf = ''
+        self._flush()
+
+    def write(self, data):
+        self.open()
+        if self.flush_on_write:
+            self.flush_input()
+        self._write(data)
+        self.writes += 1
+        self.bytes_written += len(data)
+
+    def read_line(self, timeout=None):
+        """
+        Returns the next response line including its terminator.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        self.open()
+        term = self.terminator
+        start = 0
+        deadline = time.time() + timeout
+        while True:
+            i = self.buf.find(term, start)
+            if i >= 0:
+                i += len(term)
+                line = self.buf[:i]
+                self.buf = self.buf[i:]
+                self.lines_read += 1
+                return line
+            # only search the new data next time, allowing for a terminator split across blocks
+            start = max(0, len(self.buf) - len(term) + 1)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise SCPIError('Timeout waiting for response')
+            data = self._recv(remaining)
+            if not data:
+                raise SCPIError('Timeout waiting for response')
+            self.bytes_read += len(data)
+            self.buf += data
+
+    def query(self, cmd_str, timeout=None):
+        """
+        Write cmd_str and return the response line (including the terminator).
+        """
+        start = time.time()
+        self.write(cmd_str)
+        line = self.read_line(timeout)
+        latency = time.time() - start
+        self.queries += 1
+        self.latency_last = latency
+        self.latency_total += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        return line
+
+    def stats(self):
+        """
+        Returns a dict of transfer counts and query latency (seconds).
+        """
+        mean = 0.
+        if self.queries > 0:
+            mean = self.latency_total/self.queries
+        return {'writes': self.writes, 'bytes_written': self.bytes_written, 'lines_read': self.lines_read,
+                'bytes_read': self.bytes_read, 'queries': self.queries, 'latency_last': self.latency_last,
+                'latency_mean': mean, 'latency_max': self.latency_max}
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _flush(self):
+        pass
+
+    def _write(self, data):
+        raise SCPIError('Write not implemented')
+
+    def _recv(self, timeout):
+        raise SCPIError('Read not implemented')
+
+
+class SocketTransport(Transport):
+    """
+    TCP/IP instrument connection. The connection is made on the first write.
+    """
+
+    def __init__(self, ipaddr, ipport, **kwargs):
+        Transport.__init__(self, **kwargs)
+        self.ipaddr = ipaddr
+        self.ipport = ipport
+        self.sock = None
+
+    def _open(self):
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # commands are small and usually followed by a query, don't hold them back
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect((self.ipaddr, self.ipport))
+        except Exception, e:
+            self.sock = None
+            raise SCPIError('Unable to connect to %s:%s: %s' % (self.ipaddr, self.ipport, str(e)))
+
+    def _close(self):
+        try:
+            if self.sock is not None:
+                self.sock.close()
+        finally:
+            self.sock = None
+
+    def _flush(self):
+        if self.sock is None:
+            return
+        self.sock.setblocking(0)
+        try:
+            while True:
+                if not self.sock.recv(self.buffer_size):
+                    break
+        except socket.error:
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+    def _write(self, data):
+        try:
+            self.sock.sendall(data)
+        except Exception, e:
+            raise SCPIError(str(e))
+
+    def _recv(self, timeout):
+        try:
+            self.sock.settimeout(timeout)
+            return self.sock.recv(self.buffer_size)
+        except socket.timeout:
+            return ''
+        except Exception, e:
+            raise SCPIError(str(e))
+        finally:
+            if self.sock is not None:
+                self.sock.settimeout(self.timeout)
+
+
+class SerialTransport(Transport):
+    """
+    Serial instrument connection (requires pyserial).
+    """
+
+    def __init__(self, port, baudrate=9600, write_timeout=2, **kwargs):
+        Transport.__init__(self, **kwargs)
+        self.port = port
+        self.baudrate = baudrate
+        self.write_timeout = write_timeout
+        self.serial = None
+
+    def _open(self):
+        try:
+            import serial
+            self.serial = serial.Serial(port=self.port, baudrate=self.baudrate, bytesize=8, stopbits=1, xonxoff=0,
+                                        timeout=self.timeout, writeTimeout=self.write_timeout)
+        except Exception, e:
+            self.serial = None
+            raise SCPIError('Unable to open %s: %s' % (self.port, str(e)))
+
+    def _close(self):
+        try:
+            if self.serial is not None:
+                self.serial.close()
+        finally:
+            self.serial = None
+
+    def _flush(self):
+        if self.serial is not None:
+            self.serial.flushInput()
+
+    def _write(self, data):
+        try:
+            self.serial.write(data)
+        except Exception, e:
+            raise SCPIError(str(e))
+
+    def _recv(self, timeout):
+        try:
+            self.serial.timeout = timeout
+            count = self.serial.inWaiting()
+            if count < 1:
+                count = 1
+            return self.serial.read(count)
+        except Exception, e:
+            raise SCPIError(str(e))
+
+
+class FakeInstrument(object):
+    """
+    Local TCP server answering SCPI queries for exercising the transports without hardware.
+
+    responses - dict of command (upper case, without terminator) to response string. Queries not in the dict are
+                answered with '0'. Commands in errors push an error onto the SYSTem:ERRor? queue.
+    chunk - send responses in pieces of this many bytes to exercise split reads.
+    """
+
+    def __init__(self, responses=None, errors=None, terminator='\n', chunk=None):
+        self.responses = responses or {}
+        self.errors = errors or []
+        self.terminator = terminator
+        self.chunk = chunk
+        self.error_queue = []
+        self.received = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.ipport = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _send(self, conn, resp):
+        data = resp + self.terminator
+        if self.chunk:
+            for i in range(0, len(data), self.chunk):
+                conn.sendall(data[i:i + self.chunk])
+                time.sleep(0.001)
+        else:
+            conn.sendall(data)
+
+    def _serve(self):
+        try:
+            conn, addr = self.sock.accept()
+        except socket.error:
+            return
+        buf = ''
+        while True:
+            try:
+                data = conn.recv(4096)
+            except socket.error:
+                break
+            if not data:
+                break
+            buf += data
+            while self.terminator in buf:
+                line, buf = buf.split(self.terminator, 1)
+                line = line.strip()
+                self.received.append(line)
+                key = line.upper()
+                if key in [e.upper() for e in self.errors]:
+                    self.error_queue.append('-113,"Undefined header;%s"' % line)
+                if key.startswith('SYST') and ':ERR' in key and key.endswith('?'):
+                    if self.error_queue:
+                        self._send(conn, self.error_queue.pop(0))
+                    else:
+                        self._send(conn, '0,"No error"')
+                elif key.endswith('?'):
+                    self._send(conn, self.responses.get(key, '0'))
+        conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+
+    for term in ['\n', '\r']:
+        fake = FakeInstrument(responses={'*IDN?': 'Fake Instrument,0,1.0'}, errors=['BAD:CMD'], terminator=term,
+                              chunk=3)
+        conn = SocketTransport('127.0.0.1', fake.ipport, terminator=term, timeout=2)
+        print repr(conn.query('*IDN?' + term))
+        # pipelined: two queries in one write, second response is kept in the buffer
+        conn.write('*IDN?%sSYSTem:ERRor?%s' % (term, term))
+        print repr(conn.read_line()), repr(conn.read_line())
+        conn.write('BAD:CMD' + term)
+        print repr(conn.query('SYSTem:ERRor?' + term))
+        for i in range(100):
+            conn.query('*IDN?' + term)
+        print conn.stats()
+        conn.close()
+        fake.close()
@@ -0,0 +1,470 @@
+"""
+Copyright (c) 2017, Sandia National Labs and SunSpec Alliance
+All rights reserved.
+
+Software created under the SunSpec Alliance - Sandia National Laboratories CRADA 1831.00
+
+Software-in-the-loop test bench: a simulated grid, PV source and EUT sharing one clock.
+
+The world is created by the first simulated instrument (gridsim 'Sim', pvsim 'Sim' or das 'Sim') and shared by
+the others. Closing any of the simulated instruments closes the world: the Modbus server is stopped and the real
+time functions are restored. It holds the grid (voltage, frequency, relay and the running profile), the PV source (irradiance
+and its profile) and the EUT model (sim_eut), which is served to the test script as a SunSpec Modbus TCP device.
+
+With the virtual clock, time only passes when the script sleeps: ts.sleep, time.sleep (in the script thread) and
+time.time are replaced so a 300 s profile is run as fast as the EUT model can be stepped through it. The EUT is
+advanced lazily to the clock whenever it is observed (Modbus read, DAS read) or its inputs change.
+
+    w = sim.world(ts)
+    w.grid.set(v=0.5*w.grid.v_nom)
+    ts.sleep(1.)
+    w.eut.update()
+"""
+
+import threading
+import time
+import bisect
+
+import sampler
+
+GROUP_NAME = 'sim'
+PARAM_GROUP = 'gridsim.' + GROUP_NAME
+
+CLOCK_VIRTUAL = 'Virtual'
+CLOCK_REAL = 'Real'
+
+# simulation parameters (name, label, default, values), in the gridsim.sim parameter group
+PARAMS = [
+    ('clock', 'Clock', CLOCK_VIRTUAL, [CLOCK_VIRTUAL, CLOCK_REAL]),
+    ('v_nom', 'Nominal Voltage (V)', 240.),
+    ('f_nom', 'Nominal Frequency (Hz)', 60.),
+    ('v_max', 'Maximum Voltage (V)', 300.),
+    ('i_max', 'Maximum Current (A)', 100.),
+    ('eut_w_max', 'EUT Power Rating (W)', 3000.),
+    ('eut_phases', 'EUT Phases', 1, [1, 3]),
+    ('eut_reconnect', 'EUT Reconnect Delay (s)', 5.),
+    ('eut_ipaddr', 'EUT Modbus IP Address', '127.0.0.1'),
+    ('eut_ipport', 'EUT Modbus IP Port (0 = no server)', 5020),
+    ('pv_p_max', 'PV Power at 1000 W/m^2 (W)', 3300.),
+    ('pv_v_mpp', 'PV Maximum Power Point Voltage (V)', 400.),
+]
+
+# the script thread sleeps in virtual time, other threads keep real time
+_real_time = time.time
+_real_sleep = time.sleep
+
+_world = None
+_world_lock = threading.Lock()
+
+
+class SimError(Exception):
+    pass
+
+
+def params(info):
+    """
+    Adds the simulation parameters to the gridsim 'Sim' parameter group.
+    """
+    for p in PARAMS:
+        name, label, default = p[:3]
+        values = p[3] if len(p) > 3 else None
+        if values is not None:
+            info.param(PARAM_GROUP + '.' + name, label=label, default=default, values=values)
+        else:
+            info.param(PARAM_GROUP + '.' + name, label=label, default=default)
+
+
+def param_values(ts):
+    """
+    Returns the simulation parameters as a dict, defaults for the parameters that are not set (e.g., when only the
+    pvsim or das is simulated).
+    """
+    values = {}
+    for p in PARAMS:
+        name, default = p[0], p[2]
+        value = None
+        if ts is not None:
+            try:
+                value = ts.param_value(PARAM_GROUP + '.' + name)
+            except Exception:
+                value = None
+        values[name] = value if value is not None else default
+    return values
+
+
+class RealClock(object):
+    """
+    Wall clock with the VirtualClock interface.
+    """
+
+    virtual = False
+
+    def time(self):
+        return _real_time()
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _real_sleep(seconds)
+
+    def install(self, ts=None):
+        pass
+
+    def uninstall(self):
+        pass
+
+
+class VirtualClock(object):
+    """
+    Clock advanced by sleep() instead of waiting. Starts at the wall clock time so the timestamps in logs and
+    result files remain plausible.
+    """
+
+    virtual = True
+
+    def __init__(self, start=None):
+        if start is None:
+            start = _real_time()
+        self._t = float(start)
+        self._lock = threading.Lock()
+        self._installed = None
+        self._thread = None
+
+    def time(self):
+        return self._t
+
+    monotonic = time
+
+    def advance(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._t += seconds
+        return self._t
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def _sleep(self, seconds):
+        # time.sleep replacement: only the script thread advances the clock
+        if threading.current_thread() is self._thread:
+            self.advance(seconds)
+        else:
+            _real_sleep(seconds)
+
+    def install(self, ts=None):
+        """
+        Replaces ts.sleep, time.time, time.sleep and the sampler clock with the virtual clock. The thread calling
+        install is the script thread.
+        """
+        if self._installed is not None:
+            return
+        self._thread = threading.current_thread()
+        self._installed = (ts, getattr(ts, 'sleep', None), sampler.monotonic)
+        if ts is not None:
+            ts.sleep = self.sleep
+        time.time = self.time
+        time.sleep = self._sleep
+        sampler.monotonic = self.monotonic
+
+    def uninstall(self):
+        if self._installed is None:
+            return
+        ts, ts_sleep, monotonic = self._installed
+        if ts is not None and ts_sleep is not None:
+            ts.sleep = ts_sleep
+        time.time = _real_time
+        time.sleep = _real_sleep
+        sampler.monotonic = monotonic
+        self._installed = None
+
+
+class Grid(object):
+    """
+    Grid simulator state. The output is the static setpoint (v, f) unless a profile is running, after the profile
+    the output returns to the setpoint like a grid simulator list transient.
+    """
+
+    def __init__(self, clock, v_nom=240., f_nom=60., sync=None):
+        self.clock = clock
+        self.v_nom = float(v_nom)
+        self.f_nom = float(f_nom)
+        self.v = self.v_nom
+        self.f = self.f_nom
+        self.relay_closed = True
+        self.sync = sync
+        self.program = None
+        self.t_start = None
+        self.last_run = None  # (start, end) of the last profile started
+        self._ends = []
+
+    def _sync(self):
+        if self.sync is not None:
+            self.sync()
+
+    def set(self, v=None, f=None):
+        """
+        Sets the static voltage and/or frequency. A running profile is stopped at its present output.
+        """
+        self._sync()
+        if self.program is not None:
+            self.stop()
+        if v is not None:
+            self.v = float(v)
+        if f is not None:
+            self.f = float(f)
+
+    def relay(self, closed):
+        self._sync()
+        self.relay_closed = bool(closed)
+
+    def start(self, program, t=None):
+        """
+        Starts a grid_profiles.Program at time t (default now).
+        """
+        self._sync()
+        self.program = program
+        self.t_start = self.clock.time() if t is None else t
+        self._ends = []
+        end = 0.
+        for dwell in program.dwell:
+            end += dwell
+            self._ends.append(end)
+        self.last_run = (self.t_start, self.t_start + end)
+
+    def stop(self):
+        """
+        Stops the profile, the output holds the present profile values.
+        """
+        self._sync()
+        if self.program is not None:
+            t = self.clock.time()
+            self.v, self.f = self.values(t)
+            if self.running(t):
+                self.last_run = (self.t_start, t)
+        self.program = None
+        self.t_start = None
+
+    def running(self, t=None):
+        if self.program is None:
+            return False
+        if t is None:
+            t = self.clock.time()
+        return t - self.t_start < self._ends[-1]
+
+    def end_time(self):
+        """
+        Returns the clock time at which the running profile ends or None.
+        """
+        if self.program is None:
+            return None
+        return self.t_start + self._ends[-1]
+
+    def _segment_value(self, i, dt, targets, slews, start):
+        target = targets[i]
+        slew = slews[i]
+        if slew is None:
+            return target
+        prev = targets[i - 1] if i > 0 else start
+        if target >= prev:
+            return min(target, prev + slew*dt)
+        return max(target, prev - slew*dt)
+
+    def values(self, t=None):
+        """
+        Returns the grid (voltage, frequency) at time t (default now), 0 V with the relay open.
+        """
+        if t is None:
+            t = self.clock.time()
+        v, f = self.v, self.f
+        p = self.program
+        if p is not None:
+            rel = t - self.t_start
+            if 0 <= rel < self._ends[-1]:
+                i = bisect.bisect_right(self._ends, rel)
+                dt = rel - (self._ends[i - 1] if i > 0 else 0.)
+                v = self._segment_value(i, dt, p.volt, p.volt_slew, self.v)
+                f = self._segment_value(i, dt, p.freq, p.freq_slew, self.f)
+        if not self.relay_closed:
+            v = 0.
+        return v, f
+
+    def next_change(self, t):
+        """
+        Returns the earliest time after t at which the output may change without a command, None if it is
+        constant. The output is constant within steps, ramps are reported as changing immediately.
+        """
+        p = self.program
+        if p is None:
+            return None
+        rel = t - self.t_start
+        if rel < 0:
+            return self.t_start
+        if rel >= self._ends[-1]:
+            return None
+        i = bisect.bisect_right(self._ends, rel)
+        if p.volt_slew[i] is not None or p.freq_slew[i] is not None:
+            return t
+        return self.t_start + self._ends[i]
+
+
+class PV(object):
+    """
+    PV simulator state: available DC power at the irradiance, optionally from an irradiance profile
+    [(time offset (s), irradiance (W/m^2)), ...], linearly interpolated and held at the last value.
+    """
+
+    def __init__(self, clock, p_max=3300., v_mpp=400., sync=None):
+        self.clock = clock
+        self.p_max = float(p_max)
+        self.v_mpp = float(v_mpp)
+        self.irradiance = 1000.
+        self.on = True
+        self.sync = sync
+        self.profile = None
+        self.t_start = None
+
+    def _sync(self):
+        if self.sync is not None:
+            self.sync()
+
+    def set(self, irradiance=None, on=None):
+        self._sync()
+        if irradiance is not None:
+            self.irradiance = float(irradiance)
+            self.profile = None
+        if on is not None:
+            self.on = bool(on)
+
+    def start(self, profile, t=None):
+        self._sync()
+        self.profile = ([float(p[0]) for p in profile], [float(p[1]) for p in profile])
+        self.t_start = self.clock.time() if t is None else t
+
+    def irradiance_at(self, t=None):
+        if self.profile is None:
+            return self.irradiance
+        if t is None:
+            t = self.clock.time()
+        times, values = self.profile
+        rel = t - self.t_start
+        if rel <= times[0]:
+            return values[0]
+        if rel >= times[-1]:
+            return values[-1]
+        i = bisect.bisect_right(times, rel)
+        t0, t1 = times[i - 1], times[i]
+        if t1 == t0:
+            return values[i]
+        return values[i - 1] + (values[i] - values[i - 1])*(rel - t0)/(t1 - t0)
+
+    def power(self, t=None):
+        """
+        Returns the available DC power (W) at time t.
+        """
+        if not self.on:
+            return 0.
+        return self.p_max*self.irradiance_at(t)/1000.
+
+    def next_change(self, t):
+        if self.profile is None:
+            return None
+        rel = t - self.t_start
+        if rel >= self.profile[0][-1]:
+            return None
+        return t
+
+
+class World(object):
+    """
+    The shared simulation: clock, grid, PV source and EUT (with its Modbus server).
+    """
+
+    def __init__(self, ts=None, params=None):
+        import sim_eut
+
+        self.ts = ts
+        self.params = param_values(ts)
+        if params is not None:
+            self.params.update(params)
+        p = self.params
+        if p['clock'] == CLOCK_VIRTUAL:
+            self.clock = VirtualClock()
+        else:
+            self.clock = RealClock()
+        self.grid = Grid(self.clock, v_nom=p['v_nom'], f_nom=p['f_nom'], sync=self.sync)
+        self.pv = PV(self.clock, p_max=p['pv_p_max'], v_mpp=p['pv_v_mpp'], sync=self.sync)
+        self.eut = sim_eut.EUT(self.clock, self.grid, self.pv, w_max=p['eut_w_max'], phases=int(p['eut_phases']),
+                               reconnect=p['eut_reconnect'])
+        self.server = None
+        if int(p['eut_ipport']):
+            self.server = sim_eut.Server(self.eut, ipaddr=p['eut_ipaddr'], ipport=int(p['eut_ipport']))
+            self.server.start()
+        self.clock.install(ts)
+        self.log('Simulation started: %s clock, EUT %0.0f W %d phase%s%s' %
+                 (p['clock'], self.eut.w_max, self.eut.phases, 's' if self.eut.phases > 1 else '',
+                  ', Modbus TCP %s:%s' % (self.server.ipaddr, self.server.ipport) if self.server else ''))
+
+    def log(self, msg):
+        if self.ts is not None:
+            self.ts.log(msg)
+
+    def sync(self):
+        """
+        Advances the EUT to the present time, called before any of its inputs change.
+        """
+        self.eut.update()
+
+    def attach(self, ts):
+        """
+        Binds the world to another test script, the clock is moved to its sleep and its thread. The world keeps the
+        parameters it was created with.
+        """
+        self.clock.uninstall()
+        self.ts = ts
+        self.clock.install(ts)
+
+    def close(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+        self.clock.uninstall()
+
+
+def world(ts=None, params=None):
+    """
+    Returns the simulation world, created on first use. A world left open by an earlier script is attached to ts.
+    """
+    global _world
+    with _world_lock:
+        if _world is None:
+            _world = World(ts, params)
+        elif ts is not None and ts is not _world.ts:
+            _world.attach(ts)
+        return _world
+
+
+def reset():
+    """
+    Closes the simulation world, the next world() call starts a new one.
+    """
+    global _world
+    with _world_lock:
+        if _world is not None:
+            _world.close()
+        _world = None
+
+
+if __name__ == "__main__":
+
+    import grid_profiles
+
+    w = world(params={'eut_ipport': 0})
+    start = time.time()
+    real_start = _real_time()
+    w.grid.start(grid_profiles.program('VV Profile', w.grid.v_nom, w.grid.f_nom))
+    for i in range(30):
+        time.sleep(10.)
+        w.eut.update()
+    print 'virtual %0.1f s in %0.3f s: %s' % (time.time() - start, _real_time() - real_start, w.eut)
+    reset()
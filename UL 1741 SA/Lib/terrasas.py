@@ -9,7 +9,8 @@ Software created under the SunSpec Alliance - Sandia National Laboratories CRADA
 
 import sys
 import time
-import socket
+
+import scpi
 
 EN_50530_CURVE = 'EN 50530 CURVE'
 
@@ -29,42 +30,30 @@ class TerraSAS(object):
         self.buffer_size = 1024
         self.conn = None
 
+    def open(self):
+        if self.conn is None:
+            self.conn = scpi.SocketTransport(self.ipaddr, self.ipport, terminator='\r', timeout=self.timeout,
+                                             buffer_size=self.buffer_size)
+
     def _cmd(self, cmd_str):
         try:
-            if self.conn is None:
-                self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.conn.settimeout(self.timeout)
-                self.conn.connect((self.ipaddr, self.ipport))
-
+            self.open()
             # print 'cmd> %s' % (cmd_str)
-            self.conn.send(cmd_str)
-        except Exception, e:
-            raise
+            self.conn.write(cmd_str)
+        except scpi.SCPIError, e:
+            raise TerraSASError(str(e))
 
     def _query(self, cmd_str):
-        resp = ''
-        more_data = True
-
-        self._cmd(cmd_str)
-
-        while more_data:
-            try:
-                data = self.conn.recv(self.buffer_size)
-                if len(data) > 0:
-                    for d in data:
-                        resp += d
-                        if d == '\r':
-                            more_data = False
-                            break
-            except Exception, e:
-                raise TerraSASError('Timeout waiting for response')
-
-        return resp
+        try:
+            self.open()
+            return self.conn.query(cmd_str)
+        except scpi.SCPIError, e:
+            raise TerraSASError(str(e))
 
     def cmd(self, cmd_str):
         try:
-            self._cmd(cmd_str)
-            resp = self._query('SYSTem:ERRor?\r')
+            # send the command and the error query in a single write
+            resp = self._query(cmd_str + 'SYSTem:ERRor?\r')
 
             if len(resp) > 0:
                 if resp[0] != '0':
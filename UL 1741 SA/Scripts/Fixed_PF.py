@@ -48,17 +48,19 @@ import sunspec.core.client as client
 import script
 
 import inverter
+import sampler
 
 # returns: True if state == current connection state and power generation matches threshold expectation, False if not
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, data=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, data):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -119,8 +121,9 @@ def pf_out_of_range(power_factor, power_factor_lower, power_factor_upper, power_
 def log_conn_state(inv, data=None):
     try:
         connected = inverter.get_conn_state(inv)
-        power = inverter.get_power(inv, data)
-        pf = inverter.get_power_factor(inv, data)
+        snap = inverter.snapshot(inv, data)
+        power = snap.power
+        pf = snap.pf
         ts.log('Current connection state is %s. Power output = %0.3f W. power factor %0.3f.' %
                (inverter.conn_state_str(connected), power, pf))
     except Exception, e:
@@ -298,8 +301,9 @@ def test_run():
                 # Initialize consecutive failure count to not script fail on transient behavior
                 failures = 0
 
+                loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
                 while elapsed_time <= test_duration:
-                    ts.sleep(0.93)
+                    loop_timer.wait()
                     elapsed_time = time.time()-start_time
 
                     pf = inverter.get_power_factor(inv, data)
@@ -41,6 +41,7 @@ import os
 import traceback
 import time
 import inverter
+import sampler
 import pvsim
 import das
 import numpy as np
@@ -134,6 +135,7 @@ def test_run():
         # Script timing and pass/fail criteria
         pretest_delay = ts.param_value('invt.pretest_delay')
         verification_delay = ts.param_value('invt.verification_delay')
+        data_update_rate = ts.param_value('invt.data_update_rate')  # Hz
         posttest_delay = ts.param_value('invt.posttest_delay')
         power_threshold = ts.param_value('invt.power_threshold')
         disable = ts.param_value('invt.disable')
@@ -204,10 +206,11 @@ def test_run():
 
                 # Step h.	Stop recording the time domain response after the ramp duration plus a
                 #           manufacturer-specified dwell time.
-                data_update_rate = 1  # Hz
                 check_duration = (Irated-Ilow)/ramp
                 test_duration = t_dwell + check_duration
                 duration = 0
+                loop_timer = sampler.Sampler(rate=data_update_rate, sleep=ts.sleep)
+                loop_timer.start()
                 while duration < test_duration+verification_delay:
                     duration = time.time()-start_time
                     ts.log_debug('duration = %0.2f, check duration = %0.2f' % (duration, check_duration))
@@ -227,7 +230,8 @@ def test_run():
                                 ts.log_error('EUT did not reach at least 95% of Irated at the end of the dwell time.')
                                 raise script.ScriptFail()
                             break
-                    time.sleep(1/data_update_rate)  # todo: should improve the loop timing
+                    loop_timer.wait()
+                ts.log_debug(str(loop_timer))
 
                 if posttest_delay > 0:
                     ts.log('Waiting for post-test delay of %d seconds' % posttest_delay)
@@ -316,6 +320,8 @@ info.param('invt.verification_delay', label='Verification Delay (seconds)', defa
            desc='Time allowed for INV1 operations. Applied to connect, disconnect, time window, and revert.')
 info.param('invt.posttest_delay', label='Post-Test Delay (seconds)', default=10,
            desc='Delay after finishing the test.')
+info.param('invt.data_update_rate', label='Data Sampling Rate (Hz)', default=1.,
+           desc='Rate at which the ramp is sampled. Higher rates give denser data for the ramp-rate check.')
 
 #PV simulator
 pvsim.params(info)
@@ -41,6 +41,7 @@ import os
 import traceback
 import time
 import inverter
+import sampler
 import pvsim
 import gridsim
 import numpy as np
@@ -138,6 +139,7 @@ def test_run():
         # Script timing and pass/fail criteria
         pretest_delay = ts.param_value('invt.pretest_delay')
         verification_delay = ts.param_value('invt.verification_delay')
+        data_update_rate = ts.param_value('invt.data_update_rate')  # Hz
         posttest_delay = ts.param_value('invt.posttest_delay')
         power_threshold = ts.param_value('invt.power_threshold')
         disable = ts.param_value('invt.disable')
@@ -236,10 +238,11 @@ def test_run():
                     t_reconnection = time.time()-start_time  # Reconnection time updates until the inverter reconnects
                     time.sleep(0.1)
 
-                data_update_rate = 1  # Hz ... parameterize sometime...
                 check_duration = 100./ramp
                 test_duration = t_dwell + check_duration
                 duration = 0
+                loop_timer = sampler.Sampler(rate=data_update_rate, sleep=ts.sleep)
+                loop_timer.start()
                 while duration < test_duration+verification_delay:
                     duration = time.time()-start_time-t_reconnection
                     if duration <= check_duration:  # only check the ramp response during the check_duration
@@ -258,7 +261,8 @@ def test_run():
                                 ts.log_error('EUT did not reach at least 95% of Irated at the end of the dwell time.')
                                 raise script.ScriptFail()
                             break
-                    time.sleep(1/data_update_rate)  # todo: improve the loop timing
+                    loop_timer.wait()
+                ts.log_debug(str(loop_timer))
 
                 if posttest_delay > 0:
                     ts.log('Waiting for post-test delay of %d seconds' % posttest_delay)
@@ -341,6 +345,8 @@ info.param('invt.verification_delay', label='Verification Delay (seconds)', defa
            desc='Time allowed for INV1 operations. Applied to connect, disconnect, time window, and revert.')
 info.param('invt.posttest_delay', label='Post-Test Delay (seconds)', default=10,
            desc='Delay after finishing the test.')
+info.param('invt.data_update_rate', label='Data Sampling Rate (Hz)', default=1.,
+           desc='Rate at which the ramp is sampled. Higher rates give denser data for the ramp-rate check.')
 
 # PV simulator
 pvsim.params(info)
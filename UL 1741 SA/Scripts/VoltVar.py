@@ -46,21 +46,25 @@ import numpy as np
 import script
 
 import inverter
+import sampler
+import curve
 import terrasas
 import gridsim
 import das
 import pvsim
+import tasks
 
 # returns: True if state == current connection state and power generation matches threshold expectation, False if not
 def verify_initial_conn_state(inv, state, time_period=0, threshold=50, data=None):
     result = None
     start_time = time.time()
+    loop_timer = sampler.Sampler(rate=1., sleep=ts.sleep)
 
     while result is None:
         elapsed_time = time.time()-start_time
         if elapsed_time <= time_period:
             if not inverter.verify_conn_state(inv, state, threshold, data):
-                ts.sleep(0.89) #Attempt to make loop exactly 1 second
+                loop_timer.wait()
             else:
                 result = True
         else:
@@ -81,7 +85,7 @@ def get_ac_voltage_pct(inv, data=None):
             inv.inverter.read()
             gridVraw = float(inv.inverter.PhVphA)
 
-        inv.settings.read()
+        inverter.read_model(inv, 'settings')
         Vgrid_nom = float(inv.settings.VRef)
 
         return (gridVraw/Vgrid_nom)*100.0
@@ -89,25 +93,21 @@ def get_ac_voltage_pct(inv, data=None):
     except Exception, e:
         raise script.ScriptFail('Unable to get ac voltage from das or EUT: %s' % str(e))
 
-def var_pass_fail_band(inv, volt=None, var=None, n_points=4, var_range=50., deptRef = 2, data=None):
+# vv_curve is the volt-var curve built from volt, var and n_points when the curve is written, it is built here only
+# if it is not given
+def var_pass_fail_band(inv, volt=None, var=None, n_points=4, var_range=50., deptRef = 2, data=None, vv_curve=None):
 
     varTarg = None
     var_upper = None
     var_lower = None
 
-    #Check to be sure the voltages are monotonically increasing.
-    for i in xrange(1, n_points-1):
-        if volt[i] > volt[i+1]:
-            ts.log_error('Voltages are not monotonically increasing in volt-var curve.')
-        break
-
     lots_of_output = False #Flag to turn on data dumps to help debugging
     if lots_of_output:
         ts.log_debug('deptRef: %s' % deptRef)
 
     # get var settings
     try:
-        inv.nameplate.read()
+        inverter.read_model(inv, 'nameplate')
         max_Var = float(inv.nameplate.VArRtgQ1) #Q1 is pos
         max_VA = float(inv.nameplate.VARtg) #Q1 is pos
         max_W = float(inv.nameplate.WRtg) #Q1 is pos
@@ -121,100 +121,22 @@ def var_pass_fail_band(inv, volt=None, var=None, n_points=4, var_range=50., dept
     #Get grid voltage to determine the proper EUT vars
     gridV = get_ac_voltage_pct(inv, data)
 
-    if deptRef == inverter.VOLTVAR_WMAX:
-        if gridV < volt[1]: #Vgrid is below the 1st point - extrapolate
-            varAval = math.sqrt(math.pow(max_VA,2) - math.pow(max_W,2)) # units of vars
-            varAvalTargPct = var[1]/100.
-            varTarg = varAval*varAvalTargPct # units of vars
-            var_upper = varTarg + var_range*max_Var/100. #units of vars #var_range is %max_Var
-            var_lower = varTarg - var_range*max_Var/100. #units of vars #var_range is %max_Var
-            if lots_of_output:
-                ts.log_debug('Low')
-                ts.log_debug('varAval, varAvalTarg Fraction, varTarg, var_upper, var_lower')
-                ts.log_debug('%.3f, %.3f, %.3f, %.3f, %.3f' %
-                             (varAval, varAvalTargPct, varTarg, var_upper, var_lower))
-        elif gridV > volt[n_points]: #Vgrid is above the last point - extrapolate
-            varAval = math.sqrt(math.pow(max_VA,2) - math.pow(max_W,2)) # units of vars
-            varAvalTargPct = var[n_points]/100.
-            varTarg = varAval*varAvalTargPct # units of vars
-            var_upper = varTarg + var_range*max_Var/100. #units of vars #var_range is %max_Var
-            var_lower = varTarg - var_range*max_Var/100. #units of vars #var_range is %max_Var
-            if lots_of_output:
-                ts.log_debug('High')
-                ts.log_debug('varAval, varAvalTarg Fraction, varTarg, var_upper, var_lower')
-                ts.log_debug('%.3f, %.3f, %.3f, %.3f, %.3f' %
-                             (varAval, varAvalTargPct, varTarg, var_upper, var_lower))
+    if deptRef == inverter.VOLTVAR_WMAX or deptRef == inverter.VOLTVAR_VARMAX:
+        if vv_curve is None:
+            vv_curve = curve.Curve.from_sunspec(volt, var, n_points, name='volt-var curve')
+        if deptRef == inverter.VOLTVAR_WMAX:
+            var_base = math.sqrt(math.pow(max_VA,2) - math.pow(max_W,2)) # available vars
         else:
-            # pointwise algorithm to find target vars
-            for i in xrange(1, n_points):
-                if lots_of_output:
-                    ts.log_debug('Grid voltage is %.3f' % (gridV))
-                    ts.log_debug('i = %d' % i)
-                    ts.log_debug('gridV >= volt[i] and gridV <= volt[i+1]')
-                    ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (gridV, volt[i], gridV, volt[i+1]))
-
-                if gridV >= volt[i] and gridV <= volt[i+1]: #curve interpolation
-                    varAval = math.sqrt(math.pow(max_VA,2) - math.pow(max_W,2)) # units of vars
-                    #varTarg = Qi + (Qi+1 - Qi)*((gridV - Vi)/(Vi+1 - Vi))
-                    varAvalTargPct = (var[i] + (var[i+1] - var[i]) * ((gridV - volt[i])/(volt[i+1] - volt[i])))/100.
-                    varTarg = varAval*varAvalTargPct # units of vars
-                    var_upper = varTarg + var_range*max_Var/100. #units of vars #var_range is %max_Var
-                    var_lower = varTarg - var_range*max_Var/100. #units of vars #var_range is %max_Var
-                    if lots_of_output:
-                        ts.log_debug('Interpolated')
-                        ts.log_debug('varAval, varAvalTarg Fraction, varTarg, var_upper, var_lower')
-                        ts.log_debug('%.3f, %.3f, %.3f, %.3f, %.3f' %
-                                     (varAval, varAvalTargPct, varTarg, var_upper, var_lower))
-                    break
-
-    elif deptRef == inverter.VOLTVAR_VARMAX:
-        if gridV < volt[1]: #Vgrid is below the 1st point - extrapolate
-            varTargPct = var[1]/100.
-            varTarg = max_Var*varTargPct # units of vars
-            var_upper = varTarg + var_range*max_Var/100. #units of vars #var_range is %max_Var
-            var_lower = varTarg - var_range*max_Var/100. #units of vars #var_range is %max_Var
-            if lots_of_output:
-                print 'volt[1], var[1]'
-                print volt[1], var[1]
-                ts.log_debug('Low')
-                ts.log_debug('varTarg Fraction, varTarg, var_upper, var_lower')
-                ts.log_debug('%.3f, %.3f, %.3f, %.3f' % (varTargPct, varTarg, var_upper, var_lower))
-        elif gridV > volt[n_points]: #Vgrid is above the last point - extrapolate
-            varTargPct = var[n_points]/100.
-            varTarg = max_Var*varTargPct # units of vars
-            var_upper = varTarg + var_range*max_Var/100. #units of vars #var_range is %max_Var
-            var_lower = varTarg - var_range*max_Var/100. #units of vars #var_range is %max_Var
-            if lots_of_output:
-                print 'volt[n_points], var[n_points]'
-                print volt[n_points], var[n_points]
-                ts.log_debug('High')
-                ts.log_debug('varTarg Fraction, varTarg,  var_upper, var_lower')
-                ts.log_debug('%.3f, %.3f, %.3f, %.3f' % (varTargPct, varTarg, var_upper, var_lower))
-        else:
-            # pointwise algorithm to find target vars
-            for i in xrange(1, n_points):
-                if lots_of_output:
-                    ts.log_debug('Grid voltage is %.3f' % (gridV))
-                    ts.log_debug('i = %d' % i)
-                    ts.log_debug('gridV >= volt[i] and gridV <= volt[i+1]')
-                    ts.log_debug('%.3f >= %.3f and %.3f <= %.3f' % (gridV, volt[i], gridV, volt[i+1]))
-                    #ts.log('var_range = %.3f' % var_range)
-                if gridV >= volt[i] and gridV <= volt[i+1]: #curve interpolation
-                    #varTarg = Qi + (Qi+1 - Qi)*((gridV - Vi)/(Vi+1 - Vi))
-                    varTargPct = (var[i]+(var[i+1]-var[i])*((gridV-volt[i])/(volt[i+1]-volt[i])))/100.
-                    varTarg = max_Var*varTargPct
-                    var_upper = varTarg + var_range*max_Var/100. #var_range is %VarAval
-                    var_lower = varTarg - var_range*max_Var/100. #var_range is %VarAval
-                    if lots_of_output:
-                        print 'var[i], var[i+1], var[i], gridV, volt[i], volt[i+1], volt[i]'
-                        print var[i], var[i+1], var[i], gridV, volt[i], volt[i+1], volt[i]
-                        print 'var[i] + (var[i+1]-var[i])*((gridV-volt[i])/(volt[i+1]-volt[i]))'
-                        print var[i] + (var[i+1]-var[i])*((gridV-volt[i])/(volt[i+1]-volt[i]))
-                        ts.log_debug('Interpolated - VV12')
-                        ts.log_debug('varTarg Fraction, varTarg, var_upper, var_lower')
-                        ts.log_debug('%.3f, %.3f, %.3f, %.3f' % (varTargPct, varTarg, var_upper, var_lower))
-                    break
-
+            var_base = max_Var
+        # curve is held at the end points when Vgrid is outside the curve
+        varTargPct = vv_curve(gridV)/100.
+        varTarg = var_base*varTargPct # units of vars
+        var_upper = varTarg + var_range*max_Var/100. #units of vars #var_range is %max_Var
+        var_lower = varTarg - var_range*max_Var/100. #units of vars #var_range is %max_Var
+        if lots_of_output:
+            ts.log_debug('Grid voltage is %.3f, %s' % (gridV, vv_curve))
+            ts.log_debug('var_base, varTarg Fraction, varTarg, var_upper, var_lower')
+            ts.log_debug('%.3f, %.3f, %.3f, %.3f, %.3f' % (var_base, varTargPct, varTarg, var_upper, var_lower))
 
     elif deptRef == inverter.VOLTVAR_VARAVAL:
         fixedVarPct = var[1]/100. ###NOTE: fixedVarPct is a decimal, not in units of percent
@@ -490,18 +412,19 @@ def test_run():
         10. Repeat steps 6 - 9 for the remaining tests in Table 10.
         '''
 
-        # initialize data acquisition system
-        daq = das.das_init(ts)
+        # initialize pv simulation
+        def pv_init():
+            pv = pvsim.pvsim_init(ts)
+            pv.power_on()
+            return pv
+
+        # initialize data acquisition system, pv simulation and (UL 1741 SA Step 2: Set all AC source parameters to
+        # the nominal operating conditions for the EUT) grid simulation at the same time
+        daq, pv, grid = tasks.parallel((das.das_init, ts), pv_init, (gridsim.gridsim_init, ts),
+                                       cleanup=tasks.close)  # instruments started before a failed init are closed
         data = daq.data_init()
         trigger = daq.trigger_init()
 
-        # initialize pv simulation
-        pv = pvsim.pvsim_init(ts)
-        pv.power_on()
-
-        # UL 1741 SA Step 2: Set all AC source parameters to the nominal operating conditions for the EUT
-        # initialize grid simulation
-        grid = gridsim.gridsim_init(ts)
         if grid:
             gridsim_v_nom = grid.v_nom()
 
@@ -575,6 +498,7 @@ def test_run():
         # UL 1741 SA Step 4 (using deptRef) and Step 5 (setting the Q(V) characteristic curve)
         inverter.set_volt_var(inv, volt=volt, var=var, n_points=n_points,
                               curve_num=curve_num, deptRef=deptRef, enable=1)
+        vv_curve = curve.Curve.from_sunspec(volt, var, n_points, name='volt-var curve')
 
         #voltage_pct_test_points = np.linspace(0., 100., voltage_tests_per_line)
         #ts.log('test_on_vv_points == Yes: %s' % voltage_pct_test_points)
@@ -633,11 +557,12 @@ def test_run():
                             trigger.on()
                         start_time = time.time()
 
-                        inv.nameplate.read()
+                        inverter.read_model(inv, 'nameplate')
                         VarAval = inv.nameplate.VArRtgQ1
 
                         varTarg, var_upper, var_lower = var_pass_fail_band(inv, volt=volt, var=var, n_points=n_points,
-                                                                        var_range=var_range, deptRef=deptRef, das=das)
+                                                                        var_range=var_range, deptRef=deptRef, data=data,
+                                                                        vv_curve=vv_curve)
                         ts.log('        Target vars: %.3f. Pass limits for screening: lower = %.3f  upper = %.3f' %
                                (varTarg, var_lower, var_upper))
 